@@ -15,7 +15,7 @@ from typing import Optional
 
 from src.agent.tool_router import route as tool_route
 from src.agent.tools import ToolCall, tool_params_to_filters, INTENT_TO_TOOL
-from src.agent.entities import extract_entities
+from src.agent.request_context import current_request
 from src.agent.context import (
     ConversationContext, build_context_hint,
     detect_filter_request
@@ -23,7 +23,6 @@ from src.agent.context import (
 from src.agent.session import session_store
 from src.agent.product import detect_product_query, is_product_code
 from src.agent.brain import is_analytical_query, brain_analyze, collect_session_context
-from src.core.utils import normalize, tokenize
 from src.agent.scoring import COLUMN_NORMALIZE, detect_view_mode
 from src.agent.multistep import detect_multistep, extract_kpis_from_result, StepResult
 from src.formatters.comparison import format_comparison
@@ -44,8 +43,10 @@ async def ask_core_v5(self, question: str, user_context: dict = None, _log: dict
     """
     await self._load_entities()
     t0 = time.time()
-    tokens = tokenize(question)
-    q_norm = normalize(question)
+    parsed = self._parsed(question)
+    req = current_request()
+    tokens = list(parsed.tokens)
+    q_norm = parsed.q_norm
     user_id = (user_context or {}).get("user", "__default__")
     
     # ========== SESSION MEMORY ==========
@@ -58,9 +59,10 @@ async def ask_core_v5(self, question: str, user_context: dict = None, _log: dict
         _log["processing"] = _log.get("processing", {})
 
     # ========== ALIAS RESOLVER (pré-processamento) ==========
-    params_pre = extract_entities(question, self._known_marcas, self._known_empresas, self._known_compradores)
-    self._last_alias_resolved = None
-    self._last_produto_nome = params_pre.get("produto_nome")
+    params_pre = parsed.params()
+    if req:
+        req.produto_nome = params_pre.get("produto_nome")
+        req.alias_resolved = None
     
     if params_pre.get("produto_nome"):
         alias = self.alias_resolver.resolve(params_pre["produto_nome"])
@@ -72,7 +74,8 @@ async def ask_core_v5(self, question: str, user_context: dict = None, _log: dict
                 params_pre.pop("produto_nome", None)
             elif alias.get("nome_real"):
                 params_pre["produto_nome"] = alias["nome_real"]
-            self._last_alias_resolved = {"from": original_term, "to": resolved_to}
+            if req:
+                req.alias_resolved = {"from": original_term, "to": resolved_to}
             print(f"[ALIAS] Resolvido: '{original_term}' -> {resolved_to}")
 
     # ========== BRAIN: Analytical query intercept ==========
@@ -129,10 +132,9 @@ async def ask_core_v5(self, question: str, user_context: dict = None, _log: dict
 
     # ========== LAYER 0.5: PRODUTO (roteamento especial) ==========
     # Detecta queries de produto que precisam de tratamento especial
-    from src.agent.scoring import score_intent, INTENT_THRESHOLDS
-    scores = score_intent(tokens)
-    best_intent = max(scores, key=scores.get)
-    best_score = scores[best_intent]
+    from src.agent.scoring import INTENT_THRESHOLDS
+    best_intent = parsed.best_intent
+    best_score = parsed.best_score
     
     _non_product = ("pendencia_compras", "estoque", "vendas", "rastreio_pedido")
     _scoring_wins = best_intent in _non_product and best_score >= INTENT_THRESHOLDS.get(best_intent, 8)
@@ -163,8 +165,10 @@ async def ask_core_v5(self, question: str, user_context: dict = None, _log: dict
         known_marcas=self._known_marcas,
         known_empresas=self._known_empresas,
         known_compradores=self._known_compradores,
+        entity_matcher=self._entity_matcher,
         log=log_route,
         history=history,
+        parsed=parsed,
     )
     
     print(f"[SMART] Router: {tool_call}")
@@ -522,17 +526,7 @@ def patch_smart_agent(SmartAgentClass):
                     question, user_context, t0, tokens, params or {}, ctx)
     SmartAgentClass._dispatch_product = _dispatch_product
     
-    # Substituir _get_context e clear_user pra usar SessionStore
-    SmartAgentClass._get_context = lambda self, user_id: session_store.get_context(user_id)
-    
-    _original_clear = SmartAgentClass.clear_user
-    def _clear_with_session(self, user_id):
-        _original_clear(self, user_id)
-        # Sessão expira naturalmente, mas forçar limpeza do ctx
-        session = session_store.get(user_id)
-        session.ctx = ConversationContext(user_id)
-        session.messages.clear()
-    SmartAgentClass.clear_user = _clear_with_session
-    
+    # _get_context / clear_user do SmartAgent ja usam o session_store
+
     print("[SMART] V5 Tool Use pattern ativado!")
     print(f"[SESSION] SessionStore inicializado ({session_store.active_count} sessões ativas)")
\ No newline at end of file
@@ -455,6 +455,7 @@ async def brain_analyze(question: str, context_data: dict) -> Optional[dict]:
     """
     from src.core.groq_client import pool_classify, pool_narrate, groq_request
     from src.core.config import GROQ_MODEL_CLASSIFY
+    from src.core.chat_stream import token_callback, tokens_mark, reset_since
 
     ctx_text = _format_context_for_llm(context_data)
     print(f"[BRAIN] Contexto formatado: {len(ctx_text)} chars")
@@ -470,6 +471,7 @@ Use os numeros do resumo — NAO recalcule. Sugira acoes praticas."""
     if pool_classify.available:
         print(f"[BRAIN] Enviando pro 70b (pool_classify)...")
         t_start = time.time()
+        mark = tokens_mark()
 
         result = await groq_request(
             pool=pool_classify,
@@ -481,6 +483,7 @@ Use os numeros do resumo — NAO recalcule. Sugira acoes praticas."""
             temperature=0.7,
             max_tokens=800,
             timeout=15,
+            on_token=token_callback(),
         )
 
         text = _clean_brain_response(result)
@@ -489,10 +492,12 @@ Use os numeros do resumo — NAO recalcule. Sugira acoes praticas."""
             print(f"[BRAIN] 70b OK ({len(text)} chars, {elapsed_llm:.1f}s)")
             return _build_result(text, model="70b")
 
+        reset_since(mark)
         print(f"[BRAIN] 70b falhou, tentando 8b...")
 
     # ---- Fallback: 8b (pool_narrate) com prompt analitico ----
     if pool_narrate.available:
+        mark = tokens_mark()
         result = await groq_request(
             pool=pool_narrate,
             messages=[
@@ -501,6 +506,7 @@ Use os numeros do resumo — NAO recalcule. Sugira acoes praticas."""
             ],
             temperature=0.7,
             max_tokens=600,
+            on_token=token_callback(),
         )
 
         text = _clean_brain_response(result)
@@ -508,6 +514,8 @@ Use os numeros do resumo — NAO recalcule. Sugira acoes praticas."""
             print(f"[BRAIN] 8b-fallback OK ({len(text)} chars)")
             return _build_result(text, model="8b-fallback")
 
+        reset_since(mark)
+
     print(f"[BRAIN] Ambos falharam, fallback pro routing normal")
     return None
 
@@ -303,8 +303,8 @@ def _build_context_hint(ctx) -> str:
         parts.append(f"Filtros ativos: {param_str}")
 
     # Resumo dos resultados anteriores (contagens, nao dados brutos)
-    if ctx.last_result and ctx.last_result.get("detail_data"):
-        data = ctx.last_result["detail_data"]
+    if ctx.has_data():
+        data = ctx.get_data()
         total_itens = len(data)
         status_count = {}
         for item in data:
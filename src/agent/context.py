@@ -3,9 +3,15 @@ MMarra Data Hub - Contexto de Conversa.
 Memoria por usuario, deteccao de follow-up, regras de filtro.
 """
 
+import os
 import re
+import itertools
+from collections import Counter
 
 from src.core.utils import normalize
+from src.agent.entity_matcher import EntityMatcher
+from src.agent.result_table import ResultTable
+from src.agent.result_store import RetainedResult
 
 
 # ============================================================
@@ -34,6 +40,21 @@ FOLLOWUP_PATTERNS = [
     r'\b(qual|quais)\s+\w+\s+(ele|ela|eles|elas)\b',
 ]
 
+# Contadores de regra disparada (follow-up e filtros), ver rule_stats()
+RULE_HITS = Counter()
+
+_GROUP_OPEN = re.compile(r'(?<!\\)\((?!\?)')
+
+
+def _compile_alternation(patterns: list, prefix: str) -> re.Pattern:
+    """Junta os patterns num regex so: (?P<p0>...)|(?P<p1>...).
+    Grupos internos viram (?:...) para lastgroup apontar a regra."""
+    parts = [f"(?P<{prefix}{i}>{_GROUP_OPEN.sub('(?:', p)})" for i, p in enumerate(patterns)]
+    return re.compile("|".join(parts))
+
+
+_FOLLOWUP_RE = _compile_alternation(FOLLOWUP_PATTERNS, "f")
+
 
 def detect_followup(tokens: list, question_norm: str) -> bool:
     """Detecta se a pergunta e um follow-up referenciando dados anteriores.
@@ -46,11 +67,14 @@ def detect_followup(tokens: list, question_norm: str) -> bool:
     if isinstance(tokens, str):
         question_norm = tokens
         tokens = tokens.split()
-    if any(t in FOLLOWUP_WORDS for t in tokens):
-        return True
-    for pattern in FOLLOWUP_PATTERNS:
-        if re.search(pattern, question_norm):
+    for t in tokens:
+        if t in FOLLOWUP_WORDS:
+            RULE_HITS[f"followup:word:{t}"] += 1
             return True
+    m = _FOLLOWUP_RE.search(question_norm)
+    if m:
+        RULE_HITS[f"followup:pattern:{m.lastgroup[1:]}"] += 1
+        return True
     if len(tokens) <= 7:
         followup_indicators = {"itens", "pedidos", "atrasados", "atrasado", "pendentes",
                                 "pendente", "confirmados", "prazo", "previsao", "proximo",
@@ -67,6 +91,7 @@ def detect_followup(tokens: list, question_norm: str) -> bool:
                            "pedido", "esta", "esse", "essa", "qual"}
             other_words = [t for t in tokens if t not in noise_words and len(t) >= 4]
             if not other_words:
+                RULE_HITS["followup:indicator"] += 1
                 return True
     return False
 
@@ -120,19 +145,70 @@ FILTER_RULES = [
     {"match": ["proximo", "proximos"],                 "filter": {"STATUS_ENTREGA": "PROXIMO"}},
 ]
 
-# Compiled rules (populated by knowledge_compiler at startup)
+# Compiled rules (publicadas por scoring.load_compiled_knowledge via set_compiled_rules)
 _COMPILED_RULES = []
 
+_NUM_BEFORE_RE = re.compile(r'\b(\d{1,3})\s+(?:mais|primeiro|primeiros|maior|menor|ultim)')
+_NUM_AFTER_RE = re.compile(r'(?:top|os)\s+(\d{1,3})\b')
+
+
+class _FilterEngine:
+    """FILTER_RULES + compiladas num automato so (Aho-Corasick por substring).
+
+    Uma passada pela pergunta devolve o indice de TODAS as regras com algum
+    termo presente (inclusive termos sobrepostos: "mais atrasados" casa
+    "mais atrasado" e "atrasados"); a ordem de aplicacao continua a da lista.
+    """
+
+    def __init__(self, manual: list, compiled: list):
+        self.rules = list(manual) + list(compiled)
+        self.n_manual = len(manual)
+        self.key = (id(manual), len(manual), id(compiled), len(compiled))
+        self.matcher = EntityMatcher(
+            {i: [m for m in rule.get("match", []) if m] for i, rule in enumerate(self.rules)},
+            word_boundary=False,
+        )
+
+    def matching(self, question_norm: str) -> list:
+        return sorted({span.kind for span in self.matcher.find_all(question_norm)})
+
+    def label(self, i: int) -> str:
+        source = "manual" if i < self.n_manual else "compiled"
+        match = self.rules[i].get("match") or ["?"]
+        return f"filter:{source}:{match[0]}"
+
+
+_FILTER_ENGINE = None
+
+
+def _filter_engine() -> _FilterEngine:
+    """Engine atual; recompila se FILTER_RULES/_COMPILED_RULES mudaram."""
+    global _FILTER_ENGINE
+    engine = _FILTER_ENGINE
+    key = (id(FILTER_RULES), len(FILTER_RULES), id(_COMPILED_RULES), len(_COMPILED_RULES))
+    if engine is None or engine.key != key:
+        engine = _FilterEngine(FILTER_RULES, _COMPILED_RULES)
+        _FILTER_ENGINE = engine
+    return engine
+
+
+def set_compiled_rules(rules: list):
+    """Publica as regras do Knowledge Compiler e recompila o automato (troca atomica)."""
+    global _COMPILED_RULES, _FILTER_ENGINE
+    rules = list(rules)
+    engine = _FilterEngine(FILTER_RULES, rules)
+    _COMPILED_RULES = rules
+    _FILTER_ENGINE = engine
+
 
 def detect_filter_request(question_norm: str, tokens: list) -> dict:
     """Detecta se o usuario quer filtrar/ordenar dados anteriores. FILTER_RULES + compiladas."""
     result = {}
 
-    all_rules = list(FILTER_RULES) + list(_COMPILED_RULES)
-    for rule in all_rules:
-        matched = any(m in question_norm for m in rule["match"])
-        if not matched:
-            continue
+    engine = _filter_engine()
+    for i in engine.matching(question_norm):
+        rule = engine.rules[i]
+        RULE_HITS[engine.label(i)] += 1
 
         if "filter" in rule:
             result.update(rule["filter"])
@@ -149,9 +225,9 @@ def detect_filter_request(question_norm: str, tokens: list) -> dict:
             break
 
     # Detectar numero explicito: "5 mais caros", "top 10"
-    num_match = re.search(r'\b(\d{1,3})\s+(?:mais|primeiro|primeiros|maior|menor|ultim)', question_norm)
+    num_match = _NUM_BEFORE_RE.search(question_norm)
     if not num_match:
-        num_match = re.search(r'(?:top|os)\s+(\d{1,3})\b', question_norm)
+        num_match = _NUM_AFTER_RE.search(question_norm)
     if num_match:
         result["_top"] = int(num_match.group(1))
 
@@ -162,13 +238,36 @@ def detect_filter_request(question_norm: str, tokens: list) -> dict:
     return result
 
 
-def apply_filters(data: list, filters: dict) -> list:
-    """Aplica filtros, ordenacao e limite aos dados ja retornados."""
+def rule_stats(limit: int = 50) -> dict:
+    """Regras que mais disparam (follow-up + filtros) e tamanho do automato."""
+    engine = _filter_engine()
+    return {
+        "filter_rules": len(engine.rules),
+        "compiled_rules": len(engine.rules) - engine.n_manual,
+        "followup_patterns": len(FOLLOWUP_PATTERNS),
+        "total_hits": sum(RULE_HITS.values()),
+        "top": dict(RULE_HITS.most_common(limit)),
+    }
+
+
+def apply_filters(data: list, filters: dict, table: ResultTable = None) -> list:
+    """Aplica filtros, ordenacao e limite aos dados ja retornados.
+
+    table: ResultTable dos mesmos rows (ConversationContext.get_table()) -
+    executa tudo vetorizado sobre as colunas em cache.
+    """
     if not data or not filters:
         return data
 
     sort_key = filters.pop("_sort", None)
     top_n = filters.pop("_top", None)
+
+    if table is not None and table.rows is data:
+        idx = table.select(filters, sort_key, top_n)
+        for fn_key in [k for k in filters if k.startswith("_fn_")]:
+            filters.pop(fn_key)
+        return table.take(idx)
+
     result = data
 
     fn_keys = [k for k in filters if k.startswith("_fn_")]
@@ -235,6 +334,9 @@ def apply_filters(data: list, filters: dict) -> list:
 # CONVERSATION CONTEXT
 # ============================================================
 
+_RESULT_IDS = itertools.count(1)
+
+
 class ConversationContext:
     """Contexto de conversa de um usuario. Guarda parametros e dados anteriores."""
 
@@ -242,11 +344,34 @@ class ConversationContext:
         self.user_id = user_id
         self.intent = None
         self.params = {}
-        self.last_result = {}
+        self._meta = {}       # last_result sem as rows
+        self._retained = None  # RetainedResult com o detail_data (quente/compacto/disco)
+        self._owner = None     # callback(ctx) do SessionStore quando o resultado muda
         self.last_question = ""
         self.last_view_mode = "pedidos"
         self.turn_count = 0
         self._extra_columns = []
+        self._table = None  # ResultTable do detail_data atual (colunas em cache)
+        self._result_id = None  # muda a cada resultado novo (backend compartilhado so regrava rows se mudou)
+
+    @property
+    def last_result(self) -> dict:
+        """Metadados do ultimo resultado (description, columns, params, response...).
+        As rows ficam em get_data()."""
+        return self._meta
+
+    @last_result.setter
+    def last_result(self, result: dict):
+        result = dict(result or {})
+        rows = result.pop("detail_data", None)
+        underscore_rows = result.pop("_detail_data", None)
+        rows = rows or underscore_rows
+        self._meta = result
+        self._retained = RetainedResult(rows) if rows else None
+        self._table = None
+        self._result_id = f"{os.getpid()}-{next(_RESULT_IDS)}" if rows else None
+        if self._owner is not None:
+            self._owner(self)
 
     def merge_params(self, new_params: dict) -> dict:
         """Mescla parametros novos com contexto anterior."""
@@ -278,19 +403,74 @@ class ConversationContext:
 
     def has_data(self) -> bool:
         """Verifica se tem dados de detalhe. Aceita 'detail_data' e '_detail_data'."""
-        if not self.last_result:
-            return False
-        return bool(self.last_result.get("detail_data") or self.last_result.get("_detail_data"))
+        return self._retained is not None and self._retained.n_rows > 0
 
     def get_data(self) -> list:
         """Retorna dados de detalhe. Aceita 'detail_data' e '_detail_data'."""
-        if not self.last_result:
+        retained = self._retained
+        if retained is None:
             return []
-        return self.last_result.get("detail_data") or self.last_result.get("_detail_data", [])
+        was_hot = retained.rows is not None
+        rows = retained.get()
+        if not was_hot and self._owner is not None:
+            self._owner(self, rehydrated=True)  # voltou para a RAM: SessionStore reconta o orcamento
+        return rows
+
+    @property
+    def result_bytes(self) -> int:
+        return self._retained.nbytes if self._retained is not None else 0
+
+    def demote_result(self, spill) -> bool:
+        """Desce o resultado 1 nivel (quente -> compacto -> disco)."""
+        if self._retained is None:
+            return False
+        self._table = None  # a table segura as rows quentes
+        return self._retained.demote(spill)
+
+    def get_table(self):
+        """ResultTable dos dados atuais (montada 1x por resultado, reusada nos follow-ups)."""
+        data = self.get_data()
+        if not data:
+            return None
+        table = self._table
+        if table is None or table.rows is not data:
+            table = self._table = ResultTable.from_rows(data)
+        return table
 
     def get_description(self) -> str:
         return self.last_result.get("description", "")
 
+    # ============================================================
+    # ESTADO SERIALIZAVEL (backend compartilhado entre workers)
+    # ============================================================
+
+    def to_state(self) -> dict:
+        """Tudo menos as rows (gravadas a parte, so quando _result_id muda)."""
+        return {
+            "intent": self.intent,
+            "params": self.params,
+            "meta": self._meta,
+            "result_id": self._result_id,
+            "last_question": self.last_question,
+            "view_mode": self.last_view_mode,
+            "turn_count": self.turn_count,
+            "extra_columns": self._extra_columns,
+        }
+
+    def load_state(self, state: dict, rows: list = None):
+        """Restaura o contexto gravado por outro worker. rows=None mantem o resultado atual."""
+        self.intent = state.get("intent")
+        self.params = dict(state.get("params") or {})
+        self._meta = dict(state.get("meta") or {})
+        self.last_question = state.get("last_question", "")
+        self.last_view_mode = state.get("view_mode", "pedidos")
+        self.turn_count = state.get("turn_count", 0)
+        self._extra_columns = list(state.get("extra_columns") or [])
+        if rows is not None:
+            self._retained = RetainedResult(rows) if rows else None
+            self._table = None
+        self._result_id = state.get("result_id")
+
     def __repr__(self):
         return f"<Ctx user={self.user_id} intent={self.intent} params={self.params} turns={self.turn_count}>"
 
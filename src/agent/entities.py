@@ -6,6 +6,7 @@ Extraído de smart_agent.py na refatoração modular.
 
 import re
 from src.core.utils import normalize, tokenize
+from src.agent.entity_matcher import EntityMatcher
 
 
 # Mapa de prefixo empresa -> nome legível para exibição
@@ -40,6 +41,27 @@ PERIODO_NOMES = {
 }
 
 
+# Tokens que nunca viram marca no matching com o banco
+_MARCA_STOP_WORDS = {"DOS", "DAS", "DEL", "UMA", "UNS", "COM", "POR", "QUE",
+                     "NAO", "SIM", "MAS", "SEM", "SOB", "TEM", "SAO", "ERA",
+                     "FOI", "SER", "TER", "VER", "DAR", "FAZ", "DIZ",
+                     "MEU", "SEU", "TEU", "NOS", "VOS", "ELA", "ELE",
+                     "PARA", "MAIS", "COMO", "ESSE", "ESSA", "ESTE", "ESTA",
+                     "AQUI", "ONDE", "QUAL", "QUEM", "AGORA", "ALEM",
+                     "ITENS", "ITEM", "CADA", "DOIS", "TRES", "QUATRO",
+                     "PRECISO", "QUERO", "GERAR", "GERA", "TOTAL"}
+
+
+def build_entity_matcher(known_marcas: set = None, known_empresas: set = None,
+                         known_compradores: set = None) -> EntityMatcher:
+    """Compila os dicionarios do banco num EntityMatcher (chamar 1x, apos carregar)."""
+    return EntityMatcher({
+        "marca": known_marcas or (),
+        "empresa": known_empresas or (),
+        "comprador": known_compradores or (),
+    })
+
+
 def _resolve_cidade(name):
     """Resolve nome/prefixo para prefixo padrão de empresa."""
     for cidade, prefixo in _CIDADES_EMPRESA.items():
@@ -49,17 +71,26 @@ def _resolve_cidade(name):
 
 
 def extract_entities(question: str, known_marcas: set = None,
-                     known_empresas: set = None, known_compradores: set = None) -> dict:
+                     known_empresas: set = None, known_compradores: set = None,
+                     matcher: EntityMatcher = None) -> dict:
     """Extrai entidades da pergunta usando matching com banco.
 
     Entidades extraídas: marca, fornecedor, empresa, comprador, codprod,
     codigo_fabricante, produto_nome, aplicacao, periodo, nunota.
+
+    matcher: EntityMatcher pre-compilado (SmartAgent._entity_matcher). Sem ele,
+    compila na hora a partir dos sets (ok para dicionarios pequenos/testes).
     """
     params = {}
     q_upper = question.upper().strip()
     q_norm = normalize(question)
     tokens = tokenize(question)
 
+    if matcher is None and (known_marcas or known_empresas or known_compradores):
+        matcher = build_entity_matcher(known_marcas, known_empresas, known_compradores)
+    # Todas as ocorrencias de marcas/empresas/compradores conhecidos, 1 passada
+    spans = matcher.find_all(q_upper) if matcher else []
+
     # ---- VENDEDOR ----
     # "vendedor X", "do vendedor X", "da vendedora X"
     m_vend = re.search(
@@ -111,30 +142,21 @@ def extract_entities(question: str, known_marcas: set = None,
                 params["marca"] = candidate
 
     # Estratégia 2: Matching com marcas do banco
-    if "marca" not in params and known_marcas:
-        stop_words = {"DOS", "DAS", "DEL", "UMA", "UNS", "COM", "POR", "QUE",
-                       "NAO", "SIM", "MAS", "SEM", "SOB", "TEM", "SAO", "ERA",
-                       "FOI", "SER", "TER", "VER", "DAR", "FAZ", "DIZ",
-                       "MEU", "SEU", "TEU", "NOS", "VOS", "ELA", "ELE",
-                       "PARA", "MAIS", "COMO", "ESSE", "ESSA", "ESTE", "ESTA",
-                       "AQUI", "ONDE", "QUAL", "QUEM", "AGORA", "ALEM",
-                       "ITENS", "ITEM", "CADA", "DOIS", "TRES", "QUATRO",
-                       "PRECISO", "QUERO", "GERAR", "GERA", "TOTAL"}
-        for i, token in enumerate(tokens):
+    # 2a. Nome completo na pergunta (fronteira de palavra, o mais longo)
+    if "marca" not in params and matcher:
+        for span in matcher.longest(spans, "marca"):
+            if len(span.value) >= 3 and span.value not in _MARCA_STOP_WORDS:
+                params["marca"] = span.value
+                break
+    # 2b. Token parcial como prefixo de palavra da marca ("DONALD" -> DONALDSON)
+    if "marca" not in params and matcher:
+        for token in tokens:
             t_upper = token.upper()
-            if len(t_upper) < 3 or t_upper in stop_words:
+            if len(t_upper) < 4 or t_upper in _MARCA_STOP_WORDS:
                 continue
-            if t_upper in known_marcas:
-                params["marca"] = t_upper
-                break
-            for m in known_marcas:
-                if t_upper in m and len(t_upper) >= 4:
-                    params["marca"] = m
-                    break
-                if m in q_upper and len(m) >= 4:
-                    params["marca"] = m
-                    break
-            if "marca" in params:
+            completed = matcher.complete("marca", t_upper)
+            if completed:
+                params["marca"] = completed
                 break
 
     # ---- FORNECEDOR ----
@@ -169,19 +191,21 @@ def extract_entities(question: str, known_marcas: set = None,
                 break
 
     # 4. Match com empresas do banco
-    if "empresa" not in params and known_empresas:
+    if "empresa" not in params and matcher:
+        emp_spans = [sp for sp in matcher.longest(spans, "empresa") if len(sp.value) >= 3]
         m_prep2 = re.search(r'\b(?:POR|EM|PARA|PRA)\s+([A-Z][A-Z\s\-]{2,30})', q_upper)
         if m_prep2:
-            candidate_emp = m_prep2.group(1).strip()
-            for emp in known_empresas:
-                if candidate_emp in emp or emp in candidate_emp:
-                    params["empresa"] = emp
-                    break
-        if "empresa" not in params:
-            for emp in known_empresas:
-                if emp in q_upper and len(emp) >= 3:
-                    params["empresa"] = emp
-                    break
+            # Empresa dentro do trecho apos a preposicao, ou trecho como prefixo da empresa
+            inside = [sp for sp in emp_spans if sp.start >= m_prep2.start(1) and sp.end <= m_prep2.end(1)]
+            if inside:
+                params["empresa"] = inside[0].value
+            else:
+                first_emp = m_prep2.group(1).split()[0]
+                completed = matcher.complete("empresa", first_emp) if len(first_emp) >= 4 else None
+                if completed:
+                    params["empresa"] = completed
+        if "empresa" not in params and emp_spans:
+            params["empresa"] = emp_spans[0].value
 
     # Limpar marca se pegou cidade por engano
     if params.get("marca") and params.get("empresa"):
@@ -221,10 +245,10 @@ def extract_entities(question: str, known_marcas: set = None,
         if not re.match(r'^D[AEOI]\s', candidate_comp):
             params["comprador"] = candidate_comp
 
-    if "comprador" not in params and known_compradores:
-        for comp in known_compradores:
-            if comp in q_upper and len(comp) >= 3:
-                params["comprador"] = comp
+    if "comprador" not in params and matcher:
+        for span in matcher.longest(spans, "comprador"):
+            if len(span.value) >= 3:
+                params["comprador"] = span.value
                 break
 
     # ---- NUMERO PEDIDO ----
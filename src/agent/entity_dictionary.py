@@ -0,0 +1,265 @@
+"""
+MMarra Data Hub - Dicionario de entidades (marcas, empresas, compradores).
+
+Servico que mantem os nomes conhecidos do banco + o EntityMatcher compilado:
+- Startup: carrega o ultimo snapshot do disco (data/entity_snapshot.json),
+  sem esperar o Sankhya. So sem snapshot a 1a pergunta busca no banco.
+- Background: re-consulta TGFMAR/TSIEMP/TGFVEN a cada ENTITY_REFRESH_INTERVAL
+  e troca o snapshot inteiro numa atribuicao (requests em andamento continuam
+  com o snapshot que ja tinham em maos).
+- Snapshot versionado: cada refresh com conteudo novo incrementa a versao e
+  regrava o arquivo (tmp + rename atomico).
+- Multi-worker: so o worker lider roda o refresh; os demais rodam
+  watch_snapshot e recarregam o arquivo quando o lider grava versao nova.
+
+Uso:
+    entities = EntityDictionary()
+    entities.load_snapshot()
+    asyncio.create_task(entities.run_scheduler(executor))
+    snap = entities.current      # EntitySnapshot imutavel
+    extract_entities(q, snap.marcas, snap.empresas, snap.compradores, matcher=snap.matcher)
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+from pathlib import Path
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from src.agent.entity_matcher import EntityMatcher
+from src.core.query_scheduler import runs_as
+
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+SNAPSHOT_FILE = PROJECT_ROOT / "data" / "entity_snapshot.json"
+SNAPSHOT_FORMAT = 1
+ENTITY_REFRESH_INTERVAL = int(os.getenv("ENTITY_REFRESH_INTERVAL", "3600"))  # segundos
+ENTITY_WATCH_INTERVAL = int(os.getenv("ENTITY_WATCH_INTERVAL", "60"))  # seguidores: checa o arquivo
+
+ENTITY_QUERIES = {
+    "marcas": "SELECT UPPER(TRIM(DESCRICAO)) AS M FROM TGFMAR WHERE DESCRICAO IS NOT NULL",
+    "empresas": "SELECT UPPER(TRIM(NOMEFANTASIA)) AS E FROM TSIEMP WHERE NOMEFANTASIA IS NOT NULL",
+    "compradores": "SELECT DISTINCT UPPER(TRIM(V.APELIDO)) AS C FROM TGFVEN V JOIN TGFMAR M ON M.AD_CODVEND = V.CODVEND WHERE V.APELIDO IS NOT NULL",
+}
+
+
+@dataclass(frozen=True)
+class EntitySnapshot:
+    """Versao imutavel dos dicionarios + matcher compilado."""
+    version: int = 0
+    created_at: str = ""
+    marcas: frozenset = frozenset()
+    empresas: frozenset = frozenset()
+    compradores: frozenset = frozenset()
+    matcher: EntityMatcher = field(default=None, compare=False, repr=False)
+    source: str = "empty"  # empty | disk | sankhya
+
+    @property
+    def empty(self) -> bool:
+        return not (self.marcas or self.empresas or self.compradores)
+
+    def digest(self) -> str:
+        raw = json.dumps([sorted(self.marcas), sorted(self.empresas), sorted(self.compradores)],
+                         ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _build_snapshot(version: int, marcas, empresas, compradores,
+                    source: str, created_at: str = None) -> EntitySnapshot:
+    marcas, empresas, compradores = frozenset(marcas), frozenset(empresas), frozenset(compradores)
+    matcher = EntityMatcher({"marca": marcas, "empresa": empresas, "comprador": compradores})
+    return EntitySnapshot(
+        version=version,
+        created_at=created_at or datetime.now().isoformat(timespec="seconds"),
+        marcas=marcas, empresas=empresas, compradores=compradores,
+        matcher=matcher, source=source,
+    )
+
+
+def _column_values(result: dict, key: str) -> set:
+    """Extrai a 1a coluna do resultado do executor (rows como dict ou lista)."""
+    values = set()
+    if not result.get("success"):
+        return values
+    for row in result.get("data", []):
+        if isinstance(row, dict):
+            v = row.get(key)
+        elif isinstance(row, (list, tuple)) and row:
+            v = row[0]
+        else:
+            v = None
+        v = str(v).strip() if v is not None else ""
+        if len(v) > 1:
+            values.add(v)
+    return values
+
+
+class EntityDictionary:
+    """Dicionarios de entidades com snapshot em disco e refresh em background."""
+
+    def __init__(self, snapshot_file: Path = None, refresh_interval: int = ENTITY_REFRESH_INTERVAL):
+        self.snapshot_file = snapshot_file or SNAPSHOT_FILE
+        self.refresh_interval = refresh_interval
+        self.current = EntitySnapshot(matcher=EntityMatcher({}))
+        self._refresh_lock = None   # asyncio.Lock (recriado se o event loop mudar)
+        self._lock_loop = None
+        self._fetch_tried = False
+        self._snapshot_mtime = None
+        self._stats = {"refreshes": 0, "swaps": 0, "errors": 0,
+                       "last_refresh": None, "last_refresh_ms": 0}
+
+    # ============================================================
+    # DISCO
+    # ============================================================
+
+    def load_snapshot(self) -> bool:
+        """Carrega o snapshot do disco (startup). Retorna True se carregou."""
+        t0 = time.time()
+        try:
+            if not self.snapshot_file.exists():
+                return False
+            self._snapshot_mtime = self.snapshot_file.stat().st_mtime
+            data = json.loads(self.snapshot_file.read_text(encoding="utf-8"))
+            if data.get("format") != SNAPSHOT_FORMAT:
+                print(f"[ENTITIES] Snapshot com formato {data.get('format')} ignorado")
+                return False
+            self.current = _build_snapshot(
+                data.get("version", 0), data.get("marcas", []), data.get("empresas", []),
+                data.get("compradores", []), source="disk", created_at=data.get("created_at"),
+            )
+            snap = self.current
+            print(f"[ENTITIES] Snapshot v{snap.version} ({snap.created_at}): {len(snap.marcas)} marcas, "
+                  f"{len(snap.empresas)} empresas, {len(snap.compradores)} compradores "
+                  f"({(time.time() - t0) * 1000:.0f}ms)")
+            return True
+        except Exception as e:
+            print(f"[ENTITIES] Erro ao carregar snapshot: {e}")
+            return False
+
+    def _save_snapshot(self, snap: EntitySnapshot):
+        try:
+            self.snapshot_file.parent.mkdir(parents=True, exist_ok=True)
+            data = {
+                "format": SNAPSHOT_FORMAT,
+                "version": snap.version,
+                "created_at": snap.created_at,
+                "marcas": sorted(snap.marcas),
+                "empresas": sorted(snap.empresas),
+                "compradores": sorted(snap.compradores),
+            }
+            tmp = self.snapshot_file.with_suffix(".tmp")
+            tmp.write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+            os.replace(tmp, self.snapshot_file)
+            self._snapshot_mtime = self.snapshot_file.stat().st_mtime
+        except Exception as e:
+            print(f"[ENTITIES] Erro ao gravar snapshot: {e}")
+
+    # ============================================================
+    # REFRESH
+    # ============================================================
+
+    async def refresh(self, executor) -> bool:
+        """Re-consulta o banco e troca o snapshot se algo mudou.
+
+        Tipo cuja query falhou mantem os valores do snapshot atual.
+        Retorna True se trocou.
+        """
+        loop = asyncio.get_running_loop()
+        if self._refresh_lock is None or self._lock_loop is not loop:
+            self._refresh_lock = asyncio.Lock()
+            self._lock_loop = loop
+        async with self._refresh_lock:
+            t0 = time.time()
+            old = self.current
+            try:
+                results = await executor.execute_batch(list(ENTITY_QUERIES.values()))
+            except Exception as e:
+                self._stats["errors"] += 1
+                print(f"[ENTITIES] Erro no refresh: {e}")
+                return False
+
+            r_marcas, r_empresas, r_compradores = results
+            if not any(r.get("success") for r in results):
+                self._stats["errors"] += 1
+                print(f"[ENTITIES] Refresh falhou: {r_marcas.get('error', '?')}")
+                return False
+
+            marcas = _column_values(r_marcas, "M") if r_marcas.get("success") else old.marcas
+            empresas = _column_values(r_empresas, "E") if r_empresas.get("success") else old.empresas
+            compradores = _column_values(r_compradores, "C") if r_compradores.get("success") else old.compradores
+
+            self._stats["refreshes"] += 1
+            self._stats["last_refresh"] = datetime.now().isoformat(timespec="seconds")
+            candidate = EntitySnapshot(marcas=frozenset(marcas), empresas=frozenset(empresas),
+                                       compradores=frozenset(compradores))
+            if not old.empty and candidate.digest() == old.digest():
+                self._stats["last_refresh_ms"] = int((time.time() - t0) * 1000)
+                return False
+
+            # Compilar o automato fora do event loop (milhares de marcas)
+            new = await asyncio.to_thread(
+                _build_snapshot, old.version + 1, marcas, empresas, compradores, "sankhya"
+            )
+            self.current = new  # troca atomica: 1 atribuicao
+            self._stats["swaps"] += 1
+            self._stats["last_refresh_ms"] = int((time.time() - t0) * 1000)
+            await asyncio.to_thread(self._save_snapshot, new)
+            print(f"[ENTITIES] Snapshot v{new.version}: {len(new.marcas)} marcas "
+                  f"(+{len(new.marcas - old.marcas)}/-{len(old.marcas - new.marcas)}), "
+                  f"{len(new.empresas)} empresas, {len(new.compradores)} compradores "
+                  f"({self._stats['last_refresh_ms']}ms)")
+            return True
+
+    async def ensure_loaded(self, executor):
+        """Sem snapshot nenhum (1a execucao): busca no banco agora (1 tentativa;
+        depois disso fica por conta do scheduler)."""
+        if self.current.empty and not self._fetch_tried:
+            self._fetch_tried = True
+            await self.refresh(executor)
+
+    @runs_as("background")
+    async def run_scheduler(self, executor):
+        """Loop de refresh: 1x logo no startup, depois a cada refresh_interval.
+
+        Roda na classe background da fila do Sankhya; ensure_loaded (1a pergunta
+        sem snapshot nenhum) continua na classe de quem chamou.
+        """
+        while True:
+            try:
+                await self.refresh(executor)
+            except Exception as e:
+                self._stats["errors"] += 1
+                print(f"[ENTITIES] Erro no scheduler: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    async def watch_snapshot(self, interval: int = ENTITY_WATCH_INTERVAL):
+        """Loop dos workers seguidores: recarrega o snapshot quando o arquivo muda
+        (quem consulta o banco e o worker lider, via run_scheduler)."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if not self.snapshot_file.exists():
+                    continue
+                if self.snapshot_file.stat().st_mtime != self._snapshot_mtime:
+                    old = self.current
+                    if await asyncio.to_thread(self.load_snapshot) and self.current.version != old.version:
+                        self._stats["swaps"] += 1
+            except Exception as e:
+                self._stats["errors"] += 1
+                print(f"[ENTITIES] Erro ao recarregar snapshot: {e}")
+
+    def stats(self) -> dict:
+        snap = self.current
+        return {
+            **self._stats,
+            "version": snap.version,
+            "source": snap.source,
+            "created_at": snap.created_at,
+            "marcas": len(snap.marcas),
+            "empresas": len(snap.empresas),
+            "compradores": len(snap.compradores),
+            "refresh_interval": self.refresh_interval,
+        }
@@ -0,0 +1,137 @@
+"""
+MMarra Data Hub - Matcher de entidades conhecidas (Aho-Corasick).
+
+Compila marcas, empresas e compradores do banco num unico automato e acha
+todas as ocorrencias numa passada pela pergunta, em vez de testar
+`m in q_upper` contra cada item do dicionario.
+
+Regras:
+- Match so em fronteira de palavra (MANN nao casa dentro de MANNHEIM)
+- Longest-match: entre spans sobrepostos do mesmo tipo vence o mais a
+  esquerda e, empatado, o mais longo ("MANN FILTER" ganha de "MANN")
+- complete(): token parcial como prefixo de palavra ("DONALD" -> DONALDSON)
+
+Construido 1x em SmartAgent._load_entities:
+    matcher = EntityMatcher({"marca": marcas, "empresa": empresas, "comprador": compradores})
+    spans = matcher.find_all(question.upper())
+"""
+
+from bisect import bisect_left
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+
+class EntitySpan(NamedTuple):
+    start: int
+    end: int
+    kind: str
+    value: str
+
+
+class EntityMatcher:
+    """Automato Aho-Corasick sobre os nomes conhecidos (ja em maiusculas)."""
+
+    def __init__(self, entities: Dict[str, Iterable[str]], word_boundary: bool = True):
+        self.word_boundary = word_boundary
+        self._goto: List[dict] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[list] = [[]]  # [(tamanho, kind, valor)]
+        self._words: Dict[str, list] = {}  # {kind: [(palavra, valor)] ordenado}
+        self.sizes: Dict[str, int] = {}
+
+        for kind, values in entities.items():
+            values = {v for v in (values or ()) if v}
+            self.sizes[kind] = len(values)
+            for value in values:
+                self._add(value, kind)
+            self._words[kind] = sorted({(w, v) for v in values for w in v.split()})
+        self._build()
+
+    # ============================================================
+    # CONSTRUCAO
+    # ============================================================
+
+    def _add(self, value: str, kind: str):
+        node = 0
+        for ch in value:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((len(value), kind, value))
+
+    def _build(self):
+        """Calcula links de falha (BFS) e herda as saidas do sufixo."""
+        goto, fail, out = self._goto, self._fail, self._out
+        queue = list(goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for ch, child in goto[node].items():
+                queue.append(child)
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                target = goto[f].get(ch, 0)
+                fail[child] = target if target != child else 0
+                if out[fail[child]]:
+                    out[child] = out[child] + out[fail[child]]
+
+    # ============================================================
+    # BUSCA
+    # ============================================================
+
+    def find_all(self, text: str) -> List[EntitySpan]:
+        """Todas as ocorrencias (em fronteira de palavra) de todos os tipos, 1 passada.
+
+        Com word_boundary=False vale qualquer substring (inclusive sobrepostas).
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        spans = []
+        node = 0
+        n = len(text)
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if not out[node]:
+                continue
+            if not self.word_boundary:
+                spans.extend(EntitySpan(i - length + 1, i + 1, kind, value)
+                             for length, kind, value in out[node])
+                continue
+            # Fronteira so importa quando a borda do nome e alfanumerica ("S.A." pode colar)
+            if ch.isalnum() and i + 1 < n and text[i + 1].isalnum():
+                continue
+            for length, kind, value in out[node]:
+                start = i - length + 1
+                if start == 0 or not text[start].isalnum() or not text[start - 1].isalnum():
+                    spans.append(EntitySpan(start, i + 1, kind, value))
+        return spans
+
+    @staticmethod
+    def longest(spans: List[EntitySpan], kind: str) -> List[EntitySpan]:
+        """Spans de um tipo sem sobreposicao (leftmost-longest), em ordem."""
+        chosen = []
+        end = -1
+        for span in sorted((s for s in spans if s.kind == kind), key=lambda s: (s.start, -s.end)):
+            if span.start >= end:
+                chosen.append(span)
+                end = span.end
+        return chosen
+
+    def complete(self, kind: str, token: str) -> Optional[str]:
+        """Valor cujo alguma palavra comeca com token (o mais curto; empate alfabetico)."""
+        words = self._words.get(kind) or []
+        i = bisect_left(words, (token,))
+        best = None
+        while i < len(words) and words[i][0].startswith(token):
+            value = words[i][1]
+            if best is None or (len(value), value) < (len(best), best):
+                best = value
+            i += 1
+        return best
@@ -10,12 +10,25 @@ import os
 from typing import Optional
 
 from src.core.groq_client import pool_narrate, pool_classify, groq_request
+from src.core.chat_stream import emit, token_callback, tokens_mark, reset_since
 from src.core.config import GROQ_MODEL_CLASSIFY
 from src.agent.brain import is_analytical_query, ANALYTICAL_SYSTEM
+from src.agent.request_context import current_request
 
 USE_LLM_NARRATOR = os.getenv("USE_LLM_NARRATOR", "true").lower() in ("true", "1", "yes")
 
 
+def mark_narration(model: str):
+    """Registra no request atual que a narracao chamou o Groq ("8b" ou "70b").
+
+    O custo no rate limiter e da rota + narracao; o 70b prevalece se o mesmo
+    request narrar mais de uma vez.
+    """
+    req = current_request()
+    if req is not None and req.narration != "70b":
+        req.narration = model
+
+
 NARRATOR_SYSTEM = """Voce e um assistente de BI da MMarra Distribuidora Automotiva.
 Voce recebeu dados de uma consulta ao banco e deve explicar de forma natural e inteligente.
 REGRA ABSOLUTA: Responda DIRETAMENTE em portugues brasileiro. NUNCA pense em voz alta. NUNCA comece com Okay, Let me, The user, First, I need. Va direto ao ponto.
@@ -33,13 +46,20 @@ REGRAS:
 10. Se nao tiver nada relevante pra analisar, seja breve"""
 
 
-async def llm_narrate(question: str, data_summary: str, fallback_response: str) -> str:
+async def llm_narrate(question: str, data_summary: str, fallback_response: str,
+                      preview: str = None) -> str:
     """Pede pro Groq explicar os dados de forma natural.
 
     Cerebro Analitico: perguntas analiticas (por que, compare, sugira)
     escalam pro 70b via pool_classify. Perguntas fatuais usam 8b normal.
     Se 70b falhar, cai pro 8b como fallback.
+
+    Em /api/chat/stream: preview (tabela/KPIs ja formatados) sai antes da
+    chamada ao Groq, e os tokens da narracao sao repassados conforme chegam.
     """
+    if preview:
+        emit("kpis", {"response": preview})
+
     if not USE_LLM_NARRATOR or not pool_narrate.available:
         return fallback_response
 
@@ -56,6 +76,8 @@ Analise esses dados em profundidade. Identifique padroes, riscos e sugira acoes.
 
         # Tentar 70b primeiro (pool_classify)
         if pool_classify.available:
+            mark = tokens_mark()
+            mark_narration("70b")
             result = await groq_request(
                 pool=pool_classify,
                 messages=[
@@ -66,6 +88,7 @@ Analise esses dados em profundidade. Identifique padroes, riscos e sugira acoes.
                 temperature=0.7,
                 max_tokens=600,
                 timeout=15,
+                on_token=token_callback(),
             )
 
             text = _clean_response(result)
@@ -73,9 +96,12 @@ Analise esses dados em profundidade. Identifique padroes, riscos e sugira acoes.
                 print(f"[BRAIN] 70b OK ({len(text)} chars)")
                 return text
 
+            reset_since(mark)
             print(f"[BRAIN] 70b falhou, fallback pro 8b")
 
         # Fallback: 8b com prompt analitico (melhor que nada)
+        mark = tokens_mark()
+        mark_narration("8b")
         result = await groq_request(
             pool=pool_narrate,
             messages=[
@@ -84,6 +110,7 @@ Analise esses dados em profundidade. Identifique padroes, riscos e sugira acoes.
             ],
             temperature=0.7,
             max_tokens=500,
+            on_token=token_callback(),
         )
 
         text = _clean_response(result)
@@ -91,6 +118,7 @@ Analise esses dados em profundidade. Identifique padroes, riscos e sugira acoes.
             print(f"[BRAIN] 8b-fallback OK ({len(text)} chars)")
             return text
 
+        reset_since(mark)
         return fallback_response
 
     # ---- Query simples/fatual: 8b normal ----
@@ -101,6 +129,8 @@ Dados retornados do banco:
 
 Explique esses dados de forma natural e analise o que chama atencao."""
 
+    mark = tokens_mark()
+    mark_narration("8b")
     result = await groq_request(
         pool=pool_narrate,
         messages=[
@@ -109,6 +139,7 @@ Explique esses dados de forma natural e analise o que chama atencao."""
         ],
         temperature=0.6,
         max_tokens=400,
+        on_token=token_callback(),
     )
 
     text = _clean_response(result)
@@ -116,6 +147,7 @@ Explique esses dados de forma natural e analise o que chama atencao."""
         print(f"[NARRATOR] 8b OK ({len(text)} chars)")
         return text
 
+    reset_since(mark)
     print(f"[NARRATOR] Groq falhou, usando fallback")
     return fallback_response
 
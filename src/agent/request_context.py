@@ -0,0 +1,134 @@
+"""
+MMarra Data Hub - Contexto por request (pergunta parseada 1x).
+
+Uma pergunta do /api/chat passava por normalize/tokenize/extract_entities/
+detect_filter_request varias vezes (ask_core, router, handlers), e o que era
+do request (produto_nome original, alias resolvido) ficava pendurado no
+SmartAgent compartilhado - com requests concorrentes um pisava no outro.
+
+- ParsedQuestion: imutavel, montada 1x no inicio do request. Campos caros e
+  nem sempre usados (scores, filtros, view agregada) sao calculados na
+  1a leitura e ficam guardados no proprio objeto.
+- RequestContext: estado mutavel DO REQUEST (alias resolvido, termo de
+  produto usado), vive numa ContextVar -> cada task asyncio ve o seu.
+
+Uso:
+    req = RequestContext(parse_question(question, agent.entities.current), user_id)
+    token = request_var.set(req)
+    try: ... finally: request_var.reset(token)
+
+    parsed = parsed_for(question, agent.entities.current)  # reusa o do request
+    params = parsed.params()                                # copia mutavel
+"""
+
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import cached_property
+from types import MappingProxyType
+from typing import Optional
+
+from src.core.utils import normalize, tokenize
+
+
+@dataclass(frozen=True)
+class ParsedQuestion:
+    """Pergunta ja normalizada/tokenizada + entidades extraidas (somente leitura)."""
+    question: str
+    q_norm: str
+    tokens: tuple             # tokenize(): so alfanumericos
+    words: tuple              # q_norm.split(): como o tool_router sempre pontuou
+    entities: MappingProxyType
+    snapshot_version: int = 0
+
+    def params(self) -> dict:
+        """Copia mutavel das entidades (handlers completam/alteram params)."""
+        return dict(self.entities)
+
+    @cached_property
+    def q_upper(self) -> str:
+        return self.q_norm.upper()
+
+    @cached_property
+    def scores(self) -> MappingProxyType:
+        from src.agent.scoring import score_intent
+        return MappingProxyType(score_intent(list(self.tokens)))
+
+    @cached_property
+    def word_scores(self) -> MappingProxyType:
+        from src.agent.scoring import score_intent
+        return MappingProxyType(score_intent(list(self.words)))
+
+    @property
+    def best_intent(self) -> str:
+        return max(self.scores, key=self.scores.get)
+
+    @property
+    def best_score(self) -> float:
+        return self.scores[self.best_intent]
+
+    @cached_property
+    def filters(self) -> MappingProxyType:
+        """detect_filter_request da pergunta (usar dict(...) antes de alterar)."""
+        from src.agent.context import detect_filter_request
+        return MappingProxyType(detect_filter_request(self.q_norm, list(self.tokens)))
+
+    @cached_property
+    def is_followup(self) -> bool:
+        from src.agent.context import detect_followup
+        return detect_followup(list(self.tokens), self.q_norm)
+
+    @cached_property
+    def aggregation_view(self) -> Optional[str]:
+        from src.formatters import detect_aggregation_view
+        return detect_aggregation_view(self.q_norm)
+
+    @cached_property
+    def view_mode(self) -> str:
+        from src.agent.scoring import detect_view_mode
+        return detect_view_mode(list(self.tokens))
+
+
+def parse_question(question: str, snapshot=None) -> ParsedQuestion:
+    """Monta a ParsedQuestion com os dicionarios do EntitySnapshot informado."""
+    from src.agent.entities import extract_entities
+
+    q_norm = normalize(question)
+    if snapshot is not None:
+        entities = extract_entities(question, snapshot.marcas, snapshot.empresas,
+                                    snapshot.compradores, matcher=snapshot.matcher)
+    else:
+        entities = extract_entities(question)
+    return ParsedQuestion(
+        question=question,
+        q_norm=q_norm,
+        tokens=tuple(tokenize(question)),
+        words=tuple(q_norm.split()),
+        entities=MappingProxyType(entities),
+        snapshot_version=getattr(snapshot, "version", 0),
+    )
+
+
+@dataclass
+class RequestContext:
+    """Estado de UM request do chat (nunca compartilhado entre usuarios)."""
+    parsed: ParsedQuestion
+    user_id: str = ""
+    produto_nome: Optional[str] = None   # termo original (B2: sugestao de alias / B4: sequencia)
+    alias_resolved: Optional[dict] = None  # {"from": termo, "to": nome/codprod}
+    narration: Optional[str] = None      # "8b" | "70b": narracao via Groq (custo extra no rate limiter)
+
+
+request_var: ContextVar = ContextVar("request_context", default=None)
+
+
+def current_request() -> Optional[RequestContext]:
+    return request_var.get()
+
+
+def parsed_for(question: str, snapshot=None) -> ParsedQuestion:
+    """ParsedQuestion do request atual se for a mesma pergunta; senao parseia agora
+    (multi-step, brain e chamadas fora do /api/chat passam perguntas proprias)."""
+    req = request_var.get()
+    if req is not None and req.parsed.question == question:
+        return req.parsed
+    return parse_question(question, snapshot)
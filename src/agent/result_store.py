@@ -0,0 +1,274 @@
+"""
+MMarra Data Hub - Retencao do ultimo resultado de cada conversa.
+
+O ConversationContext guarda o detail_data da ultima consulta (ate 500 rows)
+para follow-ups ("so os atrasados", "exporta pra excel"). Com muitos usuarios
+isso vira o maior consumo de RAM do processo. Cada resultado fica num de
+3 niveis, e o SessionStore desce os menos usados quando passa do orcamento:
+
+    quente  -> lista de dicts original (o que os handlers usam)
+    compacto -> colunas + 1 tupla por row (~5x menor que dicts)
+    disco   -> JSON num arquivo de spill lido via mmap (0 bytes de heap)
+
+get() volta o resultado para "quente" sob demanda, entao follow-up continua
+funcionando depois que o resultado saiu da RAM.
+
+Spill: data/session_spill/spill-<pid>-<geracao>.bin, append-only. Quando a
+geracao atual passa de metade do limite abre outra; so as 2 ultimas
+geracoes ficam no disco (resultado mais antigo que isso se perde, como uma
+sessao expirada).
+"""
+
+import os
+import sys
+import json
+import mmap
+from pathlib import Path
+from typing import Optional
+
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+SPILL_DIR = PROJECT_ROOT / "data" / "session_spill"
+SESSION_SPILL_MAX_BYTES = int(os.getenv("SESSION_SPILL_MAX_BYTES", str(512 * 1024 * 1024)))
+
+_SAMPLE_ROWS = 20
+
+
+def _row_bytes(row) -> int:
+    """Tamanho aproximado de uma row na heap (container + valores)."""
+    values = row.values() if isinstance(row, dict) else row
+    return sys.getsizeof(row) + sum(sys.getsizeof(v) for v in values)
+
+
+def _estimate(rows: list) -> int:
+    if not rows:
+        return 0
+    step = max(1, len(rows) // _SAMPLE_ROWS)
+    sample = rows[::step][:_SAMPLE_ROWS]
+    return int(sum(_row_bytes(r) for r in sample) / len(sample) * len(rows)) + sys.getsizeof(rows)
+
+
+# ============================================================
+# ENCODING COMPACTO
+# ============================================================
+
+class CompactRows:
+    """Rows com as mesmas chaves (na mesma ordem) guardadas como tuplas."""
+
+    __slots__ = ("columns", "values", "nbytes")
+
+    def __init__(self, columns: tuple, values: list):
+        self.columns = columns
+        self.values = values
+        self.nbytes = _estimate(values)
+
+    @classmethod
+    def encode(cls, rows: list) -> Optional["CompactRows"]:
+        """None se as rows nao forem dicts uniformes (ficam so quente/disco)."""
+        if not rows or not isinstance(rows[0], dict):
+            return None
+        columns = tuple(rows[0])
+        values = []
+        for r in rows:
+            if not isinstance(r, dict) or len(r) != len(columns) or tuple(r) != columns:
+                return None
+            values.append(tuple(r.values()))
+        return cls(columns, values)
+
+    def decode(self) -> list:
+        cols = self.columns
+        return [dict(zip(cols, v)) for v in self.values]
+
+    def to_json(self) -> bytes:
+        return json.dumps({"c": self.columns, "v": self.values},
+                          default=str, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def rows_to_state(rows: list) -> dict:
+    """Rows em formato serializavel: {"c": colunas, "v": tuplas} ou {"r": rows}."""
+    compact = CompactRows.encode(rows)
+    if compact is not None:
+        return {"c": compact.columns, "v": compact.values}
+    return {"r": rows}
+
+
+def rows_from_state(data: dict) -> list:
+    if "r" in data:
+        return data["r"]
+    cols = data["c"]
+    return [dict(zip(cols, v)) for v in data["v"]]
+
+
+def _rows_to_json(rows: list) -> bytes:
+    compact = CompactRows.encode(rows)
+    if compact is not None:
+        return compact.to_json()
+    return json.dumps({"r": rows}, default=str, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _rows_from_json(raw: bytes) -> list:
+    return rows_from_state(json.loads(raw))
+
+
+# ============================================================
+# SPILL EM DISCO (mmap)
+# ============================================================
+
+class ResultSpill:
+    """Arquivo append-only de resultados despejados da RAM, lido via mmap."""
+
+    def __init__(self, directory: Path = None, max_bytes: int = SESSION_SPILL_MAX_BYTES):
+        self.directory = Path(directory or SPILL_DIR)
+        self.max_bytes = max(1024, max_bytes)
+        self._gen = 0
+        self._files = {}  # {gen: {"path", "fh", "size", "mm"}}
+        self._stats = {"writes": 0, "reads": 0, "bytes_written": 0, "lost": 0, "rotations": 0}
+
+    def _path(self, gen: int) -> Path:
+        return self.directory / f"spill-{os.getpid()}-{gen}.bin"
+
+    def _open_gen(self, gen: int) -> dict:
+        if not self._files:
+            # 1o uso: limpa sobras de um processo anterior com o mesmo pid
+            self.directory.mkdir(parents=True, exist_ok=True)
+            for old in self.directory.glob(f"spill-{os.getpid()}-*.bin"):
+                try:
+                    old.unlink()
+                except OSError:
+                    pass
+        path = self._path(gen)
+        f = {"path": path, "fh": open(path, "w+b"), "size": 0, "mm": None}
+        self._files[gen] = f
+        return f
+
+    def _close_gen(self, gen: int):
+        f = self._files.pop(gen, None)
+        if not f:
+            return
+        if f["mm"] is not None:
+            f["mm"].close()
+        f["fh"].close()
+        try:
+            f["path"].unlink()
+        except OSError:
+            pass
+
+    def write(self, payload: bytes) -> tuple:
+        """Grava e retorna a referencia (geracao, offset, tamanho)."""
+        f = self._files.get(self._gen)
+        if f is not None and f["size"] + len(payload) > self.max_bytes // 2 and f["size"] > 0:
+            self._gen += 1
+            self._stats["rotations"] += 1
+            for gen in [g for g in self._files if g < self._gen - 1]:
+                self._close_gen(gen)
+            f = None
+        if f is None:
+            f = self._open_gen(self._gen)
+
+        offset = f["size"]
+        f["fh"].seek(offset)
+        f["fh"].write(payload)
+        f["fh"].flush()
+        f["size"] += len(payload)
+        self._stats["writes"] += 1
+        self._stats["bytes_written"] += len(payload)
+        return (self._gen, offset, len(payload))
+
+    def read(self, ref: tuple) -> Optional[bytes]:
+        gen, offset, length = ref
+        f = self._files.get(gen)
+        if f is None:
+            self._stats["lost"] += 1
+            return None
+        mm = f["mm"]
+        if mm is None or len(mm) < offset + length:
+            # Arquivo cresceu desde o ultimo map: remapeia o tamanho atual
+            if mm is not None:
+                mm.close()
+            mm = f["mm"] = mmap.mmap(f["fh"].fileno(), 0, access=mmap.ACCESS_READ)
+        self._stats["reads"] += 1
+        return mm[offset:offset + length]
+
+    def close(self):
+        for gen in list(self._files):
+            self._close_gen(gen)
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "generation": self._gen,
+            "disk_bytes": sum(f["size"] for f in self._files.values()),
+            "max_bytes": self.max_bytes,
+        }
+
+
+# ============================================================
+# RESULTADO RETIDO (3 niveis)
+# ============================================================
+
+class RetainedResult:
+    """detail_data de um contexto: quente, compacto ou em disco."""
+
+    __slots__ = ("rows", "compact", "ref", "spill", "n_rows", "_hot_bytes")
+
+    def __init__(self, rows: list):
+        self.rows = rows
+        self.compact = None
+        self.ref = None
+        self.spill = None
+        self.n_rows = len(rows)
+        self._hot_bytes = None
+
+    @property
+    def level(self) -> str:
+        if self.rows is not None:
+            return "hot"
+        return "compact" if self.compact is not None else "disk"
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes aproximados na heap no nivel atual."""
+        if self.rows is not None:
+            if self._hot_bytes is None:
+                self._hot_bytes = _estimate(self.rows)
+            return self._hot_bytes
+        if self.compact is not None:
+            return self.compact.nbytes
+        return 0
+
+    def get(self) -> list:
+        """Rows como lista de dicts (volta para quente se estava compacto/disco)."""
+        if self.rows is None:
+            if self.compact is not None:
+                self.rows = self.compact.decode()
+                self.compact = None
+            else:
+                raw = self.spill.read(self.ref) if self.spill else None
+                if raw is None:
+                    print(f"[SESSION] Resultado em spill perdido ({self.n_rows} rows)")
+                    self.rows = []
+                    self.n_rows = 0
+                else:
+                    self.rows = _rows_from_json(raw)
+                self.ref = None
+            self._hot_bytes = None
+        return self.rows
+
+    def demote(self, spill: ResultSpill) -> bool:
+        """Desce 1 nivel (quente -> compacto -> disco). False se ja esta no disco."""
+        if self.rows is not None:
+            compact = CompactRows.encode(self.rows)
+            if compact is not None:
+                self.compact = compact
+            else:
+                self.ref = spill.write(_rows_to_json(self.rows))
+                self.spill = spill
+            self.rows = None
+            self._hot_bytes = None
+            return True
+        if self.compact is not None:
+            self.ref = spill.write(self.compact.to_json())
+            self.spill = spill
+            self.compact = None
+            return True
+        return False
@@ -0,0 +1,160 @@
+"""
+MMarra Data Hub - Resultado em colunas (follow-ups sobre dados em memoria).
+
+O ConversationContext guarda o detail_data da ultima consulta (lista de
+dicts). Cada follow-up ("so os atrasados", "acima de 5 mil", "ordena por
+previsao") refazia str()/float() linha a linha e re-parseava DD/MM/YYYY
+dentro do sort key.
+
+ResultTable monta colunas NumPy sob demanda - so os campos que algum filtro
+ou ordenacao tocou - e guarda no contexto junto com os dados:
+- texto:  str(valor).upper()           (igualdade / contem)
+- numero: float(valor or 0) + mascara de conversao valida
+- data:   chave YYYY-MM-DD pre-parseada (sort de DD/MM/YYYY)
+
+select() devolve os indices na mesma ordem e com o mesmo resultado do
+apply_filters linha a linha (inclusive os casos em que o filtro/sort e
+ignorado por valor nao numerico).
+"""
+
+import re
+
+import numpy as np
+
+
+_DATE_RE = re.compile(r'\d{2}/\d{2}/\d{4}')
+
+
+def _desc_order(keys: np.ndarray) -> np.ndarray:
+    """argsort decrescente estavel (empates na ordem original, como sorted(reverse=True))."""
+    n = len(keys)
+    return (n - 1 - np.argsort(keys[::-1], kind="stable"))[::-1]
+
+
+def _date_key(v) -> str:
+    v = str(v or "")
+    if _DATE_RE.match(v):
+        parts = v.split("/")
+        return f"{parts[2]}-{parts[1]}-{parts[0]}"
+    return v
+
+
+class ResultTable:
+    """Colunas tipadas (lazy) sobre uma lista de rows dict."""
+
+    def __init__(self, rows: list):
+        self.rows = rows
+        self.n = len(rows)
+        self._text = {}
+        self._blank = {}
+        self._num = {}
+        self._date = {}
+
+    @classmethod
+    def from_rows(cls, rows: list):
+        """None se tiver row que nao e dict (cai no apply_filters linha a linha)."""
+        if not rows or not all(isinstance(r, dict) for r in rows):
+            return None
+        return cls(rows)
+
+    # ============================================================
+    # COLUNAS
+    # ============================================================
+
+    def text(self, field: str) -> np.ndarray:
+        col = self._text.get(field)
+        if col is None:
+            col = np.array([str(r.get(field, "")).upper() for r in self.rows], dtype=object)
+            self._text[field] = col
+        return col
+
+    def blank(self, field: str) -> np.ndarray:
+        col = self._blank.get(field)
+        if col is None:
+            col = np.array([not str(r.get(field, "") or "").strip() for r in self.rows], dtype=bool)
+            self._blank[field] = col
+        return col
+
+    def number(self, field: str):
+        """(valores float64, mascara de linhas conversiveis)."""
+        cached = self._num.get(field)
+        if cached is None:
+            values = np.zeros(self.n, dtype=np.float64)
+            valid = np.ones(self.n, dtype=bool)
+            for i, r in enumerate(self.rows):
+                try:
+                    values[i] = float(r.get(field, 0) or 0)
+                except (ValueError, TypeError):
+                    valid[i] = False
+            cached = self._num[field] = (values, valid)
+        return cached
+
+    def date_key(self, field: str) -> np.ndarray:
+        col = self._date.get(field)
+        if col is None:
+            col = np.array([_date_key(r.get(field, "")) for r in self.rows], dtype=str)
+            self._date[field] = col
+        return col
+
+    # ============================================================
+    # OPERACOES
+    # ============================================================
+
+    def _threshold(self, idx: np.ndarray, spec: str, greater: bool) -> np.ndarray:
+        campo, valor_str = str(spec).split(":", 1)
+        try:
+            threshold = float(valor_str)
+        except (ValueError, TypeError):
+            return idx
+        values, valid = self.number(campo)
+        if not valid[idx].all():
+            return idx  # linha a linha: ValueError -> filtro ignorado
+        v = values[idx]
+        return idx[v > threshold] if greater else idx[v < threshold]
+
+    def _sorted(self, idx: np.ndarray, sort_key: str) -> np.ndarray:
+        field, direction = sort_key.rsplit("_", 1)
+        reverse = direction == "DESC"
+        values, valid = self.number(field)
+        if valid[idx].all():
+            keys = values[idx]
+        else:
+            keys = self.date_key(field)[idx]
+        order = _desc_order(keys) if reverse else np.argsort(keys, kind="stable")
+        return idx[order]
+
+    def select(self, filters: dict, sort_key: str = None, top_n: int = None) -> np.ndarray:
+        """Indices das rows que passam nos filtros, ordenados e cortados."""
+        idx = np.arange(self.n)
+
+        for fn_key in [k for k in filters if k.startswith("_fn_")]:
+            spec = filters[fn_key]
+            fn_name = fn_key.replace("_fn_", "")
+            if fn_name == "empty":
+                idx = idx[self.blank(spec)[idx]]
+            elif fn_name == "not_empty":
+                idx = idx[~self.blank(spec)[idx]]
+            elif fn_name.startswith(("maior", "menor")) and ":" in str(spec):
+                idx = self._threshold(idx, spec, greater=fn_name.startswith("maior"))
+            elif fn_name == "contem" and ":" in str(spec):
+                campo, texto = str(spec).split(":", 1)
+                texto = texto.upper()
+                col = self.text(campo)[idx]
+                idx = idx[np.fromiter((texto in v for v in col), dtype=bool, count=len(col))]
+
+        for field, value in filters.items():
+            if field.startswith("_"):
+                continue
+            idx = idx[self.text(field)[idx] == value.upper()]
+
+        if sort_key and len(idx):
+            idx = self._sorted(idx, sort_key)
+
+        if top_n and len(idx):
+            idx = idx[:top_n]
+
+        return idx
+
+    def take(self, idx: np.ndarray) -> list:
+        rows = self.rows
+        return [rows[i] for i in idx.tolist()]
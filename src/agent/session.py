@@ -11,11 +11,15 @@ Permite ao agente:
 Integra com ConversationContext existente + adiciona histórico de mensagens.
 """
 
+import os
 import time
+from collections import OrderedDict
 from typing import Optional
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, asdict
 
 from src.agent.context import ConversationContext
+from src.agent.result_store import ResultSpill, rows_to_state, rows_from_state
+from src.core.state_backend import get_state_backend
 
 
 @dataclass
@@ -50,6 +54,7 @@ class SessionMemory:
         self.user_id = user_id
         self.ctx = ConversationContext(user_id)
         self.messages: list[Message] = []
+        self.failed_term: Optional[str] = None  # B4: ultimo termo de produto sem resultado
         self.created_at = time.time()
         self.last_active = time.time()
 
@@ -151,43 +156,224 @@ class SessionMemory:
         if len(self.messages) > self.MAX_HISTORY:
             self.messages = self.messages[-self.MAX_HISTORY:]
 
+    def to_state(self) -> dict:
+        return {
+            "messages": [asdict(m) for m in self.messages],
+            "failed_term": self.failed_term,
+            "created_at": self.created_at,
+            "last_active": self.last_active,
+            "ctx": self.ctx.to_state(),
+        }
+
+    def load_state(self, state: dict, rows: list = None):
+        """Restaura historico + contexto gravados por outro worker."""
+        self.messages = [Message(**m) for m in state.get("messages", [])]
+        self.failed_term = state.get("failed_term")
+        self.created_at = state.get("created_at", self.created_at)
+        self.last_active = state.get("last_active", self.last_active)
+        self.ctx.load_state(state.get("ctx") or {}, rows)
+
     def __repr__(self):
         return (f"<Session user={self.user_id} turns={self.turn_count} "
                 f"last_tool={self.ctx.intent} expired={self.is_expired}>")
 
 
 # ============================================================
-# SESSION STORE (in-memory, com cleanup automático)
+# SESSION STORE (in-memory, LRU + orcamento de memoria)
 # ============================================================
 
+SESSION_MAX_ACTIVE = int(os.getenv("SESSION_MAX_ACTIVE", "5000"))
+SESSION_MEMORY_BUDGET = int(os.getenv("SESSION_MEMORY_BUDGET", str(128 * 1024 * 1024)))  # bytes
+
+
 class SessionStore:
     """
     Store global de sessões. Thread-safe para uso com FastAPI.
     Limpa sessões expiradas automaticamente.
+
+    Memória limitada:
+    - LRU por usuário (OrderedDict, mais recente no fim); acima de
+      SESSION_MAX_ACTIVE a sessão menos usada sai inteira.
+    - Os resultados retidos (detail_data dos contextos) somam no máximo
+      SESSION_MEMORY_BUDGET bytes: passando disso, os contextos menos usados
+      descem de nível (dicts -> tuplas compactas -> spill em disco via mmap)
+      e voltam para a RAM só se tiverem follow-up.
+
+    Multi-worker: com backend compartilhado (STATE_BACKEND=sqlite) o estado
+    da sessão é gravado no fim de cada pergunta (save) e o get() recarrega
+    quando a versão no backend mudou (pergunta anterior caiu em outro worker).
+    As rows só são regravadas quando o resultado muda.
     """
 
-    def __init__(self):
-        self._sessions: dict[str, SessionMemory] = {}
+    STATE_NS = "conversation"
+    ROWS_NS = "conversation_rows"
+
+    def __init__(self, max_sessions: int = SESSION_MAX_ACTIVE,
+                 memory_budget: int = SESSION_MEMORY_BUDGET, spill: ResultSpill = None,
+                 backend=None):
+        self._sessions: "OrderedDict[str, SessionMemory]" = OrderedDict()
         self._last_cleanup = time.time()
         self._cleanup_interval = 300  # 5 minutos
+        self.max_sessions = max(1, max_sessions)
+        self.memory_budget = max(0, memory_budget)
+        self.spill = spill or ResultSpill()
+        self._bytes = {}  # {user_id: bytes do resultado retido}
+        self._total_bytes = 0
+        self._stats = {"evicted_sessions": 0, "demotions": 0, "rehydrations": 0,
+                       "state_loads": 0, "state_saves": 0}
+        self._backend = backend
+        self._versions = {}    # {user_id: versão do estado que este worker tem}
+        self._saved_rows = {}  # {user_id: result_id das rows já gravadas}
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = get_state_backend()
+        return self._backend
+
+    @property
+    def shared(self) -> bool:
+        return self.backend.shared
 
     def get(self, user_id: str) -> SessionMemory:
         """Retorna sessão existente ou cria nova."""
         self._maybe_cleanup()
+        if self.shared:
+            self._sync(user_id)
 
         session = self._sessions.get(user_id)
         if session and not session.is_expired:
+            self._sessions.move_to_end(user_id)
+            session.ctx._owner = self._result_changed
             return session
 
         # Nova sessão
-        session = SessionMemory(user_id)
-        self._sessions[user_id] = session
+        if session:
+            self._drop(user_id)
+        return self._add(SessionMemory(user_id))
+
+    def _add(self, session: SessionMemory) -> SessionMemory:
+        session.ctx._owner = self._result_changed
+        self._sessions[session.user_id] = session
+        while len(self._sessions) > self.max_sessions:
+            oldest = next(iter(self._sessions))
+            self._drop(oldest)
+            self._stats["evicted_sessions"] += 1
         return session
 
     def get_context(self, user_id: str) -> ConversationContext:
         """Atalho: retorna o ConversationContext da sessão."""
         return self.get(user_id).ctx
 
+    def reset(self, user_id: str):
+        """Descarta a sessão do usuário (logout / limpar histórico)."""
+        self._drop(user_id)
+        if self.shared:
+            self.backend.delete(self.STATE_NS, user_id)
+            self.backend.delete(self.ROWS_NS, user_id)
+
+    def clear(self):
+        uids = set(self._sessions)
+        if self.shared:
+            uids.update(uid for uid, _ in self.backend.items(self.STATE_NS))
+        for uid in uids:
+            self.reset(uid)
+
+    def _drop(self, user_id: str):
+        session = self._sessions.pop(user_id, None)
+        if session:
+            session.ctx._owner = None
+        self._total_bytes -= self._bytes.pop(user_id, 0)
+        self._versions.pop(user_id, None)
+        self._saved_rows.pop(user_id, None)
+
+    # ============================================================
+    # BACKEND COMPARTILHADO (multi-worker)
+    # ============================================================
+
+    def _sync(self, user_id: str):
+        """Recarrega a sessão do backend se outro worker gravou depois da nossa cópia."""
+        version = self.backend.version(self.STATE_NS, user_id)
+        if version == self._versions.get(user_id):
+            return
+        if version is None:
+            self._drop(user_id)  # resetada/expirada em outro worker
+            return
+        state = self.backend.get(self.STATE_NS, user_id)
+        if state is None:
+            self._drop(user_id)
+            return
+
+        session = self._sessions.get(user_id)
+        result_id = (state.get("ctx") or {}).get("result_id")
+        rows = None
+        if session is None or session.ctx._result_id != result_id:
+            stored = self.backend.get(self.ROWS_NS, user_id) if result_id else None
+            rows = rows_from_state(stored["rows"]) if stored and stored.get("id") == result_id else []
+        if session is None:
+            session = self._add(SessionMemory(user_id))
+        session.load_state(state, rows)
+        self._versions[user_id] = version
+        self._saved_rows[user_id] = session.ctx._result_id
+        self._stats["state_loads"] += 1
+        if rows is not None:
+            self._account(user_id, session.ctx)
+            self._enforce(protect=user_id)
+
+    def save(self, user_id: str):
+        """Grava o estado da sessão no backend (fim de cada pergunta). No-op em memory."""
+        if not self.shared:
+            return
+        session = self._sessions.get(user_id)
+        if session is None:
+            return
+        ctx = session.ctx
+        ttl = session.SESSION_TTL
+        if ctx._result_id and ctx._result_id != self._saved_rows.get(user_id):
+            self.backend.set(self.ROWS_NS, user_id,
+                             {"id": ctx._result_id, "rows": rows_to_state(ctx.get_data())}, ttl=ttl)
+            self._saved_rows[user_id] = ctx._result_id
+        elif not ctx._result_id and self._saved_rows.get(user_id):
+            self.backend.delete(self.ROWS_NS, user_id)
+            self._saved_rows[user_id] = None
+        self._versions[user_id] = self.backend.set(self.STATE_NS, user_id, session.to_state(), ttl=ttl)
+        self._stats["state_saves"] += 1
+
+    # ============================================================
+    # ORCAMENTO DE MEMORIA
+    # ============================================================
+
+    def _result_changed(self, ctx: ConversationContext, rehydrated: bool = False):
+        """Callback do contexto: resultado novo ou de volta para a RAM."""
+        uid = ctx.user_id
+        session = self._sessions.get(uid)
+        if session is None or session.ctx is not ctx:
+            return
+        if rehydrated:
+            self._stats["rehydrations"] += 1
+        self._account(uid, ctx)
+        self._enforce(protect=uid)
+
+    def _account(self, uid: str, ctx: ConversationContext):
+        size = ctx.result_bytes
+        self._total_bytes += size - self._bytes.get(uid, 0)
+        self._bytes[uid] = size
+
+    def _enforce(self, protect: str = None):
+        """Desce resultados (LRU primeiro) até caber no orçamento."""
+        if self._total_bytes <= self.memory_budget:
+            return
+        for level in ("hot", "compact"):
+            for uid, session in self._sessions.items():
+                if self._total_bytes <= self.memory_budget:
+                    return
+                retained = session.ctx._retained
+                if uid == protect or retained is None or retained.level != level:
+                    continue
+                if session.ctx.demote_result(self.spill):
+                    self._stats["demotions"] += 1
+                    self._account(uid, session.ctx)
+
     def _maybe_cleanup(self):
         """Remove sessões expiradas periodicamente."""
         now = time.time()
@@ -196,7 +382,7 @@ class SessionStore:
 
         expired = [uid for uid, s in self._sessions.items() if s.is_expired]
         for uid in expired:
-            del self._sessions[uid]
+            self._drop(uid)
 
         if expired:
             print(f"[SESSION] Cleanup: {len(expired)} sessões expiradas removidas, "
@@ -207,10 +393,26 @@ class SessionStore:
     def active_count(self) -> int:
         return sum(1 for s in self._sessions.values() if not s.is_expired)
 
+    def memory_stats(self) -> dict:
+        levels = {"hot": 0, "compact": 0, "disk": 0}
+        for s in self._sessions.values():
+            if s.ctx._retained is not None:
+                levels[s.ctx._retained.level] += 1
+        return {
+            **self._stats,
+            "result_bytes": self._total_bytes,
+            "memory_budget": self.memory_budget,
+            "max_sessions": self.max_sessions,
+            "state_backend": self.backend.name,
+            "results_by_level": levels,
+            "spill": self.spill.stats(),
+        }
+
     def stats(self) -> dict:
         return {
             "total_sessions": len(self._sessions),
             "active_sessions": self.active_count,
+            "memory": self.memory_stats(),
             "sessions": {
                 uid: {
                     "turns": s.turn_count,
@@ -215,25 +215,36 @@ async def route(question: str, user_context: dict = None,
                 ctx: ConversationContext = None,
                 known_marcas: set = None, known_empresas: set = None,
                 known_compradores: set = None,
-                log: dict = None, history: list = None) -> ToolCall:
+                entity_matcher=None,
+                log: dict = None, history: list = None,
+                parsed=None) -> ToolCall:
     """
     Roteador principal de 3 camadas.
+
+    parsed: ParsedQuestion do request (src/agent/request_context.py) - reusa
+    normalizacao, entidades e scores ja calculados no ask_core.
     """
     t0 = time.time()
-    q_norm = normalize(question)
-    tokens = q_norm.split()
+    if parsed is not None and parsed.question == question:
+        q_norm = parsed.q_norm
+        tokens = list(parsed.words)
+        # Entidades da pergunta ATUAL (antes de qualquer merge com contexto)
+        params = parsed.params()
+    else:
+        parsed = None
+        q_norm = normalize(question)
+        tokens = q_norm.split()
+        params = extract_entities(
+            question,
+            known_marcas or set(),
+            known_empresas or set(),
+            known_compradores or set(),
+            matcher=entity_matcher,
+        )
     
     if log is None:
         log = {}
 
-    # Extrair entidades da pergunta ATUAL (antes de qualquer merge com contexto)
-    params = extract_entities(
-        question,
-        known_marcas or set(),
-        known_empresas or set(),
-        known_compradores or set()
-    )
-
     # ================================================================
     # PRE-CHECK: Follow-up ou nova query?
     # ================================================================
@@ -269,7 +280,7 @@ async def route(question: str, user_context: dict = None,
     # TRIVIAIS: Scoring rápido para intents óbvios (<1ms)
     # Resolve saudacao/ajuda/excel SEM gastar tokens no Haiku.
     # ================================================================
-    scores = score_intent(tokens)
+    scores = parsed.word_scores if parsed is not None else score_intent(tokens)
     best_intent = max(scores, key=scores.get)
     best_score = scores[best_intent]
 
@@ -8,9 +8,12 @@ import os
 import asyncio
 from datetime import datetime
 
+from src.core.query_scheduler import runs_as
+
 TRAINING_HOUR = int(os.getenv("TRAINING_HOUR", "3"))
 
 
+@runs_as("background")
 async def daily_training(force: bool = False) -> dict:
     """Executa compilação + review de aliases via pool_train.
     Chamado automaticamente pelo scheduler ou manualmente via CLI/endpoint."""
@@ -61,6 +64,7 @@ async def daily_training(force: bool = False) -> dict:
             sync_result = await es_sync.incremental_sync()
             stats["elastic_sync"] = sync_result
             print(f"[TRAIN] Elastic sync: {sync_result}")
+            stats["elastic_reconcile"] = await es_sync.reconcile()
         else:
             print(f"[TRAIN] Elastic offline, sync ignorado")
     except Exception as e:
@@ -11,15 +11,14 @@ Uso:
 import os
 import sys
 import time
+import asyncio
 import secrets
-import requests as http_requests
-from collections import defaultdict
 from pathlib import Path
 from datetime import datetime, timedelta
 from typing import Optional
 
 from fastapi import FastAPI, Request, HTTPException, Header
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
@@ -34,6 +33,12 @@ load_dotenv(PROJECT_ROOT / ".env")
 from src.llm.agent import DataHubAgent
 from src.llm.smart_agent import SmartAgent
 from src.llm.llm_client import LLMClient, LLM_MODEL, LLM_PROVIDER
+from src.llm.query_executor import SafeQueryExecutor
+from src.core.sankhya_client import sankhya_transport
+from src.core.utils import safe_sql
+from src.core.chat_stream import ChatStream, sse_format
+from src.core.state_backend import get_state_backend, BackendDict, run_as_leader, run_once
+from src.core.rate_limiter import TokenBucketLimiter
 
 # Import reports
 from src.api.reports import router as reports_router
@@ -63,131 +68,48 @@ agent = DataHubAgent()
 smart_agent = SmartAgent()
 
 # ============================================================
-# AUTH - Sessoes em memoria
+# AUTH - Sessoes (backend de estado: memory ou sqlite p/ multi-worker)
 # ============================================================
 
-sessions = {}  # {token: {user, role, codvend, tipvend, ...}}
+state_backend = get_state_backend()
 SESSION_TIMEOUT = timedelta(hours=8)
+SESSION_TOUCH_SECONDS = 30  # last_activity so e regravado no backend a cada 30s
+sessions = BackendDict(state_backend, "auth", ttl=SESSION_TIMEOUT.total_seconds())  # {token: {user, role, ...}}
 
-# Sankhya API
-SANKHYA_BASE_URL = "https://api.sankhya.com.br"
-SANKHYA_CLIENT_ID = os.getenv("SANKHYA_CLIENT_ID", "")
-SANKHYA_CLIENT_SECRET = os.getenv("SANKHYA_CLIENT_SECRET", "")
-SANKHYA_X_TOKEN = os.getenv("SANKHYA_X_TOKEN", "")
+# Sankhya API: pool/token compartilhados em src/core/sankhya_client.py
 ADMIN_USERS = [u.strip().upper() for u in os.getenv("ADMIN_USERS", "").split(",") if u.strip()]
-_oauth_token = {"token": None, "expires_at": 0}
+
+# Perfil RBAC resolvido no login, cacheado por usuario durante a sessao
+# (no backend de estado: o logout em um worker invalida o cache de todos)
+# {USERNAME: {"profile", "role", "team_codvends", "expires"}}
+_profile_cache = BackendDict(state_backend, "rbac", ttl=SESSION_TIMEOUT.total_seconds())
 
 
 # ============================================================
-# RATE LIMITER (in-memory, sem dependencias externas)
+# RATE LIMITER (token bucket por role, custo por rota - src/core/rate_limiter.py)
 # ============================================================
 
-class SimpleRateLimiter:
-    """Rate limiter simples por usuario. 30 requests/minuto por padrao."""
-
-    def __init__(self, max_requests: int = 30, window_seconds: int = 60):
-        self.max_requests = max_requests
-        self.window = window_seconds
-        self._requests: dict[str, list[float]] = defaultdict(list)
-
-    def is_allowed(self, user_id: str) -> bool:
-        now = time.time()
-        # Limpar requests fora da janela
-        self._requests[user_id] = [
-            t for t in self._requests[user_id] if now - t < self.window
-        ]
-        if len(self._requests[user_id]) >= self.max_requests:
-            return False
-        self._requests[user_id].append(now)
-        return True
-
-    def remaining(self, user_id: str) -> int:
-        now = time.time()
-        recent = [t for t in self._requests.get(user_id, []) if now - t < self.window]
-        return max(0, self.max_requests - len(recent))
-
-
-rate_limiter = SimpleRateLimiter(max_requests=30, window_seconds=60)
-
-
-def get_sankhya_oauth_token() -> str:
-    """Obtem token OAuth do Sankhya (com cache)."""
-    if _oauth_token["token"] and time.time() < (_oauth_token["expires_at"] - 30):
-        return _oauth_token["token"]
-
-    if not all([SANKHYA_CLIENT_ID, SANKHYA_CLIENT_SECRET, SANKHYA_X_TOKEN]):
-        raise Exception("Credenciais OAuth nao configuradas no .env (SANKHYA_CLIENT_ID, SANKHYA_CLIENT_SECRET, SANKHYA_X_TOKEN)")
-
-    print(f"[AUTH] Obtendo OAuth token... (client_id={SANKHYA_CLIENT_ID[:8]}...)")
-    resp = http_requests.post(
-        f"{SANKHYA_BASE_URL}/authenticate",
-        headers={
-            "X-Token": SANKHYA_X_TOKEN,
-            "Content-Type": "application/x-www-form-urlencoded",
-        },
-        data={
-            "client_id": SANKHYA_CLIENT_ID,
-            "client_secret": SANKHYA_CLIENT_SECRET,
-            "grant_type": "client_credentials",
-        },
-        timeout=30,
-        verify=False
-    )
+rate_limiter = TokenBucketLimiter(backend=state_backend)
 
-    raw = resp.text
-    print(f"[AUTH] OAuth response: HTTP {resp.status_code}, body={raw[:500]}")
 
-    if resp.status_code != 200 or not raw.strip():
-        raise Exception(f"OAuth HTTP {resp.status_code} - resposta: '{raw[:300]}'")
+# Executor das queries de RBAC (sem cache de resultados: perfil tem cache proprio)
+_rbac_executor = SafeQueryExecutor(whitelist=["TGFVEN"])
 
-    try:
-        result = resp.json()
-    except Exception:
-        raise Exception(f"OAuth resposta nao-JSON (HTTP {resp.status_code}): '{raw[:300]}'")
-
-    if "access_token" not in result:
-        raise Exception(f"OAuth sem access_token: {result}")
-
-    _oauth_token["token"] = result["access_token"]
-    _oauth_token["expires_at"] = time.time() + result.get("expires_in", 300)
-    print(f"[AUTH] OAuth token obtido (expira em {result.get('expires_in', 300)}s)")
-    return _oauth_token["token"]
-
-
-def _execute_sankhya_query(sql: str) -> list:
-    """Executa query SQL no Sankhya via DbExplorerSP (sincrono)."""
-    oauth_token = get_sankhya_oauth_token()
-    resp = http_requests.post(
-        f"{SANKHYA_BASE_URL}/gateway/v1/mge/service.sbr",
-        params={"serviceName": "DbExplorerSP.executeQuery", "outputType": "json"},
-        headers={
-            "Authorization": f"Bearer {oauth_token}",
-            "Content-Type": "application/json",
-        },
-        json={"requestBody": {"sql": sql}},
-        timeout=30,
-        verify=False
-    )
-    data = resp.json()
-    if str(data.get("status")) != "1":
-        print(f"[RBAC] Query falhou: {data}")
-        return []
-    try:
-        rows = data["responseBody"]["rows"]
-        return rows if isinstance(rows, list) else []
-    except (KeyError, TypeError):
+
+def _rows_as_dicts(result: dict, columns: list) -> list:
+    """Normaliza rows do Sankhya (listas ou dicts) para list of dicts."""
+    if not result.get("success"):
+        if result.get("error"):
+            print(f"[RBAC] Query falhou: {result.get('error')}")
         return []
+    rows = result.get("data") or []
+    if rows and isinstance(rows[0], (list, tuple)):
+        cols = result.get("columns") or columns
+        rows = [dict(zip(cols, r)) for r in rows]
+    return [r for r in rows if isinstance(r, dict)]
 
 
-def fetch_user_profile(username: str) -> dict:
-    """Busca perfil do usuario na TGFVEN pelo APELIDO."""
-    sql = (
-        f"SELECT CODVEND, APELIDO, TIPVEND, CODGER, ATIVO, CODEMP "
-        f"FROM TGFVEN "
-        f"WHERE UPPER(APELIDO) = UPPER('{username}') AND ATIVO = 'S' "
-        f"AND ROWNUM <= 1"
-    )
-    rows = _execute_sankhya_query(sql)
+def _profile_from_rows(rows: list) -> Optional[dict]:
     if not rows:
         return None
     row = rows[0]
@@ -200,33 +122,39 @@ def fetch_user_profile(username: str) -> dict:
     }
 
 
-def fetch_team_codvends(codvend: int) -> list:
-    """Busca CODVENDs dos subordinados de um gerente."""
-    sql = (
+def _sql_profile(username: str) -> str:
+    return (
+        f"SELECT CODVEND, APELIDO, TIPVEND, CODGER, ATIVO, CODEMP "
+        f"FROM TGFVEN "
+        f"WHERE UPPER(APELIDO) = UPPER('{safe_sql(username)}') AND ATIVO = 'S' "
+        f"AND ROWNUM <= 1"
+    )
+
+
+def _sql_team(username: str) -> str:
+    """Subordinados ativos do usuario (CODGER = CODVEND dele), resolvido pelo APELIDO.
+
+    Nao depende do resultado do perfil, entao roda em paralelo com ele.
+    """
+    return (
         f"SELECT CODVEND FROM TGFVEN "
-        f"WHERE CODGER = {codvend} AND ATIVO = 'S'"
+        f"WHERE ATIVO = 'S' AND CODGER IN ("
+        f"SELECT CODVEND FROM TGFVEN "
+        f"WHERE UPPER(APELIDO) = UPPER('{safe_sql(username)}') AND ATIVO = 'S')"
     )
-    rows = _execute_sankhya_query(sql)
-    team = [int(r.get("CODVEND", 0)) for r in rows if r.get("CODVEND")]
-    if codvend not in team:
-        team.append(codvend)
-    return team
 
 
-def determine_role(username: str, profile: dict) -> str:
-    """Determina o perfil RBAC do usuario."""
+def determine_role(username: str, profile: dict, subordinados: list = None) -> str:
+    """Determina o perfil RBAC do usuario.
+
+    subordinados: CODVENDs com CODGER = codvend do usuario (ja buscados em paralelo
+    com o perfil). Tendo alguem alem dele mesmo, e gerente.
+    """
     if username.upper() in ADMIN_USERS:
         return "admin"
     if not profile:
-        return "admin" if username.upper() in ADMIN_USERS else None
-    # Verificar se tem subordinados (gerente)
-    sql = (
-        f"SELECT COUNT(*) AS QTD FROM TGFVEN "
-        f"WHERE CODGER = {profile['codvend']} AND ATIVO = 'S' "
-        f"AND CODVEND != {profile['codvend']}"
-    )
-    rows = _execute_sankhya_query(sql)
-    if rows and int(rows[0].get("QTD", 0)) > 0:
+        return None
+    if any(c != profile["codvend"] for c in (subordinados or [])):
         return "gerente"
     tipvend = (profile.get("tipvend") or "").upper()
     if tipvend == "V":
@@ -236,6 +164,42 @@ def determine_role(username: str, profile: dict) -> str:
     return "vendedor"
 
 
+async def resolve_rbac_profile(username: str) -> dict:
+    """Resolve perfil + role + equipe do usuario (cacheado durante a sessao).
+
+    Perfil e subordinados rodam em paralelo no pool async do Sankhya
+    (antes eram 3 chamadas sincronas em sequencia, travando o event loop).
+
+    Returns:
+        {"profile": dict|None, "role": str|None, "team_codvends": list}
+    """
+    key = username.upper()
+    cached = _profile_cache.get(key)
+    if cached and time.time() < cached["expires"]:
+        print(f"[RBAC] {username}: perfil do cache")
+        return cached
+
+    r_profile, r_team = await _rbac_executor.execute_batch([_sql_profile(username), _sql_team(username)])
+    profile = _profile_from_rows(_rows_as_dicts(r_profile, ["CODVEND", "APELIDO", "TIPVEND", "CODGER", "ATIVO", "CODEMP"]))
+    subordinados = [int(r.get("CODVEND", 0)) for r in _rows_as_dicts(r_team, ["CODVEND"]) if r.get("CODVEND")]
+
+    role = determine_role(username, profile, subordinados)
+    team_codvends = []
+    if profile and role == "gerente":
+        team_codvends = subordinados if profile["codvend"] in subordinados else subordinados + [profile["codvend"]]
+
+    entry = {
+        "profile": profile,
+        "role": role,
+        "team_codvends": team_codvends,
+        "expires": time.time() + SESSION_TIMEOUT.total_seconds(),
+    }
+    # So cacheia se as queries funcionaram (falha de rede nao pode virar "sem perfil")
+    if r_profile.get("success") and r_team.get("success"):
+        _profile_cache[key] = entry
+    return entry
+
+
 def get_visible_modules(role: str) -> dict:
     """Retorna modulos visiveis por perfil."""
     if role == "vendedor":
@@ -260,13 +224,63 @@ def get_current_user(authorization: Optional[str] = Header(None)) -> dict:
         del sessions[token]
         raise HTTPException(status_code=401, detail="Sessao expirada")
 
-    session["last_activity"] = datetime.now()
+    now = datetime.now()
+    stale = (now - session["last_activity"]).total_seconds() > SESSION_TOUCH_SECONDS
+    session["last_activity"] = now
+    if stale:
+        sessions[token] = session  # regrava e renova o TTL (8h de inatividade, nao desde o login)
     return session
 
 # ============================================================
 # STARTUP
 # ============================================================
 
+_leader_task = None  # run_as_leader (cancelado no shutdown, antes de fechar o backend)
+
+
+def _leader_jobs() -> list:
+    """Jobs que rodam em 1 worker so (com --workers N cada um repetiria a carga no Sankhya)."""
+    from src.llm.smart_agent import _training_scheduler
+    return [
+        smart_agent.entities.run_scheduler(smart_agent.executor),
+        _training_scheduler(),
+        # Checagem/carga do Elastic: 1x por subida, nao a cada troca de lider
+        run_once(state_backend, "elastic_startup_sync", _elastic_startup_sync),
+    ]
+
+
+def _follower_jobs() -> list:
+    """Demais workers: so acompanham o snapshot de entidades que o lider grava."""
+    return [smart_agent.entities.watch_snapshot()]
+
+
+async def _elastic_startup_sync() -> bool:
+    """Elasticsearch: verificar e sincronizar se indice vazio.
+
+    False se o Elastic estava fora (o proximo lider tenta de novo).
+    """
+    try:
+        from src.elastic.search import ElasticSearchEngine
+        from src.elastic.sync import ElasticSync
+        _es_search = ElasticSearchEngine()
+        health = await _es_search.health()
+        if health.get("status") != "offline":
+            print(f"[OK] Elasticsearch: {health.get('status')}")
+            products_count = health.get("indices", {}).get("idx_produtos", {}).get("docs", "0")
+            partners_count = health.get("indices", {}).get("idx_parceiros", {}).get("docs", "0")
+            if int(products_count or 0) == 0:
+                print("[ELASTIC] Indice vazio — iniciando full sync...")
+                # Executor proprio, sem cache: a carga nao pode encher/ler o cache do chat
+                await ElasticSync(SafeQueryExecutor()).full_sync()
+            else:
+                print(f"[OK] Elastic: {products_count} produtos, {partners_count} parceiros indexados")
+            return True
+        print(f"[!] Elasticsearch offline: {health.get('error', '?')}")
+    except Exception as e:
+        print(f"[!] Elasticsearch nao disponivel (nao critico): {e}")
+    return False
+
+
 @app.on_event("startup")
 async def startup():
     # Criar pasta de exports se nao existir
@@ -301,50 +315,52 @@ async def startup():
         stats = await compiler.compile(full=False, dry_run=False, verbose=False)
         if stats.get("processed", 0) > 0:
             print(f"[OK] Knowledge Compiler: {stats['processed']} docs processados ({stats.get('groq_calls', 0)} Groq calls)")
-            # Recarregar no SmartAgent
-            from src.llm.smart_agent import _load_compiled_knowledge, _COMPILED_LOADED
-            import src.llm.smart_agent as _sa
-            _sa._COMPILED_LOADED = False  # forcar recarga
-            _load_compiled_knowledge()
+            # Recarregar no SmartAgent (recompila o indice de scoring)
+            from src.agent.scoring import reload_compiled
+            reload_compiled()
         else:
             print(f"[OK] Knowledge Compiler: up-to-date ({stats.get('total_files', 0)} docs)")
     except Exception as e:
         print(f"[!] Knowledge Compiler falhou (nao critico): {e}")
 
-    # Training scheduler (roda de madrugada)
+    # Dicionario de entidades: snapshot do disco agora; refresh do banco, treino
+    # e sync do Elastic sao jobs singleton (so o worker lider roda, ver _leader_jobs)
     try:
-        from src.llm.smart_agent import _training_scheduler
         import asyncio
-        asyncio.create_task(_training_scheduler())
+        smart_agent.entities.load_snapshot()
+        global _leader_task
+        _leader_task = asyncio.create_task(run_as_leader(state_backend, "jobs", _leader_jobs, _follower_jobs))
         from src.llm.smart_agent import TRAINING_HOUR
-        print(f"[OK] Training scheduler ativo (todo dia as {TRAINING_HOUR}h)")
+        print(f"[OK] Jobs em background: entidades a cada {smart_agent.entities.refresh_interval}s, "
+              f"treino todo dia as {TRAINING_HOUR}h (no worker lider)")
     except Exception as e:
-        print(f"[!] Training scheduler falhou: {e}")
-
-    # Elasticsearch: verificar e sincronizar se indice vazio
-    try:
-        from src.elastic.search import ElasticSearchEngine
-        from src.elastic.sync import ElasticSync
-        _es_search = ElasticSearchEngine()
-        health = await _es_search.health()
-        if health.get("status") != "offline":
-            print(f"[OK] Elasticsearch: {health.get('status')}")
-            products_count = health.get("indices", {}).get("idx_produtos", {}).get("docs", "0")
-            partners_count = health.get("indices", {}).get("idx_parceiros", {}).get("docs", "0")
-            if int(products_count or 0) == 0:
-                print("[ELASTIC] Indice vazio — iniciando full sync em background...")
-                _es_sync = ElasticSync(smart_agent.executor)
-                asyncio.create_task(_es_sync.full_sync())
-            else:
-                print(f"[OK] Elastic: {products_count} produtos, {partners_count} parceiros indexados")
-        else:
-            print(f"[!] Elasticsearch offline: {health.get('error', '?')}")
-    except Exception as e:
-        print(f"[!] Elasticsearch nao disponivel (nao critico): {e}")
+        print(f"[!] Jobs em background falharam: {e}")
 
     print(f"[OK] MMarra Data Hub API pronta!")
     print(f"[i] Acesse: http://localhost:8000")
 
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Fechar pool HTTP do Sankhya (conexoes keep-alive)
+    await sankhya_transport.aclose()
+    # Snapshot final dos agregados do query log
+    smart_agent.query_logger.flush()
+    # Arquivos de spill dos resultados de sessao (so valem para este processo)
+    from src.agent.session import session_store
+    session_store.spill.close()
+    # Solta o lease dos jobs singleton para outro worker assumir na hora
+    if _leader_task is not None:
+        _leader_task.cancel()
+        try:
+            await _leader_task
+        except (asyncio.CancelledError, Exception):
+            pass
+    state_backend.close()
+    # Client HTTP compartilhado das buscas no Elastic
+    from src.elastic import search as elastic_search
+    await elastic_search.aclose()
+
 # ============================================================
 # MODELS
 # ============================================================
@@ -401,20 +417,18 @@ app.mount("/static", StaticFiles(directory=str(Path(__file__).parent / "static")
 async def login(req: LoginRequest):
     """Autentica usuario via Sankhya MobileLogin (com OAuth no gateway)."""
     try:
-        # 1. Obter token OAuth do gateway
-        oauth_token = get_sankhya_oauth_token()
+        # 1. Obter token OAuth do gateway (compartilhado, single-flight)
+        oauth_token = await sankhya_transport.get_token()
 
-        # 2. Chamar MobileLogin com o token OAuth
-        resp = http_requests.post(
-            f"{SANKHYA_BASE_URL}/gateway/v1/mge/service.sbr",
+        # 2. Chamar MobileLogin com o token OAuth (pool async, nao trava o event loop)
+        resp = await sankhya_transport.post(
+            "/gateway/v1/mge/service.sbr",
+            token=oauth_token,
             params={
                 "serviceName": "MobileLoginSP.login",
                 "outputType": "json",
             },
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {oauth_token}",
-            },
+            headers={"Content-Type": "application/json"},
             json={
                 "requestBody": {
                     "NOMUSU": {"$": req.username},
@@ -423,7 +437,6 @@ async def login(req: LoginRequest):
                 }
             },
             timeout=30,
-            verify=False
         )
         raw_login = resp.text
         print(f"[AUTH] MobileLogin HTTP {resp.status_code}: {raw_login[:500]}")
@@ -459,12 +472,12 @@ async def login(req: LoginRequest):
     team_codvends = []
 
     try:
-        profile = fetch_user_profile(req.username)
+        rbac = await resolve_rbac_profile(req.username)
+        profile = rbac["profile"]
         if profile:
-            role = determine_role(req.username, profile)
+            role = rbac["role"]
             codvend = profile["codvend"]
-            if role == "gerente":
-                team_codvends = fetch_team_codvends(codvend)
+            team_codvends = rbac["team_codvends"]
             print(f"[RBAC] {req.username}: role={role}, codvend={codvend}, tipvend={profile.get('tipvend')}")
         elif not role:
             print(f"[RBAC] {req.username}: nao encontrado na TGFVEN, negando acesso")
@@ -504,6 +517,9 @@ async def logout(authorization: Optional[str] = Header(None)):
         token = authorization.replace("Bearer ", "")
         session = sessions.pop(token, {})
         user = session.get("user", "?")
+        # Perfil RBAC so fica em cache enquanto o usuario tiver sessao aberta
+        if not any(s.get("user") == user for s in sessions.values()):
+            _profile_cache.pop(str(user).upper(), None)
         # Limpar contexto de conversa do usuario
         smart_agent.clear_user(user)
         print(f"[AUTH] Logout: {user} ({len(sessions)} sessoes ativas)")
@@ -528,19 +544,20 @@ async def index():
     return HTMLResponse(content=html_path.read_text(encoding="utf-8"))
 
 
-@app.post("/api/chat", response_model=ChatResponse)
-async def chat(req: ChatRequest, authorization: Optional[str] = Header(None)):
-    """Endpoint principal de chat com agente.
+def _chat_user_context(session: dict) -> dict:
+    """Contexto RBAC do usuario para o SmartAgent."""
+    return {
+        "user": session["user"],
+        "role": session.get("role", "vendedor"),
+        "codvend": session.get("codvend", 0),
+        "tipvend": session.get("tipvend", ""),
+        "team_codvends": session.get("team_codvends", []),
+    }
 
-    Fluxo:
-    1. SmartAgent tenta responder (regex + SQL templates, instantaneo)
-    2. Se nao matchou, cai no LLM Agent (Ollama, pode demorar)
-    """
-    session = get_current_user(authorization)
-    user = session.get("user", "anonymous")
-    start = time.time()
-    question = req.message.strip()
 
+def _chat_precheck(req: ChatRequest, user: str, question: str, start: float,
+                   role: str = None) -> Optional[ChatResponse]:
+    """Pergunta vazia / rate limit. Retorna ChatResponse se a request deve parar aqui."""
     if not question:
         return ChatResponse(
             response="Envie uma pergunta.",
@@ -549,63 +566,66 @@ async def chat(req: ChatRequest, authorization: Optional[str] = Header(None)):
             tipo="erro",
         )
 
-    # Rate limiting
-    if not rate_limiter.is_allowed(user):
-        print(f"[SECURITY] Rate limit exceeded: {user}")
+    # Rate limiting (token bucket: custo da rota e cobrado depois em _charge_route)
+    if not rate_limiter.is_allowed(user, role):
+        wait = rate_limiter.retry_after(user, role)
+        print(f"[SECURITY] Rate limit exceeded: {user} (role={role}, retry={wait}s)")
         smart_agent.query_logger.log_security_event(
             user, "rate_limit",
-            f"Exceeded {rate_limiter.max_requests} req/{rate_limiter.window}s"
+            f"Exceeded {rate_limiter.capacity(role)} tokens/{rate_limiter.window}s"
         )
         return ChatResponse(
-            response="Muitas consultas em sequencia. Aguarde alguns segundos e tente novamente.",
+            response=f"Muitas consultas em sequencia. Aguarde {max(wait, 1)}s e tente novamente.",
             sources=[],
             mode=req.mode,
             tipo="rate_limit",
             time_ms=int((time.time() - start) * 1000),
         )
+    return None
 
-    user_context = {
-        "user": session["user"],
-        "role": session.get("role", "vendedor"),
-        "codvend": session.get("codvend", 0),
-        "tipvend": session.get("tipvend", ""),
-        "team_codvends": session.get("team_codvends", []),
-    }
 
-    # ---- SMART AGENT (instantaneo, sem LLM) ----
-    try:
-        smart_result = await smart_agent.ask(question, user_context=user_context)
-        if smart_result:
-            elapsed = int((time.time() - start) * 1000)
-
-            # Extrair table_data para toggle de colunas no frontend
-            _td = None
-            _detail = smart_result.pop("_detail_data", None)
-            _vis_cols = smart_result.pop("_visible_columns", None)
-            if _detail and isinstance(_detail, list) and len(_detail) > 0:
-                _all_cols = list(_detail[0].keys()) if isinstance(_detail[0], dict) else []
-                _td = {
-                    "columns": _all_cols,
-                    "rows": _detail[:200],  # limitar payload
-                    "visible_columns": _vis_cols or [],
-                }
+def _charge_route(user: str, role: str, smart_result: dict):
+    """Cobra no rate limiter o custo da rota que respondeu + narracao (Groq/brain custam mais)."""
+    route = smart_result.pop("_route", None) if smart_result else None
+    narration = smart_result.pop("_narration", None) if smart_result else None
+    extra = rate_limiter.charge(user, role, route=route, narration=narration)
+    if extra:
+        print(f"[RATE] {user}: rota {route}{f' + narracao {narration}' if narration else ''} "
+              f"(+{extra:g} fichas, restam {rate_limiter.remaining(user, role)})")
 
-            return ChatResponse(
-                response=smart_result.get("response", "Sem resposta"),
-                sources=[],
-                mode="smart",
-                tipo=smart_result.get("tipo", "consulta_banco"),
-                query_executed=smart_result.get("query_executed"),
-                query_results=smart_result.get("query_results"),
-                download_url=smart_result.get("download_url"),
-                time_ms=elapsed,
-                message_id=smart_result.get("message_id"),
-                table_data=_td,
-            )
-    except Exception as e:
-        print(f"[SMART] Erro: {e}")
 
-    # ---- LLM AGENT (fallback - desabilitado se SMART_ONLY=true) ----
+def _smart_chat_response(smart_result: dict, start: float) -> ChatResponse:
+    """Converte resultado do SmartAgent em ChatResponse (com table_data p/ toggle de colunas)."""
+    elapsed = int((time.time() - start) * 1000)
+
+    # Extrair table_data para toggle de colunas no frontend
+    _td = None
+    _detail = smart_result.pop("_detail_data", None)
+    _vis_cols = smart_result.pop("_visible_columns", None)
+    if _detail and isinstance(_detail, list) and len(_detail) > 0:
+        _all_cols = list(_detail[0].keys()) if isinstance(_detail[0], dict) else []
+        _td = {
+            "columns": _all_cols,
+            "rows": _detail[:200],  # limitar payload
+            "visible_columns": _vis_cols or [],
+        }
+
+    return ChatResponse(
+        response=smart_result.get("response", "Sem resposta"),
+        sources=[],
+        mode="smart",
+        tipo=smart_result.get("tipo", "consulta_banco"),
+        query_executed=smart_result.get("query_executed"),
+        query_results=smart_result.get("query_results"),
+        download_url=smart_result.get("download_url"),
+        time_ms=elapsed,
+        message_id=smart_result.get("message_id"),
+        table_data=_td,
+    )
+
+
+async def _fallback_chat_response(req: ChatRequest, question: str, user_context: dict, start: float) -> ChatResponse:
+    """SmartAgent nao respondeu: mensagem de ajuda ou LLM Agent (se SMART_ONLY=false)."""
     smart_only = os.getenv("SMART_ONLY", "true").lower() in ("true", "1", "yes")
     if smart_only:
         elapsed = int((time.time() - start) * 1000)
@@ -640,6 +660,104 @@ async def chat(req: ChatRequest, authorization: Optional[str] = Header(None)):
     )
 
 
+@app.post("/api/chat", response_model=ChatResponse)
+async def chat(req: ChatRequest, authorization: Optional[str] = Header(None)):
+    """Endpoint principal de chat com agente.
+
+    Fluxo:
+    1. SmartAgent tenta responder (regex + SQL templates, instantaneo)
+    2. Se nao matchou, cai no LLM Agent (Ollama, pode demorar)
+    """
+    session = get_current_user(authorization)
+    user = session.get("user", "anonymous")
+    start = time.time()
+    question = req.message.strip()
+
+    early = _chat_precheck(req, user, question, start, role=session.get("role"))
+    if early is not None:
+        return early
+
+    user_context = _chat_user_context(session)
+
+    # ---- SMART AGENT (instantaneo, sem LLM) ----
+    try:
+        smart_result = await smart_agent.ask(question, user_context=user_context)
+        _charge_route(user, session.get("role"), smart_result)
+        if smart_result:
+            return _smart_chat_response(smart_result, start)
+    except Exception as e:
+        print(f"[SMART] Erro: {e}")
+
+    # ---- LLM AGENT (fallback - desabilitado se SMART_ONLY=true) ----
+    return await _fallback_chat_response(req, question, user_context, start)
+
+
+@app.post("/api/chat/stream")
+async def chat_stream(req: ChatRequest, authorization: Optional[str] = Header(None)):
+    """Chat com resposta em streaming (Server-Sent Events).
+
+    Mesmo fluxo do /api/chat, mas o cliente recebe os pedacos conforme ficam prontos:
+        event: kpis        -> tabela/KPIs assim que o SQL volta
+        event: token       -> pedacos da narracao/analise do Groq
+        event: reset       -> descartar tokens recebidos (LLM trocou de modelo)
+        event: table_data  -> linhas de detalhe (toggle de colunas)
+        event: done        -> ChatResponse completo (mesmo formato do /api/chat)
+    """
+    session = get_current_user(authorization)
+    user = session.get("user", "anonymous")
+    start = time.time()
+    question = req.message.strip()
+    user_context = _chat_user_context(session)
+    early = _chat_precheck(req, user, question, start, role=session.get("role"))
+
+    async def event_stream():
+        if early is not None:
+            yield sse_format("done", early.dict())
+            return
+
+        stream = ChatStream()
+
+        async def run_agent():
+            # Ativar dentro da task: o ContextVar vale so para esta request
+            token = stream.activate()
+            try:
+                return await smart_agent.ask(question, user_context=user_context)
+            finally:
+                ChatStream.deactivate(token)
+                stream.close()
+
+        task = asyncio.create_task(run_agent())
+        try:
+            async for event, data in stream.events():
+                yield sse_format(event, data)
+
+            try:
+                smart_result = await task
+            except Exception as e:
+                print(f"[SMART] Erro (stream): {e}")
+                smart_result = None
+            _charge_route(user, session.get("role"), smart_result)
+
+            if smart_result:
+                response = _smart_chat_response(smart_result, start)
+            else:
+                response = await _fallback_chat_response(req, question, user_context, start)
+
+            if response.table_data:
+                yield sse_format("table_data", response.table_data)
+            yield sse_format("done", response.dict(exclude={"table_data"}))
+        finally:
+            # Cliente desconectou no meio: nao deixar a task orfa
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.post("/api/feedback")
 async def feedback(req: FeedbackRequest, authorization: Optional[str] = Header(None)):
     """Registra feedback do usuario sobre uma resposta."""
@@ -728,13 +846,30 @@ async def admin_pools(authorization: Optional[str] = Header(None)):
     if session.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Acesso restrito a administradores")
     from src.llm.smart_agent import pool_classify, pool_narrate, pool_train
+    from src.agent.session import session_store
+    from src.elastic.search import search_stats as elastic_search_stats
     return {
         "classify": pool_classify.stats(),
         "narrate": pool_narrate.stats(),
         "train": pool_train.stats(),
+        "sankhya": sankhya_transport.stats(),
+        "sessions": session_store.memory_stats(),
+        "state": state_backend.stats(),
+        "rate_limit": rate_limiter.stats(),
+        "elastic": elastic_search_stats(),
     }
 
 
+@app.get("/api/admin/rules")
+async def admin_rules(authorization: Optional[str] = Header(None)):
+    """Regras de follow-up/filtro que mais disparam (admin only)."""
+    session = get_current_user(authorization)
+    if session.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso restrito a administradores")
+    from src.agent.context import rule_stats
+    return rule_stats()
+
+
 @app.post("/api/admin/train")
 async def admin_train(authorization: Optional[str] = Header(None)):
     """Dispara treinamento manual (admin only)."""
@@ -764,7 +899,7 @@ async def elastic_sync_endpoint(full: bool = False, authorization: Optional[str]
     if session.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Acesso restrito a administradores")
     from src.elastic.sync import ElasticSync
-    es_sync = ElasticSync(smart_agent.executor)
+    es_sync = ElasticSync(SafeQueryExecutor())
     if full:
         result = await es_sync.full_sync()
     else:
@@ -10,18 +10,27 @@ Cada relatorio e uma funcao que:
 
 Cache: resultados ficam em memoria por CACHE_TTL segundos.
 Mesma combinacao (relatorio + parametros + perfil) retorna do cache sem bater no Sankhya.
+Abaixo dele, cada query passa pelo cache compartilhado (src/core/query_cache.py),
+o mesmo usado pelo chat: SQL identico + mesmo escopo RBAC nao re-executa.
 """
 
+import os
 import time
+import heapq
+import asyncio
 import hashlib
 import json
+from collections import OrderedDict
 from datetime import datetime, date
 from typing import Optional
 
+import numpy as np
 from fastapi import APIRouter, HTTPException, Header
 from pydantic import BaseModel
 
-from src.llm.query_executor import SafeQueryExecutor
+from src.llm.query_executor import SafeQueryExecutor, MAX_ROWS
+from src.core.query_cache import query_cache, cache_scope, cache_refresh, scope_from_context, estimate_bytes
+from src.core.query_scheduler import query_priority_scope
 
 
 # ============================================================
@@ -30,8 +39,18 @@ from src.llm.query_executor import SafeQueryExecutor
 
 router = APIRouter(prefix="/api/reports", tags=["reports"])
 
-# Executor compartilhado
-_executor = SafeQueryExecutor()
+# Executor compartilhado (cache de queries compartilhado com o SmartAgent)
+_executor = SafeQueryExecutor(cache=query_cache, priority="reports")
+
+# Maximo de queries de um mesmo relatorio rodando ao mesmo tempo
+# (o limite global do tenant continua valendo no SankhyaTransport)
+REPORT_MAX_PARALLEL = int(os.getenv("REPORT_MAX_PARALLEL", "4"))
+
+# Pendencia de compras em modo single-scan: 1 query de detalhe + agregacoes locais.
+# O scan precisa vir completo (categorias/graficos somam tudo), entao tem limite
+# proprio de linhas em vez do MAX_ROWS do executor; acima dele cai nas 9 queries.
+PENDENCIA_SINGLE_SCAN = os.getenv("PENDENCIA_SINGLE_SCAN", "true").lower() in ("true", "1", "yes")
+PENDENCIA_SCAN_MAX_ROWS = int(os.getenv("PENDENCIA_SCAN_MAX_ROWS", "20000"))
 
 
 # ============================================================
@@ -39,19 +58,34 @@ _executor = SafeQueryExecutor()
 # ============================================================
 
 CACHE_TTL = 180  # 3 minutos (segundos)
+CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "500"))
+CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
 
 class ReportCache:
-    """Cache em memoria com TTL por chave.
+    """Cache em memoria com TTL por chave, limitado por entradas e bytes.
 
     Chave = hash de (report_id + params + role + codvend).
     Mesma pessoa com mesmos filtros pega do cache.
     Pessoas com roles diferentes geram caches separados (dados RBAC diferentes).
+
+    - LRU (OrderedDict): ao passar do limite, remove o menos usado em O(1)
+    - Expiracao: heap por vencimento, consumida so ate a 1a entrada valida
+      (sem varrer o cache inteiro a cada get); get tambem checa o TTL da chave
+    - Memoria por relatorio (bytes aproximados do JSON) exposta em stats()
     """
 
-    def __init__(self):
-        self._store = {}  # {key: {"data": ..., "expires": timestamp}}
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max(1, max_bytes)
+        self._store = OrderedDict()  # {key: {"data", "expires", "report_id", "created", "bytes"}}
+        self._expiry_heap = []       # [(expires, key)] - pode ter itens obsoletos (checados no pop)
+        self._by_report = {}         # {report_id: set(keys)}
+        self._report_bytes = {}      # {report_id: bytes}
+        self._bytes = 0
         self._hits = 0
         self._misses = 0
+        self._evictions = 0
+        self._expired = 0
 
     def _make_key(self, report_id: str, params: dict, user_context: dict) -> str:
         """Gera chave unica para a combinacao relatorio+filtros+usuario."""
@@ -67,51 +101,104 @@ class ReportCache:
 
     def get(self, report_id: str, params: dict, user_context: dict):
         """Retorna dados do cache se existir e nao expirou."""
-        self._cleanup()
+        self._expire()
         key = self._make_key(report_id, params, user_context)
         entry = self._store.get(key)
         if entry and time.time() < entry["expires"]:
+            self._store.move_to_end(key)
             self._hits += 1
             print(f"[CACHE] HIT {report_id} (key={key[:8]}..., hits={self._hits})")
             return entry["data"]
+        if entry:
+            self._remove(key)
+            self._expired += 1
         self._misses += 1
         return None
 
     def set(self, report_id: str, params: dict, user_context: dict, data):
-        """Armazena resultado no cache."""
+        """Armazena resultado no cache (removendo LRU se passar dos limites)."""
+        self._expire()
         key = self._make_key(report_id, params, user_context)
+        size = estimate_bytes(data)
+        if size > self.max_bytes:
+            print(f"[CACHE] SKIP {report_id} ({size} bytes > limite {self.max_bytes})")
+            return
+        if key in self._store:
+            self._remove(key)
+
+        now = time.time()
+        expires = now + CACHE_TTL
         self._store[key] = {
             "data": data,
-            "expires": time.time() + CACHE_TTL,
+            "expires": expires,
             "report_id": report_id,
-            "created": time.time(),
+            "created": now,
+            "bytes": size,
         }
-        print(f"[CACHE] SET {report_id} (key={key[:8]}..., ttl={CACHE_TTL}s, total={len(self._store)})")
+        heapq.heappush(self._expiry_heap, (expires, key))
+        self._by_report.setdefault(report_id, set()).add(key)
+        self._report_bytes[report_id] = self._report_bytes.get(report_id, 0) + size
+        self._bytes += size
+
+        while len(self._store) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._store)))
+            self._evictions += 1
+
+        print(f"[CACHE] SET {report_id} (key={key[:8]}..., ttl={CACHE_TTL}s, total={len(self._store)}, "
+              f"{self._bytes // 1024}KB)")
 
     def invalidate(self, report_id: str = None):
         """Limpa cache. Se report_id, limpa so daquele relatorio."""
         if report_id:
-            keys_to_del = [k for k, v in self._store.items() if v.get("report_id") == report_id]
+            keys_to_del = list(self._by_report.get(report_id, ()))
             for k in keys_to_del:
-                del self._store[k]
+                self._remove(k)
             print(f"[CACHE] INVALIDATE {report_id} ({len(keys_to_del)} entradas removidas)")
         else:
             count = len(self._store)
             self._store.clear()
+            self._expiry_heap.clear()
+            self._by_report.clear()
+            self._report_bytes.clear()
+            self._bytes = 0
             self._hits = 0
             self._misses = 0
             print(f"[CACHE] CLEAR ALL ({count} entradas removidas)")
 
-    def _cleanup(self):
-        """Remove entradas expiradas."""
+    def _remove(self, key: str):
+        """Remove 1 entrada mantendo os contadores de memoria (a entrada no heap fica obsoleta)."""
+        entry = self._store.pop(key, None)
+        if not entry:
+            return
+        rid = entry["report_id"]
+        self._bytes -= entry["bytes"]
+        self._report_bytes[rid] = self._report_bytes.get(rid, 0) - entry["bytes"]
+        keys = self._by_report.get(rid)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_report[rid]
+                self._report_bytes.pop(rid, None)
+
+    def _expire(self):
+        """Remove entradas vencidas do topo do heap (para na 1a ainda valida)."""
         now = time.time()
-        expired = [k for k, v in self._store.items() if now >= v["expires"]]
-        for k in expired:
-            del self._store[k]
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expires, key = heapq.heappop(heap)
+            entry = self._store.get(key)
+            # Ignora itens obsoletos (chave removida ou regravada com outro vencimento)
+            if entry is not None and entry["expires"] == expires:
+                self._remove(key)
+                self._expired += 1
+        # Heap acumula lixo de chaves regravadas/removidas: compacta se crescer demais
+        if len(heap) > 2 * len(self._store) + 64:
+            self._expiry_heap = [(e["expires"], k) for k, e in self._store.items()]
+            heapq.heapify(self._expiry_heap)
 
     def stats(self) -> dict:
         """Retorna estatisticas do cache."""
-        self._cleanup()
+        self._expire()
         total = self._hits + self._misses
         return {
             "entries": len(self._store),
@@ -119,6 +206,15 @@ class ReportCache:
             "misses": self._misses,
             "hit_rate": f"{(self._hits / total * 100):.1f}%" if total > 0 else "N/A",
             "ttl_seconds": CACHE_TTL,
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "evictions": self._evictions,
+            "expired": self._expired,
+            "por_relatorio": {
+                rid: {"entries": len(keys), "bytes": self._report_bytes.get(rid, 0)}
+                for rid, keys in self._by_report.items()
+            },
         }
 
 
@@ -139,6 +235,7 @@ class ReportRequest(BaseModel):
     codmarca: Optional[int] = None
     categoria: Optional[str] = None  # todos|atrasados|15dias|sem_previsao|programados|transito
     solicitante: Optional[str] = None
+    single_scan: Optional[bool] = None  # Pendencia: None = PENDENCIA_SINGLE_SCAN do .env
     no_cache: Optional[bool] = False  # Forcar bypass do cache
 
 
@@ -156,6 +253,7 @@ class ReportResponse(BaseModel):
     time_ms: int = 0
     row_count: int = 0
     from_cache: bool = False
+    query_timings: list = []         # [{query, ms, wait_ms, rows, success}] por query executada
 
 
 # ============================================================
@@ -205,10 +303,10 @@ def _build_date_filter(alias: str, data_ini: str, data_fim: str) -> str:
     return " AND ".join(parts) if parts else ""
 
 
-async def _run_query(sql: str) -> dict:
+async def _run_query(sql: str, max_rows: int = MAX_ROWS) -> dict:
     """Executa query e retorna resultado normalizado (sempre list of dicts)."""
     try:
-        result = await _executor.execute(sql)
+        result = await _executor.execute(sql, max_rows=max_rows)
 
         # Normalizar: se rows vieram como listas, converter pra dicts
         if result.get("success") and result.get("data"):
@@ -234,6 +332,88 @@ async def _run_query(sql: str) -> dict:
         return {"success": False, "error": str(e), "data": [], "columns": []}
 
 
+async def _run_query_graph(queries: dict, max_parallel: int = REPORT_MAX_PARALLEL) -> tuple:
+    """Executa um grafo de queries de relatorio com paralelismo limitado.
+
+    Cada no pode ser:
+        "nome": "SELECT ..."                                  (sem dependencias)
+        "nome": {"sql": "SELECT ...", "after": ["outro"]}
+        "nome": {"sql": lambda res: "SELECT ...", "after": ["outro"]}
+        "nome": {"sql": "SELECT ...", "max_rows": 20000}       (limite de linhas proprio)
+
+    Quando "sql" e callable, recebe o dict de resultados ja prontos das
+    dependencias e devolve o SQL (ou None para pular o no).
+    Nos independentes rodam em paralelo sob um semaforo de max_parallel.
+
+    Returns:
+        (results, timings): results = {nome: resultado de _run_query},
+        timings = [{"query", "ms", "wait_ms", "rows", "success"}] na ordem do grafo.
+    """
+    nodes = {}
+    for name, spec in queries.items():
+        if not isinstance(spec, dict):
+            spec = {"sql": spec}
+        nodes[name] = {"sql": spec.get("sql"), "after": list(spec.get("after", [])),
+                       "max_rows": spec.get("max_rows", MAX_ROWS)}
+
+    for name, node in nodes.items():
+        missing = [d for d in node["after"] if d not in nodes]
+        if missing:
+            raise ValueError(f"Query '{name}' depende de queries inexistentes: {missing}")
+
+    sem = asyncio.Semaphore(max(1, max_parallel))
+    results = {}
+    timings = {}
+    tasks = {}
+
+    async def _run_node(name):
+        node = nodes[name]
+        if node["after"]:
+            await asyncio.gather(*[tasks[d] for d in node["after"]])
+        sql = node["sql"]
+        if callable(sql):
+            sql = sql({d: results[d] for d in node["after"]})
+        if not sql:
+            results[name] = {"success": False, "error": "Query pulada", "data": [], "columns": []}
+            timings[name] = {"query": name, "ms": 0, "wait_ms": 0, "rows": 0, "success": False, "skipped": True}
+            return
+        t_wait = time.time()
+        async with sem:
+            t0 = time.time()
+            result = await _run_query(sql, node["max_rows"])
+        results[name] = result
+        timings[name] = {
+            "query": name,
+            "ms": int((time.time() - t0) * 1000),
+            "wait_ms": int((t0 - t_wait) * 1000),
+            "rows": len(result.get("data") or []),
+            "success": bool(result.get("success")),
+        }
+
+    # Ordem topologica simples: cria tasks so depois que as dependencias existem
+    pending = list(nodes)
+    while pending:
+        ready = [n for n in pending if all(d in tasks for d in nodes[n]["after"])]
+        if not ready:
+            raise ValueError(f"Dependencia circular entre queries: {pending}")
+        for n in ready:
+            tasks[n] = asyncio.ensure_future(_run_node(n))
+            pending.remove(n)
+
+    await asyncio.gather(*tasks.values())
+    return results, [timings[n] for n in nodes]
+
+
+def _log_slow_queries(report_id: str, timings: list, total_ms: int):
+    """Loga a query mais lenta do relatorio (ajuda a achar o grafico lento)."""
+    ran = [t for t in timings if not t.get("skipped")]
+    if not ran:
+        return
+    slowest = max(ran, key=lambda t: t["ms"])
+    print(f"[REPORT] {report_id}: {len(ran)} queries em {total_ms}ms "
+          f"(mais lenta: {slowest['query']} {slowest['ms']}ms)")
+
+
 def _extract_sql_aliases(sql: str) -> list:
     """Extrai aliases das colunas do SELECT pra mapear rows-lista em dicts."""
     import re as _re
@@ -287,6 +467,94 @@ def _fmt_brl(valor: float) -> str:
     return f"R$ {valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
 
 
+# Colunas extras do scan (usadas so na agregacao local, nao vao pra tabela)
+_SCAN_EXTRA_COLS = ("COD_COMPRADOR", "COD_MARCA", "LINHA", "CAT_PRAZO")
+
+
+def _np_group_sum(labels: np.ndarray, values: np.ndarray) -> list:
+    """GROUP BY label SUM(valor) ORDER BY valor DESC, vetorizado."""
+    if len(labels) == 0:
+        return []
+    uniq, inv = np.unique(labels, return_inverse=True)
+    sums = np.bincount(inv, weights=values, minlength=len(uniq))
+    order = np.argsort(-sums, kind="stable")
+    return [{"LABEL": str(uniq[i]), "VALOR": round(float(sums[i]), 2)} for i in order]
+
+
+def _np_distinct_options(codes: np.ndarray, names: np.ndarray, code_key: str) -> list:
+    """SELECT DISTINCT code, nome ... WHERE code IS NOT NULL ORDER BY nome."""
+    valid = np.array([c is not None and c != "" for c in codes], dtype=bool)
+    if not valid.any():
+        return []
+    codes, names = codes[valid], names[valid]
+    # 1a ocorrencia de cada codigo
+    _, first = np.unique(codes.astype(str), return_index=True)
+    first = first[np.argsort(names[first], kind="stable")]
+    return [{code_key: codes[i], "NOME": str(names[i])} for i in first]
+
+
+def _pendencia_from_scan(rows: list, cat_ids: list, cat_filtro: str, table_limit: int = MAX_ROWS) -> dict:
+    """Calcula localmente o que as 9 queries da pendencia retornariam.
+
+    Recebe as linhas do scan (detalhe sem filtro de categoria) e devolve um
+    dict no mesmo formato de _run_query_graph, para o resto do relatorio
+    montar categorias/graficos/filtros sem saber de onde vieram os dados.
+    A tabela e cortada em table_limit linhas (igual a query da tabela).
+    """
+    n = len(rows)
+    col = lambda k, default="": np.array([r.get(k, default) for r in rows], dtype=object)
+    num = lambda k: np.array([float(r.get(k) or 0) for r in rows], dtype=np.float64)
+
+    pedido = col("PEDIDO", 0).astype(str)
+    vlr = num("VLR_TOTAL_PENDENTE")
+    qtd_ped = num("QTD_PEDIDA")
+    qtd_atd = num("QTD_ATENDIDA")
+    cat_prazo = col("CAT_PRAZO").astype(str)
+
+    masks = {"todos": np.ones(n, dtype=bool), "transito": (qtd_atd > 0) & (qtd_atd < qtd_ped)}
+    for cat_id in cat_ids:
+        if cat_id not in masks:
+            masks[cat_id] = cat_prazo == cat_id
+
+    categorias = []
+    for cat_id in cat_ids:
+        m = masks[cat_id]
+        categorias.append({
+            "CAT": cat_id,
+            "QTD_PEDIDOS": int(len(np.unique(pedido[m]))),
+            "QTD_PRODUTOS": int(m.sum()),
+            "VLR_TOTAL": round(float(vlr[m].sum()), 2),
+        })
+
+    sel = masks.get(cat_filtro, masks["todos"])
+    idx = np.flatnonzero(sel)[:table_limit]
+    tabela = [{k: v for k, v in rows[i].items() if k not in _SCAN_EXTRA_COLS} for i in idx]
+
+    empresa = np.array([e or "N/I" for e in col("EMPRESA")], dtype=object)
+    comprador = col("COMPRADOR").astype(str)
+    marca = np.array([m or "SEM MARCA" for m in col("MARCA")], dtype=object)
+    linha = np.array([l or "N/I" for l in col("LINHA")], dtype=object)
+
+    def _ok(data):
+        return {"success": True, "data": data, "columns": list(data[0].keys()) if data else []}
+
+    return {
+        "categorias": _ok(categorias),
+        "tabela": _ok(tabela),
+        "chart_empresa": _ok(_np_group_sum(empresa[sel].astype(str), vlr[sel])),
+        "chart_comprador": _ok(_np_group_sum(comprador[sel], vlr[sel])),
+        "chart_marca": _ok(_np_group_sum(marca[sel].astype(str), vlr[sel])),
+        "chart_abc": _ok(_np_group_sum(linha[sel].astype(str), vlr[sel])),
+        "filtro_empresas": _ok(_np_distinct_options(col("COD_EMPRESA", None), empresa.astype(str), "CODEMP")),
+        "filtro_compradores": _ok(_np_distinct_options(
+            col("COD_COMPRADOR", None),
+            np.where(comprador == "SEM COMPRADOR", "N/I", comprador).astype(str), "CODVEND")),
+        "filtro_marcas": _ok(_np_distinct_options(
+            col("COD_MARCA", None),
+            np.array([m or "N/I" for m in col("MARCA")], dtype=str), "CODMARCA")),
+    }
+
+
 async def report_pendencia_compras(params: ReportRequest, user_context: dict) -> ReportResponse:
     """
     Pendencia de Compras - Replica do dashboard Power BI.
@@ -408,44 +676,16 @@ async def report_pendencia_compras(params: ReportRequest, user_context: dict) ->
         """)
 
     sql_categorias = " UNION ALL ".join(union_parts)
-    cat_result = await _run_query(sql_categorias)
-
-    categorias = []
-    kpis = []
-    if cat_result.get("success"):
-        for row in cat_result.get("data", []):
-            cat_id = str(row.get("CAT", ""))
-            qtd_ped = int(row.get("QTD_PEDIDOS", 0) or 0)
-            qtd_prod = int(row.get("QTD_PRODUTOS", 0) or 0)
-            vlr = float(row.get("VLR_TOTAL", 0) or 0)
-            categorias.append({
-                "id": cat_id,
-                "nome": cat_names.get(cat_id, cat_id),
-                "qtd_pedidos": qtd_ped,
-                "qtd_produtos": qtd_prod,
-                "valor_total": vlr,
-                "valor_fmt": _fmt_brl(vlr),
-            })
-
-            # KPIs = categoria ativa (ou 'todos')
-            cat_filtro = params.categoria or "todos"
-            if cat_id == cat_filtro:
-                kpis = [
-                    {"label": "Valor Total Pendente", "value": _fmt_brl(vlr), "icon": "💰"},
-                    {"label": "Pedidos", "value": str(qtd_ped), "icon": "📦"},
-                    {"label": "Itens", "value": str(qtd_prod), "icon": "📋"},
-                ]
 
     # ========================================
-    # 2) TABELA DETALHADA (query real do usuario)
+    # 2) SQLs da tabela, graficos e filtros
     # ========================================
     cat_filtro = params.categoria or "todos"
     cat_filter = cat_filters.get(cat_filtro, "")
     if cat_filtro != "todos":
         filtros["categoria"] = cat_filtro
 
-    sql_table = f"""
-        SELECT
+    table_select = """
             ITE.CODEMP AS COD_EMPRESA,
             EMP.NOMEFANTASIA AS EMPRESA,
             CAB.NUNOTA AS PEDIDO,
@@ -476,10 +716,9 @@ async def report_pendencia_compras(params: ReportRequest, user_context: dict) ->
                 WHEN CAB.DTPREVENT < SYSDATE THEN 'ATRASADO'
                 WHEN CAB.DTPREVENT < SYSDATE + 7 THEN 'PRÓXIMO'
                 ELSE 'NO PRAZO'
-            END AS STATUS_ENTREGA
-        {joins}
-        WHERE {where_base}
-          {cat_filter}
+            END AS STATUS_ENTREGA"""
+
+    table_order = """
         ORDER BY
             CASE
                 WHEN CAB.DTPREVENT IS NULL THEN 1
@@ -488,39 +727,18 @@ async def report_pendencia_compras(params: ReportRequest, user_context: dict) ->
                 ELSE 3
             END,
             MAR.DESCRICAO,
-            PRO.DESCRPROD
-    """
-
-    table_result = await _run_query(sql_table)
-    table_columns = [
-        {"key": "EMPRESA", "label": "Empresa", "type": "text"},
-        {"key": "PEDIDO", "label": "Pedido", "type": "number"},
-        {"key": "TIPO_COMPRA", "label": "Tipo Compra", "type": "text"},
-        {"key": "COMPRADOR", "label": "Comprador", "type": "text"},
-        {"key": "DT_PEDIDO", "label": "Data Pedido", "type": "text"},
-        {"key": "PREVISAO_ENTREGA", "label": "Previsão", "type": "text"},
-        {"key": "CONFIRMADO", "label": "Confirmado", "type": "text"},
-        {"key": "DIAS_ABERTO", "label": "Dias Aberto", "type": "number"},
-        {"key": "STATUS_ENTREGA", "label": "Status", "type": "text"},
-        {"key": "CODPROD", "label": "CodProduto", "type": "number"},
-        {"key": "PRODUTO", "label": "Produto", "type": "text"},
-        {"key": "MARCA", "label": "Marca", "type": "text"},
-        {"key": "FORNECEDOR", "label": "Fornecedor", "type": "text"},
-        {"key": "UNIDADE", "label": "Un.", "type": "text"},
-        {"key": "QTD_PEDIDA", "label": "Qtd Pedida", "type": "number"},
-        {"key": "QTD_ATENDIDA", "label": "Qtd Atendida", "type": "number"},
-        {"key": "QTD_PENDENTE", "label": "Qtd Pendente", "type": "number"},
-        {"key": "VLR_UNITARIO", "label": "Vlr Unit.", "type": "currency"},
-        {"key": "VLR_TOTAL_PENDENTE", "label": "Vlr Pendente", "type": "currency"},
-    ]
+            PRO.DESCRPROD"""
 
-    table_data = table_result.get("data", []) if table_result.get("success") else []
+    sql_table = f"""
+        SELECT{table_select}
+        {joins}
+        WHERE {where_base}
+          {cat_filter}
+        {table_order}
+    """
 
-    # ========================================
-    # 3) 4 GRAFICOS (agrupamentos como Power BI)
-    # ========================================
+    # Graficos (agrupamentos como Power BI)
     # Valor = VLR_TOTAL_PENDENTE (pendente, nao pedido total)
-
     sql_chart_empresa = f"""
         SELECT NVL(EMP.NOMEFANTASIA, 'N/I') AS LABEL,
                NVL(SUM(ROUND((ITE.QTDNEG - NVL(V_AGG.TOTAL_ATENDIDO, 0)) * ITE.VLRUNIT, 2)), 0) AS VALOR
@@ -557,11 +775,123 @@ async def report_pendencia_compras(params: ReportRequest, user_context: dict) ->
         ORDER BY VALOR DESC
     """
 
-    r_emp = await _run_query(sql_chart_empresa)
-    r_comp = await _run_query(sql_chart_comprador)
-    r_marca = await _run_query(sql_chart_marca)
-    r_abc = await _run_query(sql_chart_abc)
+    # Filtros disponiveis (para dropdowns)
+    sql_filtros_emp = f"SELECT DISTINCT ITE.CODEMP AS CODEMP, NVL(EMP.NOMEFANTASIA, 'N/I') AS NOME {joins} WHERE {where_base} ORDER BY NOME"
+    sql_filtros_comp = f"SELECT DISTINCT MAR.AD_CODVEND AS CODVEND, NVL(VEN.APELIDO, 'N/I') AS NOME {joins} WHERE {where_base} AND MAR.AD_CODVEND IS NOT NULL ORDER BY NOME"
+    sql_filtros_marca = f"SELECT DISTINCT PRO.CODMARCA AS CODMARCA, NVL(MAR.DESCRICAO, 'N/I') AS NOME {joins} WHERE {where_base} AND PRO.CODMARCA IS NOT NULL ORDER BY NOME"
+
+    # Single-scan: 1 query de detalhe (sem filtro de categoria) e categorias,
+    # graficos e filtros calculados localmente. So vale se o scan veio
+    # completo (abaixo de PENDENCIA_SCAN_MAX_ROWS); senao usa as 9 queries.
+    res = None
+    query_timings = []
+    single_scan = PENDENCIA_SINGLE_SCAN if params.single_scan is None else params.single_scan
+    if single_scan:
+        sql_scan = f"""
+            SELECT{table_select},
+                MAR.AD_CODVEND AS COD_COMPRADOR,
+                PRO.CODMARCA AS COD_MARCA,
+                NVL(PRO.AD_LINHA, 'N/I') AS LINHA,
+                CASE
+                    WHEN CAB.DTPREVENT IS NULL THEN 'sem_previsao'
+                    WHEN CAB.DTPREVENT < TRUNC(SYSDATE) THEN 'atrasados'
+                    WHEN CAB.DTPREVENT < TRUNC(SYSDATE) + 7 THEN 'proximo'
+                    ELSE 'no_prazo'
+                END AS CAT_PRAZO
+            {joins}
+            WHERE {where_base}
+            {table_order}
+        """
+        scan_res, query_timings = await _run_query_graph(
+            {"scan": {"sql": sql_scan, "max_rows": PENDENCIA_SCAN_MAX_ROWS}})
+        scan = scan_res["scan"]
+        scan_rows = scan.get("data") or []
+        if scan.get("success") and len(scan_rows) < PENDENCIA_SCAN_MAX_ROWS:
+            t0 = time.time()
+            res = _pendencia_from_scan(scan_rows, list(cat_filters), cat_filtro)
+            query_timings.append({"query": "agregacao_local", "ms": int((time.time() - t0) * 1000),
+                                  "wait_ms": 0, "rows": len(scan_rows), "success": True})
+        else:
+            motivo = "truncado" if scan.get("success") else f"erro: {scan.get('error', '?')}"
+            print(f"[REPORT] pendencia_compras: scan {motivo}, usando queries agregadas")
+
+    if res is None:
+        # Todas as 9 queries sao independentes entre si: rodam em paralelo
+        # (a tabela e a mais pesada, entra primeiro na fila)
+        res, graph_timings = await _run_query_graph({
+            "tabela": sql_table,
+            "categorias": sql_categorias,
+            "chart_empresa": sql_chart_empresa,
+            "chart_comprador": sql_chart_comprador,
+            "chart_marca": sql_chart_marca,
+            "chart_abc": sql_chart_abc,
+            "filtro_empresas": sql_filtros_emp,
+            "filtro_compradores": sql_filtros_comp,
+            "filtro_marcas": sql_filtros_marca,
+        })
+        query_timings += graph_timings
+    cat_result = res["categorias"]
 
+    # ========================================
+    # 3) CATEGORIAS + KPIs
+    # ========================================
+    categorias = []
+    kpis = []
+    if cat_result.get("success"):
+        for row in cat_result.get("data", []):
+            cat_id = str(row.get("CAT", ""))
+            qtd_ped = int(row.get("QTD_PEDIDOS", 0) or 0)
+            qtd_prod = int(row.get("QTD_PRODUTOS", 0) or 0)
+            vlr = float(row.get("VLR_TOTAL", 0) or 0)
+            categorias.append({
+                "id": cat_id,
+                "nome": cat_names.get(cat_id, cat_id),
+                "qtd_pedidos": qtd_ped,
+                "qtd_produtos": qtd_prod,
+                "valor_total": vlr,
+                "valor_fmt": _fmt_brl(vlr),
+            })
+
+            # KPIs = categoria ativa (ou 'todos')
+            cat_filtro = params.categoria or "todos"
+            if cat_id == cat_filtro:
+                kpis = [
+                    {"label": "Valor Total Pendente", "value": _fmt_brl(vlr), "icon": "💰"},
+                    {"label": "Pedidos", "value": str(qtd_ped), "icon": "📦"},
+                    {"label": "Itens", "value": str(qtd_prod), "icon": "📋"},
+                ]
+
+    # ========================================
+    # 4) TABELA DETALHADA (query real do usuario)
+    # ========================================
+    table_result = res["tabela"]
+    table_columns = [
+        {"key": "EMPRESA", "label": "Empresa", "type": "text"},
+        {"key": "PEDIDO", "label": "Pedido", "type": "number"},
+        {"key": "TIPO_COMPRA", "label": "Tipo Compra", "type": "text"},
+        {"key": "COMPRADOR", "label": "Comprador", "type": "text"},
+        {"key": "DT_PEDIDO", "label": "Data Pedido", "type": "text"},
+        {"key": "PREVISAO_ENTREGA", "label": "Previsão", "type": "text"},
+        {"key": "CONFIRMADO", "label": "Confirmado", "type": "text"},
+        {"key": "DIAS_ABERTO", "label": "Dias Aberto", "type": "number"},
+        {"key": "STATUS_ENTREGA", "label": "Status", "type": "text"},
+        {"key": "CODPROD", "label": "CodProduto", "type": "number"},
+        {"key": "PRODUTO", "label": "Produto", "type": "text"},
+        {"key": "MARCA", "label": "Marca", "type": "text"},
+        {"key": "FORNECEDOR", "label": "Fornecedor", "type": "text"},
+        {"key": "UNIDADE", "label": "Un.", "type": "text"},
+        {"key": "QTD_PEDIDA", "label": "Qtd Pedida", "type": "number"},
+        {"key": "QTD_ATENDIDA", "label": "Qtd Atendida", "type": "number"},
+        {"key": "QTD_PENDENTE", "label": "Qtd Pendente", "type": "number"},
+        {"key": "VLR_UNITARIO", "label": "Vlr Unit.", "type": "currency"},
+        {"key": "VLR_TOTAL_PENDENTE", "label": "Vlr Pendente", "type": "currency"},
+    ]
+
+    table_data = table_result.get("data", []) if table_result.get("success") else []
+
+    # ========================================
+    # 5) 4 GRAFICOS
+    # ========================================
     def _build_chart(result, title, filter_key, max_items=10):
         chart = {"type": "bar_h", "labels": [], "values": [], "title": title, "filter_key": filter_key}
         if result.get("success"):
@@ -572,25 +902,17 @@ async def report_pendencia_compras(params: ReportRequest, user_context: dict) ->
         return chart
 
     charts = [
-        _build_chart(r_emp, "Total por empresa", "EMPRESA"),
-        _build_chart(r_comp, "Total por comprador", "COMPRADOR"),
-        _build_chart(r_marca, "Total por marca", "MARCA", max_items=15),
-        _build_chart(r_abc, "Total por curva ABC", "LABEL", max_items=8),
+        _build_chart(res["chart_empresa"], "Total por empresa", "EMPRESA"),
+        _build_chart(res["chart_comprador"], "Total por comprador", "COMPRADOR"),
+        _build_chart(res["chart_marca"], "Total por marca", "MARCA", max_items=15),
+        _build_chart(res["chart_abc"], "Total por curva ABC", "LABEL", max_items=8),
     ]
 
     chart_data = charts[0] if charts else {}
 
     # ========================================
-    # 4) FILTROS DISPONIVEIS (para dropdowns)
+    # 6) FILTROS DISPONIVEIS (para dropdowns)
     # ========================================
-    sql_filtros_emp = f"SELECT DISTINCT ITE.CODEMP AS CODEMP, NVL(EMP.NOMEFANTASIA, 'N/I') AS NOME {joins} WHERE {where_base} ORDER BY NOME"
-    sql_filtros_comp = f"SELECT DISTINCT MAR.AD_CODVEND AS CODVEND, NVL(VEN.APELIDO, 'N/I') AS NOME {joins} WHERE {where_base} AND MAR.AD_CODVEND IS NOT NULL ORDER BY NOME"
-    sql_filtros_marca = f"SELECT DISTINCT PRO.CODMARCA AS CODMARCA, NVL(MAR.DESCRICAO, 'N/I') AS NOME {joins} WHERE {where_base} AND PRO.CODMARCA IS NOT NULL ORDER BY NOME"
-
-    r_f_emp = await _run_query(sql_filtros_emp)
-    r_f_comp = await _run_query(sql_filtros_comp)
-    r_f_marca = await _run_query(sql_filtros_marca)
-
     def _build_options(result, code_key, name_key):
         opts = []
         seen = set()
@@ -604,12 +926,13 @@ async def report_pendencia_compras(params: ReportRequest, user_context: dict) ->
         return opts
 
     filtros_disponiveis = {
-        "empresas": _build_options(r_f_emp, "CODEMP", "NOME"),
-        "compradores": _build_options(r_f_comp, "CODVEND", "NOME"),
-        "marcas": _build_options(r_f_marca, "CODMARCA", "NOME"),
+        "empresas": _build_options(res["filtro_empresas"], "CODEMP", "NOME"),
+        "compradores": _build_options(res["filtro_compradores"], "CODVEND", "NOME"),
+        "marcas": _build_options(res["filtro_marcas"], "CODMARCA", "NOME"),
     }
 
     elapsed = int((time.time() - start) * 1000)
+    _log_slow_queries("pendencia_compras", query_timings, elapsed)
 
     return ReportResponse(
         report_id="pendencia_compras",
@@ -624,6 +947,7 @@ async def report_pendencia_compras(params: ReportRequest, user_context: dict) ->
         filtros_disponiveis=filtros_disponiveis,
         time_ms=elapsed,
         row_count=len(table_data),
+        query_timings=query_timings,
     )
 
 
@@ -694,8 +1018,26 @@ async def report_vendas_periodo(params: ReportRequest, user_context: dict) -> Re
           AND C.DTNEG < TRUNC(SYSDATE, 'MM')
     """
 
-    kpis_result = await _run_query(sql_kpis)
-    ant_result = await _run_query(sql_mes_ant)
+    # --- Tabela: vendas por dia ---
+    sql_table = f"""
+        SELECT
+            TO_CHAR(TRUNC(C.DTNEG), 'DD/MM/YYYY') AS DATA,
+            COUNT(*) AS QTD_VENDAS,
+            SUM(C.VLRNOTA) AS FATURAMENTO,
+            ROUND(AVG(C.VLRNOTA), 2) AS TICKET_MEDIO
+        FROM TGFCAB C
+        WHERE {where_rbac}
+        GROUP BY TRUNC(C.DTNEG)
+        ORDER BY TRUNC(C.DTNEG)
+    """
+
+    res, query_timings = await _run_query_graph({
+        "kpis": sql_kpis,
+        "mes_anterior": sql_mes_ant,
+        "tabela": sql_table,
+    })
+    kpis_result = res["kpis"]
+    ant_result = res["mes_anterior"]
 
     kpis = []
     if kpis_result.get("success") and kpis_result.get("data"):
@@ -723,19 +1065,7 @@ async def report_vendas_periodo(params: ReportRequest, user_context: dict) -> Re
         ]
 
     # --- Tabela: vendas por dia ---
-    sql_table = f"""
-        SELECT
-            TO_CHAR(TRUNC(C.DTNEG), 'DD/MM/YYYY') AS DATA,
-            COUNT(*) AS QTD_VENDAS,
-            SUM(C.VLRNOTA) AS FATURAMENTO,
-            ROUND(AVG(C.VLRNOTA), 2) AS TICKET_MEDIO
-        FROM TGFCAB C
-        WHERE {where_rbac}
-        GROUP BY TRUNC(C.DTNEG)
-        ORDER BY TRUNC(C.DTNEG)
-    """
-
-    table_result = await _run_query(sql_table)
+    table_result = res["tabela"]
     table_columns = [
         {"key": "DATA", "label": "Data", "type": "text"},
         {"key": "QTD_VENDAS", "label": "Qtd Vendas", "type": "number"},
@@ -763,6 +1093,7 @@ async def report_vendas_periodo(params: ReportRequest, user_context: dict) -> Re
         filtros_aplicados=filtros,
         time_ms=elapsed,
         row_count=len(table_data),
+        query_timings=query_timings,
     )
 
 
@@ -798,19 +1129,6 @@ async def report_estoque_critico(params: ReportRequest, user_context: dict) -> R
           AND NVL(E.QTDMIN, 0) > 0
     """
 
-    kpis_result = await _run_query(sql_kpis)
-    kpis = []
-    if kpis_result.get("success") and kpis_result.get("data"):
-        row = kpis_result["data"][0]
-        crit = int(row.get("QTD_CRITICOS", 0))
-        zer = int(row.get("QTD_ZERADOS", 0))
-        vlr = float(row.get("VLR_PARADO", 0))
-        kpis = [
-            {"label": "Produtos Críticos", "value": str(crit), "icon": "⚠️", "alert": True},
-            {"label": "Estoque Zerado", "value": str(zer), "icon": "🚫", "alert": zer > 0},
-            {"label": "Valor Parado", "value": f"R$ {vlr:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."), "icon": "💰"},
-        ]
-
     # --- Tabela ---
     sql_table = f"""
         SELECT
@@ -829,18 +1147,6 @@ async def report_estoque_critico(params: ReportRequest, user_context: dict) -> R
         ORDER BY (NVL(E.QTDMIN, 0) - E.QTDATUAL) DESC
     """
 
-    table_result = await _run_query(sql_table)
-    table_columns = [
-        {"key": "CODPROD", "label": "Código", "type": "number"},
-        {"key": "PRODUTO", "label": "Produto", "type": "text"},
-        {"key": "MARCA", "label": "Marca", "type": "text"},
-        {"key": "ESTOQUE_ATUAL", "label": "Estoque", "type": "number"},
-        {"key": "ESTOQUE_MIN", "label": "Mínimo", "type": "number"},
-        {"key": "FALTA", "label": "Falta", "type": "number"},
-    ]
-
-    table_data = table_result.get("data", []) if table_result.get("success") else []
-
     # --- Grafico: top 10 marcas criticas ---
     sql_chart = f"""
         SELECT
@@ -855,7 +1161,39 @@ async def report_estoque_critico(params: ReportRequest, user_context: dict) -> R
         ORDER BY COUNT(*) DESC
     """
 
-    chart_result = await _run_query(sql_chart)
+    res, query_timings = await _run_query_graph({
+        "kpis": sql_kpis,
+        "tabela": sql_table,
+        "grafico": sql_chart,
+    })
+    kpis_result = res["kpis"]
+    kpis = []
+    if kpis_result.get("success") and kpis_result.get("data"):
+        row = kpis_result["data"][0]
+        crit = int(row.get("QTD_CRITICOS", 0))
+        zer = int(row.get("QTD_ZERADOS", 0))
+        vlr = float(row.get("VLR_PARADO", 0))
+        kpis = [
+            {"label": "Produtos Críticos", "value": str(crit), "icon": "⚠️", "alert": True},
+            {"label": "Estoque Zerado", "value": str(zer), "icon": "🚫", "alert": zer > 0},
+            {"label": "Valor Parado", "value": f"R$ {vlr:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."), "icon": "💰"},
+        ]
+
+    # --- Tabela ---
+    table_result = res["tabela"]
+    table_columns = [
+        {"key": "CODPROD", "label": "Código", "type": "number"},
+        {"key": "PRODUTO", "label": "Produto", "type": "text"},
+        {"key": "MARCA", "label": "Marca", "type": "text"},
+        {"key": "ESTOQUE_ATUAL", "label": "Estoque", "type": "number"},
+        {"key": "ESTOQUE_MIN", "label": "Mínimo", "type": "number"},
+        {"key": "FALTA", "label": "Falta", "type": "number"},
+    ]
+
+    table_data = table_result.get("data", []) if table_result.get("success") else []
+
+    # --- Grafico: top 10 marcas criticas ---
+    chart_result = res["grafico"]
     chart_data = {"type": "bar", "labels": [], "values": [], "title": "Marcas com Mais Itens Críticos", "filter_key": "MARCA"}
     if chart_result.get("success"):
         for row in chart_result.get("data", [])[:10]:
@@ -874,6 +1212,7 @@ async def report_estoque_critico(params: ReportRequest, user_context: dict) -> R
         filtros_aplicados=filtros,
         time_ms=elapsed,
         row_count=len(table_data),
+        query_timings=query_timings,
     )
 
 
@@ -961,8 +1300,13 @@ async def execute_report(report_id: str, params: ReportRequest, authorization: O
             return cached
 
     # Executar handler (miss no cache ou bypass)
+    # no_cache tambem forca re-execucao no cache de queries (e atualiza as entradas)
+    scope_token = cache_scope.set(scope_from_context(user_context))
+    refresh_token = cache_refresh.set(bool(params.no_cache))
     try:
-        result = await report_info["handler"](params, user_context)
+        # Fila do Sankhya: relatorio abaixo do chat, round-robin por usuario
+        with query_priority_scope("reports", owner=session["user"]):
+            result = await report_info["handler"](params, user_context)
         result_dict = result.dict() if hasattr(result, 'dict') else result.__dict__
 
         # Salvar no cache
@@ -973,6 +1317,9 @@ async def execute_report(report_id: str, params: ReportRequest, authorization: O
     except Exception as e:
         print(f"[REPORT] Erro em {report_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Erro ao gerar relatorio: {str(e)}")
+    finally:
+        cache_refresh.reset(refresh_token)
+        cache_scope.reset(scope_token)
 
 
 @router.get("/cache/stats")
@@ -982,7 +1329,7 @@ async def cache_stats(authorization: Optional[str] = Header(None)):
     session = get_current_user(authorization)
     if session.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Apenas admin pode ver stats do cache")
-    return _cache.stats()
+    return {**_cache.stats(), "query_cache": query_cache.stats()}
 
 
 @router.post("/cache/clear")
@@ -993,4 +1340,5 @@ async def cache_clear(authorization: Optional[str] = Header(None)):
     if session.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Apenas admin pode limpar cache")
     _cache.invalidate()
+    query_cache.clear()
     return {"status": "ok", "message": "Cache limpo"}
@@ -0,0 +1,98 @@
+"""
+MMarra Data Hub - Streaming de respostas do chat (SSE).
+
+O endpoint /api/chat/stream abre um ChatStream e roda o SmartAgent dentro dele.
+Qualquer codigo chamado durante a request (handlers, narrador, brain) pode
+emitir eventos sem receber o stream por parametro: o stream ativo fica num
+ContextVar, herdado pelas tasks criadas durante a request.
+
+Eventos emitidos:
+    kpis   -> {"response": "..."}   tabela/KPIs assim que o SQL volta
+    token  -> {"text": "..."}       pedaco da narracao/analise do Groq
+    reset  -> {}                    descartar tokens (LLM falhou no meio, vai tentar outro modelo)
+    (o endpoint ainda emite table_data e done no final)
+
+Uso:
+    from src.core.chat_stream import emit, token_callback
+
+    emit("kpis", {"response": tabela})
+    result = await groq_request(..., on_token=token_callback())
+"""
+
+import json
+import asyncio
+import contextvars
+from typing import Callable, Optional
+
+
+_active_stream: contextvars.ContextVar = contextvars.ContextVar("chat_stream", default=None)
+
+
+class ChatStream:
+    """Fila de eventos SSE de uma request de chat."""
+
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self.tokens_sent = 0
+
+    def emit(self, event: str, data: dict):
+        if event == "token":
+            self.tokens_sent += 1
+        self._queue.put_nowait((event, data))
+
+    def close(self):
+        self._queue.put_nowait(None)
+
+    async def events(self):
+        """Itera (event, data) ate close()."""
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            yield item
+
+    def activate(self):
+        """Torna este stream o ativo no contexto atual (retorna token p/ reset)."""
+        return _active_stream.set(self)
+
+    @staticmethod
+    def deactivate(token):
+        _active_stream.reset(token)
+
+
+def active_stream() -> Optional[ChatStream]:
+    return _active_stream.get()
+
+
+def emit(event: str, data: dict = None):
+    """Emite evento no stream ativo (no-op fora do /api/chat/stream)."""
+    stream = _active_stream.get()
+    if stream is not None:
+        stream.emit(event, data or {})
+
+
+def token_callback() -> Optional[Callable[[str], None]]:
+    """Callback on_token para groq_request, ou None se nao ha stream ativo."""
+    stream = _active_stream.get()
+    if stream is None:
+        return None
+    return lambda text: stream.emit("token", {"text": text})
+
+
+def tokens_mark() -> int:
+    """Quantos tokens ja foram enviados no stream ativo (0 se nao ha stream)."""
+    stream = _active_stream.get()
+    return stream.tokens_sent if stream is not None else 0
+
+
+def reset_since(mark: int):
+    """Se a tentativa do LLM falhou depois de enviar tokens, manda o cliente descartar."""
+    stream = _active_stream.get()
+    if stream is not None and stream.tokens_sent > mark:
+        stream.emit("reset", {})
+
+
+def sse_format(event: str, data) -> str:
+    """Formata 1 evento no padrao text/event-stream."""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
@@ -6,8 +6,9 @@ Extraído de smart_agent.py na refatoração modular.
 
 import os
 import time
+import json
 import httpx
-from typing import Optional
+from typing import Callable, Optional
 
 
 # Config
@@ -116,12 +117,15 @@ print(f"[GROQ] Modelos: classify={GROQ_MODEL_CLASSIFY} | geral={GROQ_MODEL}")
 
 async def groq_request(pool: GroqKeyPool, messages: list, temperature: float = 0.0,
                        max_tokens: int = 400, timeout: int = None, model: str = None,
-                       tools: list = None, tool_choice: str = None) -> dict | None:
+                       tools: list = None, tool_choice: str = None,
+                       on_token: Callable[[str], None] = None) -> dict | None:
     """Faz request ao Groq usando chave do pool, com retry automático.
     
     Args:
         tools: Lista de tool definitions (OpenAI format) para Function Calling.
         tool_choice: "auto", "required", "none", ou {"type":"function","function":{"name":"X"}}.
+        on_token: Se informado, usa streaming (SSE) e chama on_token(texto) a cada
+                  pedaço recebido. O retorno continua sendo o texto completo.
     """
     key = pool.get_key()
     if not key:
@@ -141,6 +145,9 @@ async def groq_request(pool: GroqKeyPool, messages: list, temperature: float = 0
     if tool_choice:
         payload["tool_choice"] = tool_choice
 
+    if on_token is not None and not tools:
+        return await _groq_stream(pool, key, payload, _timeout, on_token)
+
     try:
         async with httpx.AsyncClient(timeout=_timeout) as client:
             r = await client.post(
@@ -185,3 +192,57 @@ async def groq_request(pool: GroqKeyPool, messages: list, temperature: float = 0
         print(f"[GROQ:{pool._name}] Erro: {e}")
         pool.mark_error(key)
         return None
+
+
+async def _groq_stream(pool: GroqKeyPool, key: str, payload: dict, timeout: int,
+                       on_token: Callable[[str], None]) -> dict | None:
+    """Request com stream=True: repassa os tokens conforme chegam (SSE do Groq).
+
+    Em 429 antes do primeiro token, tenta 1x com chave alternativa (igual ao
+    groq_request). Retorna {"content", "usage"} como o modo normal.
+    """
+    payload = {**payload, "stream": True}
+    attempts = [key]
+    parts = []
+    usage = {}
+    try:
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            while attempts:
+                k = attempts.pop(0)
+                async with client.stream(
+                    "POST", GROQ_API_URL,
+                    headers={"Authorization": f"Bearer {k}", "Content-Type": "application/json"},
+                    json=payload,
+                ) as r:
+                    if r.status_code == 429:
+                        pool.mark_rate_limited(k, int(r.headers.get("retry-after", "60")))
+                        fallback_key = pool.get_key()
+                        if fallback_key and fallback_key != k and k == key:
+                            print(f"[GROQ:{pool._name}] Retry (stream) com chave alternativa")
+                            attempts.append(fallback_key)
+                            continue
+                        return None
+                    r.raise_for_status()
+                    async for line in r.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        chunk = json.loads(data)
+                        delta = (chunk.get("choices") or [{}])[0].get("delta", {}).get("content")
+                        if delta:
+                            parts.append(delta)
+                            on_token(delta)
+                        # Groq manda usage no ultimo chunk (x_groq.usage)
+                        usage = (chunk.get("x_groq") or {}).get("usage", usage) or usage
+                    return {"content": "".join(parts), "usage": usage}
+    except httpx.TimeoutException:
+        print(f"[GROQ:{pool._name}] Timeout stream ({timeout}s)")
+        pool.mark_error(key)
+        return None
+    except Exception as e:
+        print(f"[GROQ:{pool._name}] Erro stream: {e}")
+        pool.mark_error(key)
+        return None
+    return None
@@ -0,0 +1,215 @@
+"""
+MMarra Data Hub - Cache compartilhado de resultados de query.
+Usado pelo SmartAgent (chat) e pelos relatorios (/api/reports) via SafeQueryExecutor.
+
+- Chave = SQL normalizado + escopo RBAC (role/codvend/equipe)
+- Coalescing: N requests concorrentes com a mesma chave geram 1 unica
+  chamada ao Sankhya; as demais aguardam o resultado da primeira
+- LRU + TTL, limitado por numero de entradas e por bytes aproximados
+- Metricas: hits, misses, coalesced, evictions, expired
+
+Uso:
+    from src.core.query_cache import query_cache, cache_scope
+
+    token = cache_scope.set(scope_from_context(user_context))
+    try:
+        r = await executor.execute(sql)   # executor criado com cache=query_cache
+    finally:
+        cache_scope.reset(token)
+"""
+
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import contextvars
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+
+# Config (todas sobrescreviveis via .env)
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "120"))  # segundos
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "2000"))
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Escopo RBAC da request atual. Setado no entry point (chat/relatorio) e lido
+# pelo cache: as tasks criadas por gather herdam o valor automaticamente.
+cache_scope: contextvars.ContextVar = contextvars.ContextVar("query_cache_scope", default="")
+# True = ignora entradas cacheadas e re-executa (ex: relatorio com no_cache)
+cache_refresh: contextvars.ContextVar = contextvars.ContextVar("query_cache_refresh", default=False)
+
+# Resultado do future em voo quando o lider e cancelado: seguidores tentam de novo
+_LEADER_CANCELLED = object()
+
+
+def scope_from_context(user_context: dict) -> str:
+    """Monta o escopo RBAC (string estavel) a partir do user_context."""
+    ctx = user_context or {}
+    team = ",".join(str(c) for c in sorted(ctx.get("team_codvends", []) or []))
+    return f"{ctx.get('role', '')}|{ctx.get('codvend', 0) or 0}|{team}"
+
+
+def normalize_sql(sql: str) -> str:
+    """Normaliza SQL para a chave do cache.
+
+    Colapsa espacos/quebras de linha fora de literais e remove ';' final.
+    Nao mexe em maiusculas/minusculas (literais como '%Donaldson%' importam).
+    """
+    parts = re.split(r"('(?:[^']|'')*')", sql.strip().rstrip(";").strip())
+    out = []
+    for i, part in enumerate(parts):
+        out.append(part if i % 2 else re.sub(r"\s+", " ", part))
+    return "".join(out).strip()
+
+
+def estimate_bytes(value) -> int:
+    """Tamanho aproximado do resultado (JSON serializado)."""
+    try:
+        return len(json.dumps(value, default=str, ensure_ascii=False).encode("utf-8"))
+    except Exception:
+        return len(str(value))
+
+
+class QueryResultCache:
+    """Cache LRU+TTL de resultados de query com coalescing de requests."""
+
+    def __init__(self, ttl: int = QUERY_CACHE_TTL, max_entries: int = QUERY_CACHE_MAX_ENTRIES,
+                 max_bytes: int = QUERY_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max(1, max_bytes)
+        self._store: "OrderedDict[str, dict]" = OrderedDict()  # LRU: mais recente no fim
+        self._inflight = {}  # {key: asyncio.Future}
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0,
+                       "expired": 0, "errors": 0, "too_large": 0}
+
+    # ============================================================
+    # CHAVE
+    # ============================================================
+
+    def make_key(self, sql: str, scope: str = None) -> str:
+        scope = cache_scope.get() if scope is None else scope
+        raw = f"{scope}\n{normalize_sql(sql)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    # ============================================================
+    # GET / SET
+    # ============================================================
+
+    def _get(self, key: str) -> Optional[dict]:
+        entry = self._store.get(key)
+        if entry is None:
+            return None
+        if time.time() >= entry["expires"]:
+            self._remove(key)
+            self._stats["expired"] += 1
+            return None
+        self._store.move_to_end(key)
+        return entry["data"]
+
+    def _set(self, key: str, data: dict):
+        size = estimate_bytes(data)
+        if size > self.max_bytes:
+            self._stats["too_large"] += 1
+            return
+        if key in self._store:
+            self._remove(key)
+        self._store[key] = {"data": data, "expires": time.time() + self.ttl, "bytes": size}
+        self._bytes += size
+        while len(self._store) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._store))
+            self._remove(oldest)
+            self._stats["evictions"] += 1
+
+    def _remove(self, key: str):
+        entry = self._store.pop(key, None)
+        if entry:
+            self._bytes -= entry["bytes"]
+
+    async def get_or_execute(self, sql: str, fn: Callable[[], Awaitable[dict]],
+                             scope: str = None) -> dict:
+        """Retorna resultado do cache ou executa fn() (1 vez por chave em voo).
+
+        Args:
+            sql: SQL que sera executado (so usado na chave)
+            fn: coroutine factory que executa a query e retorna dict do executor
+            scope: escopo RBAC (default: cache_scope da request atual)
+
+        Returns:
+            Copia rasa do dict de resultado (o chamador pode reatribuir chaves).
+            So resultados com success=True sao cacheados.
+        """
+        key = self.make_key(sql, scope)
+
+        cached = None if cache_refresh.get() else self._get(key)
+        if cached is not None:
+            self._stats["hits"] += 1
+            return dict(cached)
+
+        while True:
+            fut = self._inflight.get(key)
+            if fut is None or fut.done():
+                break
+            self._stats["coalesced"] += 1
+            # shield: cancelar quem espera nao cancela a query do lider
+            result = await asyncio.shield(fut)
+            if result is not _LEADER_CANCELLED:
+                return dict(result)
+            # Lider foi cancelado (ex: cliente desconectou): o primeiro seguidor
+            # que acordar vira lider, os demais coalescem nele
+
+        self._stats["misses"] += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._stats["errors"] += 1
+            if isinstance(e, asyncio.CancelledError):
+                fut.set_result(_LEADER_CANCELLED)  # seguidores nao herdam o cancel
+            else:
+                fut.set_exception(e)
+                fut.exception()  # marca como lida (evita warning se ninguem aguardava)
+            raise
+        finally:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+
+        if isinstance(result, dict) and result.get("success"):
+            self._set(key, result)
+        fut.set_result(result)
+        return dict(result) if isinstance(result, dict) else result
+
+    # ============================================================
+    # ADMIN
+    # ============================================================
+
+    def clear(self):
+        count = len(self._store)
+        self._store.clear()
+        self._bytes = 0
+        print(f"[QCACHE] CLEAR ({count} entradas removidas)")
+
+    def stats(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["misses"] + self._stats["coalesced"]
+        saved = self._stats["hits"] + self._stats["coalesced"]
+        return {
+            **self._stats,
+            "entries": len(self._store),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "inflight": len(self._inflight),
+            "hit_rate": f"{(saved / lookups * 100):.1f}%" if lookups > 0 else "N/A",
+            "ttl_seconds": self.ttl,
+        }
+
+
+# ============================================================
+# CACHE GLOBAL
+# ============================================================
+
+query_cache = QueryResultCache()
@@ -0,0 +1,200 @@
+"""
+MMarra Data Hub - Fila de admissao das queries no Sankhya.
+
+Substitui o semaforo simples do SankhyaTransport: todas as queries do
+processo (chat, relatorios, sync do Elastic, treinamento) disputam as
+mesmas SANKHYA_MAX_CONCURRENT_QUERIES vagas, mas quem espera e atendido por:
+
+1. Classe de prioridade: chat > reports > background
+2. Dentro da classe, round-robin por usuario (fair queuing): um relatorio
+   com 20 queries nao passa na frente da 1a query de outro usuario
+3. Background nunca ocupa mais que SANKHYA_BACKGROUND_MAX_CONCURRENT vagas,
+   entao sempre sobra vaga livre para o chat mesmo com o full_sync rodando
+
+A classe e o usuario vem de ContextVars (valem so para a task atual):
+
+    from src.core.query_scheduler import query_priority_scope
+
+    with query_priority_scope("background"):
+        await es_sync.full_sync()
+
+    with query_priority_scope("chat", owner=user_id):
+        await smart_agent.ask(...)
+
+    @runs_as("background")          # jobs: sync do Elastic, treinamento
+    async def sync_products(...): ...
+
+Metricas por classe (fila atual, pico, espera media/max) em stats().
+"""
+
+import os
+import time
+import asyncio
+import functools
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+
+PRIORITIES = ("chat", "reports", "background")  # ordem = prioridade
+DEFAULT_PRIORITY = "chat"
+# Vagas maximas do background (default: 1/3 do limite global, minimo 1)
+SANKHYA_BACKGROUND_MAX_CONCURRENT = int(os.getenv("SANKHYA_BACKGROUND_MAX_CONCURRENT", "0"))
+
+query_priority: contextvars.ContextVar = contextvars.ContextVar("sankhya_query_priority", default=None)
+query_owner: contextvars.ContextVar = contextvars.ContextVar("sankhya_query_owner", default="")
+
+
+@contextmanager
+def query_priority_scope(priority: str, owner: str = None):
+    """Define classe (e usuario) das queries Sankhya disparadas dentro do bloco."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Prioridade invalida: {priority} (use {', '.join(PRIORITIES)})")
+    p_token = query_priority.set(priority)
+    o_token = query_owner.set(owner) if owner is not None else None
+    try:
+        yield
+    finally:
+        if o_token is not None:
+            query_owner.reset(o_token)
+        query_priority.reset(p_token)
+
+
+def runs_as(priority: str):
+    """Decorator de coroutine: queries disparadas por ela entram na classe `priority`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with query_priority_scope(priority):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _ClassQueue:
+    """Fila de uma classe: {owner: deque de futures}, round-robin entre owners."""
+
+    __slots__ = ("owners", "size", "in_flight", "limit", "stats")
+
+    def __init__(self, limit: int):
+        self.owners: "OrderedDict[str, deque]" = OrderedDict()
+        self.size = 0
+        self.in_flight = 0
+        self.limit = limit
+        self.stats = {"granted": 0, "queued": 0, "max_depth": 0,
+                      "wait_total_ms": 0.0, "wait_max_ms": 0.0, "cancelled": 0}
+
+    def push(self, owner: str, waiter):
+        self.owners.setdefault(owner, deque()).append(waiter)
+        self.size += 1
+        self.stats["queued"] += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], self.size)
+
+    def pop(self):
+        """Proximo waiter: 1o do owner da vez; owner volta pro fim se ainda tem fila."""
+        owner, waiters = next(iter(self.owners.items()))
+        waiter = waiters.popleft()
+        if waiters:
+            self.owners.move_to_end(owner)
+        else:
+            del self.owners[owner]
+        self.size -= 1
+        return waiter
+
+    def discard(self, owner: str, waiter) -> bool:
+        waiters = self.owners.get(owner)
+        if not waiters or waiter not in waiters:
+            return False
+        waiters.remove(waiter)
+        if not waiters:
+            del self.owners[owner]
+        self.size -= 1
+        return True
+
+
+class QueryScheduler:
+    """Limite global de queries com prioridade e fair queuing (1 por event loop)."""
+
+    def __init__(self, max_concurrent: int, background_max: int = SANKHYA_BACKGROUND_MAX_CONCURRENT):
+        self.max_concurrent = max(1, max_concurrent)
+        if background_max <= 0:
+            background_max = max(1, self.max_concurrent // 3)
+        self._queues = {p: _ClassQueue(self.max_concurrent) for p in PRIORITIES}
+        self._queues["background"].limit = min(self.max_concurrent, background_max)
+        self.in_flight = 0
+
+    def _can_run(self, q: _ClassQueue) -> bool:
+        return self.in_flight < self.max_concurrent and q.in_flight < q.limit
+
+    def _grant(self, q: _ClassQueue, waited_s: float):
+        self.in_flight += 1
+        q.in_flight += 1
+        q.stats["granted"] += 1
+        ms = waited_s * 1000
+        q.stats["wait_total_ms"] += ms
+        q.stats["wait_max_ms"] = max(q.stats["wait_max_ms"], ms)
+
+    def _has_waiters_before(self, priority: str) -> bool:
+        """Alguem da mesma classe ou de classe mais prioritaria ja esta na fila."""
+        for p in PRIORITIES:
+            if self._queues[p].size:
+                return True
+            if p == priority:
+                return False
+        return False
+
+    async def acquire(self, priority: str = DEFAULT_PRIORITY, owner: str = ""):
+        q = self._queues.get(priority) or self._queues[DEFAULT_PRIORITY]
+        if self._can_run(q) and not self._has_waiters_before(priority):
+            self._grant(q, 0.0)
+            return
+
+        entry = [asyncio.get_running_loop().create_future(), time.perf_counter(), False]  # future, enfileirou, recebeu vaga
+        q.push(owner, entry)
+        try:
+            await entry[0]
+        except asyncio.CancelledError:
+            if entry[2]:
+                self.release(priority)  # ja tinha recebido a vaga quando foi cancelado: devolve
+            elif q.discard(owner, entry):
+                q.stats["cancelled"] += 1
+            raise
+
+    def release(self, priority: str = DEFAULT_PRIORITY):
+        q = self._queues.get(priority) or self._queues[DEFAULT_PRIORITY]
+        self.in_flight -= 1
+        q.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Entrega vagas livres para a fila mais prioritaria que pode rodar."""
+        while self.in_flight < self.max_concurrent:
+            for p in PRIORITIES:
+                q = self._queues[p]
+                if q.size and q.in_flight < q.limit:
+                    entry = q.pop()
+                    if entry[0].done():  # task cancelada antes da vaga chegar
+                        q.stats["cancelled"] += 1
+                        break
+                    self._grant(q, time.perf_counter() - entry[1])
+                    entry[2] = True
+                    entry[0].set_result(None)
+                    break
+            else:
+                return
+
+    def stats(self) -> dict:
+        classes = {}
+        for p, q in self._queues.items():
+            s = q.stats
+            classes[p] = {
+                **s,
+                "wait_total_ms": round(s["wait_total_ms"], 1),
+                "wait_max_ms": round(s["wait_max_ms"], 1),
+                "wait_avg_ms": round(s["wait_total_ms"] / s["granted"], 1) if s["granted"] else 0.0,
+                "depth": q.size,
+                "waiting_users": len(q.owners),
+                "in_flight": q.in_flight,
+                "limit": q.limit,
+            }
+        return {"max_concurrent": self.max_concurrent, "in_flight": self.in_flight, "classes": classes}
@@ -0,0 +1,164 @@
+"""
+MMarra Data Hub - Rate limiter (token bucket com custo por rota).
+
+Cada usuario tem um balde de fichas que enche continuamente
+(RATE_LIMIT_<ROLE> fichas por minuto, mesmo valor de capacidade/burst).
+O estado e so [fichas, timestamp] no backend de estado (src/core/state_backend.py),
+entao a checagem e O(1) e vale entre workers.
+
+Custo por rota (layer do query log):
+- scoring / contexto / produto (sem LLM) ........ RATE_COST_SCORING (1)
+- classify via LLM (function calling, haiku,
+  ollama, scoring+groq) e fallbacks do router
+  (so chegam la depois do classify falhar) ....... RATE_COST_GROQ (3)
+- multi-step ..................................... RATE_COST_MULTISTEP (4)
+- brain 70b ...................................... RATE_COST_BRAIN (8)
+
+Somado ao da rota, o custo da narracao (processing.narration do query log):
+- 8b ............................................. RATE_COST_NARRATION (2)
+- 70b (pergunta analitica) ....................... RATE_COST_GROQ (3)
+
+A rota so e conhecida depois da resposta: a entrada cobra RATE_COST_SCORING
+(precisa ter saldo) e charge() cobra a diferenca depois. O saldo pode ficar
+negativo (ate -capacidade), segurando as proximas perguntas de quem esta
+usando os caminhos caros antes de esgotar os pools do Groq.
+
+Uso:
+    limiter = TokenBucketLimiter()
+    if not limiter.is_allowed(user, role):
+        ... 429 (limiter.retry_after(user, role) segundos)
+    result = await smart_agent.ask(...)
+    limiter.charge(user, role, route=result.get("_route"), narration=result.get("_narration"))
+"""
+
+import os
+import time
+
+from src.core.state_backend import get_state_backend
+
+
+RATE_COST_SCORING = float(os.getenv("RATE_COST_SCORING", "1"))
+RATE_COST_GROQ = float(os.getenv("RATE_COST_GROQ", "3"))
+RATE_COST_MULTISTEP = float(os.getenv("RATE_COST_MULTISTEP", "4"))
+RATE_COST_BRAIN = float(os.getenv("RATE_COST_BRAIN", "8"))
+RATE_COST_NARRATION = float(os.getenv("RATE_COST_NARRATION", "2"))
+
+# Fichas por minuto (= capacidade do balde) por role
+ROLE_QUOTAS = {
+    "admin": int(os.getenv("RATE_LIMIT_ADMIN", "120")),
+    "diretor": int(os.getenv("RATE_LIMIT_DIRETOR", "120")),
+    "ti": int(os.getenv("RATE_LIMIT_TI", "120")),
+    "gerente": int(os.getenv("RATE_LIMIT_GERENTE", "60")),
+    "comprador": int(os.getenv("RATE_LIMIT_COMPRADOR", "45")),
+    "vendedor": int(os.getenv("RATE_LIMIT_VENDEDOR", "30")),
+}
+DEFAULT_QUOTA = int(os.getenv("RATE_LIMIT_DEFAULT", "30"))
+
+# layer do query log -> custo (layers fora daqui custam RATE_COST_SCORING)
+ROUTE_COSTS = {
+    "function_calling": RATE_COST_GROQ,
+    "fc_text_fallback": RATE_COST_GROQ,
+    "scoring+groq": RATE_COST_GROQ,
+    "groq": RATE_COST_GROQ,
+    "llm": RATE_COST_GROQ,
+    "haiku": RATE_COST_GROQ,
+    "ollama": RATE_COST_GROQ,
+    "scoring_fallback": RATE_COST_GROQ,
+    "fallback_entity": RATE_COST_GROQ,
+    "fallback_kb": RATE_COST_GROQ,
+    "fallback_default": RATE_COST_GROQ,
+    "multistep": RATE_COST_MULTISTEP,
+    "brain": RATE_COST_BRAIN,
+}
+
+# processing.narration -> custo somado ao da rota
+NARRATION_COSTS = {
+    "8b": RATE_COST_NARRATION,
+    "70b": RATE_COST_GROQ,
+}
+
+
+def route_cost(route: str = None, narration: str = None) -> float:
+    return ROUTE_COSTS.get(route or "", RATE_COST_SCORING) + NARRATION_COSTS.get(narration or "", 0.0)
+
+
+class TokenBucketLimiter:
+    """Token bucket por usuario, quota por role, custo por rota."""
+
+    NS = "ratelimit"
+
+    def __init__(self, quotas: dict = None, default_quota: int = DEFAULT_QUOTA,
+                 window_seconds: int = 60, backend=None):
+        self.quotas = dict(ROLE_QUOTAS if quotas is None else quotas)
+        self.default_quota = default_quota
+        self.window = window_seconds
+        self.backend = backend or get_state_backend()
+        self._stats = {"allowed": 0, "denied": 0, "charged": 0.0}
+
+    def capacity(self, role: str = None) -> int:
+        return self.quotas.get((role or "").lower(), self.default_quota)
+
+    def _refill(self, bucket, capacity: float, now: float) -> float:
+        """Saldo atual do balde [fichas, ts] (cheio se o usuario e novo)."""
+        if not bucket:
+            return capacity
+        tokens, ts = bucket
+        rate = capacity / self.window
+        return min(capacity, tokens + max(0.0, now - ts) * rate)
+
+    def _ttl(self, capacity: float) -> float:
+        # Depois de 2 janelas sem uso o balde estaria cheio: a chave pode expirar
+        return self.window * 2 + capacity
+
+    def is_allowed(self, user_id: str, role: str = None, cost: float = RATE_COST_SCORING) -> bool:
+        """Entrada da pergunta: precisa de `cost` fichas (sem deixar negativo)."""
+        capacity = self.capacity(role)
+        now = time.time()
+
+        def take(bucket):
+            tokens = self._refill(bucket, capacity, now)
+            if tokens < cost:
+                return [tokens, now], False
+            return [tokens - cost, now], True
+
+        allowed = self.backend.update(self.NS, user_id, take, ttl=self._ttl(capacity))
+        self._stats["allowed" if allowed else "denied"] += 1
+        return allowed
+
+    def charge(self, user_id: str, role: str = None, route: str = None, paid: float = RATE_COST_SCORING,
+               narration: str = None) -> float:
+        """Cobra o resto do custo da rota + narracao (ja pagou `paid` na entrada). Retorna o custo extra."""
+        extra = route_cost(route, narration) - paid
+        if extra <= 0:
+            return 0.0
+        capacity = self.capacity(role)
+        now = time.time()
+
+        def debit(bucket):
+            tokens = self._refill(bucket, capacity, now)
+            return [max(-capacity, tokens - extra), now], None
+
+        self.backend.update(self.NS, user_id, debit, ttl=self._ttl(capacity))
+        self._stats["charged"] += extra
+        return extra
+
+    def remaining(self, user_id: str, role: str = None) -> int:
+        capacity = self.capacity(role)
+        tokens = self._refill(self.backend.get(self.NS, user_id), capacity, time.time())
+        return max(0, int(tokens))
+
+    def retry_after(self, user_id: str, role: str = None, cost: float = RATE_COST_SCORING) -> int:
+        """Segundos ate ter `cost` fichas."""
+        capacity = self.capacity(role)
+        tokens = self._refill(self.backend.get(self.NS, user_id), capacity, time.time())
+        missing = cost - tokens
+        return max(0, int(-(-missing * self.window // capacity)))
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "window": self.window,
+            "quotas": self.quotas,
+            "route_costs": ROUTE_COSTS,
+            "narration_costs": NARRATION_COSTS,
+        }
@@ -0,0 +1,277 @@
+"""
+MMarra Data Hub - Transporte HTTP compartilhado com o Sankhya.
+Um unico httpx.AsyncClient por processo (keep-alive + HTTP/2 se disponivel)
+e um token OAuth compartilhado com refresh single-flight.
+
+Uso:
+    from src.core.sankhya_client import sankhya_transport
+
+    token = await sankhya_transport.get_token()
+    r = await sankhya_transport.post("/gateway/v1/mge/service.sbr", json=payload, token=token)
+"""
+
+import os
+import time
+import asyncio
+from typing import Optional
+
+import httpx
+
+from src.core.config import (
+    SANKHYA_BASE_URL, SANKHYA_CLIENT_ID, SANKHYA_CLIENT_SECRET, SANKHYA_X_TOKEN,
+    QUERY_TIMEOUT,
+)
+from src.core.query_scheduler import QueryScheduler, query_priority, query_owner, DEFAULT_PRIORITY
+
+
+# Config do pool (todas sobrescreviveis via .env)
+SANKHYA_POOL_MAX_CONNECTIONS = int(os.getenv("SANKHYA_POOL_MAX_CONNECTIONS", "20"))
+SANKHYA_POOL_MAX_KEEPALIVE = int(os.getenv("SANKHYA_POOL_MAX_KEEPALIVE", "10"))
+SANKHYA_KEEPALIVE_EXPIRY = float(os.getenv("SANKHYA_KEEPALIVE_EXPIRY", "30"))
+SANKHYA_HTTP2 = os.getenv("SANKHYA_HTTP2", "true").lower() in ("true", "1", "yes")
+# Maximo de queries simultaneas no tenant Sankhya (todas as origens somadas)
+SANKHYA_MAX_CONCURRENT_QUERIES = int(os.getenv("SANKHYA_MAX_CONCURRENT_QUERIES", "6"))
+
+# Token expira em ~5 minutos no Sankhya, usar 4 min por seguranca
+TOKEN_TTL_SECONDS = 240
+
+
+def _http2_available() -> bool:
+    """HTTP/2 no httpx depende do pacote opcional 'h2' (pip install httpx[http2])."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class AuthenticationError(Exception):
+    """Erro de autenticacao na API Sankhya."""
+    pass
+
+
+class SankhyaTransport:
+    """Cliente HTTP unico por processo para a API Sankhya.
+
+    - Pool de conexoes com keep-alive (sem handshake TLS a cada query)
+    - HTTP/2 quando o pacote 'h2' esta instalado
+    - Token OAuth compartilhado entre todos os SafeQueryExecutor
+    - Refresh single-flight: N requests concorrentes com token expirado
+      geram 1 unica chamada a /authenticate
+    - Fila de queries por tenant (QueryScheduler): limita quantas queries
+      rodam ao mesmo tempo no Sankhya, independente de qual executor as
+      disparou, atendendo chat > reports > background e round-robin por usuario
+    """
+
+    def __init__(self, max_connections: int = SANKHYA_POOL_MAX_CONNECTIONS,
+                 max_keepalive: int = SANKHYA_POOL_MAX_KEEPALIVE,
+                 keepalive_expiry: float = SANKHYA_KEEPALIVE_EXPIRY,
+                 http2: bool = SANKHYA_HTTP2, timeout: float = QUERY_TIMEOUT,
+                 max_concurrent_queries: int = SANKHYA_MAX_CONCURRENT_QUERIES):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2 and _http2_available()
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop = None
+        self._token: Optional[str] = None
+        self._token_expires = 0.0
+        self._token_lock: Optional[asyncio.Lock] = None
+        self._lock_loop = None
+        self.max_concurrent_queries = max(1, max_concurrent_queries)
+        self._scheduler: Optional[QueryScheduler] = None
+        self._sched_loop = None
+        self._in_flight = 0
+        self._stats = {"requests": 0, "auth_calls": 0, "auth_waits": 0, "clients_created": 0,
+                       "queries": 0, "max_in_flight": 0}
+
+    # ============================================================
+    # CLIENT
+    # ============================================================
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Retorna o client do pool (recria se o event loop mudou, ex: scripts com asyncio.run)."""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=SANKHYA_BASE_URL,
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=self.http2,
+                verify=False,
+            )
+            self._client_loop = loop
+            self._stats["clients_created"] += 1
+            print(f"[SANKHYA] Pool HTTP criado (max={self.limits.max_connections}, "
+                  f"keepalive={self.limits.max_keepalive_connections}, http2={self.http2})")
+        return self._client
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._token_lock is None or self._lock_loop is not loop:
+            self._token_lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._token_lock
+
+    def _get_scheduler(self) -> QueryScheduler:
+        loop = asyncio.get_running_loop()
+        if self._scheduler is None or self._sched_loop is not loop:
+            self._scheduler = QueryScheduler(self.max_concurrent_queries)
+            self._sched_loop = loop
+        return self._scheduler
+
+    def query_slot(self, priority: str = None, owner: str = None) -> "_QuerySlot":
+        """Context manager que ocupa 1 vaga da fila de queries do tenant.
+
+        Classe/usuario: query_priority_scope() da task atual; senao os
+        defaults passados aqui (ex: prioridade do executor); senao "chat".
+
+        Uso:
+            async with transport.query_slot():
+                r = await transport.post(...)
+        """
+        priority = query_priority.get() or priority or DEFAULT_PRIORITY
+        owner = query_owner.get() or owner or ""
+        return _QuerySlot(self, self._get_scheduler(), priority, owner)
+
+    async def aclose(self):
+        """Fecha o pool (shutdown da API)."""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self._client_loop = None
+
+    # ============================================================
+    # TOKEN (single-flight)
+    # ============================================================
+
+    def _token_valid(self) -> bool:
+        return bool(self._token) and time.time() < self._token_expires
+
+    async def get_token(self) -> str:
+        """Retorna token valido. Se expirou, so 1 coroutine autentica; as demais aguardam."""
+        if self._token_valid():
+            return self._token
+
+        lock = self._get_lock()
+        if lock.locked():
+            self._stats["auth_waits"] += 1
+        async with lock:
+            # Outra coroutine pode ter renovado enquanto aguardavamos o lock
+            if self._token_valid():
+                return self._token
+            return await self._authenticate()
+
+    def invalidate_token(self, token: str = None):
+        """Invalida o token atual (401/403).
+
+        Se token for informado, so invalida se ainda for o token corrente -
+        evita que N requests que falharam com o mesmo token derrubem um token
+        novo ja renovado por outra coroutine.
+        """
+        if token is None or token == self._token:
+            self._token = None
+            self._token_expires = 0.0
+
+    async def _authenticate(self) -> str:
+        """Autentica na API Sankhya via OAuth2 (chamado sempre sob o lock)."""
+        if not all([SANKHYA_CLIENT_ID, SANKHYA_CLIENT_SECRET, SANKHYA_X_TOKEN]):
+            raise AuthenticationError(
+                "Credenciais Sankhya nao configuradas no .env "
+                "(SANKHYA_CLIENT_ID, SANKHYA_CLIENT_SECRET, SANKHYA_X_TOKEN)"
+            )
+
+        headers = {
+            "X-Token": SANKHYA_X_TOKEN,
+            "Content-Type": "application/x-www-form-urlencoded",
+        }
+        data = {
+            "client_id": SANKHYA_CLIENT_ID,
+            "client_secret": SANKHYA_CLIENT_SECRET,
+            "grant_type": "client_credentials",
+        }
+
+        self._stats["auth_calls"] += 1
+        try:
+            response = await self._get_client().post("/authenticate", headers=headers, data=data)
+            response.raise_for_status()
+            result = response.json()
+        except httpx.HTTPStatusError as e:
+            raise AuthenticationError(f"Erro HTTP na autenticacao: {e.response.status_code}")
+        except Exception as e:
+            raise AuthenticationError(f"Erro na autenticacao: {str(e)}")
+
+        token = result.get("access_token")
+        if not token:
+            raise AuthenticationError(f"OAuth sem access_token: {str(result)[:200]}")
+
+        self._token = token
+        self._token_expires = time.time() + TOKEN_TTL_SECONDS
+        print(f"[OK] Token Sankhya obtido (expira em {TOKEN_TTL_SECONDS // 60} min)")
+        return self._token
+
+    # ============================================================
+    # REQUESTS
+    # ============================================================
+
+    async def post(self, path: str, token: str = None, headers: dict = None, **kwargs) -> httpx.Response:
+        """POST no gateway Sankhya reutilizando conexoes do pool.
+
+        Args:
+            path: caminho relativo a SANKHYA_BASE_URL (ex: "/gateway/v1/mge/service.sbr")
+            token: Bearer token (se informado, adiciona Authorization)
+            headers: headers extras
+            **kwargs: repassados ao httpx (json, data, params, timeout)
+        """
+        h = dict(headers or {})
+        if token:
+            h["Authorization"] = f"Bearer {token}"
+        self._stats["requests"] += 1
+        return await self._get_client().post(path, headers=h, **kwargs)
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive": self.limits.max_keepalive_connections,
+            "max_concurrent_queries": self.max_concurrent_queries,
+            "in_flight": self._in_flight,
+            "scheduler": self._scheduler.stats() if self._scheduler else None,
+            "token_valid": self._token_valid(),
+            "token_ttl_s": max(0, int(self._token_expires - time.time())) if self._token else 0,
+        }
+
+
+class _QuerySlot:
+    """Vaga na fila de queries (com contagem de in-flight para stats)."""
+
+    def __init__(self, transport: SankhyaTransport, scheduler: QueryScheduler,
+                 priority: str = DEFAULT_PRIORITY, owner: str = ""):
+        self._transport = transport
+        self._scheduler = scheduler
+        self.priority = priority
+        self.owner = owner
+
+    async def __aenter__(self):
+        await self._scheduler.acquire(self.priority, self.owner)
+        t = self._transport
+        t._in_flight += 1
+        t._stats["queries"] += 1
+        t._stats["max_in_flight"] = max(t._stats["max_in_flight"], t._in_flight)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._transport._in_flight -= 1
+        self._scheduler.release(self.priority)
+        return False
+
+
+# ============================================================
+# TRANSPORTE GLOBAL
+# ============================================================
+
+sankhya_transport = SankhyaTransport()
@@ -0,0 +1,426 @@
+"""
+MMarra Data Hub - Backend de estado compartilhado (auth, conversas, rate limit).
+
+Com 1 worker tudo pode ficar em dicts do processo. Com `uvicorn --workers N`
+cada worker e um processo separado: o login cai num worker e o proximo
+request em outro, entao sessoes de auth, contextos de conversa e o rate
+limiter precisam de um estado comum.
+
+Backends (STATE_BACKEND no .env):
+- memory (default): dict do processo, zero overhead (valores guardados como estao)
+- sqlite: arquivo local em WAL (STATE_DB_PATH), compartilhado por todos os
+  workers da maquina, sem servico externo. Valores em JSON (datetime ok).
+
+API (namespace + chave -> dict):
+    backend = get_state_backend()
+    backend.set("auth", token, {...}, ttl=8 * 3600)
+    backend.get("auth", token)
+    backend.update("ratelimit", user, fn, ttl=60)   # read-modify-write atomico
+    backend.version("conversation", user)            # muda a cada escrita
+
+    sessions = BackendDict(backend, "auth", ttl=...)   # interface de dict
+
+Jobs singleton (refresh de entidades, treino, sync do Elastic) rodam so no
+worker que detem o lease (namespace "lease"):
+    asyncio.create_task(run_as_leader(backend, "jobs", leader_jobs, follower_jobs))
+
+Job de startup que nao deve repetir quando o lease troca de dono (namespace "once"):
+    await run_once(backend, "elastic_startup_sync", job)
+"""
+
+import os
+import json
+import time
+import socket
+import asyncio
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+STATE_DB_PATH = Path(os.getenv("STATE_DB_PATH", str(PROJECT_ROOT / "data" / "state.db")))
+
+LEADER_LEASE_TTL = int(os.getenv("LEADER_LEASE_TTL", "60"))  # segundos sem renovar ate outro worker assumir
+# Espera maxima pelo lock do arquivo: as chamadas rodam no event loop, entao
+# um worker travado no busy-wait segura todos os requests dele
+STATE_DB_TIMEOUT = float(os.getenv("STATE_DB_TIMEOUT", "1"))
+
+_PURGE_EVERY = 500  # escritas entre limpezas de chaves expiradas
+
+
+def _encode(value) -> str:
+    def default(o):
+        if isinstance(o, datetime):
+            return {"__dt__": o.isoformat()}
+        if isinstance(o, (set, frozenset, tuple)):
+            return list(o)
+        return str(o)
+    return json.dumps(value, default=default, ensure_ascii=False, separators=(",", ":"))
+
+
+def _decode(raw: str):
+    def hook(d):
+        if len(d) == 1 and "__dt__" in d:
+            return datetime.fromisoformat(d["__dt__"])
+        return d
+    return json.loads(raw, object_hook=hook)
+
+
+# ============================================================
+# MEMORY (default)
+# ============================================================
+
+class MemoryStateBackend:
+    """Estado no proprio processo. shared=False: so serve 1 worker."""
+
+    shared = False
+    name = "memory"
+
+    def __init__(self):
+        self._data = {}  # {ns: {key: [value, version, expires]}}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _entry(self, ns: str, key: str):
+        entry = self._data.get(ns, {}).get(key)
+        if entry is not None and entry[2] and entry[2] <= time.time():
+            del self._data[ns][key]
+            return None
+        return entry
+
+    def get(self, ns: str, key: str):
+        with self._lock:
+            entry = self._entry(ns, key)
+            return entry[0] if entry else None
+
+    def version(self, ns: str, key: str) -> Optional[int]:
+        with self._lock:
+            entry = self._entry(ns, key)
+            return entry[1] if entry else None
+
+    def set(self, ns: str, key: str, value, ttl: float = None) -> int:
+        with self._lock:
+            return self._set(ns, key, value, ttl)
+
+    def _set(self, ns, key, value, ttl) -> int:
+        old = self._entry(ns, key)
+        version = (old[1] + 1) if old else 1
+        self._data.setdefault(ns, {})[key] = [value, version, time.time() + ttl if ttl else 0]
+        self._writes += 1
+        if self._writes % _PURGE_EVERY == 0:
+            self._purge()
+        return version
+
+    def delete(self, ns: str, key: str):
+        with self._lock:
+            self._data.get(ns, {}).pop(key, None)
+
+    def update(self, ns: str, key: str, fn: Callable, ttl: float = None):
+        """fn(valor atual ou None) -> (novo valor, retorno). Atomico."""
+        with self._lock:
+            entry = self._entry(ns, key)
+            new_value, result = fn(entry[0] if entry else None)
+            self._set(ns, key, new_value, ttl)
+            return result
+
+    def items(self, ns: str) -> list:
+        with self._lock:
+            return [(k, e[0]) for k in list(self._data.get(ns, {}))
+                    if (e := self._entry(ns, k)) is not None]
+
+    def count(self, ns: str) -> int:
+        return len(self.items(ns))
+
+    def _purge(self):
+        now = time.time()
+        for entries in self._data.values():
+            for key in [k for k, e in entries.items() if e[2] and e[2] <= now]:
+                del entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": self.name, "namespaces": {ns: len(e) for ns, e in self._data.items()}}
+
+    def close(self):
+        pass
+
+
+# ============================================================
+# SQLITE (multi-worker na mesma maquina)
+# ============================================================
+
+class SQLiteStateBackend:
+    """Estado num arquivo SQLite (WAL) compartilhado entre processos."""
+
+    shared = True
+    name = "sqlite"
+
+    def __init__(self, path: Path = None):
+        self.path = Path(path or STATE_DB_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # isolation_level=None: transacoes explicitas (BEGIN IMMEDIATE no update)
+        self._conn = sqlite3.connect(str(self.path), timeout=STATE_DB_TIMEOUT, isolation_level=None,
+                                     check_same_thread=False)
+        self._lock = threading.Lock()
+        self._writes = 0
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                " ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " version INTEGER NOT NULL DEFAULT 1, expires REAL NOT NULL DEFAULT 0,"
+                " PRIMARY KEY (ns, key))"
+            )
+
+    def _row(self, ns: str, key: str, cols: str):
+        return self._conn.execute(
+            f"SELECT {cols} FROM kv WHERE ns=? AND key=? AND (expires=0 OR expires>?)",
+            (ns, key, time.time()),
+        ).fetchone()
+
+    def get(self, ns: str, key: str):
+        with self._lock:
+            row = self._row(ns, key, "value")
+        return _decode(row[0]) if row else None
+
+    def version(self, ns: str, key: str) -> Optional[int]:
+        with self._lock:
+            row = self._row(ns, key, "version")
+        return row[0] if row else None
+
+    def _write(self, ns, key, raw, ttl) -> int:
+        expires = time.time() + ttl if ttl else 0
+        row = self._conn.execute(
+            "INSERT INTO kv (ns, key, value, version, expires) VALUES (?, ?, ?, 1, ?) "
+            "ON CONFLICT(ns, key) DO UPDATE SET value=excluded.value, "
+            "version=CASE WHEN kv.expires=0 OR kv.expires>? THEN kv.version+1 ELSE 1 END, "
+            "expires=excluded.expires RETURNING version",
+            (ns, key, raw, expires, time.time()),
+        ).fetchone()
+        self._writes += 1
+        if self._writes % _PURGE_EVERY == 0:
+            self._conn.execute("DELETE FROM kv WHERE expires>0 AND expires<=?", (time.time(),))
+        return row[0]
+
+    def set(self, ns: str, key: str, value, ttl: float = None) -> int:
+        raw = _encode(value)
+        with self._lock:
+            return self._write(ns, key, raw, ttl)
+
+    def delete(self, ns: str, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE ns=? AND key=?", (ns, key))
+
+    def update(self, ns: str, key: str, fn: Callable, ttl: float = None):
+        """fn(valor atual ou None) -> (novo valor, retorno). BEGIN IMMEDIATE trava
+        a escrita entre processos ate o COMMIT."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._row(ns, key, "value")
+                new_value, result = fn(_decode(row[0]) if row else None)
+                self._write(ns, key, _encode(new_value), ttl)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def items(self, ns: str) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM kv WHERE ns=? AND (expires=0 OR expires>?)",
+                (ns, time.time()),
+            ).fetchall()
+        return [(k, _decode(v)) for k, v in rows]
+
+    def count(self, ns: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM kv WHERE ns=? AND (expires=0 OR expires>?)",
+                (ns, time.time()),
+            ).fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ns, COUNT(*) FROM kv WHERE expires=0 OR expires>? GROUP BY ns", (time.time(),)
+            ).fetchall()
+        return {"backend": self.name, "path": str(self.path), "namespaces": dict(rows)}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# ============================================================
+# DICT SOBRE O BACKEND
+# ============================================================
+
+class BackendDict:
+    """Interface de dict (get/[]/pop/values/len) sobre um namespace do backend.
+
+    No backend memory os valores sao os proprios objetos (alterar o dict
+    retornado ja altera o estado); no sqlite e preciso regravar (d[k] = v).
+    """
+
+    def __init__(self, backend, ns: str, ttl: float = None):
+        self.backend = backend
+        self.ns = ns
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        value = self.backend.get(self.ns, key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.backend.get(self.ns, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.backend.set(self.ns, key, value, ttl=self.ttl)
+
+    def __delitem__(self, key):
+        if self.backend.get(self.ns, key) is None:
+            raise KeyError(key)
+        self.backend.delete(self.ns, key)
+
+    def __contains__(self, key) -> bool:
+        return self.backend.get(self.ns, key) is not None
+
+    def pop(self, key, default=None):
+        value = self.backend.get(self.ns, key)
+        if value is None:
+            return default
+        self.backend.delete(self.ns, key)
+        return value
+
+    def values(self) -> list:
+        return [v for _, v in self.backend.items(self.ns)]
+
+    def __iter__(self):
+        return iter([k for k, _ in self.backend.items(self.ns)])
+
+    def __len__(self) -> int:
+        return self.backend.count(self.ns)
+
+
+# ============================================================
+# LEASE (jobs singleton entre workers)
+# ============================================================
+
+def worker_id() -> str:
+    """Identifica o processo dono do lease (host:pid)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def acquire_lease(backend, name: str, owner: str, ttl: float = LEADER_LEASE_TTL) -> bool:
+    """Pega ou renova o lease. True se owner e o dono ate agora + ttl.
+
+    A validade fica no proprio valor: update() sempre regrava a linha, entao o
+    TTL da linha nao serve para saber se o dono anterior sumiu.
+    """
+    def take(current):
+        now = time.time()
+        if current is None or current.get("owner") == owner or current.get("expires", 0) <= now:
+            return {"owner": owner, "expires": now + ttl}, True
+        return current, False
+    return backend.update("lease", name, take, ttl=ttl)
+
+
+def release_lease(backend, name: str, owner: str):
+    """Solta o lease (se ainda for de owner) para outro worker assumir ja."""
+    def drop(current):
+        if current and current.get("owner") == owner:
+            return {"owner": None, "expires": 0}, True
+        return current, False
+    return backend.update("lease", name, drop, ttl=LEADER_LEASE_TTL)
+
+
+async def run_as_leader(backend, name: str, leader_jobs: Callable, follower_jobs: Callable = None,
+                        ttl: float = LEADER_LEASE_TTL, owner: str = None):
+    """Disputa o lease a cada ttl/3 e roda os jobs do papel atual.
+
+    leader_jobs()/follower_jobs() retornam listas de coroutines. Ao ganhar o
+    lease sobe os jobs de lider; ao perder (ex: renovacao falhou) cancela e
+    volta a seguidor. No backend memory (1 processo) e sempre lider.
+    """
+    owner = owner or worker_id()
+    role, tasks = None, []
+    try:
+        while True:
+            try:
+                leader = await asyncio.to_thread(acquire_lease, backend, name, owner, ttl)
+            except Exception as e:
+                print(f"[LEADER] Erro ao renovar lease {name}: {e}")
+                leader = False
+            new_role = "lider" if leader else "seguidor"
+            if new_role != role:
+                for t in tasks:
+                    t.cancel()
+                jobs = leader_jobs() if leader else (follower_jobs() if follower_jobs else [])
+                tasks = [asyncio.create_task(job) for job in jobs]
+                role = new_role
+                print(f"[LEADER] {name}: {owner} e {role}")
+            await asyncio.sleep(ttl / 3)
+    finally:
+        for t in tasks:
+            t.cancel()
+        if role == "lider":
+            try:
+                release_lease(backend, name, owner)
+            except Exception:
+                pass
+
+
+def boot_id() -> str:
+    """Identifica a subida do servidor: workers do mesmo uvicorn/gunicorn tem o mesmo pai."""
+    return f"{socket.gethostname()}:{os.getppid()}"
+
+
+async def run_once(backend, name: str, job: Callable) -> bool:
+    """Roda job() (coroutine) 1x por subida do servidor, mesmo que o lider mude.
+
+    A conclusao fica gravada no backend; se job() levantar ou retornar False
+    nada e gravado e o proximo lider tenta de novo. True se rodou agora.
+    """
+    boot = boot_id()
+    try:
+        done = await asyncio.to_thread(backend.get, "once", name)
+    except Exception as e:
+        print(f"[LEADER] Erro ao ler estado de {name}: {e}")
+        done = None
+    if done and done.get("boot") == boot:
+        print(f"[LEADER] {name}: ja concluido nesta subida, pulando")
+        return False
+    if await job() is False:
+        return False
+    try:
+        await asyncio.to_thread(backend.set, "once", name, {"boot": boot, "done_at": time.time()})
+    except Exception as e:
+        print(f"[LEADER] Erro ao gravar conclusao de {name}: {e}")
+    return True
+
+
+_backend = None
+
+
+def get_state_backend():
+    """Backend do processo (criado 1x a partir de STATE_BACKEND)."""
+    global _backend
+    if _backend is None:
+        if STATE_BACKEND == "sqlite":
+            _backend = SQLiteStateBackend()
+            print(f"[STATE] Backend sqlite: {_backend.path}")
+        else:
+            if STATE_BACKEND != "memory":
+                print(f"[STATE] STATE_BACKEND={STATE_BACKEND} desconhecido, usando memory")
+            _backend = MemoryStateBackend()
+    return _backend
@@ -0,0 +1,456 @@
+"""
+MMarra Data Hub - Indice local de produtos (fallback do Elasticsearch offline).
+
+Construido a partir dos mesmos docs que o ElasticSync grava no idx_produtos
+(lidos do _source via search_after) e salvo como arrays numpy em disco,
+abertos com mmap: 400k produtos carregam em milissegundos e so as paginas
+usadas entram na RAM.
+
+Estruturas:
+- Codigos: cada codigo normalizado (referencia, num_fabricante, num_fabricante2,
+  num_original, ref_fornecedor - sem espaco/traco/barra/ponto) num array de
+  bytes ordenado -> searchsorted para exato e prefixo ("W950" acha "W 950/26").
+  Substring (o wildcard *CODIGO* do Elastic) pelos trigramas dos codigos, em CSR
+  (code_tri_offsets -> code_tri_rows), confirmada no proprio codigo.
+  CODPROD numerico vai direto no array de codprods
+- Texto: trigramas de descricao (peso 3) + aplicacao (peso 2) + complemento
+  (peso 1) normalizados (sem acento, A-Z0-9). Trigrama = id denso (37^3),
+  postings em CSR (tri_offsets -> tri_docs/tri_tf), ranking BM25
+- Docs: JSON dos campos de retorno num blob unico + offsets
+
+Ranking (mesma ordem das boosts do search_products do Elastic):
+    codigo exato 100 | prefixo 50 | substring 30 | codigo no texto 40 |
+    BM25 dos trigramas do texto
+Docs de texto precisam casar LOCAL_INDEX_MIN_MATCH dos trigramas da busca.
+Sem equivalente local: o fuzzy (erro de digitacao) em codigo.
+
+Geracoes: data/product_index/gen-<timestamp>/ + arquivo CURRENT (troca
+atomica via os.replace), so a geracao atual e mantida.
+
+Uso:
+    builder = LocalIndexBuilder()
+    builder.add(docs)                # docs = product_doc(...) / _source do ES
+    builder.save()                   # nova geracao + CURRENT
+
+    index = get_local_index()        # None se nunca foi construido
+    index.search(text="filtro oleo", codigo="W950", marca="MANN", limit=10)
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import unicodedata
+from array import array
+from collections import Counter
+from functools import lru_cache
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+LOCAL_INDEX_DIR = PROJECT_ROOT / "data" / "product_index"
+LOCAL_INDEX_MIN_MATCH = float(os.getenv("LOCAL_INDEX_MIN_MATCH", "0.5"))  # fracao dos trigramas da busca
+
+CODE_FIELDS = ("referencia", "num_fabricante", "num_fabricante2", "num_original", "ref_fornecedor")
+RETURN_FIELDS = ("codprod", "descricao", "marca", "aplicacao", "referencia",
+                 "num_fabricante", "num_original", "ref_fornecedor",
+                 "num_fabricante2", "complemento", "unidade")
+TEXT_WEIGHTS = (("descricao", 3), ("aplicacao", 2), ("complemento", 1))  # mesmas boosts do multi_match
+CODE_MAX_LEN = 40  # bytes por codigo no array ordenado (largura fixa)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+CODE_SCORE = 100.0
+CODE_PREFIX_SCORE = 50.0
+CODE_PARTIAL_SCORE = 30.0
+TEXT_CODE_SCORE = 40.0
+
+_ALPHABET = " ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+_CHAR_ID = {c: i for i, c in enumerate(_ALPHABET)}
+N_TRIGRAMS = len(_ALPHABET) ** 3
+_NON_ALNUM = re.compile(r"[^A-Z0-9]+")
+_CODE_SEP = re.compile(r"[\s\-/\.]")
+
+
+# ============================================================
+# NORMALIZACAO
+# ============================================================
+
+def normalize_text(text: str) -> str:
+    """Sem acento, maiusculo, so A-Z0-9 separados por 1 espaco."""
+    text = str(text or "")
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return _NON_ALNUM.sub(" ", text.upper()).strip()
+
+
+def normalize_code(code: str) -> str:
+    """Mesma limpeza do search_products (tira espaco, traco, barra, ponto)."""
+    return _CODE_SEP.sub("", str(code or "")).upper()
+
+
+@lru_cache(maxsize=200_000)
+def code_trigrams(code: str) -> tuple:
+    """Trigramas (sem borda) de um codigo normalizado; janelas com caractere fora de A-Z0-9 ficam de fora."""
+    ids = [_CHAR_ID.get(c, -1) for c in code]
+    return tuple(sorted({(ids[i] * 37 + ids[i + 1]) * 37 + ids[i + 2] for i in range(len(ids) - 2)
+                         if min(ids[i:i + 3]) > 0}))
+
+
+@lru_cache(maxsize=200_000)
+def _word_trigrams(word: str) -> tuple:
+    padded = f" {word} "
+    ids = [_CHAR_ID[c] for c in padded]
+    return tuple((ids[i] * 37 + ids[i + 1]) * 37 + ids[i + 2] for i in range(len(ids) - 2))
+
+
+def trigrams(text: str) -> Counter:
+    """Trigramas por palavra com borda (' W95', 'W95', '950', '50 ')."""
+    grams = Counter()
+    for word in normalize_text(text).split():
+        grams.update(_word_trigrams(word))  # vocabulario repete muito: cache por palavra
+    return grams
+
+
+_BYTE_ID = np.full(256, -1, dtype=np.int64)
+for _c, _i in _CHAR_ID.items():
+    if _c != " ":
+        _BYTE_ID[ord(_c)] = _i
+
+
+def _code_trigram_postings(codes: np.ndarray) -> tuple:
+    """(trigrama, linha) unicos de um array de codigos em bytes, ordenados por trigrama
+    e linha. Mesmo resultado de code_trigrams() linha a linha, sem loop em Python."""
+    width = codes.dtype.itemsize
+    if len(codes) == 0 or width < 3:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    ids = _BYTE_ID[np.frombuffer(codes.tobytes(), dtype=np.uint8).reshape(len(codes), width)]
+    a, b, c = ids[:, :-2], ids[:, 1:-1], ids[:, 2:]
+    valid = (a > 0) & (b > 0) & (c > 0)
+    tri = ((a * 37 + b) * 37 + c)[valid]
+    row = np.broadcast_to(np.arange(len(codes))[:, None], valid.shape)[valid]
+    keys = np.sort(tri * len(codes) + row)
+    keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]  # mais rapido que np.unique aqui
+    return keys // len(codes), keys % len(codes)
+
+
+def _np(buf: array, dtype) -> np.ndarray:
+    return np.frombuffer(buf, dtype=dtype) if len(buf) else np.empty(0, dtype=dtype)
+
+
+# ============================================================
+# BUILDER
+# ============================================================
+
+class LocalIndexBuilder:
+    """Acumula docs (em qualquer ordem) e grava uma geracao do indice."""
+
+    def __init__(self):
+        self._codprod = array("q")
+        self._docs: list = []            # JSON (bytes) dos campos de retorno
+        self._marca: list = []
+        # 1 entrada por ocorrencia de trigrama (peso do campo); somadas por (trigrama, doc) no save
+        self._post_tri = array("I")
+        self._post_doc = array("I")
+        self._post_w = array("B")
+        self._codes: list = []           # codigo normalizado (bytes)
+        self._code_doc = array("I")
+
+    def __len__(self):
+        return len(self._codprod)
+
+    def add(self, docs: list):
+        for doc in docs:
+            codprod = int(doc.get("codprod") or doc.get("_id") or 0)
+            if not codprod:
+                continue
+            idx = len(self._codprod)
+            self._codprod.append(codprod)
+            src = {f: doc.get(f, "") for f in RETURN_FIELDS}
+            src["codprod"] = codprod
+            self._docs.append(json.dumps(src, ensure_ascii=False).encode("utf-8"))
+            self._marca.append(normalize_text(doc.get("marca", "")))
+
+            n = len(self._post_tri)
+            for field, weight in TEXT_WEIGHTS:
+                for word in normalize_text(doc.get(field, "")).split():
+                    grams = _word_trigrams(word)
+                    self._post_tri.extend(grams)
+                    self._post_w.extend((weight,) * len(grams))
+            self._post_doc.extend((idx,) * (len(self._post_tri) - n))
+
+            for code in {normalize_code(doc.get(f, "")) for f in CODE_FIELDS}:
+                if code:
+                    self._codes.append(code.encode("utf-8")[:CODE_MAX_LEN])
+                    self._code_doc.append(idx)
+
+    def save(self, base_dir: Path = None) -> Path:
+        """Grava gen-<timestamp>/, aponta CURRENT para ela e apaga as anteriores."""
+        base_dir = Path(base_dir or LOCAL_INDEX_DIR)
+        t0 = time.perf_counter()
+        gen = base_dir / f"gen-{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+        gen.mkdir(parents=True, exist_ok=True)
+
+        # Docs ordenados por codprod (duplicado: fica a ultima versao recebida)
+        codprod = _np(self._codprod, np.int64)
+        rev = np.arange(len(codprod) - 1, -1, -1)
+        _, last = np.unique(codprod[rev], return_index=True)
+        order = rev[last]  # ja sai ordenado por codprod (np.unique)
+        new_id = np.full(len(codprod), -1, dtype=np.int64)
+        new_id[order] = np.arange(len(order))
+
+        np.save(gen / "codprod.npy", codprod[order])
+
+        blobs = [self._docs[i] for i in order]
+        offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+        if blobs:
+            offsets[1:] = np.cumsum([len(b) for b in blobs])
+        np.save(gen / "doc_offsets.npy", offsets)
+        (gen / "docs.bin").write_bytes(b"".join(blobs))
+
+        marcas = sorted({m for m in self._marca})
+        marca_id = {m: i for i, m in enumerate(marcas)}
+        np.save(gen / "marca_id.npy", np.array([marca_id[self._marca[i]] for i in order], dtype=np.int32))
+
+        # Postings (CSR por trigrama), so dos docs mantidos: ocorrencias -> tf ponderado por (trigrama, doc)
+        p_doc = new_id[_np(self._post_doc, np.uint32)]
+        valid = p_doc >= 0
+        p_doc = p_doc[valid]
+        p_tri = _np(self._post_tri, np.uint32)[valid]
+        p_w = _np(self._post_w, np.uint8)[valid].astype(np.uint32)
+        by_tri = np.lexsort((p_doc, p_tri))
+        p_doc, p_tri, p_w = p_doc[by_tri], p_tri[by_tri], p_w[by_tri]
+        first = np.ones(len(p_tri), dtype=bool)
+        first[1:] = (p_tri[1:] != p_tri[:-1]) | (p_doc[1:] != p_doc[:-1])
+        starts = np.flatnonzero(first)
+        tf = np.add.reduceat(p_w, starts) if len(starts) else p_w
+        np.save(gen / "tri_docs.npy", p_doc[starts].astype(np.int32))
+        np.save(gen / "tri_tf.npy", np.minimum(tf, 65535).astype(np.uint16))
+        tri_offsets = np.zeros(N_TRIGRAMS + 1, dtype=np.int64)
+        tri_offsets[1:] = np.cumsum(np.bincount(p_tri[starts], minlength=N_TRIGRAMS))
+        np.save(gen / "tri_offsets.npy", tri_offsets)
+        doc_len = np.bincount(p_doc, weights=p_w, minlength=len(order)).astype(np.uint32)
+        np.save(gen / "doc_len.npy", doc_len)
+
+        # Codigos: bytes ordenados -> doc, + trigramas por linha (substring)
+        c_doc = new_id[_np(self._code_doc, np.uint32)]
+        c_str = np.array(self._codes, dtype="S") if self._codes else np.empty(0, dtype="S1")
+        valid = c_doc >= 0
+        c_doc, c_str = c_doc[valid], c_str[valid]
+        by_code = np.lexsort((c_doc, c_str))
+        c_doc, c_str = c_doc[by_code], c_str[by_code]
+        np.save(gen / "code_str.npy", c_str)
+        np.save(gen / "code_doc.npy", c_doc.astype(np.int32))
+        ct_tri, ct_row = _code_trigram_postings(c_str)
+        np.save(gen / "code_tri_rows.npy", ct_row.astype(np.int32))
+        code_tri_offsets = np.zeros(N_TRIGRAMS + 1, dtype=np.int64)
+        code_tri_offsets[1:] = np.cumsum(np.bincount(ct_tri, minlength=N_TRIGRAMS))
+        np.save(gen / "code_tri_offsets.npy", code_tri_offsets)
+
+        meta = {"docs": int(len(order)), "avgdl": float(doc_len.mean()) if len(doc_len) else 0.0,
+                "marcas": marcas, "built_at": datetime.now().isoformat(timespec="seconds")}
+        (gen / "meta.json").write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+
+        tmp = base_dir / f"CURRENT.tmp-{os.getpid()}"
+        tmp.write_text(gen.name, encoding="utf-8")
+        os.replace(tmp, base_dir / "CURRENT")
+        for old in base_dir.glob("gen-*"):
+            if old != gen:
+                shutil.rmtree(old, ignore_errors=True)  # aberta via mmap em outro worker: some no proximo open
+
+        print(f"[LOCALIDX] {meta['docs']} produtos, {len(starts)} postings, {len(c_str)} codigos "
+              f"gravados em {time.perf_counter() - t0:.1f}s ({gen.name})")
+        return gen
+
+
+# ============================================================
+# INDICE (leitura via mmap)
+# ============================================================
+
+class LocalProductIndex:
+    """Busca de produtos sobre uma geracao gravada pelo LocalIndexBuilder."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        t0 = time.perf_counter()
+        load = lambda name: np.load(self.path / f"{name}.npy", mmap_mode="r")
+        self.codprod = load("codprod")
+        self.doc_len = load("doc_len")
+        self.doc_offsets = load("doc_offsets")
+        self.marca_id = load("marca_id")
+        self.tri_offsets = load("tri_offsets")
+        self.tri_docs = load("tri_docs")
+        self.tri_tf = load("tri_tf")
+        self.code_str = load("code_str")
+        self.code_doc = load("code_doc")
+        self.code_tri_offsets = load("code_tri_offsets")
+        self.code_tri_rows = load("code_tri_rows")
+        meta = json.loads((self.path / "meta.json").read_text(encoding="utf-8"))
+        self.n_docs = meta["docs"]
+        self.avgdl = meta["avgdl"] or 1.0
+        self.marcas = meta["marcas"]
+        self.built_at = meta["built_at"]
+        size = (self.path / "docs.bin").stat().st_size
+        self._docs = np.memmap(self.path / "docs.bin", dtype=np.uint8, mode="r") if size else None
+        self._norm = None  # BM25: k1 * (1 - b + b * dl/avgdl), calculado na 1a busca
+        self.load_ms = round((time.perf_counter() - t0) * 1000, 1)
+
+    # ============================================================
+    # BUSCA
+    # ============================================================
+
+    def _code_rows(self, q: bytes, prefix: bool = False) -> tuple:
+        """Faixa [lo, hi) do array ordenado com codigo == q (ou comecando com q)."""
+        if not q or len(q) > self.code_str.dtype.itemsize:
+            return 0, 0
+        lo = int(np.searchsorted(self.code_str, q, side="left"))
+        hi = int(np.searchsorted(self.code_str, q + b"\xff" if prefix else q, side="right"))
+        return lo, hi
+
+    def _code_docs(self, code: str) -> np.ndarray:
+        """Docs com o codigo exato (ou CODPROD)."""
+        lo, hi = self._code_rows(code.encode("utf-8"))
+        docs = np.asarray(self.code_doc[lo:hi], dtype=np.int64)
+        if code.isdigit():
+            pos = np.searchsorted(self.codprod, int(code))
+            if pos < self.n_docs and self.codprod[pos] == int(code):
+                docs = np.append(docs, pos)
+        return np.unique(docs)
+
+    def _code_partial_docs(self, code: str) -> tuple:
+        """(docs com prefixo, docs com substring) do codigo - o wildcard *CODIGO* do Elastic."""
+        q = code.encode("utf-8")
+        lo, hi = self._code_rows(q, prefix=True)
+        prefix = np.asarray(self.code_doc[lo:hi], dtype=np.int64)
+        grams = code_trigrams(code)
+        if not grams:
+            return prefix, np.empty(0, dtype=np.int64)
+        # Intersecao das postings, da mais rara para a mais comum
+        spans = sorted((int(self.code_tri_offsets[t + 1] - self.code_tri_offsets[t]), t) for t in grams)
+        rows = None
+        for _, tri in spans:
+            lo, hi = int(self.code_tri_offsets[tri]), int(self.code_tri_offsets[tri + 1])
+            found = np.asarray(self.code_tri_rows[lo:hi], dtype=np.int64)
+            rows = found if rows is None else np.intersect1d(rows, found, assume_unique=True)
+            if not len(rows):
+                return prefix, rows
+        rows = [r for r in rows if q in bytes(self.code_str[r])]  # trigramas em comum != substring
+        return prefix, np.asarray(self.code_doc[rows], dtype=np.int64) if rows else np.empty(0, dtype=np.int64)
+
+    def _bm25(self, text: str, scores: np.ndarray) -> tuple:
+        """Soma BM25 dos trigramas em `scores`. Retorna (trigramas casados por doc, trigramas da busca)."""
+        if self._norm is None:
+            self._norm = BM25_K1 * (1 - BM25_B + BM25_B * np.asarray(self.doc_len, dtype=np.float32) / self.avgdl)
+        norm = self._norm
+        matched = np.zeros(self.n_docs, dtype=np.int32)
+        query = trigrams(text)
+        for tri in query:
+            lo, hi = int(self.tri_offsets[tri]), int(self.tri_offsets[tri + 1])
+            if lo == hi:
+                continue
+            docs = np.asarray(self.tri_docs[lo:hi], dtype=np.int64)
+            tf = np.asarray(self.tri_tf[lo:hi], dtype=np.float32)
+            df = hi - lo
+            idf = np.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + norm[docs])
+            matched[docs] += 1
+        return matched, len(query)
+
+    def _marca_mask(self, marca: str) -> np.ndarray:
+        q = normalize_text(marca)
+        ids = [i for i, m in enumerate(self.marcas) if m and (q in m or m in q)]
+        return np.isin(self.marca_id, ids)
+
+    def doc(self, i: int) -> dict:
+        lo, hi = int(self.doc_offsets[i]), int(self.doc_offsets[i + 1])
+        return json.loads(bytes(self._docs[lo:hi]).decode("utf-8"))
+
+    def search(self, text: str = None, codigo: str = None, marca: str = None,
+               aplicacao: str = None, limit: int = 10) -> list:
+        """Mesma assinatura e formato de hit do ElasticSearchEngine.search_products."""
+        if not self.n_docs:
+            return []
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        candidates = np.zeros(self.n_docs, dtype=bool)
+
+        if codigo:
+            code = normalize_code(codigo)
+            code_scores = np.zeros(self.n_docs, dtype=np.float32)
+            prefix, partial = self._code_partial_docs(code)
+            # Melhor tipo de match por doc (um doc tem ate 5 codigos)
+            for docs, score in ((partial, CODE_PARTIAL_SCORE), (prefix, CODE_PREFIX_SCORE),
+                                (self._code_docs(code), CODE_SCORE)):
+                code_scores[docs] = np.maximum(code_scores[docs], score)
+            scores += code_scores
+            candidates |= code_scores > 0
+
+        words = " ".join(t for t in (text, aplicacao) if t)
+        if words:
+            matched, n_query = self._bm25(words, scores)
+            if n_query:
+                candidates |= matched >= max(1, int(np.ceil(n_query * LOCAL_INDEX_MIN_MATCH)))
+        if text:
+            clean = normalize_code(text)
+            if len(clean) >= 3:  # "W950" pode ser texto E codigo
+                docs = self._code_docs(clean)
+                scores[docs] += TEXT_CODE_SCORE
+                candidates[docs] = True
+
+        if not (codigo or words):
+            candidates[:] = True  # so filtro (match_all do Elastic)
+        if marca:
+            candidates &= self._marca_mask(marca)
+
+        hits = np.flatnonzero(candidates)
+        if len(hits) > limit:
+            top = np.argpartition(-scores[hits], limit - 1)[:limit]
+            hits = hits[top]
+        hits = hits[np.lexsort((self.codprod[hits], -scores[hits]))]
+
+        results = []
+        for i in hits:
+            src = self.doc(int(i))
+            src["_score"] = round(float(scores[i]), 2)
+            src["_highlights"] = {}
+            results.append(src)
+        return results
+
+    def stats(self) -> dict:
+        return {"path": self.path.name, "docs": self.n_docs, "built_at": self.built_at,
+                "load_ms": self.load_ms, "postings": int(len(self.tri_docs)),
+                "codes": int(len(self.code_str))}
+
+
+# ============================================================
+# INSTANCIA DO PROCESSO
+# ============================================================
+
+_index: Optional[LocalProductIndex] = None
+
+
+def get_local_index(base_dir: Path = None) -> Optional[LocalProductIndex]:
+    """Geracao atual (reabre se o CURRENT mudou). None se nunca foi construido."""
+    global _index
+    base_dir = Path(base_dir or LOCAL_INDEX_DIR)
+    try:
+        name = (base_dir / "CURRENT").read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    path = base_dir / name
+    if _index is None or _index.path != path:
+        try:
+            new = LocalProductIndex(path)
+        except Exception as e:
+            print(f"[LOCALIDX] Erro ao abrir {path}: {e}")
+            return _index
+        # Sem close() da geracao anterior: buscas em andamento (to_thread) ainda
+        # leem dela. Os mmaps sao liberados pelo GC quando a ultima referencia sai
+        # (no Linux os arquivos ja apagados continuam legiveis ate la)
+        _index = new
+        print(f"[LOCALIDX] {new.n_docs} produtos carregados em {new.load_ms:.0f}ms ({name})")
+    return _index
@@ -2,18 +2,142 @@
 MMarra Data Hub - Elasticsearch Search Engine
 Busca fuzzy em produtos, clientes e fornecedores.
 Toda comunicacao via HTTP REST com httpx (zero dependencia extra).
+
+Performance:
+- 1 httpx.AsyncClient compartilhado por processo (keep-alive), fechado no shutdown
+- msearch(): varias buscas (codigo/texto, produtos/parceiros) numa unica
+  chamada _msearch; busca isolada continua indo no _search
+- Cache LRU+TTL curto (ES_CODE_CACHE_TTL) das buscas por codigo: o mesmo
+  W950 / P618689 e consultado o dia inteiro
+
+Elastic offline: busca de produto cai no indice local (src/elastic/local_index.py,
+mesmos docs, ranking parecido) em vez do LIKE no Sankhya. Depois de uma falha
+de conexao o Elastic so e tentado de novo apos ES_RETRY_SECONDS.
 """
 
 import os
 import re
+import json
+import time
+import asyncio
+import inspect
+from collections import OrderedDict
+from typing import Optional
 
 import httpx
 
 ELASTIC_URL = os.getenv("ELASTIC_URL", "http://localhost:9200")
+ES_SEARCH_TIMEOUT = int(os.getenv("ES_SEARCH_TIMEOUT", "10"))
+ES_MAX_CONNECTIONS = int(os.getenv("ES_MAX_CONNECTIONS", "20"))
+ES_CODE_CACHE_TTL = int(os.getenv("ES_CODE_CACHE_TTL", "300"))  # segundos
+ES_CODE_CACHE_MAX_ENTRIES = int(os.getenv("ES_CODE_CACHE_MAX_ENTRIES", "1000"))
+ES_RETRY_SECONDS = int(os.getenv("ES_RETRY_SECONDS", "30"))
 
 from src.elastic.mappings import PRODUCTS_INDEX, PARTNERS_INDEX
 
 
+# ============================================================
+# CLIENT COMPARTILHADO
+# ============================================================
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop = None
+_offline_until = 0.0  # time.time() ate quando o Elastic e considerado fora
+
+
+def _get_client() -> httpx.AsyncClient:
+    """Client do processo (recria se o event loop mudou)."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            timeout=ES_SEARCH_TIMEOUT,
+            limits=httpx.Limits(max_connections=ES_MAX_CONNECTIONS,
+                                max_keepalive_connections=ES_MAX_CONNECTIONS),
+        )
+        _client_loop = loop
+    return _client
+
+
+async def aclose():
+    global _client, _client_loop
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+
+# ============================================================
+# CACHE DAS BUSCAS POR CODIGO
+# ============================================================
+
+class CodeLookupCache:
+    """LRU+TTL de resultados de busca por codigo (chave = parametros da busca)."""
+
+    def __init__(self, ttl: int = ES_CODE_CACHE_TTL, max_entries: int = ES_CODE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._store: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires, hits); mais recente no fim
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    @staticmethod
+    def make_key(kind: str, params: dict) -> Optional[str]:
+        """So busca de produto com codigo e cacheavel (None = nao cachear)."""
+        if kind != "products" or not params.get("codigo"):
+            return None
+        norm = {k: (str(v).strip().upper() if isinstance(v, str) else v)
+                for k, v in params.items() if v not in (None, "")}
+        return json.dumps(norm, sort_keys=True)
+
+    def get(self, key: str) -> Optional[list]:
+        entry = self._store.get(key)
+        if entry is None:
+            self._stats["misses"] += 1
+            return None
+        if time.time() >= entry[0]:
+            del self._store[key]
+            self._stats["expired"] += 1
+            self._stats["misses"] += 1
+            return None
+        self._store.move_to_end(key)
+        self._stats["hits"] += 1
+        return [dict(h) for h in entry[1]]  # copia: o chamador pode mexer nos dicts
+
+    def set(self, key: str, hits: list):
+        self._store[key] = (time.time() + self.ttl, [dict(h) for h in hits])
+        self._store.move_to_end(key)
+        while len(self._store) > self.max_entries:
+            self._store.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def clear(self):
+        self._store.clear()
+
+    def stats(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "entries": len(self._store),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hit_rate": f"{(self._stats['hits'] / lookups * 100):.1f}%" if lookups > 0 else "N/A",
+        }
+
+
+code_cache = CodeLookupCache()
+_search_stats = {"searches": 0, "msearch_calls": 0, "msearch_items": 0, "errors": 0,
+                 "local_fallback": 0}
+
+
+def search_stats() -> dict:
+    """Metricas para /api/admin/pools."""
+    from src.elastic.local_index import get_local_index
+    local = get_local_index()
+    return {**_search_stats, "client_open": _client is not None and not _client.is_closed,
+            "offline": time.time() < _offline_until,
+            "code_cache": code_cache.stats(), "local_index": local.stats() if local else None}
+
+
 class ElasticSearchEngine:
     """Motor de busca com Elasticsearch."""
 
@@ -24,8 +148,15 @@ class ElasticSearchEngine:
     async def search_products(self, text: str = None, codigo: str = None,
                                marca: str = None, aplicacao: str = None,
                                limit: int = 10) -> list:
+        """Busca híbrida de produtos (ver products_query). Codigo repetido sai do cache."""
+        params = {"text": text, "codigo": codigo, "marca": marca, "aplicacao": aplicacao, "limit": limit}
+        return (await self.msearch([("products", params)]))[0]
+
+    def products_query(self, text: str = None, codigo: str = None,
+                       marca: str = None, aplicacao: str = None,
+                       limit: int = 10) -> dict:
         """
-        Busca híbrida de produtos no Elasticsearch.
+        Monta a query híbrida de produtos no Elasticsearch.
 
         Combina 3 estratégias:
           Prioridade 1: Match EXATO em campos de código (boost 10)
@@ -40,7 +171,7 @@ class ElasticSearchEngine:
             limit: maximo de resultados
 
         Returns:
-            Lista de dicts com produtos rankeados por relevancia
+            Body do _search (hits viram produtos rankeados por relevancia)
         """
         should = []
         filter_clauses = [{"term": {"ativo": True}}]
@@ -179,32 +310,17 @@ class ElasticSearchEngine:
             }
         }
 
-        try:
-            async with httpx.AsyncClient(timeout=10) as client:
-                r = await client.post(
-                    f"{ELASTIC_URL}/{PRODUCTS_INDEX}/_search",
-                    json=query,
-                    headers={"Content-Type": "application/json"}
-                )
-
-                if r.status_code != 200:
-                    print(f"[ELASTIC] Erro busca produtos: {r.status_code} {r.text[:200]}")
-                    return []
-
-                result = r.json()
-                hits = result.get("hits", {}).get("hits", [])
-
-                products = []
-                for hit in hits:
-                    src = hit.get("_source", {})
-                    src["_score"] = round(hit.get("_score", 0), 2)
-                    src["_highlights"] = hit.get("highlight", {})
-                    products.append(src)
+        return query
 
-                return products
-        except Exception as e:
-            print(f"[ELASTIC] Erro conexao busca produtos: {e}")
-            return []
+    @staticmethod
+    def _product_hits(result: dict) -> list:
+        products = []
+        for hit in result.get("hits", {}).get("hits", []):
+            src = hit.get("_source", {})
+            src["_score"] = round(hit.get("_score", 0), 2)
+            src["_highlights"] = hit.get("highlight", {})
+            products.append(src)
+        return products
 
     # ============================================================
     # BUSCA DE PARCEIROS (Clientes/Fornecedores)
@@ -213,8 +329,16 @@ class ElasticSearchEngine:
     async def search_partners(self, text: str = None, cnpj: str = None,
                                tipo: str = None, cidade: str = None,
                                vendedor: str = None, limit: int = 10) -> list:
+        """Busca clientes/fornecedores (ver partners_query)."""
+        params = {"text": text, "cnpj": cnpj, "tipo": tipo, "cidade": cidade,
+                  "vendedor": vendedor, "limit": limit}
+        return (await self.msearch([("partners", params)]))[0]
+
+    def partners_query(self, text: str = None, cnpj: str = None,
+                       tipo: str = None, cidade: str = None,
+                       vendedor: str = None, limit: int = 10) -> dict:
         """
-        Busca clientes/fornecedores no Elasticsearch.
+        Monta a query de clientes/fornecedores no Elasticsearch.
 
         Args:
             text: busca geral (nome, fantasia, cidade)
@@ -270,25 +394,113 @@ class ElasticSearchEngine:
                          "cidade", "uf", "telefone", "email", "vendedor"],
         }
 
-        try:
-            async with httpx.AsyncClient(timeout=10) as client:
-                r = await client.post(
-                    f"{ELASTIC_URL}/{PARTNERS_INDEX}/_search",
-                    json=query,
-                    headers={"Content-Type": "application/json"}
-                )
+        return query
 
-                if r.status_code != 200:
-                    print(f"[ELASTIC] Erro busca parceiros: {r.status_code}")
-                    return []
+    @staticmethod
+    def _partner_hits(result: dict) -> list:
+        return [{"_score": round(h.get("_score", 0), 2), **h.get("_source", {})}
+                for h in result.get("hits", {}).get("hits", [])]
 
-                result = r.json()
-                hits = result.get("hits", {}).get("hits", [])
+    # ============================================================
+    # MULTI-SEARCH
+    # ============================================================
 
-                return [{"_score": round(h.get("_score", 0), 2), **h.get("_source", {})} for h in hits]
-        except Exception as e:
-            print(f"[ELASTIC] Erro conexao busca parceiros: {e}")
+    _KINDS = {
+        "products": (PRODUCTS_INDEX, "products_query", "_product_hits"),
+        "partners": (PARTNERS_INDEX, "partners_query", "_partner_hits"),
+    }
+
+    async def msearch(self, searches: list) -> list:
+        """
+        Resolve varias buscas numa unica chamada ao Elasticsearch.
+
+        Args:
+            searches: [("products", {"codigo": "W950"}), ("partners", {"text": "..."}), ...]
+
+        Returns:
+            Lista de resultados na mesma ordem ([] para busca que falhou)
+        """
+        results = [None] * len(searches)
+        pending = []  # (posicao, index, query, chave do cache, parser)
+        for pos, (kind, params) in enumerate(searches):
+            index, build, parse = self._KINDS[kind]
+            build = getattr(self, build)
+            bound = inspect.signature(build).bind(**params)
+            bound.apply_defaults()  # limit omitido e limit=10 caem na mesma chave
+            params = dict(bound.arguments)
+            key = code_cache.make_key(kind, params)
+            if key is not None:
+                cached = code_cache.get(key)
+                if cached is not None:
+                    results[pos] = cached
+                    continue
+            pending.append((pos, index, build(**params), key, getattr(self, parse)))
+
+        if pending:
+            responses = await self._send(pending)
+            for (pos, _, _, key, parse), resp in zip(pending, responses):
+                kind, params = searches[pos]
+                if resp is None and kind == "products":  # Elastic fora: indice local (nao cacheia)
+                    results[pos] = await self._local_search(params)
+                    continue
+                if resp is None or resp.get("error"):
+                    if resp is not None:
+                        print(f"[ELASTIC] Erro busca: {str(resp.get('error'))[:200]}")
+                        _search_stats["errors"] += 1
+                    results[pos] = []
+                    continue
+                results[pos] = parse(resp)
+                if key is not None and results[pos]:  # vazio nao: produto recem-sincronizado apareceria so apos o TTL
+                    code_cache.set(key, results[pos])
+        return results
+
+    async def _local_search(self, params: dict) -> list:
+        """Busca de produto no indice local ([] se ainda nao foi construido)."""
+        from src.elastic.local_index import get_local_index
+        index = get_local_index()
+        if index is None:
             return []
+        _search_stats["local_fallback"] += 1
+        return await asyncio.to_thread(index.search, **params)
+
+    async def _send(self, pending: list) -> list:
+        """1 busca -> _search; varias -> _msearch (NDJSON header + body por busca).
+        None na posicao = Elastic inacessivel."""
+        global _offline_until
+        if time.time() < _offline_until:
+            return [None] * len(pending)
+        _search_stats["searches"] += len(pending)
+        try:
+            client = _get_client()
+            if len(pending) == 1:
+                _, index, query, _, _ = pending[0]
+                r = await client.post(f"{ELASTIC_URL}/{index}/_search", json=query,
+                                      headers={"Content-Type": "application/json"})
+                if r.status_code != 200:
+                    return [{"error": f"{r.status_code} {r.text[:200]}"}]
+                return [r.json()]
+
+            lines = []
+            for _, index, query, _, _ in pending:
+                lines.append(json.dumps({"index": index}))
+                lines.append(json.dumps(query, ensure_ascii=False))
+            _search_stats["msearch_calls"] += 1
+            _search_stats["msearch_items"] += len(pending)
+            r = await client.post(f"{ELASTIC_URL}/_msearch", content="\n".join(lines) + "\n",
+                                  headers={"Content-Type": "application/x-ndjson"})
+            if r.status_code != 200:
+                return [{"error": f"{r.status_code} {r.text[:200]}"}] * len(pending)
+            responses = r.json().get("responses", [])
+            return responses + [None] * (len(pending) - len(responses))
+        except httpx.TransportError as e:
+            print(f"[ELASTIC] Offline ({e}), usando indice local por {ES_RETRY_SECONDS}s")
+            _search_stats["errors"] += 1
+            _offline_until = time.time() + ES_RETRY_SECONDS
+            return [None] * len(pending)
+        except Exception as e:
+            print(f"[ELASTIC] Erro conexao busca: {e}")
+            _search_stats["errors"] += 1
+            return [{"error": str(e)}] * len(pending)
 
     # ============================================================
     # HEALTH CHECK
@@ -296,21 +508,27 @@ class ElasticSearchEngine:
 
     async def health(self) -> dict:
         try:
-            async with httpx.AsyncClient(timeout=5) as client:
-                r = await client.get(f"{ELASTIC_URL}/_cluster/health")
-                health = r.json()
-
-                r2 = await client.get(f"{ELASTIC_URL}/_cat/indices?format=json")
-                indices = r2.json()
-
-                return {
-                    "status": health.get("status"),
-                    "indices": {
-                        idx.get("index"): {
-                            "docs": idx.get("docs.count"),
-                            "size": idx.get("store.size"),
-                        } for idx in indices if idx.get("index", "").startswith("idx_")
-                    }
+            client = _get_client()
+            r = await client.get(f"{ELASTIC_URL}/_cluster/health", timeout=5)
+            health = r.json()
+
+            r2 = await client.get(f"{ELASTIC_URL}/_cat/indices?format=json", timeout=5)
+            indices = r2.json()
+
+            # Geracoes (idx_produtos_v...) aparecem pelo alias de leitura
+            r3 = await client.get(f"{ELASTIC_URL}/_cat/aliases?format=json", timeout=5)
+            aliases = {a.get("index"): a.get("alias") for a in (r3.json() if r3.status_code == 200 else [])
+                       if str(a.get("alias", "")).startswith("idx_")}
+
+            return {
+                "status": health.get("status"),
+                "indices": {
+                    aliases.get(idx.get("index"), idx.get("index")): {
+                        "docs": idx.get("docs.count"),
+                        "size": idx.get("store.size"),
+                        "index": idx.get("index"),
+                    } for idx in indices if idx.get("index", "").startswith("idx_")
                 }
+            }
         except Exception as e:
             return {"status": "offline", "error": str(e)}
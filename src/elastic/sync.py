@@ -6,29 +6,217 @@ Estrategia:
 - Full sync: Carrega TUDO na primeira vez e semanalmente
 - Incremental sync: Carrega apenas alterados (DTALTER > ultima_sync)
 - Roda no startup (se indice vazio) e no daily_training (incremental)
+
+Pipeline (produtor/consumidor):
+- Produtor busca as paginas no Sankhya (keyset: CODPROD > ultimo) e joga
+  numa fila limitada (ELASTIC_SYNC_QUEUE paginas) - a pagina N+1 ja esta
+  sendo buscada enquanto a N e indexada
+- ELASTIC_BULK_WORKERS consumidores montam os docs e mandam o _bulk
+- 1 httpx.AsyncClient por sync (keep-alive), fechado no fim
+- Full sync: refresh_interval=-1 e replicas=0 durante a carga, restaurados
+  no fim (+ _refresh). Throughput reportado em docs/s
+
+Blue/green (full sync sem downtime):
+- idx_produtos / idx_parceiros sao ALIASES; os indices fisicos sao geracoes
+  <alias>_v<YYYYmmddHHMMSS>
+- Full sync carrega uma geracao nova enquanto a busca segue na atual, valida
+  (_count >= ELASTIC_REINDEX_MIN_RATIO x COUNT do Sankhya) e troca o alias numa
+  unica chamada _aliases. Reprovada, a geracao nova e apagada e nada muda
+- Mantem ELASTIC_KEEP_GENERATIONS geracoes anteriores (rollback = apontar o
+  alias de volta) e apaga o resto
+- Indice legado com o nome do alias e removido na mesma troca atomica
+
+Reconciliacao (inativados/excluidos no Sankhya):
+- Incremental so traz ATIVO = 'S', entao o que foi inativado continua no indice
+- reconcile() le os ids do indice (search_after, sem _source), depois as
+  chaves ativas do Sankhya em faixas (LISTAGG por bucket de chave: ~200k
+  chaves por query), diff com arrays numpy ordenados e _bulk de delete
+- Roda no daily_training, depois do incremental
+
+Indice local (fallback com o Elastic offline, src/elastic/local_index.py):
+- build_local_index() le os docs do idx_produtos (_source, search_after) e
+  grava uma geracao nova em data/product_index/. Roda no fim do full_sync e
+  no daily_training
 """
 
 import os
 import json
-import re
+import time
+import asyncio
 from datetime import datetime
 from pathlib import Path
+from typing import Callable, Optional
 
 import httpx
+import numpy as np
+
+from src.core.query_scheduler import runs_as
 
 ELASTIC_URL = os.getenv("ELASTIC_URL", "http://localhost:9200")
 ELASTIC_TIMEOUT = int(os.getenv("ELASTIC_TIMEOUT", "30"))
 SYNC_BATCH_SIZE = 500  # Max rows por query no Sankhya (ROWNUM <= 500)
+ELASTIC_BULK_WORKERS = int(os.getenv("ELASTIC_BULK_WORKERS", "3"))
+ELASTIC_SYNC_QUEUE = int(os.getenv("ELASTIC_SYNC_QUEUE", "4"))  # paginas buscadas e ainda nao indexadas
+# Full sync so troca o alias se a nova geracao tiver >= X% do COUNT do Sankhya
+ELASTIC_REINDEX_MIN_RATIO = float(os.getenv("ELASTIC_REINDEX_MIN_RATIO", "0.99"))
+ELASTIC_KEEP_GENERATIONS = int(os.getenv("ELASTIC_KEEP_GENERATIONS", "1"))  # geracoes antigas mantidas
+# Reconciliacao: chaves por linha do LISTAGG (400 x 7 digitos + virgula < 4000 bytes do VARCHAR2)
+ELASTIC_RECONCILE_BUCKET = int(os.getenv("ELASTIC_RECONCILE_BUCKET", "400"))
+# Aborta se for apagar mais que X% do indice (Sankhya devolveu parcial?)
+ELASTIC_RECONCILE_MAX_DELETE_RATIO = float(os.getenv("ELASTIC_RECONCILE_MAX_DELETE_RATIO", "0.2"))
+ES_SCAN_PAGE = 10000
 
 SYNC_STATE_FILE = Path(__file__).resolve().parent.parent.parent / "data" / "elastic_sync_state.json"
 
 
+# ============================================================
+# LINHA SANKHYA -> DOC
+# ============================================================
+
+PRODUCT_COLS = ["CODPROD", "DESCRPROD", "MARCA", "MARCA_CODIGO",
+                "APLICACAO", "COMPLEMENTO", "REFERENCIA",
+                "NUM_FABRICANTE", "NUM_FABRICANTE2", "NUM_ORIGINAL",
+                "REF_FORNECEDOR", "NCM", "UNIDADE"]
+
+PARTNER_COLS = ["CODPARC", "NOME", "FANTASIA", "CNPJ_CPF",
+                "TIPO", "CIDADE", "UF", "BAIRRO",
+                "TELEFONE", "EMAIL", "VENDEDOR"]
+
+
+def _as_dicts(result: dict, default_cols: list) -> list:
+    """Converter lista -> dict se necessario (Sankhya retorna listas)."""
+    data = result.get("data") or []
+    if data and isinstance(data[0], (list, tuple)):
+        cols = result.get("columns") or default_cols
+        data = [dict(zip(cols, row)) for row in data]
+    return data
+
+
+def product_doc(row: dict) -> dict:
+    codprod = int(row.get("CODPROD", 0) or 0)
+    ref = str(row.get("REFERENCIA", "") or "")
+    nf = str(row.get("NUM_FABRICANTE", "") or "")
+    nf2 = str(row.get("NUM_FABRICANTE2", "") or "")
+    no = str(row.get("NUM_ORIGINAL", "") or "")
+    rf = str(row.get("REF_FORNECEDOR", "") or "")
+    descr = str(row.get("DESCRPROD", "") or "")
+    aplic = str(row.get("APLICACAO", "") or "")
+    compl = str(row.get("COMPLEMENTO", "") or "")
+
+    return {
+        "_id": codprod,
+        "codprod": codprod,
+        "descricao": descr,
+        "marca": str(row.get("MARCA", "") or ""),
+        "marca_codigo": int(row.get("MARCA_CODIGO", 0) or 0),
+        "aplicacao": aplic,
+        "complemento": compl,
+        "referencia": ref,
+        "num_fabricante": nf,
+        "num_fabricante2": nf2,
+        "num_original": no,
+        "ref_fornecedor": rf,
+        "ncm": str(row.get("NCM", "") or ""),
+        "unidade": str(row.get("UNIDADE", "") or ""),
+        "ativo": True,
+        "updated_at": datetime.now().isoformat(),
+        "all_codes": f"{ref} {nf} {nf2} {no} {rf}".strip(),
+        "full_text": f"{descr} {aplic} {compl}".strip(),
+    }
+
+
+def partner_doc(row: dict) -> dict:
+    codparc = int(row.get("CODPARC", 0) or 0)
+    nome = str(row.get("NOME", "") or "")
+    fantasia = str(row.get("FANTASIA", "") or "")
+    cidade = str(row.get("CIDADE", "") or "")
+
+    return {
+        "_id": codparc,
+        "codparc": codparc,
+        "nome": nome,
+        "fantasia": fantasia,
+        "cnpj_cpf": str(row.get("CNPJ_CPF", "") or ""),
+        "tipo": str(row.get("TIPO", "C") or "C"),
+        "cidade": cidade,
+        "uf": str(row.get("UF", "") or ""),
+        "bairro": str(row.get("BAIRRO", "") or ""),
+        "telefone": str(row.get("TELEFONE", "") or ""),
+        "email": str(row.get("EMAIL", "") or ""),
+        "vendedor": str(row.get("VENDEDOR", "") or ""),
+        "ativo": True,
+        "updated_at": datetime.now().isoformat(),
+        "full_text": f"{nome} {fantasia} {cidade}".strip(),
+    }
+
+
+def product_page_sql(where: str, last_codprod: int) -> str:
+    return f"""SELECT PRO.CODPROD, PRO.DESCRPROD,
+                NVL(MAR.DESCRICAO, '') AS MARCA,
+                NVL(MAR.CODIGO, 0) AS MARCA_CODIGO,
+                NVL(PRO.CARACTERISTICAS, '') AS APLICACAO,
+                NVL(PRO.COMPLDESC, '') AS COMPLEMENTO,
+                NVL(PRO.REFERENCIA, '') AS REFERENCIA,
+                NVL(PRO.AD_NUMFABRICANTE, '') AS NUM_FABRICANTE,
+                NVL(PRO.AD_NUMFABRICANTE2, '') AS NUM_FABRICANTE2,
+                NVL(PRO.AD_NUMORIGINAL, '') AS NUM_ORIGINAL,
+                NVL(PRO.REFFORN, '') AS REF_FORNECEDOR,
+                NVL(PRO.NCM, '') AS NCM,
+                NVL(PRO.CODVOL, '') AS UNIDADE
+            FROM TGFPRO PRO
+            LEFT JOIN TGFMAR MAR ON MAR.CODIGO = PRO.CODMARCA
+            WHERE {where} AND PRO.CODPROD > {last_codprod}
+            ORDER BY PRO.CODPROD"""
+
+
+def partner_page_sql(where: str, last_codparc: int) -> str:
+    return f"""SELECT
+                PAR.CODPARC,
+                PAR.NOMEPARC AS NOME,
+                NVL(PAR.RAZAOSOCIAL, '') AS FANTASIA,
+                NVL(PAR.CGC_CPF, '') AS CNPJ_CPF,
+                CASE
+                    WHEN PAR.CLIENTE = 'S' AND PAR.FORNECEDOR = 'S' THEN 'A'
+                    WHEN PAR.FORNECEDOR = 'S' THEN 'F'
+                    ELSE 'C'
+                END AS TIPO,
+                NVL(CID.NOMECID, '') AS CIDADE,
+                NVL(UFS.UF, '') AS UF,
+                NVL(BAI.NOMEBAI, '') AS BAIRRO,
+                NVL(PAR.TELEFONE, '') AS TELEFONE,
+                NVL(PAR.EMAIL, '') AS EMAIL,
+                NVL(VEN.APELIDO, '') AS VENDEDOR
+            FROM TGFPAR PAR
+            LEFT JOIN TSICID CID ON CID.CODCID = PAR.CODCID
+            LEFT JOIN TSIUFS UFS ON UFS.CODUF = CID.UF
+            LEFT JOIN TSIBAI BAI ON BAI.CODBAI = PAR.CODBAI
+            LEFT JOIN TGFVEN VEN ON VEN.CODVEND = PAR.CODVEND
+            WHERE {where} AND PAR.CODPARC > {last_codparc}
+            ORDER BY PAR.CODPARC"""
+
+
+def active_keys_sql(table: str, alias: str, key_col: str, last_key: int,
+                    bucket: int = ELASTIC_RECONCILE_BUCKET) -> str:
+    """1 linha por faixa de `bucket` chaves: BUCKET + CODES ('1,5,9')."""
+    return f"""SELECT FLOOR({alias}.{key_col} / {bucket}) AS BUCKET,
+                LISTAGG({alias}.{key_col}, ',') WITHIN GROUP (ORDER BY {alias}.{key_col}) AS CODES
+            FROM {table} {alias}
+            WHERE {alias}.ATIVO = 'S' AND {alias}.{key_col} > {last_key}
+            GROUP BY FLOOR({alias}.{key_col} / {bucket})
+            ORDER BY 1"""
+
+
 class ElasticSync:
     """Sincroniza Sankhya -> Elasticsearch."""
 
-    def __init__(self, executor):
+    def __init__(self, executor, bulk_workers: int = ELASTIC_BULK_WORKERS,
+                 queue_size: int = ELASTIC_SYNC_QUEUE):
         self.executor = executor
+        self.bulk_workers = max(1, bulk_workers)
+        self.queue_size = max(1, queue_size)
         self._state = self._load_state()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop = None
 
     # ============================================================
     # STATE MANAGEMENT
@@ -50,26 +238,44 @@ class ElasticSync:
     # ELASTICSEARCH HELPERS
     # ============================================================
 
+    def _get_client(self) -> httpx.AsyncClient:
+        """Client persistente do sync (recria se o event loop mudou)."""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=ELASTIC_TIMEOUT,
+                limits=httpx.Limits(max_connections=self.bulk_workers + 2,
+                                    max_keepalive_connections=self.bulk_workers + 2),
+            )
+            self._client_loop = loop
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self._client_loop = None
+
     async def _es_request(self, method: str, path: str, body: dict = None) -> dict:
-        async with httpx.AsyncClient(timeout=ELASTIC_TIMEOUT) as client:
-            url = f"{ELASTIC_URL}/{path}"
-            if method == "GET":
-                r = await client.get(url)
-            elif method == "PUT":
-                r = await client.put(url, json=body, headers={"Content-Type": "application/json"})
-            elif method == "POST":
-                r = await client.post(url, json=body, headers={"Content-Type": "application/json"})
-            elif method == "DELETE":
-                r = await client.delete(url)
-            elif method == "HEAD":
-                r = await client.head(url)
-                return {"status": r.status_code}
-            else:
-                raise ValueError(f"Method {method} nao suportado")
+        client = self._get_client()
+        url = f"{ELASTIC_URL}/{path}"
+        if method == "GET":
+            r = await client.get(url)
+        elif method == "PUT":
+            r = await client.put(url, json=body, headers={"Content-Type": "application/json"})
+        elif method == "POST":
+            r = await client.post(url, json=body, headers={"Content-Type": "application/json"})
+        elif method == "DELETE":
+            r = await client.delete(url)
+        elif method == "HEAD":
+            r = await client.head(url)
+            return {"status": r.status_code}
+        else:
+            raise ValueError(f"Method {method} nao suportado")
 
-            if r.status_code >= 400:
-                return {"error": r.text, "status": r.status_code}
-            return r.json() if r.text else {"status": r.status_code}
+        if r.status_code >= 400:
+            return {"error": r.text, "status": r.status_code}
+        return r.json() if r.text else {"status": r.status_code}
 
     async def _bulk_index(self, index: str, docs: list) -> dict:
         if not docs:
@@ -83,274 +289,440 @@ class ElasticSync:
 
         body = "\n".join(lines) + "\n"
 
-        async with httpx.AsyncClient(timeout=60) as client:
-            r = await client.post(
-                f"{ELASTIC_URL}/_bulk",
-                content=body,
-                headers={"Content-Type": "application/x-ndjson"}
-            )
-            result = r.json()
-            errors = sum(1 for item in result.get("items", []) if item.get("index", {}).get("error"))
-            return {"indexed": len(docs) - errors, "errors": errors}
-
-    async def _create_index_if_not_exists(self, index: str, mapping: dict) -> bool:
-        check = await self._es_request("HEAD", index)
+        r = await self._get_client().post(
+            f"{ELASTIC_URL}/_bulk",
+            content=body,
+            headers={"Content-Type": "application/x-ndjson"},
+            timeout=60,
+        )
+        if r.status_code >= 400:
+            print(f"[ELASTIC] Bulk HTTP {r.status_code}: {r.text[:200]}")
+            return {"indexed": 0, "errors": len(docs)}
+        result = r.json()
+        errors = sum(1 for item in result.get("items", []) if item.get("index", {}).get("error"))
+        return {"indexed": len(docs) - errors, "errors": errors}
+
+    async def _alias_targets(self, alias: str) -> list:
+        """Indices fisicos atras do alias ([] se o alias nao existe)."""
+        result = await self._es_request("GET", f"_alias/{alias}")
+        if not isinstance(result, dict) or result.get("error"):
+            return []
+        return sorted(name for name in result if name != "status")
+
+    async def _create_generation(self, alias: str, mapping: dict) -> Optional[str]:
+        """Cria o indice fisico <alias>_v<timestamp> (ainda sem alias)."""
+        name = f"{alias}_v{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        result = await self._es_request("PUT", name, mapping)
+        if result.get("acknowledged"):
+            print(f"[ELASTIC] Indice {name} criado")
+            return name
+        print(f"[ELASTIC] Erro ao criar {name}: {str(result)[:200]}")
+        return None
+
+    async def _ensure_alias(self, alias: str, mapping: dict) -> bool:
+        """Incremental escreve pelo alias; na 1a vez cria a geracao inicial."""
+        check = await self._es_request("HEAD", alias)
         if check.get("status") == 200:
-            print(f"[ELASTIC] Indice {index} ja existe")
+            return True  # alias (ou indice legado com o mesmo nome)
+        name = await self._create_generation(alias, mapping)
+        return bool(name) and await self._swap_alias(alias, name)
+
+    async def _swap_alias(self, alias: str, new_index: str) -> bool:
+        """Troca atomica: o alias sai das geracoes antigas e entra na nova numa unica chamada."""
+        current = await self._alias_targets(alias)
+        actions = [{"remove": {"index": old, "alias": alias}} for old in current if old != new_index]
+        actions.append({"add": {"index": new_index, "alias": alias}})
+        if not current and (await self._es_request("HEAD", alias)).get("status") == 200:
+            # Indice legado com o nome do alias: apagado na mesma operacao
+            actions.append({"remove_index": {"index": alias}})
+        result = await self._es_request("POST", "_aliases", {"actions": actions})
+        if not result.get("acknowledged"):
+            print(f"[ELASTIC] Erro ao trocar alias {alias}: {str(result)[:200]}")
             return False
-        result = await self._es_request("PUT", index, mapping)
-        if result.get("acknowledged"):
-            print(f"[ELASTIC] Indice {index} criado")
-            return True
+        print(f"[ELASTIC] Alias {alias} -> {new_index} (antes: {', '.join(current) or 'nenhum'})")
+        return True
+
+    async def _drop_generation(self, name: str):
+        """Apaga uma geracao que nao chegou ao alias (erro no DELETE so e logado)."""
+        try:
+            result = await self._es_request("DELETE", name)
+        except Exception as e:
+            result = {"error": str(e)}
+        if result.get("error") and result.get("status") != 404:
+            print(f"[ELASTIC] Erro ao apagar geracao {name}: {str(result.get('error'))[:200]}")
         else:
-            print(f"[ELASTIC] Erro ao criar {index}: {result}")
-            return False
+            print(f"[ELASTIC] Geracao {name} descartada")
+
+    async def _cleanup_generations(self, alias: str, keep: int = ELASTIC_KEEP_GENERATIONS) -> list:
+        """Apaga geracoes fora do ar: mantem so as `keep` anteriores a atual (rollback manual).
+
+        Geracoes mais novas que a atual e fora do alias sao sobras de cargas que
+        falharam e sempre saem.
+        """
+        result = await self._es_request("GET", f"_cat/indices/{alias}_v*?format=json&h=index")
+        if not isinstance(result, list):
+            return []
+        live = set(await self._alias_targets(alias))
+        if not live:
+            return []
+        # Nomes <alias>_v<YYYYmmddHHMMSS>: ordem alfabetica == ordem de criacao
+        current = min(live)
+        stale = sorted(i["index"] for i in result if i.get("index") and i["index"] not in live)
+        older = [name for name in stale if name < current]
+        newer = [name for name in stale if name > current]
+        doomed = (older[:-keep] if keep > 0 else older) + newer
+        for name in doomed:
+            await self._es_request("DELETE", name)
+            print(f"[ELASTIC] Geracao antiga {name} removida")
+        return doomed
 
     async def _count_docs(self, index: str) -> int:
         result = await self._es_request("GET", f"{index}/_count")
         return result.get("count", 0)
 
+    async def _count_rows(self, sql_count: str) -> int:
+        count_result = await self.executor.execute(sql_count)
+        if count_result.get("success") and count_result.get("data"):
+            row = count_result["data"][0]
+            return int(row.get("TOTAL", 0) or 0) if isinstance(row, dict) else int(row[0] or 0)
+        return 0
+
+    async def _begin_bulk_load(self, index: str) -> dict:
+        """Full sync: desliga refresh e replicas durante a carga. Retorna o que restaurar."""
+        current = await self._es_request("GET", f"{index}/_settings")
+        settings = (current.get(index) or {}).get("settings", {}).get("index", {})
+        previous = {
+            # None = volta ao default do ES
+            "refresh_interval": settings.get("refresh_interval"),
+            "number_of_replicas": settings.get("number_of_replicas"),
+        }
+        result = await self._es_request("PUT", f"{index}/_settings",
+                                        {"index": {"refresh_interval": "-1", "number_of_replicas": 0}})
+        if result.get("error"):
+            print(f"[ELASTIC] {index}: nao foi possivel ajustar settings de carga: {result.get('error', '')[:200]}")
+        return previous
+
+    async def _end_bulk_load(self, index: str, previous: dict):
+        result = await self._es_request("PUT", f"{index}/_settings", {"index": previous})
+        if result.get("error"):
+            print(f"[ELASTIC] {index}: erro ao restaurar settings: {result.get('error', '')[:200]}")
+        await self._es_request("POST", f"{index}/_refresh")
+
     # ============================================================
-    # SYNC PRODUTOS
+    # PIPELINE (busca no Sankhya || bulk no ES)
     # ============================================================
 
-    async def sync_products(self, full: bool = False) -> dict:
-        from src.elastic.mappings import PRODUCTS_MAPPING, PRODUCTS_INDEX
-        await self._create_index_if_not_exists(PRODUCTS_INDEX, PRODUCTS_MAPPING)
+    async def _pipeline(self, label: str, index: str, page_sql: Callable[[int], str],
+                        cols: list, key_col: str, build_doc: Callable[[dict], dict],
+                        total: int) -> dict:
+        """Produtor pagina o Sankhya por keyset; N workers indexam as paginas da fila."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        stats = {"indexed": 0, "errors": 0, "pages": 0, "last_key": 0}
+        t0 = time.perf_counter()
+
+        async def producer():
+            last_key = 0
+            cancelled = False
+            try:
+                while True:
+                    result = await self.executor.execute(page_sql(last_key))
+                    if not result.get("success") or not result.get("data"):
+                        if not result.get("success"):
+                            print(f"[ELASTIC] Erro SQL {label}: {result.get('error', '?')}")
+                        break
+
+                    data = _as_dicts(result, cols)
+                    if not data:
+                        break
+                    last_key = int(data[-1].get(key_col, 0) or 0)
+                    stats["pages"] += 1
+                    await queue.put((data, last_key))  # bloqueia se os workers estao atrasados
+
+                    if len(data) < SYNC_BATCH_SIZE:
+                        break
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            finally:
+                # Cancelado junto com os workers: ninguem consumiria o fim da fila
+                if not cancelled:
+                    for _ in range(self.bulk_workers):
+                        await queue.put(None)
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                data, last_key = item
+                try:
+                    docs = [build_doc(row) for row in data]
+                    bulk = await self._bulk_index(index, docs)
+                except Exception as e:
+                    # Linha ruim ou bulk com erro: a pagina conta como erro e o worker segue
+                    print(f"[ELASTIC] Erro bulk {label}: {e}")
+                    bulk = {"indexed": 0, "errors": len(data)}
+                stats["indexed"] += bulk.get("indexed", 0)
+                stats["errors"] += bulk.get("errors", 0)
+                stats["last_key"] = max(stats["last_key"], last_key)
+                elapsed = time.perf_counter() - t0
+                rate = stats["indexed"] / elapsed if elapsed > 0 else 0.0
+                print(f"[ELASTIC] {label}: {stats['indexed']}/{total} "
+                      f"(last={last_key}, fila={queue.qsize()}, {rate:.0f} docs/s)")
+
+        tasks = [asyncio.create_task(producer())]
+        tasks += [asyncio.create_task(worker()) for _ in range(self.bulk_workers)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Falha em qualquer ponta: sem cancelar, o produtor ficaria preso no
+            # queue.put (ou os workers num queue.get) para sempre
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        elapsed = time.perf_counter() - t0
+        stats["elapsed_seconds"] = round(elapsed, 2)
+        stats["docs_per_s"] = round(stats["indexed"] / elapsed, 1) if elapsed > 0 else 0.0
+        return stats
+
+    async def _sync_index(self, label: str, index: str, mapping: dict, table: str, alias: str,
+                          page_sql: Callable[[str, int], str], cols: list, key_col: str,
+                          build_doc: Callable[[dict], dict], state_key: str, full: bool) -> dict:
+        """`index` e o alias de leitura. Full reconstroi numa geracao nova e troca o alias;
+        incremental escreve direto pelo alias."""
+        if not full and not await self._ensure_alias(index, mapping):
+            return {"indexed": 0, "errors": 0, "total": 0, "error": f"alias {index} indisponivel"}
 
         # Montar WHERE
-        where = "PRO.ATIVO = 'S'"
-        if not full and self._state.get("last_products_sync"):
-            last = self._state["last_products_sync"]
-            where += f" AND PRO.DTALTER >= TO_DATE('{last}', 'YYYY-MM-DD HH24:MI:SS')"
+        where = f"{alias}.ATIVO = 'S'"
+        if not full and self._state.get(state_key):
+            last = self._state[state_key]
+            where += f" AND {alias}.DTALTER >= TO_DATE('{last}', 'YYYY-MM-DD HH24:MI:SS')"
+        # Marca o inicio: o que for alterado durante a carga entra no proximo incremental
+        started_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
         # Contar total
-        sql_count = f"SELECT COUNT(*) AS TOTAL FROM TGFPRO PRO WHERE {where}"
-        count_result = await self.executor.execute(sql_count)
-        total = 0
-        if count_result.get("success") and count_result.get("data"):
-            row = count_result["data"][0]
-            total = int(row.get("TOTAL", 0) or 0) if isinstance(row, dict) else int(row[0] or 0)
-
+        total = await self._count_rows(f"SELECT COUNT(*) AS TOTAL FROM {table} {alias} WHERE {where}")
         if total == 0:
-            print(f"[ELASTIC] Produtos: nenhum novo/alterado")
+            print(f"[ELASTIC] {label}: nenhum novo/alterado")
             return {"indexed": 0, "errors": 0, "total": 0}
 
-        mode = "full" if full else "incremental"
-        print(f"[ELASTIC] Produtos: sincronizando {total} ({mode})...")
-
-        # Paginar via ROWNUM ranges (Oracle)
-        indexed_total = 0
-        errors_total = 0
-        last_codprod = 0
-
-        while True:
-            sql = f"""SELECT PRO.CODPROD, PRO.DESCRPROD,
-                NVL(MAR.DESCRICAO, '') AS MARCA,
-                NVL(MAR.CODIGO, 0) AS MARCA_CODIGO,
-                NVL(PRO.CARACTERISTICAS, '') AS APLICACAO,
-                NVL(PRO.COMPLDESC, '') AS COMPLEMENTO,
-                NVL(PRO.REFERENCIA, '') AS REFERENCIA,
-                NVL(PRO.AD_NUMFABRICANTE, '') AS NUM_FABRICANTE,
-                NVL(PRO.AD_NUMFABRICANTE2, '') AS NUM_FABRICANTE2,
-                NVL(PRO.AD_NUMORIGINAL, '') AS NUM_ORIGINAL,
-                NVL(PRO.REFFORN, '') AS REF_FORNECEDOR,
-                NVL(PRO.NCM, '') AS NCM,
-                NVL(PRO.CODVOL, '') AS UNIDADE
-            FROM TGFPRO PRO
-            LEFT JOIN TGFMAR MAR ON MAR.CODIGO = PRO.CODMARCA
-            WHERE {where} AND PRO.CODPROD > {last_codprod}
-            ORDER BY PRO.CODPROD"""
-
-            result = await self.executor.execute(sql)
-            if not result.get("success") or not result.get("data"):
-                if not result.get("success"):
-                    print(f"[ELASTIC] Erro SQL produtos: {result.get('error', '?')}")
-                break
+        target = index
+        if full:
+            target = await self._create_generation(index, mapping)
+            if not target:
+                return {"indexed": 0, "errors": 0, "total": total, "error": "falha ao criar indice"}
 
-            data = result["data"]
-            if not data:
-                break
+        mode = "full" if full else "incremental"
+        print(f"[ELASTIC] {label}: sincronizando {total} -> {target} ({mode}, {self.bulk_workers} workers)...")
+
+        previous = None
+        try:
+            previous = await self._begin_bulk_load(target) if full else None
+            stats = await self._pipeline(label, target, lambda last: page_sql(where, last),
+                                         cols, key_col, build_doc, total)
+        except BaseException:
+            if full:
+                # Geracao nova nunca foi pro ar: nao deixa orfa ocupando disco
+                previous = None
+                await self._drop_generation(target)
+            raise
+        finally:
+            if previous is not None:
+                await self._end_bulk_load(target, previous)
+
+        count = await self._count_docs(target)
+        summary = {"indexed": stats["indexed"], "errors": stats["errors"], "total_in_index": count,
+                   "pages": stats["pages"], "elapsed_seconds": stats["elapsed_seconds"],
+                   "docs_per_s": stats["docs_per_s"]}
 
-            # Converter lista -> dict se necessario (Sankhya retorna listas)
-            PRODUCT_COLS = ["CODPROD", "DESCRPROD", "MARCA", "MARCA_CODIGO",
-                            "APLICACAO", "COMPLEMENTO", "REFERENCIA",
-                            "NUM_FABRICANTE", "NUM_FABRICANTE2", "NUM_ORIGINAL",
-                            "REF_FORNECEDOR", "NCM", "UNIDADE"]
-            if data and isinstance(data[0], (list, tuple)):
-                cols = result.get("columns") or PRODUCT_COLS
-                data = [dict(zip(cols, row)) for row in data]
-
-            docs = []
-            for row in data:
-                codprod = int(row.get("CODPROD", 0) or 0)
-                last_codprod = codprod
-                ref = str(row.get("REFERENCIA", "") or "")
-                nf = str(row.get("NUM_FABRICANTE", "") or "")
-                nf2 = str(row.get("NUM_FABRICANTE2", "") or "")
-                no = str(row.get("NUM_ORIGINAL", "") or "")
-                rf = str(row.get("REF_FORNECEDOR", "") or "")
-                descr = str(row.get("DESCRPROD", "") or "")
-                aplic = str(row.get("APLICACAO", "") or "")
-                compl = str(row.get("COMPLEMENTO", "") or "")
-
-                docs.append({
-                    "_id": codprod,
-                    "codprod": codprod,
-                    "descricao": descr,
-                    "marca": str(row.get("MARCA", "") or ""),
-                    "marca_codigo": int(row.get("MARCA_CODIGO", 0) or 0),
-                    "aplicacao": aplic,
-                    "complemento": compl,
-                    "referencia": ref,
-                    "num_fabricante": nf,
-                    "num_fabricante2": nf2,
-                    "num_original": no,
-                    "ref_fornecedor": rf,
-                    "ncm": str(row.get("NCM", "") or ""),
-                    "unidade": str(row.get("UNIDADE", "") or ""),
-                    "ativo": True,
-                    "updated_at": datetime.now().isoformat(),
-                    "all_codes": f"{ref} {nf} {nf2} {no} {rf}".strip(),
-                    "full_text": f"{descr} {aplic} {compl}".strip(),
-                })
-
-            bulk = await self._bulk_index(PRODUCTS_INDEX, docs)
-            indexed_total += bulk.get("indexed", 0)
-            errors_total += bulk.get("errors", 0)
-
-            batch_num = (indexed_total // SYNC_BATCH_SIZE) + 1
-            print(f"[ELASTIC] Produtos: batch {batch_num} — {indexed_total}/{total} (last_codprod={last_codprod})")
-
-            if len(data) < SYNC_BATCH_SIZE:
-                break
+        if full:
+            # Validar a geracao nova antes de expor: COUNT do ES vs COUNT do Sankhya
+            summary.update(index=target, expected=total)
+            if count < total * ELASTIC_REINDEX_MIN_RATIO or not await self._swap_alias(index, target):
+                print(f"[ELASTIC] {label}: {target} reprovado ({count}/{total} docs), "
+                      f"alias {index} mantido na geracao anterior")
+                await self._drop_generation(target)
+                return {**summary, "swapped": False}
+            summary["swapped"] = True
+            summary["removed_generations"] = await self._cleanup_generations(index)
 
         # Atualizar state
-        self._state["last_products_sync"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        if full:
-            self._state["last_full_sync"] = self._state["last_products_sync"]
+        self._state[state_key] = started_at
         self._save_state()
 
-        count = await self._count_docs(PRODUCTS_INDEX)
-        print(f"[ELASTIC] Produtos: {indexed_total} indexados, {errors_total} erros. Total no indice: {count}")
-        return {"indexed": indexed_total, "errors": errors_total, "total_in_index": count}
+        print(f"[ELASTIC] {label}: {stats['indexed']} indexados, {stats['errors']} erros "
+              f"em {stats['elapsed_seconds']:.1f}s ({stats['docs_per_s']:.0f} docs/s). Total no indice: {count}")
+        return summary
 
     # ============================================================
-    # SYNC PARCEIROS
+    # RECONCILIACAO (ids no indice x chaves ativas no Sankhya)
     # ============================================================
 
-    async def sync_partners(self, full: bool = False) -> dict:
-        from src.elastic.mappings import PARTNERS_MAPPING, PARTNERS_INDEX
-        await self._create_index_if_not_exists(PARTNERS_INDEX, PARTNERS_MAPPING)
+    async def _index_keys(self, index: str, key_field: str) -> Optional[np.ndarray]:
+        """Todas as chaves do indice, ordenadas (None se a leitura falhou)."""
+        chunks, after = [], None
+        while True:
+            body = {"size": ES_SCAN_PAGE, "_source": False, "track_total_hits": False,
+                    "sort": [{key_field: "asc"}]}
+            if after is not None:
+                body["search_after"] = after
+            result = await self._es_request("POST", f"{index}/_search", body)
+            if result.get("error"):
+                print(f"[ELASTIC] Erro lendo ids de {index}: {str(result.get('error'))[:200]}")
+                return None
+            hits = result.get("hits", {}).get("hits", [])
+            if not hits:
+                break
+            chunks.append(np.fromiter((h["sort"][0] for h in hits), dtype=np.int64, count=len(hits)))
+            after = hits[-1]["sort"]
+            if len(hits) < ES_SCAN_PAGE:
+                break
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
 
-        where = "PAR.ATIVO = 'S'"
-        if not full and self._state.get("last_partners_sync"):
-            last = self._state["last_partners_sync"]
-            where += f" AND PAR.DTALTER >= TO_DATE('{last}', 'YYYY-MM-DD HH24:MI:SS')"
+    async def _active_keys(self, label: str, table: str, alias: str, key_col: str) -> Optional[np.ndarray]:
+        """Chaves ativas no Sankhya, ordenadas, buscadas por faixas (None se alguma query falhou)."""
+        chunks, last_key, bucket = [], -1, ELASTIC_RECONCILE_BUCKET
+        while True:
+            result = await self.executor.execute(active_keys_sql(table, alias, key_col, last_key, bucket))
+            if not result.get("success"):
+                print(f"[ELASTIC] Erro SQL reconciliacao {label}: {result.get('error', '?')}")
+                return None
+            rows = _as_dicts(result, ["BUCKET", "CODES"])
+            if not rows:
+                break
+            for row in rows:
+                codes = str(row.get("CODES") or "")
+                if codes:
+                    chunks.append(np.array(codes.split(","), dtype=np.int64))
+            # Proxima faixa comeca no bucket seguinte ao ultimo recebido
+            last_key = (int(rows[-1].get("BUCKET", 0) or 0) + 1) * bucket - 1
+            if len(rows) < SYNC_BATCH_SIZE:
+                break
+        return np.unique(np.concatenate(chunks)) if chunks else np.empty(0, dtype=np.int64)
+
+    async def _bulk_delete(self, index: str, ids) -> dict:
+        deleted = errors = 0
+        for start in range(0, len(ids), SYNC_BATCH_SIZE * 2):
+            chunk = ids[start:start + SYNC_BATCH_SIZE * 2]
+            body = "".join(json.dumps({"delete": {"_index": index, "_id": str(int(i))}}) + "\n" for i in chunk)
+            r = await self._get_client().post(
+                f"{ELASTIC_URL}/_bulk",
+                content=body,
+                headers={"Content-Type": "application/x-ndjson"},
+                timeout=60,
+            )
+            if r.status_code >= 400:
+                print(f"[ELASTIC] Bulk delete HTTP {r.status_code}: {r.text[:200]}")
+                errors += len(chunk)
+                continue
+            items = r.json().get("items", [])
+            failed = sum(1 for item in items
+                         if item.get("delete", {}).get("error") and item["delete"].get("status") != 404)
+            deleted += len(chunk) - failed
+            errors += failed
+        return {"deleted": deleted, "errors": errors}
+
+    async def _reconcile_index(self, label: str, index: str, table: str, alias: str,
+                               key_col: str, key_field: str) -> dict:
+        t0 = time.perf_counter()
+        # Indice antes do Sankhya: doc criado no meio nao vira falso "inativo"
+        in_index = await self._index_keys(index, key_field)
+        if in_index is None:
+            return {"deleted": 0, "errors": 0, "error": "falha ao ler o indice"}
+        active = await self._active_keys(label, table, alias, key_col)
+        if active is None:
+            return {"deleted": 0, "errors": 0, "error": "falha ao ler o Sankhya"}
+
+        in_index = np.unique(in_index)
+        stale = np.setdiff1d(in_index, active, assume_unique=True)
+        missing = int(len(active) - np.intersect1d(in_index, active, assume_unique=True).size)
+        stats = {"in_index": int(len(in_index)), "active": int(len(active)),
+                 "stale": int(len(stale)), "missing": missing}
+
+        if len(in_index) and len(stale) > len(in_index) * ELASTIC_RECONCILE_MAX_DELETE_RATIO:
+            print(f"[ELASTIC] {label}: reconciliacao abortada, {len(stale)}/{len(in_index)} "
+                  f"docs seriam apagados (limite {ELASTIC_RECONCILE_MAX_DELETE_RATIO:.0%})")
+            return {**stats, "deleted": 0, "errors": 0, "error": "limite de delecao excedido"}
+
+        result = await self._bulk_delete(index, stale) if len(stale) else {"deleted": 0, "errors": 0}
+        stats.update(result, elapsed_seconds=round(time.perf_counter() - t0, 2))
+        print(f"[ELASTIC] {label}: reconciliacao {stats['deleted']} removidos, "
+              f"{missing} ativos fora do indice ({stats['elapsed_seconds']:.1f}s)")
+        return stats
 
-        sql_count = f"SELECT COUNT(*) AS TOTAL FROM TGFPAR PAR WHERE {where}"
-        count_result = await self.executor.execute(sql_count)
-        total = 0
-        if count_result.get("success") and count_result.get("data"):
-            row = count_result["data"][0]
-            total = int(row.get("TOTAL", 0) or 0) if isinstance(row, dict) else int(row[0] or 0)
+    # ============================================================
+    # INDICE LOCAL (fallback de busca)
+    # ============================================================
 
-        if total == 0:
-            print(f"[ELASTIC] Parceiros: nenhum novo/alterado")
-            return {"indexed": 0, "errors": 0, "total": 0}
+    async def build_local_index(self) -> dict:
+        """Reconstroi o indice local de produtos a partir do _source do idx_produtos."""
+        from src.elastic.mappings import PRODUCTS_INDEX
+        from src.elastic.local_index import LocalIndexBuilder, RETURN_FIELDS
 
-        mode = "full" if full else "incremental"
-        print(f"[ELASTIC] Parceiros: sincronizando {total} ({mode})...")
+        t0 = time.perf_counter()
+        builder, after = LocalIndexBuilder(), None
+        while True:
+            body = {"size": ES_SCAN_PAGE, "_source": list(RETURN_FIELDS), "track_total_hits": False,
+                    "sort": [{"codprod": "asc"}]}
+            if after is not None:
+                body["search_after"] = after
+            result = await self._es_request("POST", f"{PRODUCTS_INDEX}/_search", body)
+            if result.get("error"):
+                print(f"[ELASTIC] Indice local: erro lendo {PRODUCTS_INDEX}: {str(result.get('error'))[:200]}")
+                return {"docs": 0, "error": "falha ao ler o indice"}
+            hits = result.get("hits", {}).get("hits", [])
+            await asyncio.to_thread(builder.add, [h.get("_source", {}) for h in hits])
+            if len(hits) < ES_SCAN_PAGE:
+                break
+            after = hits[-1]["sort"]
 
-        indexed_total = 0
-        errors_total = 0
-        last_codparc = 0
+        if not len(builder):
+            return {"docs": 0, "error": "indice vazio"}
+        gen = await asyncio.to_thread(builder.save)  # CPU: ordena postings e grava os arrays
+        return {"docs": len(builder), "path": gen.name,
+                "elapsed_seconds": round(time.perf_counter() - t0, 2)}
 
-        while True:
-            sql = f"""SELECT
-                PAR.CODPARC,
-                PAR.NOMEPARC AS NOME,
-                NVL(PAR.RAZAOSOCIAL, '') AS FANTASIA,
-                NVL(PAR.CGC_CPF, '') AS CNPJ_CPF,
-                CASE
-                    WHEN PAR.CLIENTE = 'S' AND PAR.FORNECEDOR = 'S' THEN 'A'
-                    WHEN PAR.FORNECEDOR = 'S' THEN 'F'
-                    ELSE 'C'
-                END AS TIPO,
-                NVL(CID.NOMECID, '') AS CIDADE,
-                NVL(UFS.UF, '') AS UF,
-                NVL(BAI.NOMEBAI, '') AS BAIRRO,
-                NVL(PAR.TELEFONE, '') AS TELEFONE,
-                NVL(PAR.EMAIL, '') AS EMAIL,
-                NVL(VEN.APELIDO, '') AS VENDEDOR
-            FROM TGFPAR PAR
-            LEFT JOIN TSICID CID ON CID.CODCID = PAR.CODCID
-            LEFT JOIN TSIUFS UFS ON UFS.CODUF = CID.UF
-            LEFT JOIN TSIBAI BAI ON BAI.CODBAI = PAR.CODBAI
-            LEFT JOIN TGFVEN VEN ON VEN.CODVEND = PAR.CODVEND
-            WHERE {where} AND PAR.CODPARC > {last_codparc}
-            ORDER BY PAR.CODPARC"""
+    @runs_as("background")
+    async def reconcile_products(self) -> dict:
+        from src.elastic.mappings import PRODUCTS_INDEX
+        return await self._reconcile_index("Produtos", PRODUCTS_INDEX, "TGFPRO", "PRO", "CODPROD", "codprod")
 
-            result = await self.executor.execute(sql)
-            if not result.get("success") or not result.get("data"):
-                if not result.get("success"):
-                    print(f"[ELASTIC] Erro SQL parceiros: {result.get('error', '?')}")
-                break
+    @runs_as("background")
+    async def reconcile_partners(self) -> dict:
+        from src.elastic.mappings import PARTNERS_INDEX
+        return await self._reconcile_index("Parceiros", PARTNERS_INDEX, "TGFPAR", "PAR", "CODPARC", "codparc")
 
-            data = result["data"]
-            if not data:
-                break
+    # ============================================================
+    # SYNC PRODUTOS
+    # ============================================================
 
-            # Converter lista -> dict se necessario (Sankhya retorna listas)
-            PARTNER_COLS = ["CODPARC", "NOME", "FANTASIA", "CNPJ_CPF",
-                            "TIPO", "CIDADE", "UF", "BAIRRO",
-                            "TELEFONE", "EMAIL", "VENDEDOR"]
-            if data and isinstance(data[0], (list, tuple)):
-                cols = result.get("columns") or PARTNER_COLS
-                data = [dict(zip(cols, row)) for row in data]
-
-            docs = []
-            for row in data:
-                codparc = int(row.get("CODPARC", 0) or 0)
-                last_codparc = codparc
-                nome = str(row.get("NOME", "") or "")
-                fantasia = str(row.get("FANTASIA", "") or "")
-                cidade = str(row.get("CIDADE", "") or "")
-
-                docs.append({
-                    "_id": codparc,
-                    "codparc": codparc,
-                    "nome": nome,
-                    "fantasia": fantasia,
-                    "cnpj_cpf": str(row.get("CNPJ_CPF", "") or ""),
-                    "tipo": str(row.get("TIPO", "C") or "C"),
-                    "cidade": cidade,
-                    "uf": str(row.get("UF", "") or ""),
-                    "bairro": str(row.get("BAIRRO", "") or ""),
-                    "telefone": str(row.get("TELEFONE", "") or ""),
-                    "email": str(row.get("EMAIL", "") or ""),
-                    "vendedor": str(row.get("VENDEDOR", "") or ""),
-                    "ativo": True,
-                    "updated_at": datetime.now().isoformat(),
-                    "full_text": f"{nome} {fantasia} {cidade}".strip(),
-                })
-
-            bulk = await self._bulk_index(PARTNERS_INDEX, docs)
-            indexed_total += bulk.get("indexed", 0)
-            errors_total += bulk.get("errors", 0)
-
-            batch_num = (indexed_total // SYNC_BATCH_SIZE) + 1
-            print(f"[ELASTIC] Parceiros: batch {batch_num} — {indexed_total}/{total} (last_codparc={last_codparc})")
-
-            if len(data) < SYNC_BATCH_SIZE:
-                break
+    @runs_as("background")
+    async def sync_products(self, full: bool = False) -> dict:
+        from src.elastic.mappings import PRODUCTS_MAPPING, PRODUCTS_INDEX
+        result = await self._sync_index(
+            "Produtos", PRODUCTS_INDEX, PRODUCTS_MAPPING, "TGFPRO", "PRO",
+            product_page_sql, PRODUCT_COLS, "CODPROD", product_doc,
+            "last_products_sync", full,
+        )
+        if full and result.get("swapped"):
+            self._state["last_full_sync"] = self._state["last_products_sync"]
+            self._save_state()
+        return result
 
-        self._state["last_partners_sync"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self._save_state()
+    # ============================================================
+    # SYNC PARCEIROS
+    # ============================================================
 
-        count = await self._count_docs(PARTNERS_INDEX)
-        print(f"[ELASTIC] Parceiros: {indexed_total} indexados, {errors_total} erros. Total: {count}")
-        return {"indexed": indexed_total, "errors": errors_total, "total_in_index": count}
+    @runs_as("background")
+    async def sync_partners(self, full: bool = False) -> dict:
+        from src.elastic.mappings import PARTNERS_MAPPING, PARTNERS_INDEX
+        return await self._sync_index(
+            "Parceiros", PARTNERS_INDEX, PARTNERS_MAPPING, "TGFPAR", "PAR",
+            partner_page_sql, PARTNER_COLS, "CODPARC", partner_doc,
+            "last_partners_sync", full,
+        )
 
     # ============================================================
     # FULL / INCREMENTAL
@@ -359,13 +731,31 @@ class ElasticSync:
     async def full_sync(self) -> dict:
         print(f"[ELASTIC] === FULL SYNC INICIANDO ===")
         t0 = datetime.now()
-        products = await self.sync_products(full=True)
-        partners = await self.sync_partners(full=True)
+        try:
+            products = await self.sync_products(full=True)
+            partners = await self.sync_partners(full=True)
+            local = await self.build_local_index() if products.get("swapped") else None
+        finally:
+            await self.aclose()
         elapsed = (datetime.now() - t0).total_seconds()
         print(f"[ELASTIC] === FULL SYNC COMPLETO em {elapsed:.0f}s ===")
-        return {"products": products, "partners": partners, "elapsed_seconds": elapsed}
+        return {"products": products, "partners": partners, "local_index": local,
+                "elapsed_seconds": elapsed}
 
     async def incremental_sync(self) -> dict:
-        products = await self.sync_products(full=False)
-        partners = await self.sync_partners(full=False)
-        return {"products": products, "partners": partners}
\ No newline at end of file
+        try:
+            products = await self.sync_products(full=False)
+            partners = await self.sync_partners(full=False)
+        finally:
+            await self.aclose()
+        return {"products": products, "partners": partners}
+
+    async def reconcile(self, rebuild_local: bool = True) -> dict:
+        """Remove do indice o que foi inativado/excluido no Sankhya (e atualiza o indice local)."""
+        try:
+            products = await self.reconcile_products()
+            partners = await self.reconcile_partners()
+            local = await self.build_local_index() if rebuild_local else None
+        finally:
+            await self.aclose()
+        return {"products": products, "partners": partners, "local_index": local}
@@ -7,6 +7,10 @@ Uso:
 
     executor = SafeQueryExecutor()
     result = await executor.execute("SELECT * FROM TGFPAR WHERE ROWNUM <= 10")
+
+Todas as instancias compartilham o mesmo pool HTTP e token OAuth
+(src/core/sankhya_client.py). Executores criados com cache=query_cache
+compartilham tambem o cache de resultados (src/core/query_cache.py).
 """
 
 import os
@@ -14,11 +18,12 @@ import re
 import asyncio
 from pathlib import Path
 from typing import Optional
-from datetime import datetime
 
 import httpx
 from dotenv import load_dotenv
 
+from src.core.sankhya_client import sankhya_transport, AuthenticationError
+
 # Setup paths
 PROJECT_ROOT = Path(__file__).parent.parent.parent
 load_dotenv(PROJECT_ROOT / ".env")
@@ -28,9 +33,7 @@ load_dotenv(PROJECT_ROOT / ".env")
 # ============================================================
 
 SANKHYA_BASE_URL = "https://api.sankhya.com.br"
-SANKHYA_CLIENT_ID = os.getenv("SANKHYA_CLIENT_ID")
-SANKHYA_CLIENT_SECRET = os.getenv("SANKHYA_CLIENT_SECRET")
-SANKHYA_X_TOKEN = os.getenv("SANKHYA_X_TOKEN")
+SANKHYA_QUERY_PATH = "/gateway/v1/mge/service.sbr?serviceName=DbExplorerSP.executeQuery&outputType=json"
 
 # Limites de seguranca
 MAX_ROWS = 500
@@ -48,9 +51,7 @@ class QueryExecutionError(Exception):
     """Erro na execucao da query."""
     pass
 
-class AuthenticationError(Exception):
-    """Erro de autenticacao na API Sankhya."""
-    pass
+# AuthenticationError vive no transporte (re-exportado aqui por compatibilidade)
 
 # ============================================================
 # SAFE QUERY EXECUTOR
@@ -78,7 +79,8 @@ class SafeQueryExecutor:
         "INTO DUMPFILE", "LOAD_FILE", "UTL_FILE", "DBMS_", "XP_", "SP_"
     ]
 
-    def __init__(self, whitelist: Optional[list] = None, on_security_event=None):
+    def __init__(self, whitelist: Optional[list] = None, on_security_event=None, transport=None,
+                 cache=None, priority: Optional[str] = None):
         """
         Inicializa o executor.
 
@@ -86,11 +88,16 @@ class SafeQueryExecutor:
             whitelist: Lista opcional de tabelas permitidas (ex: ["TGFPAR", "TGFCAB"])
                       Se None, permite qualquer tabela (somente SELECT)
             on_security_event: Callback(user, event_type, details) para audit log
+            transport: SankhyaTransport (default: pool global do processo)
+            cache: QueryResultCache opcional (None = sem cache, ex: sync do Elastic)
+            priority: classe padrao na fila do Sankhya ("chat", "reports", "background");
+                      query_priority_scope() da task atual tem precedencia
         """
         self.whitelist = [t.upper() for t in whitelist] if whitelist else None
         self.on_security_event = on_security_event
-        self.access_token = None
-        self.token_expires = None
+        self.transport = transport or sankhya_transport
+        self.cache = cache
+        self.priority = priority
 
     # ============================================================
     # VALIDACAO
@@ -198,7 +205,10 @@ class SafeQueryExecutor:
 
     async def _authenticate(self) -> str:
         """
-        Autentica na API Sankhya via OAuth2.
+        Retorna token OAuth do transporte compartilhado.
+
+        O token e unico por processo (SankhyaTransport): todos os executores
+        reaproveitam o mesmo, e o refresh e single-flight.
 
         Returns:
             Access token
@@ -206,59 +216,21 @@ class SafeQueryExecutor:
         Raises:
             AuthenticationError: Se falhar autenticacao
         """
-        # Verificar se token ainda e valido
-        if self.access_token and self.token_expires:
-            if datetime.now() < self.token_expires:
-                return self.access_token
-
-        # Validar credenciais
-        if not all([SANKHYA_CLIENT_ID, SANKHYA_CLIENT_SECRET, SANKHYA_X_TOKEN]):
-            raise AuthenticationError(
-                "Credenciais Sankhya nao configuradas no .env "
-                "(SANKHYA_CLIENT_ID, SANKHYA_CLIENT_SECRET, SANKHYA_X_TOKEN)"
-            )
-
-        url = f"{SANKHYA_BASE_URL}/authenticate"
-        headers = {
-            "X-Token": SANKHYA_X_TOKEN,
-            "Content-Type": "application/x-www-form-urlencoded",
-        }
-        data = {
-            "client_id": SANKHYA_CLIENT_ID,
-            "client_secret": SANKHYA_CLIENT_SECRET,
-            "grant_type": "client_credentials",
-        }
-
-        async with httpx.AsyncClient(timeout=30.0, verify=False) as client:
-            try:
-                response = await client.post(url, headers=headers, data=data)
-                response.raise_for_status()
-
-                result = response.json()
-                self.access_token = result.get("access_token")
-
-                # Token expira em ~5 minutos no Sankhya, usar 4 min por seguranca
-                from datetime import timedelta
-                self.token_expires = datetime.now() + timedelta(minutes=4)
-
-                print("[OK] Token Sankhya obtido (expira em 4 min)")
-                return self.access_token
-
-            except httpx.HTTPStatusError as e:
-                raise AuthenticationError(f"Erro HTTP na autenticacao: {e.response.status_code}")
-            except Exception as e:
-                raise AuthenticationError(f"Erro na autenticacao: {str(e)}")
+        return await self.transport.get_token()
 
     # ============================================================
     # EXECUCAO
     # ============================================================
 
-    async def execute(self, query: str) -> dict:
+    async def execute(self, query: str, use_cache: bool = True, max_rows: int = MAX_ROWS) -> dict:
         """
         Executa query SQL de forma segura.
 
         Args:
             query: SQL SELECT a ser executado
+            use_cache: se False, ignora o cache de resultados (quando configurado)
+            max_rows: limite de linhas (ROWNUM); so relatorios que agregam
+                      localmente pedem mais que MAX_ROWS
 
         Returns:
             dict com:
@@ -281,11 +253,43 @@ class SafeQueryExecutor:
             raise QuerySecurityError(error_msg)
 
         # 2. Adicionar limite de linhas
-        safe_query = self.add_row_limit(query)
+        safe_query = self.add_row_limit(query, max_rows)
 
         # 3. Executar com retry automatico em caso de token expirado
+        #    (via cache compartilhado, se configurado: queries identicas
+        #    concorrentes viram 1 chamada ao Sankhya)
+        if self.cache is not None and use_cache:
+            return await self.cache.get_or_execute(
+                safe_query, lambda: self._execute_with_retry(safe_query)
+            )
         return await self._execute_with_retry(safe_query)
 
+    async def execute_batch(self, queries: list) -> list:
+        """
+        Executa N queries independentes em paralelo.
+
+        A concorrencia e limitada pelo semaforo do tenant (SankhyaTransport),
+        entao um batch grande nao afoga o Sankhya. O custo de um batch e
+        ~max(latencia) em vez da soma.
+
+        Args:
+            queries: lista de SQL SELECT (None = posicao ignorada)
+
+        Returns:
+            Lista de resultados (mesmo formato de execute()), na mesma ordem
+            das queries. Erros de seguranca/execucao viram {"success": False}
+            em vez de exception, para nao derrubar o batch inteiro.
+        """
+        async def _one(query):
+            if not query:
+                return {"success": False, "error": "Query vazia", "data": [], "query_executed": None}
+            try:
+                return await self.execute(query)
+            except (QuerySecurityError, QueryExecutionError) as e:
+                return {"success": False, "error": str(e), "data": [], "query_executed": query[:200]}
+
+        return list(await asyncio.gather(*[_one(q) for q in queries]))
+
     async def _execute_with_retry(self, safe_query: str, retry_count: int = 0) -> dict:
         """
         Executa query com retry automatico em caso de 401/403 (token expirado).
@@ -309,12 +313,7 @@ class SafeQueryExecutor:
                 "query_executed": safe_query,
             }
 
-        # Executar via DbExplorerSP.executeQuery
-        url = f"{SANKHYA_BASE_URL}/gateway/v1/mge/service.sbr?serviceName=DbExplorerSP.executeQuery&outputType=json"
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        }
+        # Executar via DbExplorerSP.executeQuery (conexao reaproveitada do pool)
         payload = {
             "serviceName": "DbExplorerSP.executeQuery",
             "requestBody": {
@@ -322,79 +321,83 @@ class SafeQueryExecutor:
             }
         }
 
-        async with httpx.AsyncClient(timeout=QUERY_TIMEOUT, verify=False) as client:
-            try:
-                response = await client.post(url, headers=headers, json=payload)
-
-                # Verificar se token expirou (401 ou 403)
-                if response.status_code in (401, 403):
-                    if retry_count < MAX_RETRIES:
-                        print(f"[!] Token expirado (HTTP {response.status_code}), re-autenticando...")
-                        # Invalidar token para forcar nova autenticacao
-                        self.access_token = None
-                        self.token_expires = None
-                        # Tentar novamente
-                        return await self._execute_with_retry(safe_query, retry_count + 1)
-                    else:
-                        return {
-                            "success": False,
-                            "error": f"Token expirado e retry falhou (HTTP {response.status_code})",
-                            "query_executed": safe_query,
-                        }
-
-                response.raise_for_status()
-
-                result = response.json()
-
-                # Processar resposta Sankhya
-                if result.get("status") == "1" or result.get("statusMessage") == "OK":
-                    rows = result.get("responseBody", {}).get("rows", [])
-
-                    # Extrair colunas do primeiro registro
-                    columns = []
-                    if rows:
-                        columns = list(rows[0].keys()) if isinstance(rows[0], dict) else []
+        try:
+            async with self.transport.query_slot(priority=self.priority):
+                response = await self.transport.post(
+                    SANKHYA_QUERY_PATH,
+                    token=token,
+                    headers={"Content-Type": "application/json"},
+                    json=payload,
+                    timeout=QUERY_TIMEOUT,
+                )
 
-                    return {
-                        "success": True,
-                        "data": rows,
-                        "columns": columns,
-                        "row_count": len(rows),
-                        "query_executed": safe_query,
-                    }
+            # Verificar se token expirou (401 ou 403)
+            if response.status_code in (401, 403):
+                if retry_count < MAX_RETRIES:
+                    print(f"[!] Token expirado (HTTP {response.status_code}), re-autenticando...")
+                    # Invalidar token para forcar nova autenticacao
+                    self.transport.invalidate_token(token)
+                    # Tentar novamente
+                    return await self._execute_with_retry(safe_query, retry_count + 1)
                 else:
-                    error = result.get("statusMessage", "Erro desconhecido")
                     return {
                         "success": False,
-                        "error": error,
+                        "error": f"Token expirado e retry falhou (HTTP {response.status_code})",
                         "query_executed": safe_query,
                     }
 
-            except httpx.TimeoutException:
-                return {
-                    "success": False,
-                    "error": f"Timeout: query excedeu {QUERY_TIMEOUT} segundos",
-                    "query_executed": safe_query,
-                }
-            except httpx.HTTPStatusError as e:
-                # Se for 401/403 e ainda tem retry disponivel
-                if e.response.status_code in (401, 403) and retry_count < MAX_RETRIES:
-                    print(f"[!] Token expirado (HTTP {e.response.status_code}), re-autenticando...")
-                    self.access_token = None
-                    self.token_expires = None
-                    return await self._execute_with_retry(safe_query, retry_count + 1)
+            response.raise_for_status()
+
+            result = response.json()
+
+            # Processar resposta Sankhya
+            if result.get("status") == "1" or result.get("statusMessage") == "OK":
+                rows = result.get("responseBody", {}).get("rows", [])
+
+                # Extrair colunas do primeiro registro
+                columns = []
+                if rows:
+                    columns = list(rows[0].keys()) if isinstance(rows[0], dict) else []
+
                 return {
-                    "success": False,
-                    "error": f"Erro HTTP: {e.response.status_code}",
+                    "success": True,
+                    "data": rows,
+                    "columns": columns,
+                    "row_count": len(rows),
                     "query_executed": safe_query,
                 }
-            except Exception as e:
+            else:
+                error = result.get("statusMessage", "Erro desconhecido")
                 return {
                     "success": False,
-                    "error": f"Erro na execucao: {str(e)}",
+                    "error": error,
                     "query_executed": safe_query,
                 }
 
+        except httpx.TimeoutException:
+            return {
+                "success": False,
+                "error": f"Timeout: query excedeu {QUERY_TIMEOUT} segundos",
+                "query_executed": safe_query,
+            }
+        except httpx.HTTPStatusError as e:
+            # Se for 401/403 e ainda tem retry disponivel
+            if e.response.status_code in (401, 403) and retry_count < MAX_RETRIES:
+                print(f"[!] Token expirado (HTTP {e.response.status_code}), re-autenticando...")
+                self.transport.invalidate_token(token)
+                return await self._execute_with_retry(safe_query, retry_count + 1)
+            return {
+                "success": False,
+                "error": f"Erro HTTP: {e.response.status_code}",
+                "query_executed": safe_query,
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Erro na execucao: {str(e)}",
+                "query_executed": safe_query,
+            }
+
     # ============================================================
     # FORMATACAO
     # ============================================================
@@ -9,21 +9,35 @@ Registra toda interacao do Smart Agent em arquivo JSONL para:
 
 Storage: data/query_log.jsonl (JSON Lines, append-only)
 Rotacao: 10MB -> query_log_YYYYMM.jsonl
+
+Feedback: eventos append-only em data/query_log.feedback.jsonl, juntados
+com as entradas na leitura (o ultimo evento de cada message_id vence).
+Indice: data/query_log.idx (message_id -> byte offset no JSONL), para
+get_entry/save_feedback em O(1) independente do tamanho do log.
+Agregados: data/query_log.stats.json (snapshot de query_stats.QueryAggregates),
+atualizados a cada linha gravada; analytics/sugestoes leem so os agregados.
+Multi-worker: cada processo tem seu indice/agregados em memoria e, antes de
+usa-los, aplica o que os outros workers anexaram ao log e ao feedback (_catch_up).
 """
 
 import json
 import os
 import uuid
+import time
 import threading
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime
 from collections import Counter
 
+from src.llm.query_stats import QueryAggregates, AGG_RETENTION_DAYS, SNAPSHOT_VERSION
+
 
 PROJECT_ROOT = Path(__file__).parent.parent.parent
 DATA_DIR = PROJECT_ROOT / "data"
 LOG_FILE = DATA_DIR / "query_log.jsonl"
 MAX_LOG_SIZE = 10 * 1024 * 1024  # 10MB
+AGG_SNAPSHOT_EVERY = 50       # linhas gravadas entre snapshots dos agregados
+AGG_SNAPSHOT_INTERVAL = 60    # ou segundos desde o ultimo snapshot
 
 
 class QueryLogger:
@@ -31,7 +45,15 @@ class QueryLogger:
 
     def __init__(self, log_file: Path = None):
         self.log_file = log_file or LOG_FILE
+        self.index_file = self.log_file.with_suffix(".idx")
+        self.feedback_file = self.log_file.with_name(self.log_file.stem + ".feedback.jsonl")
         self._lock = threading.Lock()
+        self._offsets = None   # {message_id: byte offset} (carregado sob demanda)
+        self._feedback = None  # {message_id: feedback} (ultimo evento vence)
+        self.stats_file = self.log_file.with_name(self.log_file.stem + ".stats.json")
+        self._agg = None       # QueryAggregates (carregado sob demanda)
+        self._agg_pending = 0
+        self._agg_saved_at = 0.0
         self._ensure_dir()
 
     def _ensure_dir(self):
@@ -63,6 +85,7 @@ class QueryLogger:
                 "groq_raw": None,
                 "groq_corrected": False,
                 "view_mode": None,
+                "narration": None,
                 "time_ms": 0,
             },
             "result": {
@@ -88,11 +111,24 @@ class QueryLogger:
             print(f"[QLOG] Erro ao salvar: {e}")
 
     def _write_line(self, entry: dict):
-        """Escreve uma linha no JSONL. Thread-safe."""
-        line = json.dumps(entry, ensure_ascii=False, default=str)
+        """Escreve uma linha no JSONL e registra o offset no indice. Thread-safe."""
+        line = (json.dumps(entry, ensure_ascii=False, default=str) + "\n").encode("utf-8")
         with self._lock:
-            with open(self.log_file, "a", encoding="utf-8") as f:
-                f.write(line + "\n")
+            self._ensure_index()
+            self._ensure_aggregates()
+            with open(self.log_file, "ab") as f:
+                f.write(line)
+                f.flush()
+                offset = f.tell() - len(line)  # O_APPEND: fim real, mesmo com outro worker escrevendo
+            self._catch_up(log_end=offset)     # linhas de outros workers antes da nossa
+            msg_id = entry.get("id")
+            if msg_id:
+                self._offsets[msg_id] = offset
+                with open(self.index_file, "a", encoding="utf-8") as f:
+                    f.write(f"{msg_id}\t{offset}\n")
+            self._agg.add(entry, (entry.get("feedback") or {}).get("rating"))
+            self._agg.log_offset = offset + len(line)
+            self._agg_touched()
 
     def log_security_event(self, user_id: str, event_type: str, details: str = ""):
         """
@@ -120,145 +156,348 @@ class QueryLogger:
             if self.log_file.exists() and self.log_file.stat().st_size > MAX_LOG_SIZE:
                 suffix = datetime.now().strftime("%Y%m")
                 rotated = self.log_file.parent / f"query_log_{suffix}.jsonl"
-                # Se ja existe arquivo rotacionado do mes, append
-                if rotated.exists():
-                    with open(self.log_file, "r", encoding="utf-8") as src:
-                        with open(rotated, "a", encoding="utf-8") as dst:
-                            dst.write(src.read())
-                else:
-                    self.log_file.rename(rotated)
-                    return
-                # Limpar arquivo principal
                 with self._lock:
-                    with open(self.log_file, "w", encoding="utf-8") as f:
+                    # Agregados precisam estar em memoria antes: depois da rotacao
+                    # o historico antigo nao esta mais no arquivo principal
+                    self._ensure_aggregates()
+                    # Se ja existe arquivo rotacionado do mes, append
+                    if rotated.exists():
+                        with open(self.log_file, "r", encoding="utf-8") as src:
+                            with open(rotated, "a", encoding="utf-8") as dst:
+                                dst.write(src.read())
+                        # Limpar arquivo principal
+                        with open(self.log_file, "w", encoding="utf-8") as f:
+                            pass
+                    else:
+                        self.log_file.rename(rotated)
+                    # Offsets apontavam para o arquivo principal: zera o indice
+                    self._offsets = {}
+                    with open(self.index_file, "w", encoding="utf-8") as f:
                         pass
+                    self._agg.log_offset = 0
+                    self._save_aggregates()
                 print(f"[QLOG] Log rotacionado -> {rotated.name}")
         except Exception as e:
             print(f"[QLOG] Erro na rotacao: {e}")
 
     # ================================================================
-    # FEEDBACK
+    # INDICE (message_id -> byte offset)
     # ================================================================
 
-    def save_feedback(self, message_id: str, rating: str, comment: str = None) -> bool:
-        """Atualiza o feedback de um registro existente."""
-        try:
-            if not self.log_file.exists():
-                return False
+    def _ensure_index(self):
+        """Carrega o indice do disco (chamar com self._lock).
 
-            lines = []
-            found = False
-            with self._lock:
-                with open(self.log_file, "r", encoding="utf-8") as f:
-                    for line in f:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        try:
-                            entry = json.loads(line)
-                            if entry.get("id") == message_id:
-                                entry["feedback"] = {
-                                    "rating": rating,
-                                    "rated_at": datetime.now().isoformat(timespec="seconds"),
-                                    "comment": comment,
-                                }
-                                found = True
-                            lines.append(json.dumps(entry, ensure_ascii=False, default=str))
-                        except json.JSONDecodeError:
-                            lines.append(line)
-
-                if found:
-                    with open(self.log_file, "w", encoding="utf-8") as f:
-                        f.write("\n".join(lines) + "\n")
-
-            return found
-        except Exception as e:
-            print(f"[QLOG] Erro ao salvar feedback: {e}")
-            return False
-
-    def get_entry(self, message_id: str) -> dict | None:
-        """Busca uma entrada pelo message_id."""
-        try:
-            if not self.log_file.exists():
-                return None
-            with open(self.log_file, "r", encoding="utf-8") as f:
+        O indice e append-only. Se ficou para tras do log (ex: processo caiu
+        entre as duas escritas) indexa so o final do log; se esta inconsistente
+        (offset alem do fim do arquivo) reconstroi do zero.
+        """
+        if self._offsets is not None:
+            return
+        offsets = {}
+        last_offset = -1
+        if self.index_file.exists():
+            with open(self.index_file, "r", encoding="utf-8") as f:
                 for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    try:
-                        entry = json.loads(line)
-                        if entry.get("id") == message_id:
-                            return entry
-                    except json.JSONDecodeError:
-                        continue
-            return None
-        except Exception:
+                    msg_id, _, off = line.rstrip("\n").partition("\t")
+                    if msg_id and off.isdigit():
+                        offsets[msg_id] = int(off)
+                        last_offset = max(last_offset, int(off))
+
+        log_size = self.log_file.stat().st_size if self.log_file.exists() else 0
+        if last_offset >= log_size:
+            offsets, last_offset = {}, -1
+
+        missing = self._scan_offsets(start=max(last_offset, 0), skip_first=last_offset >= 0)
+        if missing:
+            offsets.update(missing)
+            mode = "a" if last_offset >= 0 else "w"
+            with open(self.index_file, mode, encoding="utf-8") as f:
+                f.writelines(f"{k}\t{v}\n" for k, v in missing.items())
+            print(f"[QLOG] Indice atualizado: +{len(missing)} entradas")
+        elif last_offset < 0 and self.index_file.exists():
+            with open(self.index_file, "w", encoding="utf-8") as f:
+                pass
+        self._offsets = offsets
+
+    def _catch_up(self, log_end: int = None):
+        """Aplica o que outros workers gravaram desde a nossa ultima leitura
+        (chamar com self._lock): offsets e agregados das linhas novas do log
+        ate log_end e os eventos novos de feedback. Sem nada novo custa 2 stat().
+        """
+        self._ensure_index()
+        self._ensure_aggregates()
+        agg = self._agg
+        if log_end is None:
+            log_end = self.log_file.stat().st_size if self.log_file.exists() else 0
+        if agg.log_offset > log_end:
+            # Outro worker rotacionou o log: offsets antigos nao valem mais
+            self._offsets = None
+            self._ensure_index()
+            agg.log_offset = 0
+        if agg.log_offset < log_end:
+            for offset, entry in self._iter_log(agg.log_offset):
+                if offset >= log_end:
+                    break
+                if entry.get("id"):
+                    self._offsets[entry["id"]] = offset
+                agg.add(entry, (entry.get("feedback") or {}).get("rating"))
+            agg.log_offset = log_end
+        fb_size = self.feedback_file.stat().st_size if self.feedback_file.exists() else 0
+        if agg.feedback_offset < fb_size:
+            self._replay_feedback(agg, agg.feedback_offset, fb_size)
+            agg.feedback_offset = fb_size
+
+    def _scan_offsets(self, start: int = 0, skip_first: bool = False) -> dict:
+        """Le o log a partir de start e retorna {message_id: offset}."""
+        found = {}
+        for offset, entry in self._iter_log(start):
+            if skip_first and offset == start:
+                continue
+            if entry.get("id"):
+                found[entry["id"]] = offset
+        return found
+
+    def _read_at(self, offset: int) -> dict | None:
+        with open(self.log_file, "rb") as f:
+            f.seek(offset)
+            raw = f.readline()
+        try:
+            return json.loads(raw)
+        except (json.JSONDecodeError, UnicodeDecodeError):
             return None
 
     # ================================================================
-    # LEITURA (para analytics e sugestoes)
+    # AGREGADOS (analytics/sugestoes incrementais)
     # ================================================================
 
-    def _load_entries(self, max_age_days: int = 30) -> list:
-        """Carrega entradas dos ultimos N dias."""
-        entries = []
-        if not self.log_file.exists():
-            return entries
+    def _ensure_aggregates(self):
+        """Carrega snapshot + replay do que foi gravado depois (chamar com self._lock).
 
-        cutoff = datetime.now() - timedelta(days=max_age_days)
+        Sem snapshot valido, reconstroi lendo o arquivo principal inteiro (1 vez).
+        """
+        if self._agg is not None:
+            return
+        snap = None
         try:
-            with open(self.log_file, "r", encoding="utf-8") as f:
+            if self.stats_file.exists():
+                snap = json.loads(self.stats_file.read_text(encoding="utf-8"))
+        except Exception as e:
+            print(f"[QLOG] Snapshot de agregados invalido, reconstruindo: {e}")
+
+        log_size = self.log_file.stat().st_size if self.log_file.exists() else 0
+        fb_size = self.feedback_file.stat().st_size if self.feedback_file.exists() else 0
+        if (snap and snap.get("version") == SNAPSHOT_VERSION
+                and snap.get("log_offset", 0) <= log_size
+                and snap.get("feedback_offset", 0) <= fb_size):
+            agg = QueryAggregates(snap)
+            replayed = 0
+            for _, entry in self._iter_log(agg.log_offset):
+                agg.add(entry, (entry.get("feedback") or {}).get("rating"))
+                replayed += 1
+            if agg.feedback_offset < fb_size:
+                self._ensure_index()
+                replayed += self._replay_feedback(agg, agg.feedback_offset, fb_size)
+            if replayed:
+                print(f"[QLOG] Agregados: snapshot + {replayed} linhas reaplicadas")
+        else:
+            self._ensure_feedback()
+            agg = QueryAggregates()
+            for _, entry in self._iter_log(0):
+                fb = self._feedback.get(entry.get("id")) or entry.get("feedback") or {}
+                agg.add(entry, fb.get("rating"))
+            print(f"[QLOG] Agregados reconstruidos: {len(agg.days)} dias")
+
+        agg.log_offset = log_size
+        agg.feedback_offset = fb_size
+        self._agg = agg
+        self._save_aggregates()
+
+    def _replay_feedback(self, agg: QueryAggregates, start: int, end: int) -> int:
+        """Reaplica os eventos de feedback entre start e end (bytes). Retorna quantos."""
+        replayed = 0
+        with open(self.feedback_file, "rb") as f:
+            f.seek(start)
+            while f.tell() < end:
+                raw = f.readline()
+                if not raw:
+                    break
+                try:
+                    event = json.loads(raw)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    continue
+                msg_id = event.get("id")
+                offset = self._offsets.get(msg_id)
+                entry = self._read_at(offset) if offset is not None else None
+                if entry:
+                    agg.rate(entry, event.get("rating"))
+                if self._feedback is not None and msg_id:
+                    self._feedback[msg_id] = {
+                        "rating": event.get("rating"),
+                        "rated_at": event.get("rated_at"),
+                        "comment": event.get("comment"),
+                    }
+                replayed += 1
+        return replayed
+
+    def _iter_log(self, start: int = 0):
+        """Itera (offset, entry) do arquivo principal a partir de start."""
+        if not self.log_file.exists():
+            return
+        with open(self.log_file, "rb") as f:
+            f.seek(start)
+            while True:
+                offset = f.tell()
+                raw = f.readline()
+                if not raw:
+                    break
+                try:
+                    entry = json.loads(raw)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    continue
+                if isinstance(entry, dict):
+                    yield offset, entry
+
+    def _agg_touched(self):
+        """Conta uma alteracao e grava snapshot a cada N linhas ou T segundos."""
+        self._agg_pending += 1
+        if (self._agg_pending >= AGG_SNAPSHOT_EVERY
+                or time.time() - self._agg_saved_at >= AGG_SNAPSHOT_INTERVAL):
+            self._save_aggregates()
+
+    def _save_aggregates(self):
+        """Grava snapshot compacto (tmp + rename atomico). Chamar com self._lock."""
+        try:
+            self._agg.prune(AGG_RETENTION_DAYS)
+            tmp = self.stats_file.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self._agg.to_dict(), ensure_ascii=False, separators=(",", ":")),
+                           encoding="utf-8")
+            os.replace(tmp, self.stats_file)
+            self._agg_pending = 0
+            self._agg_saved_at = time.time()
+        except Exception as e:
+            print(f"[QLOG] Erro ao gravar snapshot de agregados: {e}")
+
+    def flush(self):
+        """Grava snapshot dos agregados agora (ex: no shutdown da API)."""
+        with self._lock:
+            if self._agg is not None and self._agg_pending:
+                self._save_aggregates()
+
+    # ================================================================
+    # FEEDBACK
+    # ================================================================
+
+    def _ensure_feedback(self):
+        """Carrega os eventos de feedback do disco (chamar com self._lock)."""
+        if self._feedback is not None:
+            return
+        feedback = {}
+        if self.feedback_file.exists():
+            with open(self.feedback_file, "r", encoding="utf-8") as f:
                 for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
                     try:
-                        entry = json.loads(line)
-                        ts = entry.get("timestamp", "")
-                        if ts and ts >= cutoff.isoformat(timespec="seconds"):
-                            entries.append(entry)
+                        event = json.loads(line)
                     except json.JSONDecodeError:
                         continue
+                    if event.get("id"):
+                        feedback[event["id"]] = {
+                            "rating": event.get("rating"),
+                            "rated_at": event.get("rated_at"),
+                            "comment": event.get("comment"),
+                        }
+        self._feedback = feedback
+
+    def _join_feedback(self, entry: dict, feedback: dict) -> dict:
+        fb = feedback.get(entry.get("id"))
+        if fb is not None:
+            entry["feedback"] = dict(fb)
+        return entry
+
+    def save_feedback(self, message_id: str, rating: str, comment: str = None) -> bool:
+        """Registra feedback de uma entrada (append de 1 evento, sem reescrever o log)."""
+        try:
+            with self._lock:
+                self._ensure_feedback()
+                self._catch_up()   # message_id pode ter sido gravado por outro worker
+                if message_id not in self._offsets:
+                    return False
+                fb = {
+                    "rating": rating,
+                    "rated_at": datetime.now().isoformat(timespec="seconds"),
+                    "comment": comment,
+                }
+                line = json.dumps({"id": message_id, **fb}, ensure_ascii=False, default=str)
+                raw = (line + "\n").encode("utf-8")
+                with open(self.feedback_file, "ab") as f:
+                    f.write(raw)
+                    f.flush()
+                    feedback_end = f.tell()
+                if self._agg.feedback_offset < feedback_end - len(raw):
+                    # evento de outro worker entre o _catch_up e a nossa escrita
+                    self._replay_feedback(self._agg, self._agg.feedback_offset, feedback_end - len(raw))
+                self._feedback[message_id] = fb
+
+                entry = self._read_at(self._offsets[message_id])
+                if entry:
+                    self._agg.rate(entry, rating)
+                self._agg.feedback_offset = feedback_end
+                self._agg_touched()
+            return True
         except Exception as e:
-            print(f"[QLOG] Erro ao carregar: {e}")
+            print(f"[QLOG] Erro ao salvar feedback: {e}")
+            return False
 
-        return entries
+    def get_entry(self, message_id: str) -> dict | None:
+        """Busca uma entrada pelo message_id (seek direto pelo indice)."""
+        try:
+            with self._lock:
+                self._ensure_feedback()
+                self._catch_up()
+                offset = self._offsets.get(message_id)
+                if offset is None:
+                    return None
+                entry = self._read_at(offset)
+                feedback = self._feedback
+            if not entry or entry.get("id") != message_id:
+                return None
+            return self._join_feedback(entry, feedback)
+        except Exception:
+            return None
 
     # ================================================================
     # SUGESTOES
     # ================================================================
 
     def get_suggestions(self, user: str = None) -> dict:
-        """Gera sugestoes de perguntas baseadas no historico."""
-        entries = self._load_entries(max_age_days=30)
-        if not entries:
+        """Gera sugestoes de perguntas baseadas no historico (agregados, 30 dias)."""
+        with self._lock:
+            self._catch_up()
+            buckets = self._agg.window(30)
+
+            # Popular: perguntas com feedback positivo ou sem negativo
+            question_stats = {}  # {question_normalized: {count, positive, negative, question}}
+            for b in buckets:
+                for q, (question, count, pos, neg) in b["questions"].items():
+                    if q not in question_stats:
+                        question_stats[q] = {"count": 0, "positive": 0, "negative": 0, "question": question}
+                    question_stats[q]["count"] += count
+                    question_stats[q]["positive"] += pos
+                    question_stats[q]["negative"] += neg
+
+            user_upper = (user or "").upper()
+            user_buckets = [b["users"][user_upper] for b in buckets if user and user_upper in b["users"]]
+            positives = [p for ub in user_buckets for p in ub["positive"].values()]
+            marca_counter = Counter()
+            for ub in user_buckets:
+                marca_counter.update(ub["marcas"])
+
+        if not buckets:
             return {
                 "popular": self._default_suggestions(),
                 "recent_successful": [],
                 "personalized": [],
             }
 
-        # Popular: perguntas com feedback positivo ou sem negativo
-        question_stats = {}  # {question_normalized: {count, positive, negative}}
-        for e in entries:
-            q = e.get("question_normalized", "")
-            if not q or len(q) < 5:
-                continue
-            proc = e.get("processing", {})
-            intent = proc.get("intent", "")
-            if intent in ("saudacao", "ajuda"):
-                continue
-
-            if q not in question_stats:
-                question_stats[q] = {"count": 0, "positive": 0, "negative": 0, "question": e.get("question", q)}
-            question_stats[q]["count"] += 1
-            rating = (e.get("feedback") or {}).get("rating")
-            if rating == "positive":
-                question_stats[q]["positive"] += 1
-            elif rating == "negative":
-                question_stats[q]["negative"] += 1
-
         # Top 10 populares (mais usadas, sem muitos negativos)
         popular_sorted = sorted(
             question_stats.values(),
@@ -269,42 +508,25 @@ class QueryLogger:
 
         # Recent successful: ultimas 5 do usuario com feedback positivo
         recent_successful = []
-        if user:
-            user_upper = user.upper()
-            user_entries = [e for e in entries if e.get("user", "").upper() == user_upper]
-            for e in reversed(user_entries):
-                rating = (e.get("feedback") or {}).get("rating")
-                if rating == "positive":
-                    q = e.get("question", "")
-                    if q and q not in recent_successful:
-                        recent_successful.append(q)
-                        if len(recent_successful) >= 5:
-                            break
-
-        # Personalized: marcas/intents mais usados pelo usuario -> templates
+        for _, q in sorted(reversed(positives), key=lambda p: p[0], reverse=True):
+            if q and q not in recent_successful:
+                recent_successful.append(q)
+                if len(recent_successful) >= 5:
+                    break
+
+        # Personalized: marcas mais usadas pelo usuario -> templates
         personalized = []
-        if user:
-            user_upper = user.upper()
-            user_entries = [e for e in entries if e.get("user", "").upper() == user_upper]
-            marca_counter = Counter()
-            for e in user_entries:
-                entities = (e.get("processing") or {}).get("entities") or {}
-                marca = entities.get("marca")
-                if marca:
-                    marca_counter[marca] += 1
-
-            # Gerar sugestoes pra marcas mais usadas
-            templates = [
-                "pendencias da {marca}",
-                "pedidos atrasados da {marca}",
-                "o que falta chegar da {marca}",
-            ]
-            used_marcas = [m for m, _ in marca_counter.most_common(3)]
-            for marca in used_marcas:
-                template = templates[len(personalized) % len(templates)]
-                suggestion = template.format(marca=marca.title())
-                if suggestion not in personalized:
-                    personalized.append(suggestion)
+        templates = [
+            "pendencias da {marca}",
+            "pedidos atrasados da {marca}",
+            "o que falta chegar da {marca}",
+        ]
+        used_marcas = [m for m, _ in marca_counter.most_common(3)]
+        for marca in used_marcas:
+            template = templates[len(personalized) % len(templates)]
+            suggestion = template.format(marca=marca.title())
+            if suggestion not in personalized:
+                personalized.append(suggestion)
 
         if not popular:
             popular = self._default_suggestions()
@@ -330,9 +552,33 @@ class QueryLogger:
     # ================================================================
 
     def get_analytics(self, days: int = 30) -> dict:
-        """Gera analytics completo para admin."""
-        entries = self._load_entries(max_age_days=days)
-        total = len(entries)
+        """Gera analytics completo para admin (agregados por dia, ate AGG_RETENTION_DAYS)."""
+        with self._lock:
+            self._catch_up()
+            buckets = self._agg.window(days)
+            total = sum(b["total"] for b in buckets)
+            positive = sum(b["positive"] for b in buckets)
+            negative = sum(b["negative"] for b in buckets)
+            by_intent = QueryAggregates.merge_triples(buckets, "by_intent")
+            by_layer = QueryAggregates.merge_triples(buckets, "by_layer")
+            latency = QueryAggregates.latency_summary(buckets)
+
+            # Problem queries: perguntas com feedback negativo
+            problem_counter = {}
+            for b in buckets:
+                for q, (question, neg, last_seen) in b["problems"].items():
+                    if q not in problem_counter:
+                        problem_counter[q] = {"question": question, "count": 0, "negative": 0, "last_seen": last_seen}
+                    problem_counter[q]["count"] += neg
+                    problem_counter[q]["negative"] += neg
+                    if last_seen > problem_counter[q]["last_seen"]:
+                        problem_counter[q]["last_seen"] = last_seen
+
+            improvement_suggestions = self._generate_improvements(
+                QueryAggregates.merge_counts(buckets, "corrections"),
+                QueryAggregates.merge_counts(buckets, "fallback"),
+                QueryAggregates.merge_counts(buckets, "llm_intents"),
+            )
 
         if total == 0:
             return {
@@ -343,58 +589,14 @@ class QueryLogger:
                 "by_layer": {},
                 "problem_queries": [],
                 "improvement_suggestions": [],
+                "latency": latency,
             }
 
-        # Feedback summary
-        positive = sum(1 for e in entries if (e.get("feedback") or {}).get("rating") == "positive")
-        negative = sum(1 for e in entries if (e.get("feedback") or {}).get("rating") == "negative")
         no_feedback = total - positive - negative
         rated = positive + negative
         satisfaction = round((positive / rated * 100), 1) if rated > 0 else 0
-
-        # By intent
-        by_intent = {}
-        for e in entries:
-            intent = (e.get("processing") or {}).get("intent") or "unknown"
-            if intent not in by_intent:
-                by_intent[intent] = {"total": 0, "positive": 0, "negative": 0}
-            by_intent[intent]["total"] += 1
-            rating = (e.get("feedback") or {}).get("rating")
-            if rating == "positive":
-                by_intent[intent]["positive"] += 1
-            elif rating == "negative":
-                by_intent[intent]["negative"] += 1
-
-        # By layer
-        by_layer = {}
-        for e in entries:
-            layer = (e.get("processing") or {}).get("layer") or "unknown"
-            if layer not in by_layer:
-                by_layer[layer] = {"total": 0, "positive": 0, "negative": 0}
-            by_layer[layer]["total"] += 1
-            rating = (e.get("feedback") or {}).get("rating")
-            if rating == "positive":
-                by_layer[layer]["positive"] += 1
-            elif rating == "negative":
-                by_layer[layer]["negative"] += 1
-
-        # Problem queries: perguntas com feedback negativo
-        negative_entries = [e for e in entries if (e.get("feedback") or {}).get("rating") == "negative"]
-        problem_counter = {}
-        for e in negative_entries:
-            q = e.get("question_normalized", e.get("question", "?"))
-            if q not in problem_counter:
-                problem_counter[q] = {"question": e.get("question", q), "count": 0, "negative": 0, "last_seen": e.get("timestamp", "")}
-            problem_counter[q]["count"] += 1
-            problem_counter[q]["negative"] += 1
-            if e.get("timestamp", "") > problem_counter[q]["last_seen"]:
-                problem_counter[q]["last_seen"] = e.get("timestamp", "")
-
         problem_queries = sorted(problem_counter.values(), key=lambda x: x["negative"], reverse=True)[:10]
 
-        # Improvement suggestions
-        improvement_suggestions = self._generate_improvements(entries)
-
         return {
             "total_queries": total,
             "period": f"last_{days}_days",
@@ -408,24 +610,15 @@ class QueryLogger:
             "by_layer": by_layer,
             "problem_queries": problem_queries,
             "improvement_suggestions": improvement_suggestions,
+            "latency": latency,
         }
 
-    def _generate_improvements(self, entries: list) -> list:
+    def _generate_improvements(self, groq_corrections: Counter, fallback_questions: Counter,
+                               llm_intents: Counter) -> list:
         """Gera sugestoes automaticas de melhoria baseadas nos padroes."""
         suggestions = []
 
         # 1. Groq corrections frequentes (pos-processamento corrigiu algo)
-        groq_corrections = Counter()
-        for e in entries:
-            proc = e.get("processing") or {}
-            if proc.get("groq_corrected"):
-                raw = proc.get("groq_raw") or {}
-                # Detectar qual campo foi corrigido
-                tags = e.get("auto_tags") or []
-                for tag in tags:
-                    if "corrected" in tag:
-                        groq_corrections[tag] += 1
-
         for correction, count in groq_corrections.most_common(5):
             if count >= 3:
                 suggestions.append({
@@ -435,14 +628,6 @@ class QueryLogger:
                 })
 
         # 2. Queries que caem em fallback frequentemente
-        fallback_questions = Counter()
-        for e in entries:
-            proc = e.get("processing") or {}
-            if proc.get("layer") == "fallback":
-                q = e.get("question_normalized", "")
-                if q:
-                    fallback_questions[q] += 1
-
         for q, count in fallback_questions.most_common(5):
             if count >= 3:
                 suggestions.append({
@@ -453,14 +638,6 @@ class QueryLogger:
 
         # 3. Layer 2 (LLM) muito frequente para um mesmo intent
         # Indica que scoring poderia resolver mas nao tem keywords suficientes
-        llm_intents = Counter()
-        for e in entries:
-            proc = e.get("processing") or {}
-            layer = proc.get("layer", "")
-            intent = proc.get("intent", "")
-            if layer in ("groq", "ollama") and intent:
-                llm_intents[intent] += 1
-
         for intent, count in llm_intents.most_common(3):
             if count >= 10:
                 suggestions.append({
@@ -0,0 +1,231 @@
+"""
+MMarra Data Hub - Agregados incrementais do Query Log.
+
+Mantem contadores por dia (intent, layer, feedback, popularidade de perguntas,
+marcas por usuario, histograma de latencia) atualizados a cada linha gravada
+no query_log.jsonl. /api/analytics e /api/suggestions leem daqui em vez de
+re-parsear 30 dias de log.
+
+Estrutura (tudo serializavel em JSON, para o snapshot em disco):
+    days[YYYY-MM-DD] = {
+        "total", "positive", "negative",
+        "by_intent":  {intent: [total, pos, neg]},
+        "by_layer":   {layer: [total, pos, neg]},
+        "questions":  {q_norm: [question, count, pos, neg]},  # candidatas a sugestao
+        "problems":   {q_norm: [question, neg, last_seen]},
+        "users":      {USER: {"marcas": {marca: n}, "positive": {msg_id: [ts, question]}}},
+        "corrections": {tag: n}, "fallback": {q_norm: n}, "llm_intents": {intent: n},
+        "latency":    [n por faixa de LATENCY_BUCKETS_MS + 1 overflow],
+    }
+    ratings[msg_id] = [day, rating]  # rating aplicado (para trocar feedback depois)
+
+Nao e thread-safe: o QueryLogger chama tudo sob o proprio lock.
+"""
+
+from datetime import datetime, timedelta
+from collections import Counter
+
+
+AGG_RETENTION_DAYS = 90
+LATENCY_BUCKETS_MS = [250, 500, 1000, 2000, 5000, 10000, 30000]
+SNAPSHOT_VERSION = 1
+
+_RATING_SLOT = {"positive": 1, "negative": 2}
+_SKIP_SUGGESTION_INTENTS = ("saudacao", "ajuda")
+
+
+def _new_day() -> dict:
+    return {
+        "total": 0, "positive": 0, "negative": 0,
+        "by_intent": {}, "by_layer": {},
+        "questions": {}, "problems": {}, "users": {},
+        "corrections": {}, "fallback": {}, "llm_intents": {},
+        "latency": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+    }
+
+
+def _bump(counter: dict, key: str, n: int = 1):
+    counter[key] = counter.get(key, 0) + n
+
+
+def entry_meta(entry: dict) -> dict:
+    """Extrai do registro so o que os agregados precisam."""
+    proc = entry.get("processing") or {}
+    ts = entry.get("timestamp", "")
+    q = entry.get("question_normalized", "")
+    intent = proc.get("intent", "")
+    return {
+        "ts": ts,
+        "day": ts[:10],
+        "intent": proc.get("intent") or "unknown",
+        "layer": proc.get("layer") or "unknown",
+        "q": q,
+        "question": entry.get("question", q),
+        "problem_key": entry.get("question_normalized", entry.get("question", "?")),
+        "user": (entry.get("user") or "").upper(),
+        "suggest": bool(q) and len(q) >= 5 and intent not in _SKIP_SUGGESTION_INTENTS,
+    }
+
+
+class QueryAggregates:
+    """Agregados por dia do query log, atualizados linha a linha."""
+
+    def __init__(self, data: dict = None):
+        data = data or {}
+        self.days = data.get("days", {})
+        self.ratings = data.get("ratings", {})
+        self.log_offset = data.get("log_offset", 0)
+        self.feedback_offset = data.get("feedback_offset", 0)
+
+    # ============================================================
+    # ATUALIZACAO
+    # ============================================================
+
+    def add(self, entry: dict, rating: str = None):
+        """Conta um registro novo (rating = feedback ja conhecido, se houver)."""
+        meta = entry_meta(entry)
+        if not meta["ts"]:
+            return
+        day = self.days.get(meta["day"])
+        if day is None:
+            day = self.days[meta["day"]] = _new_day()
+
+        day["total"] += 1
+        day["by_intent"].setdefault(meta["intent"], [0, 0, 0])[0] += 1
+        day["by_layer"].setdefault(meta["layer"], [0, 0, 0])[0] += 1
+        if meta["suggest"]:
+            day["questions"].setdefault(meta["q"], [meta["question"], 0, 0, 0])[1] += 1
+
+        user = day["users"].setdefault(meta["user"], {"marcas": {}, "positive": {}})
+        proc = entry.get("processing") or {}
+        marca = (proc.get("entities") or {}).get("marca")
+        if marca:
+            _bump(user["marcas"], marca)
+
+        if proc.get("groq_corrected"):
+            for tag in entry.get("auto_tags") or []:
+                if "corrected" in tag:
+                    _bump(day["corrections"], tag)
+        layer = proc.get("layer", "")
+        if layer == "fallback" and meta["q"]:
+            _bump(day["fallback"], meta["q"])
+        if layer in ("groq", "ollama") and proc.get("intent", ""):
+            _bump(day["llm_intents"], proc["intent"])
+
+        time_ms = proc.get("time_ms")
+        if proc and isinstance(time_ms, (int, float)):
+            slot = len(LATENCY_BUCKETS_MS)
+            for i, limit in enumerate(LATENCY_BUCKETS_MS):
+                if time_ms <= limit:
+                    slot = i
+                    break
+            day["latency"][slot] += 1
+
+        if rating in _RATING_SLOT:
+            self.rate(entry, rating)
+
+    def rate(self, entry: dict, rating: str):
+        """Aplica (ou troca) o feedback de um registro ja contado."""
+        msg_id = entry.get("id")
+        meta = entry_meta(entry)
+        old = (self.ratings.get(msg_id) or [None, None])[1]
+        day = self.days.get(meta["day"])
+        if day is None or old == rating:
+            return
+
+        for value, sign in ((old, -1), (rating, 1)):
+            slot = _RATING_SLOT.get(value)
+            if slot is None:
+                continue
+            day[value] += sign
+            day["by_intent"].setdefault(meta["intent"], [0, 0, 0])[slot] += sign
+            day["by_layer"].setdefault(meta["layer"], [0, 0, 0])[slot] += sign
+            if meta["suggest"]:
+                day["questions"].setdefault(meta["q"], [meta["question"], 0, 0, 0])[slot + 1] += sign
+
+            if value == "negative":
+                key = meta["problem_key"]
+                prob = day["problems"].setdefault(key, [meta["question"], 0, ""])
+                prob[1] += sign
+                if sign > 0:
+                    prob[2] = max(prob[2], meta["ts"])
+                if prob[1] <= 0:
+                    del day["problems"][key]
+            else:
+                positives = day["users"].setdefault(meta["user"], {"marcas": {}, "positive": {}})["positive"]
+                if sign > 0:
+                    positives[msg_id] = [meta["ts"], meta["question"]]
+                else:
+                    positives.pop(msg_id, None)
+
+        if rating in _RATING_SLOT:
+            self.ratings[msg_id] = [meta["day"], rating]
+        else:
+            self.ratings.pop(msg_id, None)
+
+    def prune(self, retention_days: int = AGG_RETENTION_DAYS):
+        """Descarta dias fora da retencao."""
+        cutoff = (datetime.now() - timedelta(days=retention_days)).date().isoformat()
+        old_days = [d for d in self.days if d < cutoff]
+        for d in old_days:
+            del self.days[d]
+        if old_days:
+            self.ratings = {k: v for k, v in self.ratings.items() if v[0] >= cutoff}
+
+    def to_dict(self) -> dict:
+        return {
+            "version": SNAPSHOT_VERSION,
+            "log_offset": self.log_offset,
+            "feedback_offset": self.feedback_offset,
+            "days": self.days,
+            "ratings": self.ratings,
+        }
+
+    # ============================================================
+    # LEITURA
+    # ============================================================
+
+    def window(self, days: int) -> list:
+        """Buckets diarios dos ultimos N dias (granularidade de dia), em ordem."""
+        start = (datetime.now() - timedelta(days=days)).date().isoformat()
+        return [self.days[d] for d in sorted(self.days) if d >= start]
+
+    @staticmethod
+    def merge_counts(buckets: list, field: str) -> Counter:
+        total = Counter()
+        for b in buckets:
+            total.update(b[field])
+        return total
+
+    @staticmethod
+    def merge_triples(buckets: list, field: str) -> dict:
+        """Soma {key: [total, pos, neg]} -> {key: {"total","positive","negative"}}."""
+        out = {}
+        for b in buckets:
+            for key, (t, p, n) in b[field].items():
+                acc = out.setdefault(key, {"total": 0, "positive": 0, "negative": 0})
+                acc["total"] += t
+                acc["positive"] += p
+                acc["negative"] += n
+        return out
+
+    @staticmethod
+    def latency_summary(buckets: list) -> dict:
+        """Histograma de latencia + percentis aproximados (limite superior da faixa)."""
+        hist = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        for b in buckets:
+            hist = [a + c for a, c in zip(hist, b["latency"])]
+        labels = [f"<={ms}ms" for ms in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        total = sum(hist)
+
+        def percentile(p):
+            if total == 0:
+                return None
+            acc = 0
+            for i, count in enumerate(hist):
+                acc += count
+                if acc >= total * p:
+                    return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else None
+            return None
+
+        return {"histogram": dict(zip(labels, hist)), "p50_ms": percentile(0.5), "p95_ms": percentile(0.95)}
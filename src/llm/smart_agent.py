@@ -6,6 +6,7 @@ Arquitetura modular:
 - src/core/groq_client.py: GroqKeyPool, pools, groq_request
 - src/agent/scoring.py: INTENT_SCORES, score_intent, thresholds
 - src/agent/entities.py: extract_entities, EMPRESA_DISPLAY
+- src/agent/entity_dictionary.py: EntityDictionary (marcas/empresas/compradores + EntityMatcher)
 - src/agent/context.py: ConversationContext, detect_followup, detect_filter_request, apply_filters
 - src/agent/classifier.py: LLM_CLASSIFIER_PROMPT, groq_classify, llm_classify
 - src/agent/narrator.py: llm_narrate, build_*_summary
@@ -27,6 +28,8 @@ from typing import Optional
 from datetime import datetime
 
 from src.core.utils import normalize, tokenize, fmt_brl, fmt_num, trunc, safe_sql
+from src.core.query_cache import query_cache, cache_scope, scope_from_context
+from src.core.query_scheduler import query_priority, query_owner
 from src.core.groq_client import (
     GroqKeyPool, pool_classify, pool_narrate, pool_train,
     groq_request, GROQ_MODEL, GROQ_MODEL_CLASSIFY
@@ -39,6 +42,11 @@ from src.agent.scoring import (
     EXISTING_SQL_COLUMNS, EXTRA_SQL_FIELDS
 )
 from src.agent.entities import extract_entities, EMPRESA_DISPLAY, PERIODO_NOMES
+from src.agent.entity_dictionary import EntityDictionary
+from src.agent.request_context import (
+    RequestContext, request_var, current_request, parse_question, parsed_for
+)
+from src.agent.session import session_store
 from src.agent.context import (
     ConversationContext, build_context_hint,
     detect_followup, detect_filter_request, apply_filters,
@@ -49,7 +57,7 @@ from src.agent.classifier import (
     USE_LLM_CLASSIFIER
 )
 from src.agent.narrator import (
-    llm_narrate, build_pendencia_summary, build_vendas_summary, build_estoque_summary,
+    llm_narrate, mark_narration, build_pendencia_summary, build_vendas_summary, build_estoque_summary,
     build_produto_summary, USE_LLM_NARRATOR
 )
 from src.agent.product import (
@@ -178,11 +186,10 @@ class SmartAgent:
             on_security_event=lambda evt, details: self.query_logger.log_security_event(
                 "SYSTEM", evt, details
             ),
+            cache=query_cache,
         )
-        self._known_marcas = set()
-        self._known_empresas = set()
-        self._known_compradores = set()
-        self._entities_loaded = False
+        # Marcas/empresas/compradores: snapshot em disco + refresh em background
+        self.entities = EntityDictionary()
         self.kb = KnowledgeBase()  # Knowledge Base para perguntas sobre processos
         self.alias_resolver = AliasResolver()  # Apelidos de produto
         self.query_logger = QueryLogger()
@@ -193,8 +200,7 @@ class SmartAgent:
             self.elastic = ElasticSearchEngine()
         except Exception:
             self.elastic = None
-        # Contexto POR USUARIO
-        self._user_contexts = {}  # {user_id: ConversationContext}
+        # Contexto POR USUARIO: vive na SessionMemory (session_store, LRU + orcamento de memoria)
         # Carregar knowledge compilado (auto-gerado)
         _load_compiled_knowledge()
 
@@ -202,60 +208,75 @@ class SmartAgent:
         """Retorna (ou cria) contexto do usuario."""
         if not user_id:
             user_id = "__default__"
-        if user_id not in self._user_contexts:
-            self._user_contexts[user_id] = ConversationContext(user_id)
-        return self._user_contexts[user_id]
+        return session_store.get_context(user_id)
 
     def clear_user(self, user_id: str):
         """Limpa contexto de um usuario especifico (logout)."""
-        if user_id in self._user_contexts:
-            del self._user_contexts[user_id]
-            print(f"[CTX] Contexto limpo: {user_id}")
+        session_store.reset(user_id or "__default__")
+        print(f"[CTX] Contexto limpo: {user_id}")
 
     def clear(self):
         """Limpa todos os contextos (compatibilidade)."""
-        self._user_contexts.clear()
+        session_store.clear()
         print(f"[CTX] Todos os contextos limpos")
 
+    # Dicionarios vem do snapshot atual (trocado inteiro pelo refresh em background)
+    @property
+    def _known_marcas(self) -> frozenset:
+        return self.entities.current.marcas
+
+    @property
+    def _known_empresas(self) -> frozenset:
+        return self.entities.current.empresas
+
+    @property
+    def _known_compradores(self) -> frozenset:
+        return self.entities.current.compradores
+
+    @property
+    def _entity_matcher(self):
+        return self.entities.current.matcher
+
     async def _load_entities(self):
-        """Carrega entidades do banco (1x, depois cache)."""
-        if self._entities_loaded:
-            return
-        try:
-            # Marcas
-            r = await self.executor.execute("SELECT UPPER(TRIM(DESCRICAO)) AS M FROM TGFMAR WHERE DESCRICAO IS NOT NULL")
-            if r.get("success"):
-                for row in r.get("data", []):
-                    v = row.get("M", row[0] if isinstance(row, (list, tuple)) else "") if isinstance(row, dict) else (str(row[0]) if isinstance(row, (list, tuple)) and row else "")
-                    if v and len(v) > 1: self._known_marcas.add(v.strip())
-            # Empresas
-            r = await self.executor.execute("SELECT UPPER(TRIM(NOMEFANTASIA)) AS E FROM TSIEMP WHERE NOMEFANTASIA IS NOT NULL")
-            if r.get("success"):
-                for row in r.get("data", []):
-                    v = row.get("E", row[0] if isinstance(row, (list, tuple)) else "") if isinstance(row, dict) else (str(row[0]) if isinstance(row, (list, tuple)) and row else "")
-                    if v and len(v) > 1: self._known_empresas.add(v.strip())
-            # Compradores (via marcas)
-            r = await self.executor.execute("SELECT DISTINCT UPPER(TRIM(V.APELIDO)) AS C FROM TGFVEN V JOIN TGFMAR M ON M.AD_CODVEND = V.CODVEND WHERE V.APELIDO IS NOT NULL")
-            if r.get("success"):
-                for row in r.get("data", []):
-                    v = row.get("C", row[0] if isinstance(row, (list, tuple)) else "") if isinstance(row, dict) else (str(row[0]) if isinstance(row, (list, tuple)) and row else "")
-                    if v and len(v) > 1: self._known_compradores.add(v.strip())
-            print(f"[SMART] Entidades: {len(self._known_marcas)} marcas, {len(self._known_empresas)} empresas, {len(self._known_compradores)} compradores")
-        except Exception as e:
-            print(f"[SMART] Erro ao carregar entidades: {e}")
-        self._entities_loaded = True
+        """Garante dicionarios carregados (snapshot do disco; sem ele, busca no banco)."""
+        await self.entities.ensure_loaded(self.executor)
+
+    def _parsed(self, question: str):
+        """ParsedQuestion do request atual (ou parse novo se a pergunta for outra)."""
+        return parsed_for(question, self.entities.current)
 
     async def ask(self, question: str, user_context: dict = None) -> Optional[dict]:
         """Entry point com logging integrado."""
         user_id = (user_context or {}).get("user", "")
         _log = self.query_logger.create_entry(question, user=user_id)
 
+        # Escopo RBAC do cache de queries (compartilhado com /api/reports)
+        _scope_token = cache_scope.set(scope_from_context(user_context))
+        # Fila do Sankhya: chat na frente de relatorios/background, round-robin por usuario
+        _prio_token = query_priority.set("chat")
+        _owner_token = query_owner.set(user_id)
+        # Pergunta parseada 1x + estado do request (isolado por task, nao no self)
+        req = None
+        _req_token = None
         try:
+            await self._load_entities()
+            req = RequestContext(parse_question(question, self.entities.current), user_id)
+            _req_token = request_var.set(req)
             result = await self._ask_core(question, user_context, _log)
         except Exception as e:
             print(f"[SMART] Erro no ask: {e}")
             result = self._handle_fallback(question)
             _log["processing"]["layer"] = "error"
+        finally:
+            if _req_token is not None:
+                request_var.reset(_req_token)
+            query_owner.reset(_owner_token)
+            query_priority.reset(_prio_token)
+            cache_scope.reset(_scope_token)
+
+        # Narracao via Groq custa a mais no rate limiter (alem da rota)
+        if req is not None and req.narration:
+            _log["processing"]["narration"] = req.narration
 
         # Finalizar log e salvar
         try:
@@ -270,10 +291,13 @@ class SmartAgent:
 
         if result:
             result["message_id"] = _log["id"]
+            result["_route"] = (_log.get("processing") or {}).get("layer")  # custo no rate limiter
+            result["_narration"] = (_log.get("processing") or {}).get("narration")
 
             # B2: Registrar termos sem match como sugestao de alias
             query_results = result.get("query_results")
-            produto_nome_used = getattr(self, '_last_produto_nome', None)
+            produto_nome_used = req.produto_nome if req else None
+            session = session_store.get(user_id or "__default__") if produto_nome_used else None
 
             if query_results == 0 and produto_nome_used:
                 self.alias_resolver.suggest_alias(
@@ -281,30 +305,31 @@ class SmartAgent:
                     context=question,
                     user=user_id
                 )
-                # B4: Salvar failed term para deteccao de sequencia
-                if not hasattr(self, '_failed_terms'):
-                    self._failed_terms = {}
-                self._failed_terms[user_id] = produto_nome_used
+                # B4: Salvar failed term (na sessao do usuario) para deteccao de sequencia
+                session.failed_term = produto_nome_used
             elif query_results and query_results > 0 and produto_nome_used:
                 # B4: Sequencia detectada - query anterior falhou, esta passou
-                failed = getattr(self, '_failed_terms', {}).get(user_id)
+                failed = session.failed_term
                 if failed and failed != produto_nome_used:
                     codprod_found = None
                     detail = result.get("_detail_data") or []
                     if detail and isinstance(detail[0], dict):
                         codprod_found = detail[0].get("CODPROD")
                     self.alias_resolver.detect_alias_from_sequence(failed, produto_nome_used, codprod_found)
-                    self._failed_terms.pop(user_id, None)
-
-            self._last_produto_nome = None
+                    session.failed_term = None
 
             # Prefixar resposta com alias resolvido
-            if hasattr(self, '_last_alias_resolved') and self._last_alias_resolved:
-                alias_info = self._last_alias_resolved
-                self._last_alias_resolved = None
+            if req and req.alias_resolved:
+                alias_info = req.alias_resolved
                 resp = result.get("response", "")
                 prefix = f"*'{alias_info['from']}' = {alias_info['to']}*\n\n"
                 result["response"] = prefix + resp
+
+        # Multi-worker: grava a sessao no backend compartilhado (no-op em memory)
+        try:
+            session_store.save(user_id or "__default__")
+        except Exception as e:
+            print(f"[SESSION] Erro ao salvar estado: {e}")
         return result
 
     def _finalize_log(self, _log: dict, result: dict, _detail_data: list = None):
@@ -351,16 +376,18 @@ class SmartAgent:
     async def _ask_core(self, question: str, user_context: dict = None, _log: dict = None) -> Optional[dict]:
         await self._load_entities()
         t0 = time.time()
-        tokens = tokenize(question)
-        q_norm = normalize(question)
+        parsed = self._parsed(question)
+        req = current_request()
+        tokens = list(parsed.tokens)
+        q_norm = parsed.q_norm
         user_id = (user_context or {}).get("user", "__default__")
         ctx = self._get_context(user_id)
         context_hint = build_context_hint(ctx)
 
         # Score de cada intent
-        scores = score_intent(tokens)
-        best_intent = max(scores, key=scores.get)
-        best_score = scores[best_intent]
+        scores = parsed.scores
+        best_intent = parsed.best_intent
+        best_score = parsed.best_score
 
         if _log:
             _log["processing"]["score"] = best_score
@@ -388,8 +415,8 @@ class SmartAgent:
             return self._handle_ajuda()
 
         # ========== DETECTAR FOLLOW-UP (referencia a dados anteriores) ==========
-        is_followup = detect_followup(tokens, q_norm)
-        filters = detect_filter_request(q_norm, tokens) if is_followup else {}
+        is_followup = parsed.is_followup
+        filters = dict(parsed.filters) if is_followup else {}
 
         if is_followup and ctx.has_data() and filters:
             # Filtrar dados anteriores
@@ -400,7 +427,7 @@ class SmartAgent:
                 return result
 
         # ========== EXTRAIR PARAMETROS + MERGE COM CONTEXTO ==========
-        params = extract_entities(question, self._known_marcas, self._known_empresas, self._known_compradores)
+        params = parsed.params()
         has_entity = (params.get("marca") or params.get("fornecedor") or params.get("comprador")
                       or params.get("empresa") or params.get("codprod") or params.get("codigo_fabricante")
                       or params.get("produto_nome"))
@@ -424,10 +451,11 @@ class SmartAgent:
                 print(f"[CTX] Herdando intent: {best_intent} (follow-up sem score)")
 
         # Salvar produto_nome original para B2 (registro de termos sem match)
-        self._last_produto_nome = params.get("produto_nome")
+        if req:
+            req.produto_nome = params.get("produto_nome")
+            req.alias_resolved = None
 
         # ========== LAYER 0.4: ALIAS RESOLVER ==========
-        self._last_alias_resolved = None
         if params.get("produto_nome"):
             alias = self.alias_resolver.resolve(params["produto_nome"])
             if alias:
@@ -438,7 +466,8 @@ class SmartAgent:
                     params.pop("produto_nome", None)
                 elif alias.get("nome_real"):
                     params["produto_nome"] = alias["nome_real"]
-                self._last_alias_resolved = {"from": original_term, "to": resolved_to}
+                if req:
+                    req.alias_resolved = {"from": original_term, "to": resolved_to}
                 print(f"[ALIAS] Resolvido: '{original_term}' -> {resolved_to} (conf={alias.get('confidence',0):.0%})")
 
         # ========== LAYER 0.5: PRODUTO (roteamento especial) ==========
@@ -486,7 +515,7 @@ class SmartAgent:
             if _log: _log["processing"].update(layer="scoring", intent=best_intent)
 
             # Detectar se query e complexa (filtros/ordenacao que o pattern nao pegou)
-            pattern_filters = detect_filter_request(q_norm, tokens)
+            pattern_filters = dict(parsed.filters)
 
             # Intent override: se filter rules detectou TIPO_COMPRA, forcar pendencia_compras
             # (evita "compras de estoque da eaton" cair em intent=estoque)
@@ -684,7 +713,7 @@ class SmartAgent:
     async def _dispatch(self, intent: str, question: str, user_context: dict, t0: float, tokens: list, params: dict = None, ctx: ConversationContext = None):
         """Despacha para o handler correto baseado no intent."""
         if params is None:
-            params = extract_entities(question, self._known_marcas, self._known_empresas, self._known_compradores)
+            params = self._parsed(question).params()
         if intent == "pendencia_compras":
             view_mode = detect_view_mode(tokens)
             return await self._handle_pendencia_compras(question, user_context, t0, params, view_mode, ctx)
@@ -693,7 +722,7 @@ class SmartAgent:
         elif intent == "vendas":
             return await self._handle_vendas(question, user_context, t0, params, ctx)
         elif intent == "produto":
-            q_norm = normalize(question)
+            q_norm = self._parsed(question).q_norm
             product_type = detect_product_query(q_norm, params)
             if product_type == "similares":
                 return await self._handle_similares(question, user_context, t0, params, ctx)
@@ -735,7 +764,7 @@ class SmartAgent:
         filter_fields = {k: v for k, v in filters.items() if not k.startswith("_")}
         fn_fields = {k: v for k, v in filters.items() if k.startswith("_fn_")}
 
-        filtered = apply_filters(list(data), dict(filters))
+        filtered = apply_filters(data, dict(filters), table=ctx.get_table())
 
         if not filtered:
             desc = ctx.get_description()
@@ -853,7 +882,7 @@ class SmartAgent:
     # ---- PENDENCIA ----
     async def _handle_pendencia_compras(self, question, user_context, t0, params=None, view_mode="pedidos", ctx=None, llm_filters=None, extra_columns=None):
         if params is None:
-            params = extract_entities(question, self._known_marcas, self._known_empresas, self._known_compradores)
+            params = self._parsed(question).params()
         # Merge com contexto se disponivel
         if ctx and not (params.get("marca") or params.get("fornecedor") or params.get("comprador")):
             params = ctx.merge_params(params)
@@ -879,7 +908,8 @@ class SmartAgent:
             )
             print(f"[SMART] SQL com campos extras: {needs_sql_extra}")
 
-        kpis_result = await self.executor.execute(sql_kpis)
+        # KPIs + detalhe em paralelo (detalhe so e usado se houver pendencia)
+        kpis_result, dr = await self.executor.execute_batch([sql_kpis, sql_detail])
         if not kpis_result.get("success"):
             return {"response": f"Erro ao consultar: {kpis_result.get('error','?')}", "tipo": "consulta_banco", "query_executed": sql_kpis[:200], "query_results": 0}
 
@@ -893,7 +923,6 @@ class SmartAgent:
         detail_columns = ["EMPRESA","PEDIDO","TIPO_COMPRA","COMPRADOR","DT_PEDIDO","PREVISAO_ENTREGA","CONFIRMADO","FORNECEDOR","CODPROD","PRODUTO","MARCA","APLICACAO","NUM_FABRICANTE","UNIDADE","QTD_PEDIDA","QTD_ATENDIDA","QTD_PENDENTE","VLR_UNITARIO","VLR_PENDENTE","DIAS_ABERTO","STATUS_ENTREGA"] + needs_sql_extra
 
         if qtd > 0:
-            dr = await self.executor.execute(sql_detail)
             if dr.get("success"):
                 detail_data = dr.get("data", [])
                 if detail_data and isinstance(detail_data[0], (list, tuple)):
@@ -911,7 +940,7 @@ class SmartAgent:
             print(f"[CTX] Atualizado: {ctx}")
 
         # ========== VIEWS AGREGADAS (quem compra/fornece marca X?) ==========
-        agg_view = detect_aggregation_view(normalize(question))
+        agg_view = self._parsed(question).aggregation_view
         if agg_view and detail_data:
             marca = params.get("marca", "")
             elapsed = int((time.time() - t0) * 1000)
@@ -924,7 +953,7 @@ class SmartAgent:
 
         # ========== FILTROS (LLM ou pattern-based) ==========
         # Prioridade: LLM filters > inline pattern filters
-        active_filters = llm_filters if llm_filters else detect_filter_request(normalize(question), tokenize(question))
+        active_filters = llm_filters if llm_filters else dict(self._parsed(question).filters)
         filter_source = "LLM" if llm_filters else "pattern"
 
         if active_filters and detail_data:
@@ -935,7 +964,9 @@ class SmartAgent:
             filter_fields = {k: v for k, v in active_filters.items() if not k.startswith("_")}
             fn_fields = {k: v for k, v in active_filters.items() if k.startswith("_fn_")}
 
-            filtered = apply_filters(list(detail_data), dict(active_filters))
+            # detail_data ja esta no ctx: colunas montadas aqui servem os proximos follow-ups
+            table = ctx.get_table() if ctx else None
+            filtered = apply_filters(detail_data, dict(active_filters), table=table)
             if filtered:
                 print(f"[SMART] Filtro ({filter_source}): {active_filters} -> {len(filtered)}/{len(detail_data)} registros")
 
@@ -1071,7 +1102,7 @@ class SmartAgent:
         # Narrator: LLM explica os dados naturalmente
         if USE_LLM_NARRATOR and qtd > 0:
             summary = build_pendencia_summary(kpis_data, detail_data, params)
-            narration = await llm_narrate(question, summary, "")
+            narration = await llm_narrate(question, summary, "", preview=fallback_response)
             if narration:
                 # Monta resposta: analise da LLM + tabela resumida + oferta Excel
                 parts = [f"\U0001f4e6 **{description.title()}**\n"]
@@ -1103,12 +1134,12 @@ class SmartAgent:
     # ---- ESTOQUE ----
     async def _handle_estoque(self, question, user_context, t0, params=None, ctx=None):
         if params is None:
-            params = extract_entities(question, self._known_marcas, self._known_empresas, self._known_compradores)
+            params = self._parsed(question).params()
         # Merge com contexto se disponivel
         if ctx and not (params.get("codprod") or params.get("produto_nome") or params.get("marca")):
             params = ctx.merge_params(params)
         print(f"[SMART] Estoque params: {params}")
-        q_norm = normalize(question)
+        q_norm = self._parsed(question).q_norm
         is_critico = any(w in q_norm for w in ["critico", "baixo", "zerado", "minimo", "acabando", "faltando"])
 
         if params.get("codprod"):
@@ -1139,7 +1170,7 @@ class SmartAgent:
 
         if USE_LLM_NARRATOR and data:
             summary = build_estoque_summary(data, params)
-            narration = await llm_narrate(question, summary, "")
+            narration = await llm_narrate(question, summary, "", preview=fallback_response)
             if narration:
                 table_lines = fallback_response.split("\n")
                 table_start = next((i for i, l in enumerate(table_lines) if l.startswith("|")), None)
@@ -1158,7 +1189,7 @@ class SmartAgent:
     # ---- VENDAS ----
     async def _handle_vendas(self, question, user_context, t0, params=None, ctx=None):
         if params is None:
-            params = extract_entities(question, self._known_marcas, self._known_empresas, self._known_compradores)
+            params = self._parsed(question).params()
         # Merge com contexto se disponivel
         if ctx and not (params.get("marca") or params.get("empresa")):
             params = ctx.merge_params(params)
@@ -1265,8 +1296,8 @@ class SmartAgent:
         ORDER BY C.DTNEG DESC
         FETCH FIRST 500 ROWS ONLY"""
 
-        # ---- Executar KPIs ----
-        kr = await self.executor.execute(sql_kpis)
+        # ---- Executar KPIs + Top Vendedores + Detail em paralelo ----
+        kr, tr, dr = await self.executor.execute_batch([sql_kpis, sql_top, sql_detail])
         if not kr.get("success"):
             return {"response": f"Erro ao consultar vendas: {kr.get('error','?')}", "tipo": "consulta_banco", "query_executed": sql_kpis[:200], "query_results": 0}
         kd = kr.get("data", [])
@@ -1275,8 +1306,7 @@ class SmartAgent:
             kd = [dict(zip(cols, row)) for row in kd]
         kpi_row = kd[0] if kd else {}
 
-        # ---- Executar Top Vendedores ----
-        tr = await self.executor.execute(sql_top)
+        # ---- Top Vendedores ----
         td = []
         if tr.get("success"):
             td = tr.get("data", [])
@@ -1284,12 +1314,11 @@ class SmartAgent:
                 tc = tr.get("columns") or ["VENDEDOR", "QTD", "VLR_VENDAS", "VLR_DEVOLUCAO", "FATURAMENTO", "MARGEM_MEDIA"]
                 td = [dict(zip(tc, row)) for row in td]
 
-        # ---- Executar Detail (para follow-ups e Excel) ----
+        # ---- Detail (para follow-ups e Excel) ----
         detail_data = []
         detail_columns = ["NUNOTA", "DATA", "TIPMOV", "VENDEDOR", "CLIENTE", "VALOR", "MARGEM", "COMISSAO", "EMPRESA"]
         qtd_vendas = int(kpi_row.get("QTD_VENDAS", 0) or 0)
         if qtd_vendas > 0:
-            dr = await self.executor.execute(sql_detail)
             if dr.get("success"):
                 detail_data = dr.get("data", [])
                 if detail_data and isinstance(detail_data[0], (list, tuple)):
@@ -1329,7 +1358,7 @@ class SmartAgent:
         # ---- Narracao ----
         if USE_LLM_NARRATOR and qtd_vendas > 0:
             summary = build_vendas_summary(kpi_row, td, description)
-            narration = await llm_narrate(question, summary, "")
+            narration = await llm_narrate(question, summary, "", preview=fallback_response)
             if narration:
                 # Montar tabela de top vendedores
                 table_lines = fallback_response.split("\n")
@@ -1474,7 +1503,32 @@ class SmartAgent:
         LEFT JOIN TGFVEN V ON C.CODVEND = V.CODVEND
         WHERE C.NUNOTA = {nunota}"""
 
-        r1 = await self.executor.execute(sql_status)
+        # ETAPA 2: Itens do pedido com estoque
+        sql_itens = f"""SELECT
+            ITE.SEQUENCIA, PRO.CODPROD, PRO.DESCRPROD AS PRODUTO,
+            NVL(MAR.DESCRICAO, '') AS MARCA,
+            ITE.QTDNEG AS QTD_VENDIDA,
+            NVL(EST.ESTOQUE, 0) AS ESTOQUE,
+            NVL(EST.RESERVADO, 0) AS RESERVADO,
+            NVL(EST.ESTOQUE, 0) - NVL(EST.RESERVADO, 0) AS DISPONIVEL,
+            CASE
+                WHEN NVL(EST.ESTOQUE,0) - NVL(EST.RESERVADO,0) >= ITE.QTDNEG THEN 'DISPONIVEL'
+                WHEN NVL(EST.ESTOQUE,0) > 0 THEN 'PARCIAL'
+                ELSE 'SEM ESTOQUE'
+            END AS STATUS_ESTOQUE
+        FROM TGFITE ITE
+        JOIN TGFPRO PRO ON ITE.CODPROD = PRO.CODPROD
+        LEFT JOIN TGFMAR MAR ON PRO.CODMARCA = MAR.CODIGO
+        LEFT JOIN (
+            SELECT CODPROD, SUM(ESTOQUE) AS ESTOQUE, SUM(RESERVADO) AS RESERVADO
+            FROM TGFEST WHERE CODLOCAL = 0 AND TIPO = 'P' AND CODPARC = 0
+            GROUP BY CODPROD
+        ) EST ON EST.CODPROD = ITE.CODPROD
+        WHERE ITE.NUNOTA = {nunota}
+        ORDER BY ITE.SEQUENCIA"""
+
+        # Status + itens sao independentes: rodar em paralelo
+        r1, r2 = await self.executor.execute_batch([sql_status, sql_itens])
         if not r1.get("success") or not r1.get("data"):
             return {"response": f"Pedido **{nunota}** nao encontrado no sistema.",
                     "tipo": "consulta_banco", "query_executed": sql_status[:200],
@@ -1506,31 +1560,7 @@ class SmartAgent:
             response += f"| **Vendedor** | {cab['VENDEDOR']} |\n"
         response += f"| **Pendente** | {'Sim' if cab.get('PENDENTE') == 'S' else 'Nao'} |\n"
 
-        # ETAPA 2: Itens do pedido com estoque
-        sql_itens = f"""SELECT
-            ITE.SEQUENCIA, PRO.CODPROD, PRO.DESCRPROD AS PRODUTO,
-            NVL(MAR.DESCRICAO, '') AS MARCA,
-            ITE.QTDNEG AS QTD_VENDIDA,
-            NVL(EST.ESTOQUE, 0) AS ESTOQUE,
-            NVL(EST.RESERVADO, 0) AS RESERVADO,
-            NVL(EST.ESTOQUE, 0) - NVL(EST.RESERVADO, 0) AS DISPONIVEL,
-            CASE
-                WHEN NVL(EST.ESTOQUE,0) - NVL(EST.RESERVADO,0) >= ITE.QTDNEG THEN 'DISPONIVEL'
-                WHEN NVL(EST.ESTOQUE,0) > 0 THEN 'PARCIAL'
-                ELSE 'SEM ESTOQUE'
-            END AS STATUS_ESTOQUE
-        FROM TGFITE ITE
-        JOIN TGFPRO PRO ON ITE.CODPROD = PRO.CODPROD
-        LEFT JOIN TGFMAR MAR ON PRO.CODMARCA = MAR.CODIGO
-        LEFT JOIN (
-            SELECT CODPROD, SUM(ESTOQUE) AS ESTOQUE, SUM(RESERVADO) AS RESERVADO
-            FROM TGFEST WHERE CODLOCAL = 0 AND TIPO = 'P' AND CODPARC = 0
-            GROUP BY CODPROD
-        ) EST ON EST.CODPROD = ITE.CODPROD
-        WHERE ITE.NUNOTA = {nunota}
-        ORDER BY ITE.SEQUENCIA"""
-
-        r2 = await self.executor.execute(sql_itens)
+        # Itens
         itens = []
         sem_estoque_prods = []
         if r2.get("success") and r2.get("data"):
@@ -1635,6 +1665,7 @@ class SmartAgent:
         if USE_LLM_NARRATOR and pool_narrate.available:
             try:
                 narr_prompt = f"Resuma em 2-3 frases para o vendedor o status do pedido {nunota}. Dados:\n{response[:800]}"
+                mark_narration("8b")
                 narr = await groq_request(pool_narrate, [{"role": "user", "content": narr_prompt}], temperature=0.3, max_tokens=200)
                 if narr and narr.get("content"):
                     response = narr["content"].strip() + "\n\n---\n\n" + response
@@ -1654,7 +1685,7 @@ class SmartAgent:
     async def _handle_busca_fabricante(self, question, user_context, t0, params=None, ctx=None):
         """Busca produto pelo codigo do fabricante (referencia, numfabricante, etc.)."""
         if params is None:
-            params = extract_entities(question, self._known_marcas, self._known_empresas, self._known_compradores)
+            params = self._parsed(question).params()
         cod_fab = params.get("codigo_fabricante")
         if not cod_fab:
             return {"response": "Informe o codigo do fabricante para buscar. Ex: *\"HU711/51\"* ou *\"referencia WK 950/21\"*", "tipo": "info", "query_executed": None, "query_results": None}
@@ -1706,7 +1737,7 @@ class SmartAgent:
     async def _handle_similares(self, question, user_context, t0, params=None, ctx=None):
         """Busca codigos auxiliares/similares de um produto."""
         if params is None:
-            params = extract_entities(question, self._known_marcas, self._known_empresas, self._known_compradores)
+            params = self._parsed(question).params()
 
         codprod = params.get("codprod")
         cod_fab = params.get("codigo_fabricante")
@@ -1749,7 +1780,7 @@ class SmartAgent:
     async def _handle_busca_aplicacao(self, question, user_context, t0, params=None, ctx=None):
         """Busca produtos por aplicacao/veiculo usando CARACTERISTICAS."""
         if params is None:
-            params = extract_entities(question, self._known_marcas, self._known_empresas, self._known_compradores)
+            params = self._parsed(question).params()
 
         aplicacao = params.get("aplicacao", "")
         if not aplicacao:
@@ -1840,7 +1871,7 @@ class SmartAgent:
     async def _handle_busca_produto(self, question, user_context, t0, params=None, ctx=None):
         """Busca produto no Elasticsearch com fuzzy matching."""
         if params is None:
-            params = extract_entities(question, self._known_marcas, self._known_empresas, self._known_compradores)
+            params = self._parsed(question).params()
 
         text = params.get("texto_busca") or params.get("produto_nome")
         codigo = params.get("codigo_fabricante")
@@ -1882,19 +1913,15 @@ class SmartAgent:
             return {"response": "Busca de produto indisponivel no momento (Elasticsearch offline).", "tipo": "info"}
 
         print(f"[SMART] Busca Elastic: text='{text}' codigo='{codigo}' marca='{marca}' aplicacao='{aplicacao}'")
-        results = await self.elastic.search_products(
-            text=text, codigo=codigo, marca=marca, aplicacao=aplicacao, limit=15
-        )
-
-        # Se nao encontrou com todos os filtros, tentar mais amplo
-        if not results and marca:
-            results = await self.elastic.search_products(
-                text=text or codigo, aplicacao=aplicacao, limit=15
-            )
-        if not results and aplicacao:
-            results = await self.elastic.search_products(
-                text=text or codigo, marca=marca, limit=15
-            )
+        searches = [("products", {"text": text, "codigo": codigo, "marca": marca,
+                                  "aplicacao": aplicacao, "limit": 15})]
+        # Variacoes mais amplas (sem marca / sem aplicacao) vao no mesmo _msearch
+        if marca:
+            searches.append(("products", {"text": text or codigo, "aplicacao": aplicacao, "limit": 15}))
+        if aplicacao:
+            searches.append(("products", {"text": text or codigo, "marca": marca, "limit": 15}))
+        # 1a variacao com resultado (mesma ordem do fallback sequencial)
+        results = next((r for r in await self.elastic.msearch(searches) if r), [])
         if not results:
             # Fallback SQL
             if codigo:
@@ -1926,7 +1953,7 @@ class SmartAgent:
         # Narrar se habilitado
         if USE_LLM_NARRATOR and len(results) > 0:
             summary = build_produto_summary(results, params or {})
-            narration = await llm_narrate(question, summary, "")
+            narration = await llm_narrate(question, summary, "", preview=response)
             if narration:
                 response = narration + "\n\n" + response
 
@@ -1945,7 +1972,7 @@ class SmartAgent:
     async def _handle_busca_parceiro(self, question, user_context, t0, params=None, tipo="C", ctx=None):
         """Busca cliente ou fornecedor no Elasticsearch com fuzzy matching."""
         if params is None:
-            params = extract_entities(question, self._known_marcas, self._known_empresas, self._known_compradores)
+            params = self._parsed(question).params()
 
         text = params.get("texto_busca") or params.get("fornecedor") or params.get("empresa")
         cnpj = params.get("cnpj")
@@ -1981,7 +2008,7 @@ class SmartAgent:
         response = "\n".join(lines)
         if USE_LLM_NARRATOR and len(results) > 0:
             summary = f"Busca de {tipo_nome} por '{text or cnpj}'. {len(results)} resultados."
-            narration = await llm_narrate(question, summary, "")
+            narration = await llm_narrate(question, summary, "", preview=response)
             if narration:
                 response = narration + "\n\n" + response
 
@@ -2001,7 +2028,7 @@ class SmartAgent:
     async def _handle_produto_360(self, question, user_context, t0, params=None, ctx=None):
         """Combina estoque + pendencia + vendas para visao completa de um produto."""
         if params is None:
-            params = extract_entities(question, self._known_marcas, self._known_empresas, self._known_compradores)
+            params = self._parsed(question).params()
 
         codprod = params.get("codprod")
         cod_fab = params.get("codigo_fabricante")
@@ -2070,11 +2097,28 @@ class SmartAgent:
           AND C.TIPMOV = 'V' AND C.CODTIPOPER IN (1100,1101) AND C.STATUSNOTA <> 'C'
           AND C.DTNEG >= ADD_MONTHS(TRUNC(SYSDATE), -3)"""
 
-        # Executar em paralelo
-        r_prod, r_est, r_vendas = await asyncio.gather(
-            self.executor.execute(sql_prod),
-            self.executor.execute(sql_est),
-            self.executor.execute(sql_vendas),
+        # Pendencia de compras do produto
+        pend_params = {"codprod": codprod}
+        sql_pend = f"""SELECT CAB.NUNOTA AS PEDIDO,
+            CASE WHEN CAB.CODTIPOPER = 1313 THEN 'Casada' WHEN CAB.CODTIPOPER = 1301 THEN 'Estoque' END AS TIPO_COMPRA,
+            PAR.NOMEPARC AS FORNECEDOR, SUM(ITE.QTDNEG - NVL(ITE.QTDENTREGUE,0)) AS QTD_PENDENTE,
+            SUM((ITE.QTDNEG - NVL(ITE.QTDENTREGUE,0)) * ITE.VLRUNIT) AS VLR_PENDENTE,
+            CASE WHEN CAB.AD_DTPREVCHEG IS NULL THEN 'SEM PREVISAO'
+                 WHEN CAB.AD_DTPREVCHEG < TRUNC(SYSDATE) THEN 'ATRASADO'
+                 ELSE 'NO PRAZO' END AS STATUS_ENTREGA
+        FROM TGFCAB CAB
+        JOIN TGFITE ITE ON ITE.NUNOTA = CAB.NUNOTA
+        JOIN TGFPRO PRO ON PRO.CODPROD = ITE.CODPROD
+        JOIN TGFPAR PAR ON PAR.CODPARC = CAB.CODPARC
+        WHERE CAB.CODTIPOPER IN (1301, 1313) AND CAB.PENDENTE = 'S'
+          AND ITE.CODPROD = {codprod}
+          AND (ITE.QTDNEG - NVL(ITE.QTDENTREGUE,0)) > 0
+        GROUP BY CAB.NUNOTA, CAB.CODTIPOPER, PAR.NOMEPARC, CAB.AD_DTPREVCHEG
+        ORDER BY CAB.NUNOTA"""
+
+        # Executar em paralelo (respeitando o limite de queries do tenant)
+        r_prod, r_est, r_vendas, r_pend = await self.executor.execute_batch(
+            [sql_prod, sql_est, sql_vendas, sql_pend]
         )
 
         # Montar info do produto
@@ -2103,26 +2147,7 @@ class SmartAgent:
                 edata = [dict(zip(cols, row)) for row in edata]
             estoque_data = [r for r in edata if isinstance(r, dict)]
 
-        # Pendencia de compras (usa handler existente internamente)
-        pend_params = {"codprod": codprod}
-        sql_pend = f"""SELECT CAB.NUNOTA AS PEDIDO,
-            CASE WHEN CAB.CODTIPOPER = 1313 THEN 'Casada' WHEN CAB.CODTIPOPER = 1301 THEN 'Estoque' END AS TIPO_COMPRA,
-            PAR.NOMEPARC AS FORNECEDOR, SUM(ITE.QTDNEG - NVL(ITE.QTDENTREGUE,0)) AS QTD_PENDENTE,
-            SUM((ITE.QTDNEG - NVL(ITE.QTDENTREGUE,0)) * ITE.VLRUNIT) AS VLR_PENDENTE,
-            CASE WHEN CAB.AD_DTPREVCHEG IS NULL THEN 'SEM PREVISAO'
-                 WHEN CAB.AD_DTPREVCHEG < TRUNC(SYSDATE) THEN 'ATRASADO'
-                 ELSE 'NO PRAZO' END AS STATUS_ENTREGA
-        FROM TGFCAB CAB
-        JOIN TGFITE ITE ON ITE.NUNOTA = CAB.NUNOTA
-        JOIN TGFPRO PRO ON PRO.CODPROD = ITE.CODPROD
-        JOIN TGFPAR PAR ON PAR.CODPARC = CAB.CODPARC
-        WHERE CAB.CODTIPOPER IN (1301, 1313) AND CAB.PENDENTE = 'S'
-          AND ITE.CODPROD = {codprod}
-          AND (ITE.QTDNEG - NVL(ITE.QTDENTREGUE,0)) > 0
-        GROUP BY CAB.NUNOTA, CAB.CODTIPOPER, PAR.NOMEPARC, CAB.AD_DTPREVCHEG
-        ORDER BY CAB.NUNOTA"""
-
-        r_pend = await self.executor.execute(sql_pend)
+        # Pendencia de compras
         pendencia_data = {"detail_data": []}
         if r_pend.get("success") and r_pend.get("data"):
             pd_data = r_pend["data"]
@@ -2156,7 +2181,7 @@ class SmartAgent:
     # ---- FINANCEIRO (Contas a Pagar / Receber / Fluxo de Caixa) ----
     async def _handle_financeiro(self, question, user_context, t0, params=None, ctx=None):
         if params is None:
-            params = extract_entities(question, self._known_marcas, self._known_empresas, self._known_compradores)
+            params = self._parsed(question).params()
         # Preservar params financeiros antes do merge (merge_params só mantém entity keys)
         _fin_save = {k: params[k] for k in ("tipo", "status", "valor_minimo", "valor_maximo", "parceiro", "top", "periodo") if params.get(k) is not None}
         if ctx and not (params.get("empresa") or params.get("parceiro")):
@@ -2165,7 +2190,7 @@ class SmartAgent:
         print(f"[SMART] Financeiro params: {params}")
 
         # Detectar tipo (pagar/receber/fluxo)
-        q_norm = normalize(question)
+        q_norm = self._parsed(question).q_norm
         tipo = params.get("tipo", "")
         if not tipo:
             if any(w in q_norm for w in ["pagar", "despesa", "despesas", "fornecedor", "boleto", "boletos", "duplicata", "duplicatas", "pagamento", "pagamentos"]):
@@ -2298,8 +2323,8 @@ class SmartAgent:
             ORDER BY FIN.DTVENC {'ASC' if status == 'a_vencer' else 'DESC'}
             FETCH FIRST {top_n} ROWS ONLY"""
 
-        # Execute KPIs
-        kr = await self.executor.execute(sql_kpis)
+        # Execute KPIs + Detail em paralelo
+        kr, dr = await self.executor.execute_batch([sql_kpis, sql_detail])
         if not kr.get("success"):
             return {"response": f"Erro ao consultar financeiro: {kr.get('error', '?')}", "tipo": "consulta_banco", "query_executed": sql_kpis[:200], "query_results": 0}
 
@@ -2309,7 +2334,7 @@ class SmartAgent:
             kd = [dict(zip(cols, row)) for row in kd]
         kpi_row = kd[0] if kd else {}
 
-        # Execute Detail
+        # Detail
         detail_data = []
         if tipo == "fluxo":
             detail_columns = ["PARCEIRO", "RECDESP", "DTVENC", "VLRDESDOB", "DIAS_VENCIDO", "STATUS", "EMPRESA", "NUFIN"]
@@ -2318,7 +2343,6 @@ class SmartAgent:
 
         qtd = int(kpi_row.get("QTD_TITULOS", 0) or 0)
         if qtd > 0:
-            dr = await self.executor.execute(sql_detail)
             if dr.get("success"):
                 detail_data = dr.get("data", [])
                 if detail_data and isinstance(detail_data[0], (list, tuple)):
@@ -2342,7 +2366,7 @@ class SmartAgent:
     # ---- INADIMPLENCIA ----
     async def _handle_inadimplencia(self, question, user_context, t0, params=None, ctx=None):
         if params is None:
-            params = extract_entities(question, self._known_marcas, self._known_empresas, self._known_compradores)
+            params = self._parsed(question).params()
         # Preservar params financeiros antes do merge (merge_params só mantém entity keys)
         _fin_save = {k: params[k] for k in ("parceiro", "dias_minimo", "valor_minimo", "top") if params.get(k) is not None}
         if ctx and not (params.get("empresa") or params.get("parceiro")):
@@ -2404,8 +2428,8 @@ class SmartAgent:
         ORDER BY SUM(FIN.VLRDESDOB) DESC
         FETCH FIRST {top_n} ROWS ONLY"""
 
-        # Execute KPIs
-        kr = await self.executor.execute(sql_kpis)
+        # Execute KPIs + Detail em paralelo
+        kr, dr = await self.executor.execute_batch([sql_kpis, sql_detail])
         if not kr.get("success"):
             return {"response": f"Erro ao consultar inadimplencia: {kr.get('error', '?')}", "tipo": "consulta_banco", "query_executed": sql_kpis[:200], "query_results": 0}
 
@@ -2415,13 +2439,12 @@ class SmartAgent:
             kd = [dict(zip(cols, row)) for row in kd]
         kpi_row = kd[0] if kd else {}
 
-        # Execute Detail
+        # Detail
         detail_data = []
         detail_columns = ["PARCEIRO", "QTD_TITULOS", "VLR_INADIMPLENTE", "MAIOR_ATRASO"]
         qtd_clientes = int(kpi_row.get("QTD_CLIENTES", 0) or 0)
 
         if qtd_clientes > 0:
-            dr = await self.executor.execute(sql_detail)
             if dr.get("success"):
                 detail_data = dr.get("data", [])
                 if detail_data and isinstance(detail_data[0], (list, tuple)):
@@ -2445,7 +2468,7 @@ class SmartAgent:
     # ---- COMISSAO ----
     async def _handle_comissao(self, question, user_context, t0, params=None, ctx=None):
         if params is None:
-            params = extract_entities(question, self._known_marcas, self._known_empresas, self._known_compradores)
+            params = self._parsed(question).params()
         # Preservar params de comissão antes do merge (merge_params só mantém entity keys)
         _com_save = {k: params[k] for k in ("vendedor", "periodo", "view", "top", "marca") if params.get(k) is not None}
         if ctx and not (params.get("empresa") or params.get("vendedor")):
@@ -2468,7 +2491,7 @@ class SmartAgent:
 
         print(f"[SMART] Comissao params: {params}")
 
-        q_norm = normalize(question)
+        q_norm = self._parsed(question).q_norm
 
         # Detectar view (ranking/detalhe)
         view = params.get("view", "")
@@ -2625,8 +2648,8 @@ class SmartAgent:
             FETCH FIRST {top_n} ROWS ONLY"""
             detail_columns = ["NUNOTA", "VENDEDOR", "DT_NEG", "TIPMOV", "VLR_FATURADO", "BASE_COMISSAO", "VLR_CUSTO", "MARGEM", "PMV", "ALIQUOTA", "VLR_COMISSAO", "EMPRESA"]
 
-        # Execute KPIs
-        kr = await self.executor.execute(sql_kpis)
+        # Execute KPIs + Detail em paralelo
+        kr, dr = await self.executor.execute_batch([sql_kpis, sql_detail])
         if not kr.get("success"):
             return {"response": f"Erro ao consultar comissao: {kr.get('error', '?')}", "tipo": "consulta_banco", "query_executed": sql_kpis[:200], "query_results": 0}
 
@@ -2636,12 +2659,11 @@ class SmartAgent:
             kd = [dict(zip(cols, row)) for row in kd]
         kpi_row = kd[0] if kd else {}
 
-        # Execute Detail
+        # Detail
         detail_data = []
         qtd_notas = int(kpi_row.get("QTD_NOTAS", 0) or 0)
 
         if qtd_notas > 0:
-            dr = await self.executor.execute(sql_detail)
             if dr.get("success"):
                 detail_data = dr.get("data", [])
                 if detail_data and isinstance(detail_data[0], (list, tuple)):
@@ -2664,10 +2686,10 @@ class SmartAgent:
 
     # ---- EXCEL ----
     async def _handle_excel_followup(self, user_context, ctx=None):
-        last_result = ctx.last_result if ctx else {}
-        if not last_result or not last_result.get("detail_data"):
+        if not ctx or not ctx.has_data():
             return {"response": "Nao tenho dados para gerar o arquivo. Faca uma consulta primeiro.", "tipo": "info", "query_executed": None, "query_results": None}
-        data = last_result["detail_data"]
+        last_result = ctx.last_result
+        data = ctx.get_data()
         columns = last_result["columns"]
         description = last_result["description"]
         params = last_result.get("params", {})
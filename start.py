@@ -4,8 +4,10 @@ Inicia o servidor FastAPI + tunel ngrok em um comando.
 
 Uso:
     python start.py
+    WEB_WORKERS=4 python start.py   # 1 processo por core (estado em STATE_BACKEND=sqlite)
 """
 
+import os
 import sys
 import time
 import subprocess
@@ -14,6 +16,7 @@ import uvicorn
 
 
 PORT = 8000
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
 ngrok_process = None
 
 
@@ -129,7 +132,13 @@ def main():
     # 3. Iniciar ngrok
     ngrok_url = start_ngrok()
 
-    # 4. Iniciar FastAPI (bloqueia aqui)
+    # 4. Multi-worker: sessoes/contextos/rate limit e o lease dos jobs singleton
+    #    (refresh de entidades, treino, sync do Elastic) precisam de estado compartilhado
+    if WEB_WORKERS > 1 and os.getenv("STATE_BACKEND", "memory").lower() == "memory":
+        os.environ["STATE_BACKEND"] = "sqlite"  # herdado pelos processos dos workers
+        print(f"[OK] {WEB_WORKERS} workers: STATE_BACKEND=sqlite")
+
+    # 5. Iniciar FastAPI (bloqueia aqui)
     try:
         uvicorn.run(
             "src.api.app:app",
@@ -137,6 +146,7 @@ def main():
             port=PORT,
             reload=False,
             log_level="info",
+            workers=WEB_WORKERS,
         )
     except KeyboardInterrupt:
         pass
@@ -0,0 +1,63 @@
+"""
+Testes do streaming do chat (/api/chat/stream, src/core/chat_stream.py).
+Roda com: python -m pytest tests/test_chat_stream.py -v
+"""
+
+import sys
+import json
+from pathlib import Path
+from datetime import datetime
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def _parse_sse(text: str) -> list:
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n") if ": " in line)
+        events.append((lines.get("event"), json.loads(lines.get("data", "null"))))
+    return events
+
+
+# ============================================================
+# TestChatStream
+# ============================================================
+
+class TestChatStream:
+    def test_emit_fora_do_stream_e_noop(self):
+        from src.core.chat_stream import emit, token_callback, tokens_mark
+        emit("kpis", {"response": "x"})
+        assert token_callback() is None
+        assert tokens_mark() == 0
+
+    def test_endpoint_ordem_dos_eventos(self, monkeypatch):
+        from fastapi.testclient import TestClient
+        import src.api.app as app_mod
+        from src.core.chat_stream import emit, token_callback
+
+        async def fake_ask(question, user_context=None):
+            emit("kpis", {"response": "| KPI | 1 |"})
+            on_token = token_callback()
+            for t in ["Tudo ", "certo."]:
+                on_token(t)
+            return {"response": "Tudo certo.\n| KPI | 1 |", "tipo": "consulta_banco",
+                    "message_id": "m1", "_detail_data": [{"PEDIDO": 1}]}
+
+        monkeypatch.setattr(app_mod.smart_agent, "ask", fake_ask)
+        monkeypatch.setitem(app_mod.sessions, "tok", {
+            "user": "teste", "role": "admin", "last_activity": datetime.now(),
+        })
+
+        client = TestClient(app_mod.app)
+        r = client.post("/api/chat/stream", json={"message": "pendencia"},
+                        headers={"Authorization": "Bearer tok"})
+        assert r.status_code == 200
+        assert r.headers["content-type"].startswith("text/event-stream")
+
+        events = _parse_sse(r.text)
+        names = [e for e, _ in events]
+        assert names == ["kpis", "token", "token", "table_data", "done"]
+        assert events[3][1]["rows"] == [{"PEDIDO": 1}]
+        assert events[4][1]["message_id"] == "m1"
@@ -0,0 +1,61 @@
+"""
+Testes do motor de regras de follow-up/filtro (src/agent/context.py).
+Roda com: python -m pytest tests/test_context_rules.py -v
+"""
+
+import sys
+from pathlib import Path
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+# ============================================================
+# TestDetectFilterRequest
+# ============================================================
+
+class TestDetectFilterRequest:
+    def test_filtro_e_superlativo(self):
+        from src.agent.context import detect_filter_request
+
+        r = detect_filter_request("pedidos da compra casada com maior quantidade", [])
+        assert r == {"TIPO_COMPRA": "Casada", "_sort": "QTD_PENDENTE_DESC", "_top": 1}
+
+    def test_ordem_da_lista_e_break_no_sort(self):
+        from src.agent.context import detect_filter_request
+
+        # "mais caro" vem antes de "atrasado" na lista e para a avaliacao
+        r = detect_filter_request("atrasado mais caro", [])
+        assert r == {"_sort": "VLR_PENDENTE_DESC", "_top": 1}
+
+    def test_numero_explicito(self):
+        from src.agent.context import detect_filter_request
+
+        assert detect_filter_request("top 10 atrasados", [])["_top"] == 10
+        assert detect_filter_request("", []) == {}
+
+    def test_regras_compiladas(self, monkeypatch):
+        import src.agent.context as context
+
+        monkeypatch.setattr(context, "_COMPILED_RULES", [])
+        context.set_compiled_rules([{"match": ["sem nota"], "filter": {"STATUS_NOTA": "N"}}])
+        try:
+            assert context.detect_filter_request("itens sem nota", []) == {"STATUS_NOTA": "N"}
+            assert context.rule_stats()["compiled_rules"] == 1
+        finally:
+            context.set_compiled_rules([])
+
+
+# ============================================================
+# TestDetectFollowup
+# ============================================================
+
+class TestDetectFollowup:
+    def test_patterns_e_contadores(self):
+        from src.agent.context import detect_followup, RULE_HITS
+
+        before = RULE_HITS["followup:pattern:4"]
+        assert detect_followup(["e", "quantos", "atrasados"], "e quantos atrasados?")
+        assert RULE_HITS["followup:pattern:4"] == before + 1
+        assert not detect_followup(["pendencias", "da", "mann"], "pendencias da mann")
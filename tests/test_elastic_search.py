@@ -0,0 +1,133 @@
+"""
+Testes do motor de busca Elasticsearch (src/elastic/search.py): _msearch, client e cache.
+Roda com: python -m pytest tests/test_elastic_search.py -v
+"""
+
+import sys
+import json
+import asyncio
+from pathlib import Path
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import httpx
+
+
+def _hit(codprod):
+    return {"_score": 9.5, "_source": {"codprod": codprod, "descricao": f"PROD {codprod}"}}
+
+
+def _make_engine(monkeypatch, fail_index=None):
+    import src.elastic.search as search_mod
+
+    monkeypatch.setattr(search_mod, "code_cache", search_mod.CodeLookupCache(ttl=60))
+    calls = {"search": [], "msearch": []}
+
+    async def handler(request):
+        path = request.url.path
+        if path == "/_msearch":
+            lines = request.content.decode().strip().split("\n")
+            headers, bodies = lines[::2], [json.loads(l) for l in lines[1::2]]
+            calls["msearch"].append([json.loads(h)["index"] for h in headers])
+            responses = []
+            for i, body in enumerate(bodies):
+                if i == fail_index:
+                    responses.append({"error": {"type": "search_phase_execution_exception"}, "status": 400})
+                else:
+                    responses.append({"hits": {"hits": [_hit(100 + i)]}})
+            return httpx.Response(200, json={"responses": responses})
+        if path.endswith("/_search"):
+            calls["search"].append(path.strip("/").split("/")[0])
+            return httpx.Response(200, json={"hits": {"hits": [_hit(1)]}})
+        return httpx.Response(404, text="?")
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(search_mod, "_get_client", lambda: client)
+    return search_mod.ElasticSearchEngine(), calls
+
+
+# ============================================================
+# TestMultiSearch
+# ============================================================
+
+class TestMultiSearch:
+    def test_varias_buscas_numa_chamada(self, monkeypatch):
+        engine, calls = _make_engine(monkeypatch)
+
+        results = asyncio.run(engine.msearch([
+            ("products", {"codigo": "W950"}),
+            ("products", {"text": "filtro oleo"}),
+            ("partners", {"text": "transportes silva"}),
+        ]))
+
+        assert calls["msearch"] == [["idx_produtos", "idx_produtos", "idx_parceiros"]]
+        assert calls["search"] == []
+        assert [r[0].get("codprod") for r in results[:2]] == [100, 101]
+        assert results[2][0]["_score"] == 9.5 and "_highlights" not in results[2][0]
+
+    def test_busca_isolada_usa_search(self, monkeypatch):
+        engine, calls = _make_engine(monkeypatch)
+
+        results = asyncio.run(engine.search_partners(text="silva"))
+
+        assert calls["search"] == ["idx_parceiros"] and calls["msearch"] == []
+        assert results[0]["codprod"] == 1
+
+    def test_erro_em_uma_busca_nao_derruba_as_outras(self, monkeypatch):
+        engine, calls = _make_engine(monkeypatch, fail_index=0)
+
+        results = asyncio.run(engine.msearch([("products", {"text": "x"}), ("products", {"text": "y"})]))
+
+        assert results[0] == [] and results[1][0]["codprod"] == 101
+
+
+# ============================================================
+# TestCodeLookupCache
+# ============================================================
+
+class TestCodeLookupCache:
+    def test_codigo_repetido_sai_do_cache(self, monkeypatch):
+        import src.elastic.search as search_mod
+
+        engine, calls = _make_engine(monkeypatch)
+
+        async def run():
+            first = await engine.search_products(codigo="W950")
+            first[0]["descricao"] = "alterado pelo chamador"
+            again = await engine.search_products(codigo=" w950 ")
+            text = await engine.search_products(text="W950")   # texto livre nao e cacheado
+            text2 = await engine.search_products(text="W950")
+            return again, text, text2
+
+        again, _, _ = asyncio.run(run())
+        assert len(calls["search"]) == 3
+        assert again[0]["descricao"] == "PROD 1"
+        assert search_mod.code_cache.stats()["hits"] == 1
+
+    def test_cache_pula_so_o_que_ja_tem(self, monkeypatch):
+        engine, calls = _make_engine(monkeypatch)
+
+        async def run():
+            await engine.search_products(codigo="P618689")
+            return await engine.msearch([("products", {"codigo": "P618689"}),
+                                         ("products", {"codigo": "W950"})])
+
+        results = asyncio.run(run())
+        assert calls["msearch"] == []           # so 1 miss -> _search
+        assert calls["search"] == ["idx_produtos", "idx_produtos"]
+        assert len(results) == 2 and all(results)
+
+    def test_lru_e_ttl(self, monkeypatch):
+        import time
+        from src.elastic.search import CodeLookupCache
+
+        cache = CodeLookupCache(ttl=0.05, max_entries=2)
+        keys = [cache.make_key("products", {"codigo": c}) for c in ("A1", "B2", "C3")]
+        assert cache.make_key("products", {"text": "filtro"}) is None
+        for k in keys:
+            cache.set(k, [{"codprod": 1}])
+        assert cache.get(keys[0]) is None and cache.stats()["evictions"] == 1
+        time.sleep(0.08)
+        assert cache.get(keys[2]) is None and cache.stats()["expired"] == 1
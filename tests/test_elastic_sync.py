@@ -0,0 +1,363 @@
+"""
+Testes do pipeline de sync Sankhya -> Elasticsearch (src/elastic/sync.py).
+Roda com: python -m pytest tests/test_elastic_sync.py -v
+"""
+
+import sys
+import json
+import asyncio
+from pathlib import Path
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import httpx
+
+
+class _FakeExecutor:
+    """Sankhya fake: COUNT + paginas keyset de CODPROD (500 por pagina)."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.pages = 0
+
+    async def execute(self, sql: str) -> dict:
+        if "COUNT(*)" in sql:
+            return {"success": True, "data": [{"TOTAL": self.total}]}
+        last = int(sql.split("CODPROD > ")[1].split()[0])
+        await asyncio.sleep(0.005)
+        self.pages += 1
+        rows = [[i, f"PROD {i}", "MANN", 1, "", "", f"REF{i}", "", "", "", "", "", "UN"]
+                for i in range(last + 1, min(self.total, last + 500) + 1)]
+        return {"success": True, "data": rows}
+
+
+class _FakeKeysExecutor:
+    """Sankhya fake da reconciliacao: chaves ativas agrupadas por bucket (LISTAGG)."""
+
+    def __init__(self, active, fail=False):
+        self.active = sorted(active)
+        self.fail = fail
+        self.queries = 0
+
+    async def execute(self, sql: str) -> dict:
+        self.queries += 1
+        if self.fail:
+            return {"success": False, "error": "timeout"}
+        last = int(sql.split("> ")[1].split()[0])
+        bucket = int(sql.split(" / ")[1].split(")")[0])
+        buckets = {}
+        for k in self.active:
+            if k > last:
+                buckets.setdefault(k // bucket, []).append(str(k))
+        rows = [[b, ",".join(codes)] for b, codes in sorted(buckets.items())][:500]
+        return {"success": True, "data": rows}
+
+
+def _make_sync(monkeypatch, tmp_path, total, indices=None, aliases=None, executor=None, **kw):
+    import src.elastic.sync as sync_mod
+
+    monkeypatch.setattr(sync_mod, "SYNC_STATE_FILE", tmp_path / "state.json")
+    calls = {"bulk_ids": [], "settings": [], "refresh": 0, "in_bulk": 0, "max_in_bulk": 0,
+             "indices": indices if indices is not None else {},   # nome fisico -> set de ids
+             "aliases": aliases if aliases is not None else {},   # alias -> nome fisico
+             "alias_actions": [], "deleted": []}
+
+    def resolve(name):
+        return calls["aliases"].get(name, name)
+
+    async def handler(request):
+        path = request.url.path
+        name = path.strip("/").split("/")[0]
+        if request.method == "HEAD":
+            return httpx.Response(200 if resolve(name) in calls["indices"] else 404)
+        if path.endswith("/_bulk"):
+            calls["in_bulk"] += 1
+            calls["max_in_bulk"] = max(calls["max_in_bulk"], calls["in_bulk"])
+            await asyncio.sleep(0.01)
+            calls["in_bulk"] -= 1
+            lines = request.content.decode().strip().split("\n")
+            if "delete" in lines[0]:
+                ids = [json.loads(l)["delete"]["_id"] for l in lines]
+                calls.setdefault("deleted_ids", []).extend(ids)
+                for i in ids:
+                    calls["indices"][resolve(json.loads(lines[0])["delete"]["_index"])].discard(i)
+                return httpx.Response(200, json={"items": [{"delete": {"status": 200}} for _ in ids]})
+            actions = [json.loads(l)["index"] for l in lines[::2]]
+            for a in actions:
+                calls["indices"][resolve(a["_index"])].add(a["_id"])
+            calls["bulk_ids"].extend(a["_id"] for a in actions)
+            return httpx.Response(200, json={"items": [{"index": {}} for _ in actions]})
+        if path == "/_aliases":
+            actions = json.loads(request.content)["actions"]
+            calls["alias_actions"].append(actions)
+            for a in actions:
+                if "remove_index" in a:
+                    del calls["indices"][a["remove_index"]["index"]]
+                elif "add" in a:
+                    calls["aliases"][a["add"]["alias"]] = a["add"]["index"]
+            return httpx.Response(200, json={"acknowledged": True})
+        if path.startswith("/_alias/"):
+            alias = path.split("/")[-1]
+            if alias not in calls["aliases"]:
+                return httpx.Response(404, json={"error": "alias missing"})
+            return httpx.Response(200, json={calls["aliases"][alias]: {"aliases": {alias: {}}}})
+        if path.startswith("/_cat/indices/"):
+            prefix = path.split("/")[-1].rstrip("*")
+            return httpx.Response(200, json=[{"index": i} for i in calls["indices"] if i.startswith(prefix)])
+        if path.endswith("/_search"):
+            body = json.loads(request.content)
+            after = (body.get("search_after") or [-1])[0]
+            keys = sorted(int(i) for i in calls["indices"][resolve(name)] if int(i) > after)[:body["size"]]
+            return httpx.Response(200, json={"hits": {"hits": [{"_id": str(k), "sort": [k]} for k in keys]}})
+        if path.endswith("/_settings") and request.method == "GET":
+            return httpx.Response(200, json={name: {"settings": {"index": {"refresh_interval": "5s"}}}})
+        if path.endswith("/_settings"):
+            calls["settings"].append(json.loads(request.content)["index"])
+            return httpx.Response(200, json={"acknowledged": True})
+        if path.endswith("/_refresh"):
+            calls["refresh"] += 1
+            return httpx.Response(200, json={})
+        if path.endswith("/_count"):
+            return httpx.Response(200, json={"count": len(calls["indices"].get(resolve(name), ()))})
+        if request.method == "PUT":
+            if name in calls["indices"]:
+                return httpx.Response(400, json={"error": "resource_already_exists_exception"})
+            calls["indices"][name] = set()
+            return httpx.Response(200, json={"acknowledged": True})
+        if request.method == "DELETE":
+            calls["deleted"].append(name)
+            calls["indices"].pop(name, None)
+            return httpx.Response(200, json={"acknowledged": True})
+        return httpx.Response(404, text="?")
+
+    es = sync_mod.ElasticSync(executor or _FakeExecutor(total), **kw)
+    mock = httpx.MockTransport(handler)
+    clients = []
+
+    def _get_client():
+        if not clients or clients[-1].is_closed:
+            clients.append(httpx.AsyncClient(transport=mock))
+        return clients[-1]
+
+    es._get_client = _get_client
+    return es, calls, clients
+
+
+# ============================================================
+# TestElasticSyncPipeline
+# ============================================================
+
+class TestElasticSyncPipeline:
+    def test_full_sync_indexa_tudo_em_paralelo(self, monkeypatch, tmp_path):
+        es, calls, clients = _make_sync(monkeypatch, tmp_path, total=2600, bulk_workers=3, queue_size=2)
+
+        result = asyncio.run(es.sync_products(full=True))
+
+        assert result["indexed"] == 2600 and result["errors"] == 0
+        assert sorted(map(int, calls["bulk_ids"])) == list(range(1, 2601))
+        assert result["pages"] == 6 and result["docs_per_s"] > 0
+        assert calls["max_in_bulk"] > 1          # bulks sobrepostos
+        assert len(clients) == 1                 # client persistente
+
+        # refresh desligado na carga e restaurado no fim
+        assert calls["settings"][0] == {"refresh_interval": "-1", "number_of_replicas": 0}
+        assert calls["settings"][-1] == {"refresh_interval": "5s", "number_of_replicas": None}
+        assert calls["refresh"] == 1
+        assert es._state["last_full_sync"] == es._state["last_products_sync"]
+
+        # Carga numa geracao nova, alias aponta para ela
+        assert result["swapped"] and result["index"].startswith("idx_produtos_v")
+        assert calls["aliases"]["idx_produtos"] == result["index"]
+
+    def test_incremental_nao_mexe_em_settings(self, monkeypatch, tmp_path):
+        es, calls, clients = _make_sync(monkeypatch, tmp_path, total=120, bulk_workers=2)
+
+        result = asyncio.run(es.sync_products(full=False))
+
+        assert result["indexed"] == 120 and result["pages"] == 1
+        assert calls["settings"] == [] and calls["refresh"] == 0
+        # 1a vez: cria a geracao inicial e escreve pelo alias
+        assert len(calls["indices"][calls["aliases"]["idx_produtos"]]) == 120
+
+    def test_erro_no_bulk_nao_trava_produtor(self, monkeypatch, tmp_path):
+        es, calls, clients = _make_sync(monkeypatch, tmp_path, total=1500, bulk_workers=1, queue_size=1)
+
+        async def broken(index, docs):
+            raise httpx.ConnectError("es caiu")
+
+        es._bulk_index = broken
+        result = asyncio.run(asyncio.wait_for(es.sync_products(full=False), 2))
+        assert result["indexed"] == 0 and result["errors"] == 1500
+
+
+    def test_linha_ruim_conta_pagina_como_erro(self, monkeypatch, tmp_path):
+        import src.elastic.sync as sync_mod
+        es, calls, clients = _make_sync(monkeypatch, tmp_path, total=1500, bulk_workers=2, queue_size=1)
+        original = sync_mod.product_doc
+
+        def fragile(row):
+            if row["CODPROD"] == 700:
+                raise ValueError("linha ruim")
+            return original(row)
+
+        monkeypatch.setattr(sync_mod, "product_doc", fragile)
+        result = asyncio.run(asyncio.wait_for(es.sync_products(full=False), 2))
+        assert result["indexed"] == 1000 and result["errors"] == 500
+
+    def test_worker_morto_cancela_produtor(self, monkeypatch, tmp_path):
+        es, calls, clients = _make_sync(monkeypatch, tmp_path, total=3000, bulk_workers=1, queue_size=1)
+
+        async def fatal(index, docs):
+            raise asyncio.CancelledError()   # escapa do except Exception do worker
+
+        es._bulk_index = fatal
+
+        async def run():
+            try:
+                await asyncio.wait_for(es.sync_products(full=False), 2)
+            except asyncio.CancelledError:
+                pass
+            await asyncio.sleep(0.05)
+            return [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+
+        assert asyncio.run(run()) == []
+        assert es.executor.pages < 6             # produtor parou junto
+
+
+# ============================================================
+# TestBlueGreenReindex
+# ============================================================
+
+class TestBlueGreenReindex:
+    def test_troca_atomica_e_limpa_geracoes(self, monkeypatch, tmp_path):
+        import src.elastic.sync as sync_mod
+
+        monkeypatch.setattr(sync_mod, "ELASTIC_KEEP_GENERATIONS", 1)
+        indices = {"idx_produtos_v20260101000000": {"1"}, "idx_produtos_v20260201000000": {"1", "2"}}
+        aliases = {"idx_produtos": "idx_produtos_v20260201000000"}
+        es, calls, _ = _make_sync(monkeypatch, tmp_path, total=700, indices=indices, aliases=aliases)
+
+        result = asyncio.run(es.sync_products(full=True))
+
+        new = result["index"]
+        assert result["swapped"] and result["total_in_index"] == 700
+        # remove + add na mesma chamada
+        assert calls["alias_actions"] == [[
+            {"remove": {"index": "idx_produtos_v20260201000000", "alias": "idx_produtos"}},
+            {"add": {"index": new, "alias": "idx_produtos"}},
+        ]]
+        # mantem 1 geracao anterior, apaga a mais velha
+        assert result["removed_generations"] == ["idx_produtos_v20260101000000"]
+        assert set(calls["indices"]) == {"idx_produtos_v20260201000000", new}
+
+    def test_geracao_incompleta_nao_vai_pro_ar(self, monkeypatch, tmp_path):
+        aliases = {"idx_produtos": "idx_produtos_v20260201000000"}
+        es, calls, _ = _make_sync(monkeypatch, tmp_path, total=1200,
+                                  indices={"idx_produtos_v20260201000000": {"1"}}, aliases=aliases)
+
+        async def partial(index, docs):
+            if docs[0]["codprod"] > 500:
+                return {"indexed": 0, "errors": len(docs)}
+            calls["indices"][index].update(str(d["_id"]) for d in docs)
+            return {"indexed": len(docs), "errors": 0}
+
+        es._bulk_index = partial
+        result = asyncio.run(es.sync_products(full=True))
+
+        assert result["swapped"] is False and result["expected"] == 1200
+        assert calls["aliases"] == {"idx_produtos": "idx_produtos_v20260201000000"}
+        assert calls["deleted"] == [result["index"]] and calls["alias_actions"] == []
+        assert es._state["last_full_sync"] is None
+
+    def test_falha_no_pipeline_apaga_geracao_nova(self, monkeypatch, tmp_path):
+        aliases = {"idx_produtos": "idx_produtos_v20260201000000"}
+        es, calls, _ = _make_sync(monkeypatch, tmp_path, total=3000, bulk_workers=1,
+                                  indices={"idx_produtos_v20260201000000": {"1"}}, aliases=aliases)
+
+        async def fatal(index, docs):
+            raise asyncio.CancelledError()
+
+        es._bulk_index = fatal
+
+        async def run():
+            try:
+                await es.sync_products(full=True)
+            except asyncio.CancelledError:
+                pass
+
+        asyncio.run(run())
+
+        assert set(calls["indices"]) == {"idx_produtos_v20260201000000"}
+        assert len(calls["deleted"]) == 1 and calls["deleted"][0].startswith("idx_produtos_v")
+        assert calls["aliases"] == {"idx_produtos": "idx_produtos_v20260201000000"}
+        assert calls["settings"] == [{"refresh_interval": "-1", "number_of_replicas": 0}]
+
+    def test_limpeza_apaga_geracoes_orfas_mais_novas(self, monkeypatch, tmp_path):
+        indices = {"idx_produtos_v20260101000000": set(), "idx_produtos_v20260201000000": set(),
+                   "idx_produtos_v20260301000000": set(), "idx_produtos_v20260401000000": set()}
+        aliases = {"idx_produtos": "idx_produtos_v20260201000000"}
+        es, calls, _ = _make_sync(monkeypatch, tmp_path, total=0, indices=indices, aliases=aliases)
+
+        removed = asyncio.run(es._cleanup_generations("idx_produtos", keep=1))
+
+        # v0301/v0401 sao sobras de cargas que falharam; v0101 e o rollback
+        assert removed == ["idx_produtos_v20260301000000", "idx_produtos_v20260401000000"]
+        assert set(calls["indices"]) == {"idx_produtos_v20260101000000", "idx_produtos_v20260201000000"}
+
+    def test_migra_indice_legado(self, monkeypatch, tmp_path):
+        es, calls, _ = _make_sync(monkeypatch, tmp_path, total=10, indices={"idx_produtos": {"1"}})
+
+        result = asyncio.run(es.sync_products(full=True))
+
+        assert result["swapped"]
+        assert {"remove_index": {"index": "idx_produtos"}} in calls["alias_actions"][0]
+        assert set(calls["indices"]) == {result["index"]}
+        assert calls["aliases"]["idx_produtos"] == result["index"]
+
+
+# ============================================================
+# TestReconcile
+# ============================================================
+
+class TestReconcile:
+    def test_remove_inativados(self, monkeypatch, tmp_path):
+        import src.elastic.sync as sync_mod
+
+        monkeypatch.setattr(sync_mod, "ES_SCAN_PAGE", 300)
+        in_index = {str(i) for i in range(1, 1001)}
+        active = [i for i in range(1, 1001) if i % 10] + [5000]   # 100 inativados, 1 novo
+        executor = _FakeKeysExecutor(active)
+        es, calls, _ = _make_sync(monkeypatch, tmp_path, total=0, executor=executor,
+                                  indices={"idx_produtos_v1": in_index},
+                                  aliases={"idx_produtos": "idx_produtos_v1"})
+
+        result = asyncio.run(es.reconcile_products())
+
+        assert result["stale"] == 100 and result["deleted"] == 100 and result["missing"] == 1
+        assert sorted(map(int, calls["deleted_ids"])) == list(range(10, 1001, 10))
+        assert len(calls["indices"]["idx_produtos_v1"]) == 900
+        assert executor.queries == 1   # 1001 chaves cabem numa faixa so
+
+    def test_faixas_de_chaves(self, monkeypatch, tmp_path):
+        import src.elastic.sync as sync_mod
+
+        monkeypatch.setattr(sync_mod, "ELASTIC_RECONCILE_BUCKET", 2)
+        active = list(range(1, 2501))   # 1251 buckets de 2 -> 3 queries de ate 500 linhas
+        executor = _FakeKeysExecutor(active)
+        es, calls, _ = _make_sync(monkeypatch, tmp_path, total=0, executor=executor)
+
+        keys = asyncio.run(es._active_keys("Produtos", "TGFPRO", "PRO", "CODPROD"))
+
+        assert executor.queries == 3
+        assert keys.tolist() == active
+
+    def test_aborta_sem_apagar(self, monkeypatch, tmp_path):
+        in_index = {str(i) for i in range(1, 101)}
+        for executor in (_FakeKeysExecutor([], fail=True), _FakeKeysExecutor(range(1, 51))):
+            es, calls, _ = _make_sync(monkeypatch, tmp_path, total=0, executor=executor,
+                                      indices={"idx_produtos": set(in_index)})
+            result = asyncio.run(es.reconcile_products())
+            assert result["deleted"] == 0 and result["error"]
+            assert "deleted_ids" not in calls
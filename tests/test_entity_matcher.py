@@ -0,0 +1,188 @@
+"""
+Testes do matcher de entidades (src/agent/entity_matcher.py) + benchmark.
+Roda com: python -m pytest tests/test_entity_matcher.py -v -s
+Benchmark: python tests/test_entity_matcher.py
+"""
+
+import sys
+import time
+import random
+from pathlib import Path
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+QUESTIONS = [
+    "pendencias da marca mann filter atrasadas",
+    "o que falta chegar da donaldson?",
+    "estoque critico mannheim",
+    "vendas de hoje por uberlandia",
+    "pedidos atrasados fras-le do comprador joao",
+    "qual pedido com maior valor pendente?",
+    "tem algo donald pendente",
+    "filtros da marca 4321 com previsao de entrega",
+]
+
+
+def _fake_marcas(n: int, seed: int = 7) -> set:
+    rnd = random.Random(seed)
+    letters = "ABCDEFGHIJKLMNOPRSTUVZ"
+    marcas = {"MANN", "MANN FILTER", "DONALDSON", "FRAS-LE", "SKF"}
+    while len(marcas) < n:
+        words = ["".join(rnd.choice(letters) for _ in range(rnd.randint(3, 9)))
+                 for _ in range(rnd.randint(1, 3))]
+        marcas.add(" ".join(words))
+    return marcas
+
+
+# ============================================================
+# TestEntityMatcher
+# ============================================================
+
+class TestEntityMatcher:
+    def test_fronteira_e_longest_match(self):
+        from src.agent.entity_matcher import EntityMatcher
+        m = EntityMatcher({"marca": {"MANN", "MANN FILTER", "FRAS-LE"}, "empresa": {"MMARRA"}})
+        spans = m.find_all("PENDENCIAS MANN FILTER E FRAS-LE NA MMARRA, NAO MANNHEIM")
+        marcas = [s.value for s in m.longest(spans, "marca")]
+        assert marcas == ["MANN FILTER", "FRAS-LE"]
+        assert [s.value for s in m.longest(spans, "empresa")] == ["MMARRA"]
+        assert m.complete("marca", "FRAS") == "FRAS-LE"
+        assert m.complete("marca", "XPTO") is None
+
+    def test_extract_entities_com_matcher(self):
+        from src.agent.entities import extract_entities, build_entity_matcher
+        matcher = build_entity_matcher({"MANN", "DONALDSON"}, {"MMARRA"}, {"JOAO"})
+        r = extract_entities("tem algo donald pendente pro joao", matcher=matcher)
+        assert r["marca"] == "DONALDSON"
+        assert r["comprador"] == "JOAO"
+        assert "marca" not in extract_entities("estoque critico mannheim", matcher=matcher)
+
+
+# ============================================================
+# TestEntityDictionary
+# ============================================================
+
+class _FakeExecutor:
+    def __init__(self, marcas, ok=True):
+        self.marcas = marcas
+        self.ok = ok
+        self.calls = 0
+        self.priorities = []
+
+    async def execute_batch(self, queries):
+        from src.core.query_scheduler import query_priority
+        self.calls += 1
+        self.priorities.append(query_priority.get())
+        marcas = {"success": True, "data": [[m] for m in self.marcas]}
+        empresas = {"success": self.ok, "data": [["MMARRA"]], "error": "timeout"}
+        compradores = {"success": self.ok, "data": [{"C": "JOAO"}], "error": "timeout"}
+        return [marcas, empresas, compradores]
+
+
+class TestEntityDictionary:
+    def test_refresh_troca_snapshot_e_persiste(self, tmp_path):
+        import asyncio
+        from src.agent.entity_dictionary import EntityDictionary
+        path = tmp_path / "entity_snapshot.json"
+        ents = EntityDictionary(snapshot_file=path)
+        assert ents.load_snapshot() is False and ents.current.empty
+
+        ex = _FakeExecutor(["MANN", "DONALDSON"])
+        asyncio.run(ents.ensure_loaded(ex))
+        before = ents.current
+        assert before.version == 1 and before.marcas == {"MANN", "DONALDSON"}
+        assert before.compradores == {"JOAO"}
+
+        # Sem mudanca: nao troca nem incrementa versao
+        assert asyncio.run(ents.refresh(ex)) is False
+        assert ents.current is before
+
+        # Marca nova + empresas/compradores falhando: mantem os antigos
+        ex2 = _FakeExecutor(["MANN", "DONALDSON", "FRAS-LE"], ok=False)
+        assert asyncio.run(ents.refresh(ex2)) is True
+        snap = ents.current
+        assert snap.version == 2 and "FRAS-LE" in snap.marcas
+        assert snap.empresas == {"MMARRA"}
+        assert snap.matcher.complete("marca", "FRAS") == "FRAS-LE"
+        assert before.matcher.complete("marca", "FRAS") is None  # snapshot antigo intacto
+
+        # Restart: carrega do disco sem tocar no banco
+        ents2 = EntityDictionary(snapshot_file=path)
+        assert ents2.load_snapshot() is True
+        assert ents2.current.version == 2 and ents2.current.source == "disk"
+        ex3 = _FakeExecutor([])
+        asyncio.run(ents2.ensure_loaded(ex3))
+        assert ex3.calls == 0
+
+    def test_scheduler_roda_como_background(self, tmp_path):
+        import asyncio
+        from src.agent.entity_dictionary import EntityDictionary
+        ents = EntityDictionary(snapshot_file=tmp_path / "entity_snapshot.json", refresh_interval=3600)
+        ex = _FakeExecutor(["MANN"])
+
+        async def run():
+            task = asyncio.create_task(ents.run_scheduler(ex))
+            await asyncio.sleep(0.05)
+            task.cancel()
+
+        asyncio.run(run())
+        assert ex.priorities == ["background"]
+        # Refresh direto (ensure_loaded do chat) fica na classe de quem chamou
+        asyncio.run(ents.refresh(ex))
+        assert ex.priorities == ["background", None]
+
+    def test_seguidor_recarrega_snapshot_do_lider(self, tmp_path):
+        import asyncio
+        from src.agent.entity_dictionary import EntityDictionary
+        path = tmp_path / "entity_snapshot.json"
+        leader = EntityDictionary(snapshot_file=path)
+        follower = EntityDictionary(snapshot_file=path)
+        asyncio.run(leader.refresh(_FakeExecutor(["MANN"])))
+        follower.load_snapshot()
+
+        async def run():
+            watch = asyncio.create_task(follower.watch_snapshot(interval=0.01))
+            await leader.refresh(_FakeExecutor(["MANN", "FRAS-LE"]))
+            await asyncio.sleep(0.1)
+            watch.cancel()
+
+        asyncio.run(run())
+        assert follower.current.version == 2 and "FRAS-LE" in follower.current.marcas
+        assert follower.stats()["swaps"] == 1
+
+
+# ============================================================
+# TestBenchmark
+# ============================================================
+
+def run_benchmark(n_marcas: int = 5000, rounds: int = 200) -> dict:
+    from src.agent.entities import extract_entities, build_entity_matcher
+    marcas = _fake_marcas(n_marcas)
+    empresas = {"MMARRA ARACATUBA", "MMARRA UBERLANDIA", "MMARRA RIBEIRAO"}
+
+    t0 = time.perf_counter()
+    matcher = build_entity_matcher(marcas, empresas, {"JOAO", "MARIA"})
+    build_ms = (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for q in QUESTIONS:
+            extract_entities(q, marcas, empresas, matcher=matcher)
+    per_question_ms = (time.perf_counter() - t0) * 1000 / (rounds * len(QUESTIONS))
+    return {"marcas": len(marcas), "build_ms": round(build_ms, 1),
+            "per_question_ms": round(per_question_ms, 3)}
+
+
+class TestBenchmark:
+    def test_5k_marcas(self):
+        result = run_benchmark(rounds=20)
+        print(f"\n[BENCH] extract_entities: {result}")
+        # Folgado para CI lento; o tipico e bem abaixo de 1ms
+        assert result["per_question_ms"] < 20
+
+
+if __name__ == "__main__":
+    print(run_benchmark())
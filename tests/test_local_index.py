@@ -0,0 +1,158 @@
+"""
+Testes do indice local de produtos (src/elastic/local_index.py) e do fallback com Elastic offline.
+Roda com: python -m pytest tests/test_local_index.py -v
+"""
+
+import sys
+import asyncio
+from pathlib import Path
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import httpx
+
+
+def _row(codprod, descr, marca="MANN", aplic="", ref="", nf=""):
+    return {"CODPROD": codprod, "DESCRPROD": descr, "MARCA": marca, "MARCA_CODIGO": 1,
+            "APLICACAO": aplic, "COMPLEMENTO": "", "REFERENCIA": ref,
+            "NUM_FABRICANTE": nf, "NUM_FABRICANTE2": "", "NUM_ORIGINAL": "",
+            "REF_FORNECEDOR": "", "NCM": "", "UNIDADE": "UN"}
+
+
+ROWS = [
+    _row(133346, "FILTRO DE OLEO", "MANN", "SCANIA R450", ref="W 950/26", nf="W950"),
+    _row(133347, "FILTRO DE AR", "MANN", "SCANIA R450", ref="C 25 860"),
+    _row(200001, "FILTRO OLEO COMBUSTIVEL", "DONALDSON", "VOLVO FH", ref="P618689"),
+    _row(200002, "PASTILHA DE FREIO", "FRASLE", "MERCEDES ATEGO", ref="PD/1234"),
+    _row(200003, "FILTRO DE ÓLEO LUBRIFICANTE", "FLEETGUARD", "CUMMINS ISB", ref="LF3000"),
+]
+
+
+def _build(tmp_path, rows=ROWS):
+    from src.elastic.sync import product_doc
+    from src.elastic.local_index import LocalIndexBuilder, get_local_index
+
+    builder = LocalIndexBuilder()
+    builder.add([product_doc(r) for r in reversed(rows)])   # ordem nao importa
+    builder.save(tmp_path)
+    return get_local_index(tmp_path)
+
+
+# ============================================================
+# TestLocalIndex
+# ============================================================
+
+class TestLocalIndex:
+    def test_codigo_normalizado(self, tmp_path):
+        index = _build(tmp_path)
+
+        hits = index.search(codigo="w950-26")
+        assert [h["codprod"] for h in hits] == [133346]
+        assert hits[0]["_score"] >= 100 and hits[0]["_highlights"] == {}
+        assert index.search(codigo="P 618689")[0]["codprod"] == 200001
+        assert index.search(codigo="133347")[0]["descricao"] == "FILTRO DE AR"
+
+    def test_codigo_prefixo_e_substring(self, tmp_path):
+        rows = [_row(1, "FILTRO DE OLEO", ref="W 950/26"),          # sem NUM_FABRICANTE = "W950"
+                _row(2, "FILTRO DE AR", ref="C 25 860"),
+                _row(3, "ELEMENTO", ref="W950", nf="HU 718/5X")]
+        index = _build(tmp_path, rows)
+
+        hits = index.search(codigo="W950")
+        assert [h["codprod"] for h in hits] == [3, 1]              # exato antes do prefixo
+        assert hits[0]["_score"] > hits[1]["_score"] > 0
+        assert [h["codprod"] for h in index.search(codigo="950/26")] == [1]    # substring
+        assert [h["codprod"] for h in index.search(codigo="718")] == [3]
+        assert index.search(codigo="25860")[0]["codprod"] == 2
+        assert index.search(codigo="W951") == []
+
+    def test_complemento_entra_no_texto(self, tmp_path):
+        row = _row(9, "ANEL", ref="X1")
+        row["COMPLEMENTO"] = "VEDACAO CARTER"
+        index = _build(tmp_path, ROWS + [row])
+        assert index.search(text="vedacao carter")[0]["codprod"] == 9
+
+    def test_texto_bm25_e_acento(self, tmp_path):
+        index = _build(tmp_path)
+
+        hits = index.search(text="filtro oleo")
+        codes = [h["codprod"] for h in hits]
+        # "OLEO" casa "ÓLEO"; so "filtro" (como no OR do Elastic) vem depois
+        assert set(codes[:3]) == {133346, 200001, 200003} and codes[3:] == [133347]
+        assert 200002 not in codes
+
+        # aplicacao entra no ranking
+        assert index.search(text="filtro", aplicacao="volvo")[0]["codprod"] == 200001
+
+    def test_filtro_marca_e_limit(self, tmp_path):
+        index = _build(tmp_path)
+
+        assert {h["codprod"] for h in index.search(text="filtro", marca="mann")} == {133346, 133347}
+        assert len(index.search(text="filtro", limit=2)) == 2
+        assert [h["codprod"] for h in index.search(marca="frasle")] == [200002]
+
+    def test_nova_geracao_troca_e_limpa(self, tmp_path):
+        first = _build(tmp_path)
+        second = _build(tmp_path, ROWS[:2] + [_row(300000, "CORREIA DENTADA", ref="CT1000")])
+
+        assert second is not first and second.n_docs == 3
+        assert second.search(codigo="CT1000")[0]["codprod"] == 300000
+        assert len(list(tmp_path.glob("gen-*"))) == 1
+
+
+    def test_troca_de_geracao_durante_busca(self, tmp_path):
+        from src.elastic.local_index import get_local_index
+        first = _build(tmp_path)
+        original = first.doc
+        swapped = []
+
+        def doc_and_swap(i):
+            if not swapped:   # outra task troca o CURRENT no meio desta busca
+                swapped.append(_build(tmp_path, ROWS[:2]))
+            return original(i)
+
+        first.doc = doc_and_swap
+        hits = first.search(text="filtro")
+        assert len(hits) == 4 and swapped[0] is not first
+        assert get_local_index(tmp_path) is swapped[0]
+        assert first.search(codigo="LF3000")[0]["codprod"] == 200003   # antiga segue legivel
+
+
+# ============================================================
+# TestElasticOffline
+# ============================================================
+
+class TestElasticOffline:
+    def test_search_products_cai_no_indice_local(self, tmp_path, monkeypatch):
+        import src.elastic.search as search_mod
+        import src.elastic.local_index as local_mod
+
+        _build(tmp_path)
+        monkeypatch.setattr(local_mod, "LOCAL_INDEX_DIR", tmp_path)
+        monkeypatch.setattr(search_mod, "code_cache", search_mod.CodeLookupCache())
+        monkeypatch.setattr(search_mod, "_offline_until", 0.0)
+        monkeypatch.setattr(search_mod, "_search_stats", {**search_mod._search_stats, "local_fallback": 0})
+        calls = []
+
+        def handler(request):
+            calls.append(request.url.path)
+            raise httpx.ConnectError("connection refused")
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(search_mod, "_get_client", lambda: client)
+        engine = search_mod.ElasticSearchEngine()
+
+        async def run():
+            by_code = await engine.search_products(codigo="W950")
+            by_text = await engine.msearch([("products", {"text": "pastilha freio"}),
+                                            ("partners", {"text": "silva"})])
+            return by_code, by_text
+
+        by_code, (products, partners) = asyncio.run(run())
+        assert by_code[0]["codprod"] == 133346
+        assert products[0]["codprod"] == 200002 and partners == []
+        assert len(calls) == 1                    # depois da 1a falha nem tenta o Elastic
+        assert search_mod.search_stats()["local_fallback"] == 2
+        assert search_mod.code_cache.stats()["entries"] == 0
@@ -0,0 +1,74 @@
+"""
+Testes da resolucao de perfil RBAC no login (src/api/app.py).
+Roda com: python -m pytest tests/test_login.py -v
+"""
+
+import sys
+import asyncio
+from pathlib import Path
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+# ============================================================
+# TestResolveRbacProfile
+# ============================================================
+
+class TestResolveRbacProfile:
+    def _fake_batch(self, calls, team_rows):
+        async def execute_batch(queries):
+            calls.append(queries)
+            profile = {"success": True, "data": [[42, "FULANO", "V", 0, "S", 1]]}
+            team = {"success": True, "data": team_rows}
+            return [profile, team]
+        return execute_batch
+
+    def test_gerente_em_paralelo_e_cache(self, monkeypatch):
+        import src.api.app as app_mod
+        calls = []
+        monkeypatch.setattr(app_mod, "_profile_cache", {})
+        monkeypatch.setattr(app_mod._rbac_executor, "execute_batch", self._fake_batch(calls, [[7], [8]]))
+
+        rbac = asyncio.run(app_mod.resolve_rbac_profile("fulano"))
+        assert len(calls) == 1 and len(calls[0]) == 2  # perfil + equipe num batch so
+        assert rbac["role"] == "gerente"
+        assert rbac["profile"]["codvend"] == 42
+        assert sorted(rbac["team_codvends"]) == [7, 8, 42]
+
+        asyncio.run(app_mod.resolve_rbac_profile("FULANO"))
+        assert len(calls) == 1  # segunda vez vem do cache
+
+    def test_vendedor_sem_subordinados(self, monkeypatch):
+        import src.api.app as app_mod
+        monkeypatch.setattr(app_mod, "_profile_cache", {})
+        monkeypatch.setattr(app_mod._rbac_executor, "execute_batch", self._fake_batch([], []))
+        rbac = asyncio.run(app_mod.resolve_rbac_profile("fulano"))
+        assert rbac["role"] == "vendedor"
+        assert rbac["team_codvends"] == []
+
+
+# ============================================================
+# TestSessionTouch
+# ============================================================
+
+class TestSessionTouch:
+    def test_sessao_ativa_renova_ttl_no_backend_memory(self, monkeypatch):
+        from datetime import datetime, timedelta
+        from src.core.state_backend import MemoryStateBackend, BackendDict
+        import src.api.app as app_mod
+
+        backend = MemoryStateBackend()
+        sessions = BackendDict(backend, "auth", ttl=app_mod.SESSION_TIMEOUT.total_seconds())
+        monkeypatch.setattr(app_mod, "state_backend", backend)
+        monkeypatch.setattr(app_mod, "sessions", sessions)
+
+        login = datetime.now() - timedelta(hours=7, minutes=59)
+        sessions["tok"] = {"user": "ana", "role": "vendedor", "last_activity": login}
+        expires_before = backend._data["auth"]["tok"][2]
+        sessions["tok"]["last_activity"] = datetime.now() - timedelta(minutes=5)  # usuario ativo
+
+        session = app_mod.get_current_user("Bearer tok")
+        assert session["user"] == "ana"
+        assert backend._data["auth"]["tok"][2] > expires_before  # TTL renovado no toque
@@ -0,0 +1,104 @@
+"""
+Testes do cache compartilhado de resultados de query (src/core/query_cache.py).
+Roda com: python -m pytest tests/test_query_cache.py -v
+"""
+
+import sys
+import asyncio
+from pathlib import Path
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+# ============================================================
+# TestQueryResultCache
+# ============================================================
+
+class TestQueryResultCache:
+    def test_coalescing_e_hit(self):
+        from src.core.query_cache import QueryResultCache
+        cache = QueryResultCache(ttl=60)
+        calls = {"n": 0}
+
+        async def fn():
+            calls["n"] += 1
+            await asyncio.sleep(0.02)
+            return {"success": True, "data": [[1]]}
+
+        async def run():
+            first = await asyncio.gather(*[cache.get_or_execute("SELECT 1 FROM DUAL", fn) for _ in range(10)])
+            again = await cache.get_or_execute("SELECT   1\n  FROM DUAL", fn)
+            return first, again
+
+        first, again = asyncio.run(run())
+        assert calls["n"] == 1
+        assert all(r["data"] == [[1]] for r in first)
+        assert again["data"] == [[1]]
+        st = cache.stats()
+        assert (st["misses"], st["coalesced"], st["hits"]) == (1, 9, 1)
+
+    def test_lider_cancelado_nao_cancela_seguidores(self):
+        from src.core.query_cache import QueryResultCache
+        cache = QueryResultCache(ttl=60)
+        calls = {"n": 0}
+
+        async def fn():
+            calls["n"] += 1
+            await asyncio.sleep(0.05)
+            return {"success": True, "data": [[calls["n"]]]}
+
+        async def run():
+            leader = asyncio.create_task(cache.get_or_execute("SELECT 1 FROM DUAL", fn))
+            await asyncio.sleep(0.01)
+            followers = [asyncio.create_task(cache.get_or_execute("SELECT 1 FROM DUAL", fn)) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            results = await asyncio.gather(*followers)
+            return leader, results
+
+        leader, results = asyncio.run(run())
+        assert leader.cancelled()
+        assert calls["n"] == 2                       # 1 seguidor virou lider, os outros coalesceram
+        assert all(r["data"] == [[2]] for r in results)
+        assert cache.stats()["inflight"] == 0
+
+    def test_escopo_rbac_separa_chaves(self):
+        from src.core.query_cache import QueryResultCache, cache_scope, scope_from_context
+        cache = QueryResultCache()
+        calls = {"n": 0}
+
+        async def fn():
+            calls["n"] += 1
+            return {"success": True, "data": []}
+
+        async def run(ctx):
+            token = cache_scope.set(scope_from_context(ctx))
+            try:
+                await cache.get_or_execute("SELECT 1 FROM DUAL", fn)
+            finally:
+                cache_scope.reset(token)
+
+        asyncio.run(run({"role": "admin"}))
+        asyncio.run(run({"role": "vendedor", "codvend": 5}))
+        asyncio.run(run({"role": "admin"}))
+        assert calls["n"] == 2
+
+    def test_lru_por_bytes_e_erro_nao_cacheado(self):
+        from src.core.query_cache import QueryResultCache
+        cache = QueryResultCache(max_bytes=200)
+
+        async def ok(n):
+            return {"success": True, "data": ["x" * 60], "n": n}
+
+        async def run():
+            for i in range(3):
+                await cache.get_or_execute(f"SELECT {i} FROM DUAL", lambda i=i: ok(i))
+            await cache.get_or_execute("SELECT 9 FROM DUAL", lambda: asyncio.sleep(0, {"success": False}))
+
+        asyncio.run(run())
+        st = cache.stats()
+        assert st["bytes"] <= 200
+        assert st["evictions"] >= 1
+        assert st["entries"] == 2  # 2 mais recentes; o erro nao entra
@@ -0,0 +1,147 @@
+"""
+Testes do SafeQueryExecutor e do transporte Sankhya compartilhado.
+Roda com: python -m pytest tests/test_query_executor.py -v
+"""
+
+import sys
+import json
+import asyncio
+from pathlib import Path
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import httpx
+
+
+def _make_transport(handler):
+    """SankhyaTransport com httpx.MockTransport no lugar da rede."""
+    from src.core.sankhya_client import SankhyaTransport
+    import src.core.sankhya_client as sc
+
+    transport = SankhyaTransport(http2=False)
+    mock = httpx.MockTransport(handler)
+
+    def _get_client():
+        loop = asyncio.get_running_loop()
+        if transport._client is None or transport._client_loop is not loop:
+            transport._client = httpx.AsyncClient(base_url=sc.SANKHYA_BASE_URL, transport=mock)
+            transport._client_loop = loop
+        return transport._client
+
+    transport._get_client = _get_client
+    return transport
+
+
+def _with_credentials(monkeypatch):
+    import src.core.sankhya_client as sc
+    monkeypatch.setattr(sc, "SANKHYA_CLIENT_ID", "id")
+    monkeypatch.setattr(sc, "SANKHYA_CLIENT_SECRET", "secret")
+    monkeypatch.setattr(sc, "SANKHYA_X_TOKEN", "xtoken")
+
+
+# ============================================================
+# TestSankhyaTransport
+# ============================================================
+
+class TestSankhyaTransport:
+    def test_single_flight_token(self, monkeypatch):
+        _with_credentials(monkeypatch)
+        calls = {"auth": 0}
+
+        def handler(request):
+            calls["auth"] += 1
+            return httpx.Response(200, json={"access_token": f"tok{calls['auth']}"})
+
+        transport = _make_transport(handler)
+
+        async def run():
+            return await asyncio.gather(*[transport.get_token() for _ in range(20)])
+
+        tokens = asyncio.run(run())
+        assert calls["auth"] == 1
+        assert set(tokens) == {"tok1"}
+
+    def test_invalidate_only_current_token(self, monkeypatch):
+        _with_credentials(monkeypatch)
+        transport = _make_transport(lambda r: httpx.Response(200, json={"access_token": "novo"}))
+        asyncio.run(transport.get_token())
+        transport.invalidate_token("token_antigo")
+        assert transport._token == "novo"
+        transport.invalidate_token("novo")
+        assert transport._token is None
+
+    def test_sem_credenciais(self, monkeypatch):
+        import src.core.sankhya_client as sc
+        from src.core.sankhya_client import AuthenticationError
+        monkeypatch.setattr(sc, "SANKHYA_CLIENT_ID", "")
+        transport = _make_transport(lambda r: httpx.Response(200, json={}))
+        try:
+            asyncio.run(transport.get_token())
+            assert False, "deveria falhar"
+        except AuthenticationError:
+            pass
+
+
+# ============================================================
+# TestExecutorTransport
+# ============================================================
+
+class TestExecutorTransport:
+    def test_execute_reusa_token_e_retry_401(self, monkeypatch):
+        _with_credentials(monkeypatch)
+        from src.llm.query_executor import SafeQueryExecutor
+        calls = {"auth": 0, "query": 0}
+
+        def handler(request):
+            if request.url.path == "/authenticate":
+                calls["auth"] += 1
+                return httpx.Response(200, json={"access_token": f"tok{calls['auth']}"})
+            calls["query"] += 1
+            if request.headers.get("Authorization") == "Bearer tok1" and calls["query"] == 1:
+                return httpx.Response(401)
+            body = json.loads(request.content)
+            assert "ROWNUM" in body["requestBody"]["sql"]
+            return httpx.Response(200, json={"status": "1", "responseBody": {"rows": [[1, "A"]]}})
+
+        transport = _make_transport(handler)
+        ex1 = SafeQueryExecutor(transport=transport)
+        ex2 = SafeQueryExecutor(transport=transport)
+
+        async def run():
+            r1 = await ex1.execute("SELECT CODPROD, DESCRPROD FROM TGFPRO")
+            r2 = await ex2.execute("SELECT CODPROD, DESCRPROD FROM TGFPRO")
+            return r1, r2
+
+        r1, r2 = asyncio.run(run())
+        assert r1["success"] and r2["success"]
+        assert r1["data"] == [[1, "A"]]
+        # 1 auth inicial + 1 re-auth apos 401; segundo executor reaproveita token
+        assert calls["auth"] == 2
+
+    def test_execute_batch_ordem_e_limite(self, monkeypatch):
+        _with_credentials(monkeypatch)
+        from src.llm.query_executor import SafeQueryExecutor
+
+        async def handler(request):
+            if request.url.path == "/authenticate":
+                return httpx.Response(200, json={"access_token": "tok"})
+            sql = json.loads(request.content)["requestBody"]["sql"]
+            await asyncio.sleep(0.01)
+            n = sql.split("SELECT ", 2)[-1].split(" AS N")[0]
+            return httpx.Response(200, json={"status": "1", "responseBody": {"rows": [[int(n)]]}})
+
+        transport = _make_transport(handler)
+        transport.max_concurrent_queries = 2
+        ex = SafeQueryExecutor(transport=transport)
+        queries = [f"SELECT {i} AS N FROM DUAL" for i in range(6)]
+        queries.append("DELETE FROM TGFPRO")
+
+        results = asyncio.run(ex.execute_batch(queries))
+        assert len(results) == 7
+        for i, r in enumerate(results[:6]):
+            assert r["success"]
+            assert r["data"] == [[i]]
+        assert results[6]["success"] is False
+        assert transport.stats()["max_in_flight"] <= 2
@@ -0,0 +1,136 @@
+"""
+Testes do QueryLogger: feedback append-only e indice de offsets (src/llm/query_logger.py).
+Roda com: python -m pytest tests/test_query_logger.py -v
+"""
+
+import sys
+import json
+from pathlib import Path
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+# ============================================================
+# TestQueryLoggerIndex
+# ============================================================
+
+class TestQueryLoggerIndex:
+    def _logger_with_entries(self, tmp_path, n=5):
+        from src.llm.query_logger import QueryLogger
+        ql = QueryLogger(log_file=tmp_path / "query_log.jsonl")
+        ids = []
+        for i in range(n):
+            e = ql.create_entry(f"pendencias da marca {i}", user="fulano")
+            ql.save(e)
+            ids.append(e["id"])
+        return ql, ids
+
+    def test_feedback_nao_reescreve_log(self, tmp_path):
+        from src.llm.query_logger import QueryLogger
+        ql, ids = self._logger_with_entries(tmp_path)
+        before = ql.log_file.read_bytes()
+
+        assert ql.save_feedback(ids[2], "negative", "marca errada") is True
+        assert ql.save_feedback("nao-existe", "positive") is False
+        assert ql.log_file.read_bytes() == before  # so o arquivo de eventos cresce
+
+        entry = ql.get_entry(ids[2])
+        assert entry["feedback"]["rating"] == "negative"
+        assert entry["feedback"]["comment"] == "marca errada"
+        assert ql.get_entry(ids[0])["feedback"]["rating"] is None
+
+        # Ultimo evento vence, inclusive ao reler o arquivo de eventos do zero
+        ql.save_feedback(ids[2], "positive")
+        assert ql.get_entry(ids[2])["feedback"]["rating"] == "positive"
+        fresh = QueryLogger(log_file=ql.log_file)
+        assert fresh.get_entry(ids[2])["feedback"]["rating"] == "positive"
+
+    def test_indice_persistido_e_recuperado(self, tmp_path):
+        from src.llm.query_logger import QueryLogger
+        ql, ids = self._logger_with_entries(tmp_path)
+        ql.save_feedback(ids[1], "positive")
+
+        # Linha escrita sem passar pelo indice (ex: processo caiu no meio)
+        orphan = ql.create_entry("vendas de hoje")
+        with open(ql.log_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(orphan) + "\n")
+
+        ql2 = QueryLogger(log_file=ql.log_file)
+        assert ql2.get_entry(ids[4])["question"] == "pendencias da marca 4"
+        assert ql2.get_entry(ids[1])["feedback"]["rating"] == "positive"
+        assert ql2.get_entry(orphan["id"])["question"] == "vendas de hoje"
+        assert len(ql.index_file.read_text().splitlines()) == 6
+
+    def test_entrada_gravada_por_outro_worker(self, tmp_path):
+        from src.llm.query_logger import QueryLogger
+        w1, ids = self._logger_with_entries(tmp_path, n=2)
+        w2 = QueryLogger(log_file=w1.log_file)
+        assert w2.get_entry(ids[0]) is not None   # w2 ja montou indice e agregados
+
+        # Worker 1 grava depois: w2 acha a entrada e ve o feedback dele
+        e = w1.create_entry("vendas de hoje", user="fulano")
+        w1.save(e)
+        assert w2.save_feedback(e["id"], "negative") is True
+        assert w1.get_entry(e["id"])["feedback"]["rating"] == "negative"
+        w1.save_feedback(ids[1], "positive")
+        assert w2.get_entry(ids[1])["feedback"]["rating"] == "positive"
+
+        # Agregados de cada worker incluem as linhas do outro
+        w2.save(w2.create_entry("oi", user="fulano"))
+        assert w1.get_analytics()["total_queries"] == w2.get_analytics()["total_queries"] == 4
+
+
+# ============================================================
+# TestQueryAggregates
+# ============================================================
+
+class TestQueryAggregates:
+    def _fill(self, ql):
+        ids = []
+        rows = [
+            ("pendencias da donaldson", "pendencia_compras", "scoring", "DONALDSON", 800),
+            ("pendencias da donaldson", "pendencia_compras", "scoring", "DONALDSON", 1200),
+            ("vendas de hoje", "vendas", "groq", None, 3000),
+            ("oi", "saudacao", "scoring", None, 10),
+            ("blablabla xyz", None, "fallback", None, 40000),
+        ]
+        for q, intent, layer, marca, ms in rows:
+            e = ql.create_entry(q, user="fulano")
+            e["processing"].update({"intent": intent, "layer": layer, "time_ms": ms,
+                                    "entities": {"marca": marca} if marca else {}})
+            ql.save(e)
+            ids.append(e["id"])
+        return ids
+
+    def test_incremental_igual_reconstrucao(self, tmp_path):
+        from src.llm.query_logger import QueryLogger
+        ql = QueryLogger(log_file=tmp_path / "query_log.jsonl")
+        ids = self._fill(ql)
+        ql.save_feedback(ids[0], "positive")
+        ql.save_feedback(ids[2], "negative")
+        ql.save_feedback(ids[2], "positive")  # troca de rating
+        ql.save_feedback(ids[4], "negative")
+
+        live_a, live_s = ql.get_analytics(), ql.get_suggestions(user="fulano")
+        assert live_a["total_queries"] == 5
+        assert live_a["feedback_summary"]["positive"] == 2
+        assert live_a["feedback_summary"]["negative"] == 1
+        assert live_a["by_intent"]["vendas"] == {"total": 1, "positive": 1, "negative": 0}
+        assert live_a["problem_queries"][0]["question"] == "blablabla xyz"
+        assert live_a["latency"]["histogram"][">30000ms"] == 1
+        assert live_s["popular"][0] == "pendencias da donaldson"
+        assert live_s["recent_successful"] == ["vendas de hoje", "pendencias da donaldson"]
+        assert live_s["personalized"] == ["pendencias da Donaldson"]
+
+        # Snapshot desatualizado + replay (processo reiniciado)
+        ql2 = QueryLogger(log_file=ql.log_file)
+        assert ql2.get_analytics() == live_a
+        assert ql2.get_suggestions(user="fulano") == live_s
+
+        # Sem snapshot: reconstroi lendo o log uma vez
+        ql.stats_file.unlink()
+        ql3 = QueryLogger(log_file=ql.log_file)
+        assert ql3.get_analytics() == live_a
+        assert ql3.stats_file.exists()
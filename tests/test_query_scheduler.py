@@ -0,0 +1,105 @@
+"""
+Testes da fila de queries do Sankhya (src/core/query_scheduler.py).
+Roda com: python -m pytest tests/test_query_scheduler.py -v
+"""
+
+import sys
+import asyncio
+from pathlib import Path
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+async def _hold_all(sched, n):
+    """Ocupa as n vagas (prioridade chat)."""
+    for _ in range(n):
+        await sched.acquire("chat", "dono")
+
+
+async def _enqueue(sched, order, priority, owner, label):
+    await sched.acquire(priority, owner)
+    order.append(label)
+    sched.release(priority)
+
+
+# ============================================================
+# TestQueryScheduler
+# ============================================================
+
+class TestQueryScheduler:
+    def test_prioridade_chat_antes_de_background(self):
+        from src.core.query_scheduler import QueryScheduler
+
+        async def run():
+            sched = QueryScheduler(1)
+            await _hold_all(sched, 1)
+            order = []
+            tasks = [asyncio.create_task(_enqueue(sched, order, "background", "sync", "bg")),
+                     asyncio.create_task(_enqueue(sched, order, "reports", "ana", "rep")),
+                     asyncio.create_task(_enqueue(sched, order, "chat", "bia", "chat"))]
+            await asyncio.sleep(0)
+            assert sched.stats()["classes"]["background"]["depth"] == 1
+            sched.release("chat")
+            await asyncio.gather(*tasks)
+            return order, sched.stats()
+
+        order, stats = asyncio.run(run())
+        assert order == ["chat", "rep", "bg"]
+        assert stats["in_flight"] == 0
+        assert stats["classes"]["background"]["wait_max_ms"] > 0
+
+    def test_round_robin_por_usuario(self):
+        from src.core.query_scheduler import QueryScheduler
+
+        async def run():
+            sched = QueryScheduler(1)
+            await _hold_all(sched, 1)
+            order = []
+            tasks = [asyncio.create_task(_enqueue(sched, order, "reports", "ana", f"ana{i}")) for i in range(3)]
+            tasks.append(asyncio.create_task(_enqueue(sched, order, "reports", "bia", "bia0")))
+            await asyncio.sleep(0)
+            sched.release("chat")
+            await asyncio.gather(*tasks)
+            return order
+
+        assert asyncio.run(run()) == ["ana0", "bia0", "ana1", "ana2"]
+
+    def test_background_nao_ocupa_todas_as_vagas(self):
+        from src.core.query_scheduler import QueryScheduler
+
+        async def run():
+            sched = QueryScheduler(3, background_max=1)
+            await sched.acquire("background", "sync")
+            blocked = asyncio.create_task(sched.acquire("background", "sync"))
+            await asyncio.sleep(0)
+            assert not blocked.done()
+            # chat ainda entra direto nas 2 vagas livres
+            await asyncio.wait_for(sched.acquire("chat", "ana"), 0.1)
+            await asyncio.wait_for(sched.acquire("chat", "bia"), 0.1)
+            blocked.cancel()
+            await asyncio.gather(blocked, return_exceptions=True)
+            return sched.stats()
+
+        stats = asyncio.run(run())
+        assert stats["in_flight"] == 3
+        assert stats["classes"]["background"]["cancelled"] == 1
+        assert stats["classes"]["background"]["depth"] == 0
+
+    def test_executor_usa_prioridade_do_contexto(self):
+        from src.core.sankhya_client import SankhyaTransport
+        from src.core.query_scheduler import query_priority_scope
+
+        transport = SankhyaTransport(http2=False)
+
+        async def run():
+            async with transport.query_slot(priority="reports") as slot:
+                default = slot.priority
+            with query_priority_scope("background", owner="sync"):
+                async with transport.query_slot(priority="reports") as slot:
+                    scoped = (slot.priority, slot.owner)
+            return default, scoped
+
+        assert asyncio.run(run()) == ("reports", ("background", "sync"))
+        assert transport.stats()["scheduler"]["classes"]["background"]["granted"] == 1
@@ -0,0 +1,91 @@
+"""
+Testes do rate limiter token bucket (src/core/rate_limiter.py).
+Roda com: python -m pytest tests/test_rate_limiter.py -v
+"""
+
+import sys
+from pathlib import Path
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def _limiter(**kw):
+    from src.core.state_backend import MemoryStateBackend
+    from src.core.rate_limiter import TokenBucketLimiter
+    kw.setdefault("quotas", {"admin": 10, "vendedor": 4})
+    return TokenBucketLimiter(backend=MemoryStateBackend(), **kw)
+
+
+# ============================================================
+# TestTokenBucket
+# ============================================================
+
+class TestTokenBucket:
+    def test_quota_por_role(self):
+        limiter = _limiter()
+        assert sum(limiter.is_allowed("ana", "vendedor") for _ in range(12)) == 4
+        assert sum(limiter.is_allowed("bia", "admin") for _ in range(12)) == 10
+        assert limiter.stats()["denied"] == 10
+
+    def test_recarga_continua(self, monkeypatch):
+        import src.core.rate_limiter as rl
+
+        now = [1000.0]
+        monkeypatch.setattr(rl.time, "time", lambda: now[0])
+        limiter = _limiter()  # vendedor: 4 fichas/60s = 1 ficha a cada 15s
+        for _ in range(4):
+            assert limiter.is_allowed("ana", "vendedor")
+        assert not limiter.is_allowed("ana", "vendedor")
+        assert limiter.retry_after("ana", "vendedor") == 15
+        now[0] += 15
+        assert limiter.is_allowed("ana", "vendedor")
+        now[0] += 3600
+        assert limiter.remaining("ana", "vendedor") == 4  # nao passa da capacidade
+
+    def test_custo_por_rota(self):
+        from src.core.rate_limiter import route_cost, RATE_COST_SCORING, RATE_COST_BRAIN
+
+        assert route_cost("scoring") == route_cost(None) == RATE_COST_SCORING
+        assert route_cost("function_calling") > RATE_COST_SCORING
+        assert route_cost("brain") == RATE_COST_BRAIN
+
+        limiter = _limiter(quotas={"vendedor": 10})
+        assert limiter.is_allowed("ana", "vendedor")
+        assert limiter.charge("ana", "vendedor", route="scoring") == 0
+        assert limiter.charge("ana", "vendedor", route="brain") == RATE_COST_BRAIN - 1
+        assert limiter.remaining("ana", "vendedor") == 10 - RATE_COST_BRAIN
+
+    def test_narracao_soma_ao_custo_da_rota(self):
+        from src.core.rate_limiter import (
+            route_cost, RATE_COST_SCORING, RATE_COST_GROQ, RATE_COST_NARRATION, ROUTE_COSTS
+        )
+        from src.agent.narrator import mark_narration
+        from src.agent.request_context import RequestContext, request_var, parse_question
+
+        assert route_cost("scoring", "8b") == RATE_COST_SCORING + RATE_COST_NARRATION
+        assert route_cost("scoring", "70b") == RATE_COST_SCORING + RATE_COST_GROQ
+        assert {"ollama", "haiku", "fallback_entity"} <= set(ROUTE_COSTS)
+
+        limiter = _limiter(quotas={"vendedor": 10})
+        assert limiter.charge("ana", "vendedor", route="scoring", narration="8b") == RATE_COST_NARRATION
+
+        # llm_narrate marca o request atual; 70b prevalece sobre 8b
+        req = RequestContext(parse_question("pendencias da mann"))
+        token = request_var.set(req)
+        try:
+            mark_narration("70b")
+            mark_narration("8b")
+        finally:
+            request_var.reset(token)
+        assert req.narration == "70b"
+
+    def test_divida_segura_proximas(self):
+        limiter = _limiter(quotas={"vendedor": 4})
+        assert limiter.is_allowed("ana", "vendedor")
+        limiter.charge("ana", "vendedor", route="brain")
+        limiter.charge("ana", "vendedor", route="brain")
+        assert limiter.backend.get(limiter.NS, "ana")[0] == -4  # divida limitada a -capacidade
+        assert not limiter.is_allowed("ana", "vendedor")
+        assert limiter.retry_after("ana", "vendedor") == 75  # 5 fichas a 4/min
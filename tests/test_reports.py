@@ -0,0 +1,158 @@
+"""
+Testes do modulo de relatorios (src/api/reports.py).
+Roda com: python -m pytest tests/test_reports.py -v
+"""
+
+import sys
+import asyncio
+from pathlib import Path
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+# ============================================================
+# TestQueryGraph
+# ============================================================
+
+class TestQueryGraph:
+    def test_paralelo_dependencias_e_timings(self, monkeypatch):
+        import src.api.reports as reports
+        state = {"running": 0, "max": 0, "order": []}
+
+        async def fake_run_query(sql, max_rows=None):
+            state["running"] += 1
+            state["max"] = max(state["max"], state["running"])
+            await asyncio.sleep(0.02)
+            state["running"] -= 1
+            state["order"].append(sql)
+            return {"success": True, "data": [{"SQL": sql}], "columns": ["SQL"]}
+
+        monkeypatch.setattr(reports, "_run_query", fake_run_query)
+
+        graph = {
+            "a": "SELECT A",
+            "b": "SELECT B",
+            "c": "SELECT C",
+            "d": {"sql": lambda res: "SELECT D_" + res["a"]["data"][0]["SQL"][-1], "after": ["a"]},
+            "pulada": {"sql": lambda res: None, "after": ["b"]},
+        }
+        res, timings = asyncio.run(reports._run_query_graph(graph, max_parallel=2))
+
+        assert state["max"] == 2
+        assert res["d"]["data"][0]["SQL"] == "SELECT D_A"
+        assert state["order"].index("SELECT A") < state["order"].index("SELECT D_A")
+        assert res["pulada"]["success"] is False
+        assert [t["query"] for t in timings] == ["a", "b", "c", "d", "pulada"]
+        assert all(t["ms"] >= 0 and "wait_ms" in t for t in timings)
+        assert timings[0]["rows"] == 1
+
+    def test_limite_de_linhas_por_no(self, monkeypatch):
+        import src.api.reports as reports
+        from src.llm.query_executor import MAX_ROWS
+        seen = {}
+
+        async def fake_execute(sql, use_cache=True, max_rows=MAX_ROWS):
+            seen[sql] = max_rows
+            return {"success": True, "data": [], "columns": []}
+
+        monkeypatch.setattr(reports._executor, "execute", fake_execute)
+        asyncio.run(reports._run_query_graph({"tabela": "SELECT A",
+                                              "scan": {"sql": "SELECT B", "max_rows": 20000}}))
+        assert seen == {"SELECT A": MAX_ROWS, "SELECT B": 20000}
+        assert "ROWNUM <= 20000" in reports._executor.add_row_limit("SELECT B", 20000)
+
+    def test_dependencia_circular(self):
+        import src.api.reports as reports
+        graph = {
+            "a": {"sql": "SELECT A", "after": ["b"]},
+            "b": {"sql": "SELECT B", "after": ["a"]},
+        }
+        try:
+            asyncio.run(reports._run_query_graph(graph))
+            assert False, "deveria falhar"
+        except ValueError:
+            pass
+
+
+# ============================================================
+# TestPendenciaSingleScan
+# ============================================================
+
+def _scan_row(pedido, empresa, comprador, marca, vlr, cat, atendida=0, codemp=1, codvend=10, codmarca=100):
+    return {
+        "COD_EMPRESA": codemp, "EMPRESA": empresa, "PEDIDO": pedido, "COMPRADOR": comprador,
+        "MARCA": marca, "QTD_PEDIDA": 10, "QTD_ATENDIDA": atendida, "VLR_TOTAL_PENDENTE": vlr,
+        "COD_COMPRADOR": codvend, "COD_MARCA": codmarca, "LINHA": "A", "CAT_PRAZO": cat,
+    }
+
+
+class TestPendenciaSingleScan:
+    def test_agregacao_local(self):
+        from src.api.reports import _pendencia_from_scan
+        rows = [
+            _scan_row(1, "RIBEIRAO", "JOAO", "DONALDSON", 100.0, "atrasados", codmarca=100),
+            _scan_row(1, "RIBEIRAO", "JOAO", "MANN", 50.0, "atrasados", atendida=5, codmarca=200),
+            _scan_row(2, "UBERLANDIA", "SEM COMPRADOR", "", 30.0, "sem_previsao", codemp=2, codvend=None, codmarca=None),
+        ]
+        cats = ["todos", "atrasados", "proximo", "sem_previsao", "no_prazo", "transito"]
+        res = _pendencia_from_scan(rows, cats, "todos")
+
+        by_cat = {c["CAT"]: c for c in res["categorias"]["data"]}
+        assert by_cat["todos"] == {"CAT": "todos", "QTD_PEDIDOS": 2, "QTD_PRODUTOS": 3, "VLR_TOTAL": 180.0}
+        assert by_cat["atrasados"]["QTD_PEDIDOS"] == 1
+        assert by_cat["transito"]["QTD_PRODUTOS"] == 1
+        assert by_cat["proximo"]["QTD_PRODUTOS"] == 0
+
+        assert res["chart_empresa"]["data"][0] == {"LABEL": "RIBEIRAO", "VALOR": 150.0}
+        assert [r["LABEL"] for r in res["chart_marca"]["data"]] == ["DONALDSON", "MANN", "SEM MARCA"]
+        assert [o["CODVEND"] for o in res["filtro_compradores"]["data"]] == [10]
+        assert [o["NOME"] for o in res["filtro_marcas"]["data"]] == ["DONALDSON", "MANN"]
+        assert "CAT_PRAZO" not in res["tabela"]["data"][0]
+
+        # Tabela cortada como a query da tabela; categorias somam o scan inteiro
+        res = _pendencia_from_scan(rows, cats, "todos", table_limit=2)
+        assert len(res["tabela"]["data"]) == 2
+        assert res["categorias"]["data"][0]["QTD_PRODUTOS"] == 3
+
+        res = _pendencia_from_scan(rows, cats, "sem_previsao")
+        assert len(res["tabela"]["data"]) == 1
+        assert res["chart_empresa"]["data"] == [{"LABEL": "UBERLANDIA", "VALOR": 30.0}]
+        # Filtros disponiveis ignoram a categoria (igual as queries SQL)
+        assert len(res["filtro_empresas"]["data"]) == 2
+
+
+# ============================================================
+# TestReportCache
+# ============================================================
+
+class TestReportCache:
+    def test_lru_limite_e_memoria_por_relatorio(self):
+        from src.api.reports import ReportCache
+        cache = ReportCache(max_entries=2)
+        ctx = {"role": "admin"}
+        cache.set("vendas_periodo", {"codemp": 1}, ctx, {"rows": [1]})
+        cache.set("vendas_periodo", {"codemp": 2}, ctx, {"rows": [2]})
+        assert cache.get("vendas_periodo", {"codemp": 1}, ctx) == {"rows": [1]}  # vira a mais recente
+        cache.set("estoque_critico", {}, ctx, {"rows": [3]})
+
+        assert cache.get("vendas_periodo", {"codemp": 2}, ctx) is None  # LRU removida
+        st = cache.stats()
+        assert st["entries"] == 2 and st["evictions"] == 1
+        assert st["por_relatorio"]["vendas_periodo"]["entries"] == 1
+        assert st["bytes"] == sum(r["bytes"] for r in st["por_relatorio"].values())
+
+        cache.invalidate("vendas_periodo")
+        assert "vendas_periodo" not in cache.stats()["por_relatorio"]
+
+    def test_expiracao_pelo_heap(self, monkeypatch):
+        import src.api.reports as reports
+        cache = reports.ReportCache()
+        now = [1000.0]
+        monkeypatch.setattr(reports.time, "time", lambda: now[0])
+        cache.set("vendas_periodo", {}, {}, {"rows": []})
+        now[0] += reports.CACHE_TTL + 1
+        assert cache.stats()["entries"] == 0
+        assert cache.stats()["expired"] == 1
+        assert cache.stats()["bytes"] == 0
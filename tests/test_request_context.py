@@ -0,0 +1,90 @@
+"""
+Testes do contexto por request (src/agent/request_context.py).
+Roda com: python -m pytest tests/test_request_context.py -v
+"""
+
+import sys
+import asyncio
+from pathlib import Path
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+# ============================================================
+# TestParsedQuestion
+# ============================================================
+
+class TestParsedQuestion:
+    def test_campos_e_imutabilidade(self):
+        import pytest
+        from dataclasses import FrozenInstanceError
+        from src.agent.request_context import parse_question
+
+        p = parse_question("Pendências da MANN atrasadas?")
+        assert p.q_norm == "pendencias da mann atrasadas?"
+        assert p.tokens == ("pendencias", "da", "mann", "atrasadas")
+        assert p.best_intent == "pendencia_compras"
+        with pytest.raises(FrozenInstanceError):
+            p.q_norm = "x"
+        with pytest.raises(TypeError):
+            p.entities["marca"] = "X"
+
+    def test_params_e_copia(self):
+        from src.agent.request_context import parse_question
+        from src.agent.entity_dictionary import _build_snapshot
+
+        snap = _build_snapshot(1, {"MANN"}, set(), set(), source="disk")
+        p = parse_question("pendencias da mann", snap)
+        params = p.params()
+        assert params["marca"] == "MANN"
+        params["marca"] = "OUTRA"
+        assert p.entities["marca"] == "MANN"
+
+    def test_campos_lazy_calculados_uma_vez(self):
+        from src.agent.request_context import parse_question
+
+        p = parse_question("pendencias so os atrasados")
+        assert p.filters is p.filters
+        assert p.scores is p.scores
+
+
+# ============================================================
+# TestRequestContext
+# ============================================================
+
+class TestRequestContext:
+    def test_parsed_for_reusa_so_a_mesma_pergunta(self):
+        from src.agent.request_context import (
+            RequestContext, request_var, parse_question, parsed_for
+        )
+
+        req = RequestContext(parse_question("estoque do produto 123"), "ana")
+        token = request_var.set(req)
+        try:
+            assert parsed_for("estoque do produto 123") is req.parsed
+            assert parsed_for("outra pergunta") is not req.parsed
+        finally:
+            request_var.reset(token)
+        assert parsed_for("estoque do produto 123") is not req.parsed
+
+    def test_requests_concorrentes_isolados(self):
+        from src.agent.request_context import (
+            RequestContext, request_var, current_request, parse_question
+        )
+
+        async def handle(question, user):
+            token = request_var.set(RequestContext(parse_question(question), user))
+            try:
+                current_request().produto_nome = question
+                await asyncio.sleep(0)  # outro request roda aqui no meio
+                req = current_request()
+                return req.user_id, req.produto_nome
+            finally:
+                request_var.reset(token)
+
+        async def main():
+            return await asyncio.gather(handle("filtro x", "ana"), handle("filtro y", "bia"))
+
+        assert asyncio.run(main()) == [("ana", "filtro x"), ("bia", "filtro y")]
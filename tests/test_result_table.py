@@ -0,0 +1,70 @@
+"""
+Testes do resultado em colunas (src/agent/result_table.py + apply_filters).
+Roda com: python -m pytest tests/test_result_table.py -v
+"""
+
+import sys
+from pathlib import Path
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+ROWS = [
+    {"PEDIDO": 1, "STATUS_ENTREGA": "ATRASADO", "VLR_PENDENTE": 8000.0, "PREVISAO_ENTREGA": "10/03/2026"},
+    {"PEDIDO": 2, "STATUS_ENTREGA": "NO PRAZO", "VLR_PENDENTE": 9000.0, "PREVISAO_ENTREGA": "01/02/2026"},
+    {"PEDIDO": 3, "STATUS_ENTREGA": "atrasado", "VLR_PENDENTE": "6000", "PREVISAO_ENTREGA": "05/01/2027"},
+    {"PEDIDO": 4, "STATUS_ENTREGA": "ATRASADO", "VLR_PENDENTE": 100.0, "PREVISAO_ENTREGA": ""},
+    {"PEDIDO": 5, "STATUS_ENTREGA": "ATRASADO", "VLR_PENDENTE": None, "PREVISAO_ENTREGA": "20/12/2025"},
+]
+
+
+def _pedidos(rows):
+    return [r["PEDIDO"] for r in rows]
+
+
+# ============================================================
+# TestResultTable
+# ============================================================
+
+class TestResultTable:
+    def test_filtro_valor_e_sort_por_data(self):
+        from src.agent.context import apply_filters
+        from src.agent.result_table import ResultTable
+
+        table = ResultTable.from_rows(ROWS)
+        filters = {"STATUS_ENTREGA": "ATRASADO", "_fn_maior": "VLR_PENDENTE:5000",
+                   "_sort": "PREVISAO_ENTREGA_ASC"}
+        result = apply_filters(ROWS, filters, table=table)
+        assert _pedidos(result) == [1, 3]
+        assert filters == {"STATUS_ENTREGA": "ATRASADO"}  # _sort/_top/_fn_ consumidos
+
+    def test_desc_estavel_e_top(self):
+        from src.agent.context import apply_filters
+        from src.agent.result_table import ResultTable
+
+        rows = [{"PEDIDO": i, "DIAS": d} for i, d in enumerate([5, 9, 5, 9, 1])]
+        table = ResultTable.from_rows(rows)
+        result = apply_filters(rows, {"_sort": "DIAS_DESC", "_top": 3}, table=table)
+        assert _pedidos(result) == [1, 3, 0]
+
+    def test_mesmo_resultado_sem_table(self):
+        from src.agent.context import apply_filters
+        from src.agent.result_table import ResultTable
+
+        table = ResultTable.from_rows(ROWS)
+        for filters in ({"_fn_empty": "PREVISAO_ENTREGA"}, {"_fn_contem": "STATUS_ENTREGA:prazo"},
+                        {"_sort": "VLR_PENDENTE_DESC"}, {"_fn_menor": "VLR_PENDENTE:7000", "_top": 2}):
+            assert apply_filters(ROWS, dict(filters), table=table) == apply_filters(ROWS, dict(filters))
+
+    def test_contexto_reusa_table(self):
+        from src.agent.context import ConversationContext
+
+        ctx = ConversationContext("u")
+        assert ctx.get_table() is None
+        ctx.update("pendencia_compras", {}, {"detail_data": ROWS}, "pendencias")
+        table = ctx.get_table()
+        assert table is ctx.get_table()
+        ctx.update("pendencia_compras", {}, {"detail_data": list(ROWS)}, "pendencias")
+        assert ctx.get_table() is not table
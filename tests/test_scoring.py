@@ -0,0 +1,53 @@
+"""
+Testes do indice invertido de scoring (src/agent/scoring.py).
+Roda com: python -m pytest tests/test_scoring.py -v
+"""
+
+import sys
+import json
+from pathlib import Path
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+# ============================================================
+# TestIntentIndex
+# ============================================================
+
+class TestIntentIndex:
+    def test_manual_igual_soma_direta(self):
+        from src.agent.scoring import IntentIndex, INTENT_SCORES
+        index = IntentIndex(INTENT_SCORES)
+        tokens = ["pendencias", "compras", "mann", "pedido", "pedido", "hoje"]
+        expected = {i: sum(kw.get(t, 0) for t in tokens) for i, kw in INTENT_SCORES.items()}
+        assert index.score(tokens) == expected
+
+    def test_frase_compilada_e_radical(self):
+        from src.agent.scoring import IntentIndex, FUZZY_FACTOR
+        manual = {"estoque": {"estoque": 10}, "pendencia_compras": {"atrasado": 5}}
+        compiled = {"estoque": {"codigo fabricante": 6, "estoque": 1}, "garantia": {"garantia": 8}}
+        index = IntentIndex(manual, compiled)
+
+        assert index.intents == ["estoque", "pendencia_compras", "garantia"]
+        assert index.score(["estoque"])["estoque"] == 10  # manual tem prioridade
+        assert index.score(["codigo", "fabricante"])["estoque"] == 6
+        assert index.score(["atrasadas"])["pendencia_compras"] == 5 * FUZZY_FACTOR
+        assert index.score(["garant"])["garantia"] == 8 * FUZZY_FACTOR  # prefixo
+        assert index.score(["xyz"]) == {"estoque": 0, "pendencia_compras": 0, "garantia": 0}
+
+    def test_reload_troca_indice(self, tmp_path, monkeypatch):
+        import src.agent.scoring as scoring
+        path = tmp_path / "compiled_knowledge.json"
+        path.write_text(json.dumps({"intent_keywords": {"vendas": [{"word": "faturei", "weight": 7}]}}))
+        monkeypatch.setattr(scoring, "COMPILED_PATH", path)
+        for name in ("_INDEX", "_COMPILED_SCORES", "_COMPILED_RULES", "_COMPILED_EXAMPLES", "_COMPILED_SYNONYMS"):
+            monkeypatch.setattr(scoring, name, getattr(scoring, name))  # restaura no teardown
+        monkeypatch.setattr(scoring, "_COMPILED_LOADED", False)
+
+        before = scoring._INDEX
+        scoring.reload_compiled()
+        assert scoring._INDEX is not before
+        assert scoring.score_intent(["faturei"])["vendas"] == 7
+        assert before.score(["faturei"])["vendas"] == 0  # indice antigo intacto
@@ -0,0 +1,102 @@
+"""
+Testes do SessionStore com orcamento de memoria (src/agent/session.py + result_store.py).
+Roda com: python -m pytest tests/test_session_store.py -v
+"""
+
+import sys
+from pathlib import Path
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def _rows(n, tag="A"):
+    return [{"PEDIDO": i, "MARCA": tag, "VLR_PENDENTE": i * 10.5, "STATUS_ENTREGA": "ATRASADO"}
+            for i in range(n)]
+
+
+def _store(tmp_path, **kw):
+    from src.agent.session import SessionStore
+    from src.agent.result_store import ResultSpill
+    return SessionStore(spill=ResultSpill(tmp_path, max_bytes=kw.pop("spill_bytes", 1 << 20)), **kw)
+
+
+# ============================================================
+# TestRetainedResult
+# ============================================================
+
+class TestRetainedResult:
+    def test_niveis_e_volta(self, tmp_path):
+        from src.agent.result_store import RetainedResult, ResultSpill
+
+        rows = _rows(50)
+        r = RetainedResult(rows)
+        spill = ResultSpill(tmp_path)
+        hot = r.nbytes
+        assert r.demote(spill) and r.level == "compact"
+        assert 0 < r.nbytes < hot
+        assert r.demote(spill) and r.level == "disk"
+        assert r.nbytes == 0
+        assert not r.demote(spill)
+        assert r.get() == rows and r.level == "hot"
+        spill.close()
+        assert not list(tmp_path.glob("spill-*.bin"))
+
+    def test_rows_irregulares_vao_direto_pro_disco(self, tmp_path):
+        from src.agent.result_store import RetainedResult, ResultSpill
+
+        rows = [{"A": 1}, {"B": 2}]
+        r = RetainedResult(rows)
+        r.demote(ResultSpill(tmp_path))
+        assert r.level == "disk"
+        assert r.get() == rows
+
+
+# ============================================================
+# TestSessionStore
+# ============================================================
+
+class TestSessionStore:
+    def test_last_result_separa_rows(self, tmp_path):
+        store = _store(tmp_path)
+        ctx = store.get_context("ana")
+        ctx.update("pendencia_compras", {}, {"detail_data": _rows(3), "description": "x"}, "q")
+        assert "detail_data" not in ctx.last_result
+        assert ctx.has_data() and len(ctx.get_data()) == 3
+        assert store.memory_stats()["result_bytes"] == ctx.result_bytes > 0
+
+    def test_orcamento_desce_lru_e_followup_continua(self, tmp_path):
+        store = _store(tmp_path)
+        for user in ("ana", "bia", "caio"):
+            store.get_context(user).update("pendencia_compras", {}, {"detail_data": _rows(200, user)}, "q")
+        store.memory_budget = store.memory_stats()["result_bytes"] // 2
+        store.get_context("caio").update("pendencia_compras", {}, {"detail_data": _rows(200, "caio")}, "q")
+
+        levels = {u: store.get_context(u)._retained.level for u in ("ana", "bia", "caio")}
+        assert levels["caio"] == "hot"
+        assert levels["ana"] == "disk"  # o menos usado desce primeiro
+        assert store.memory_stats()["result_bytes"] <= store.memory_budget
+
+        # follow-up da ana depois do spill: volta do mmap igual
+        assert store.get_context("ana").get_data() == _rows(200, "ana")
+        assert store.memory_stats()["rehydrations"] == 1
+
+    def test_lru_max_sessoes(self, tmp_path):
+        store = _store(tmp_path, max_sessions=2)
+        store.get("ana")
+        store.get("bia")
+        store.get("ana")       # ana vira a mais recente
+        store.get("caio")      # bia sai
+        assert set(store._sessions) == {"ana", "caio"}
+        assert store.memory_stats()["evicted_sessions"] == 1
+
+    def test_spill_rotacao_perde_geracao_antiga(self, tmp_path):
+        from src.agent.result_store import ResultSpill
+
+        spill = ResultSpill(tmp_path, max_bytes=4096)
+        refs = [spill.write(b"x" * 1500) for _ in range(5)]
+        assert spill.read(refs[0]) is None
+        assert spill.read(refs[-1]) == b"x" * 1500
+        assert len(list(tmp_path.glob("spill-*.bin"))) == 2
+        spill.close()
@@ -0,0 +1,222 @@
+"""
+Testes do backend de estado compartilhado (src/core/state_backend.py + SessionStore/rate limiter).
+Roda com: python -m pytest tests/test_state_backend.py -v
+"""
+
+import sys
+from pathlib import Path
+
+# Setup paths
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def _rows(n, tag="A"):
+    return [{"PEDIDO": i, "MARCA": tag, "VLR_PENDENTE": i * 10.5} for i in range(n)]
+
+
+# ============================================================
+# TestBackends
+# ============================================================
+
+class TestBackends:
+    def test_sqlite_roundtrip_datetime_e_versao(self, tmp_path):
+        from datetime import datetime
+        from src.core.state_backend import SQLiteStateBackend
+
+        b = SQLiteStateBackend(tmp_path / "state.db")
+        now = datetime(2026, 3, 10, 14, 30)
+        assert b.set("auth", "tok", {"user": "ana", "last_activity": now}) == 1
+        assert b.set("auth", "tok", {"user": "ana", "last_activity": now}) == 2
+        assert b.get("auth", "tok") == {"user": "ana", "last_activity": now}
+        assert b.version("auth", "tok") == 2
+        assert b.count("auth") == 1 and b.get("auth", "outro") is None
+        b.delete("auth", "tok")
+        assert b.get("auth", "tok") is None
+        b.close()
+
+    def test_ttl_expira(self, tmp_path):
+        import time
+        from src.core.state_backend import SQLiteStateBackend, MemoryStateBackend
+
+        for b in (MemoryStateBackend(), SQLiteStateBackend(tmp_path / "state.db")):
+            b.set("ratelimit", "ana", [1.0], ttl=0.05)
+            assert b.get("ratelimit", "ana") == [1.0]
+            time.sleep(0.08)
+            assert b.get("ratelimit", "ana") is None
+            assert b.set("ratelimit", "ana", [2.0]) == 1  # chave expirada recomeca a versao
+
+    def test_update_atomico_entre_conexoes(self, tmp_path):
+        from concurrent.futures import ThreadPoolExecutor
+        from src.core.state_backend import SQLiteStateBackend
+
+        path = tmp_path / "state.db"
+        backends = [SQLiteStateBackend(path) for _ in range(4)]  # 4 conexoes = 4 "workers"
+
+        def incr(b):
+            for _ in range(50):
+                b.update("n", "k", lambda v: ((v or 0) + 1, None))
+
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(incr, backends))
+        assert backends[0].get("n", "k") == 200
+
+    def test_lock_preso_nao_segura_o_worker(self, tmp_path):
+        import time
+        import sqlite3
+        import pytest
+        from src.core.state_backend import SQLiteStateBackend, STATE_DB_TIMEOUT
+
+        path = tmp_path / "state.db"
+        holder, other = SQLiteStateBackend(path), SQLiteStateBackend(path)
+        holder._conn.execute("BEGIN IMMEDIATE")
+        t0 = time.perf_counter()
+        with pytest.raises(sqlite3.OperationalError):
+            other.set("auth", "tok", {"user": "ana"})
+        assert time.perf_counter() - t0 < STATE_DB_TIMEOUT + 1
+        holder._conn.execute("ROLLBACK")
+
+    def test_backend_dict(self):
+        from src.core.state_backend import MemoryStateBackend, BackendDict
+
+        d = BackendDict(MemoryStateBackend(), "auth")
+        d["t1"] = {"user": "ana"}
+        d["t2"] = {"user": "bia"}
+        assert len(d) == 2 and "t1" in d
+        assert d.pop("t1") == {"user": "ana"}
+        assert d.pop("t1", {}) == {}
+        assert [s["user"] for s in d.values()] == ["bia"]
+
+
+# ============================================================
+# TestMultiWorker
+# ============================================================
+
+class TestMultiWorker:
+    def test_rate_limiter_compartilhado(self, tmp_path):
+        from src.core.state_backend import SQLiteStateBackend
+        from src.core.rate_limiter import TokenBucketLimiter
+
+        path = tmp_path / "state.db"
+        w1 = TokenBucketLimiter({}, default_quota=3, window_seconds=600, backend=SQLiteStateBackend(path))
+        w2 = TokenBucketLimiter({}, default_quota=3, window_seconds=600, backend=SQLiteStateBackend(path))
+        assert w1.is_allowed("ana") and w2.is_allowed("ana") and w1.is_allowed("ana")
+        assert not w2.is_allowed("ana")
+        assert w1.remaining("ana") == 0 and w2.remaining("bia") == 3
+
+    def test_conversa_continua_em_outro_worker(self, tmp_path):
+        from src.core.state_backend import SQLiteStateBackend
+        from src.agent.session import SessionStore
+        from src.agent.result_store import ResultSpill
+
+        path = tmp_path / "state.db"
+        w1 = SessionStore(spill=ResultSpill(tmp_path / "s1"), backend=SQLiteStateBackend(path))
+        w2 = SessionStore(spill=ResultSpill(tmp_path / "s2"), backend=SQLiteStateBackend(path))
+
+        s = w1.get("ana")
+        s.add_user_message("pendencias da mann")
+        s.ctx.update("pendencia_compras", {"marca": "MANN"}, {"detail_data": _rows(30), "description": "x"}, "q")
+        w1.save("ana")
+
+        # Proxima pergunta cai no worker 2
+        s2 = w2.get("ana")
+        assert s2.ctx.intent == "pendencia_compras" and s2.ctx.params == {"marca": "MANN"}
+        assert s2.ctx.get_data() == _rows(30)
+        assert s2.messages[0].content == "pendencias da mann"
+        s2.failed_term = "filtro ar"
+        w2.save("ana")
+        assert w2.memory_stats()["state_loads"] == 1
+
+        # Volta para o worker 1: recarrega estado, mantem as rows (mesmo resultado)
+        s1 = w1.get("ana")
+        assert s1.failed_term == "filtro ar"
+        assert s1.ctx.get_data() is s.ctx.get_data()
+
+        # Logout no worker 2 some nos dois
+        w2.reset("ana")
+        assert not w1.get("ana").ctx.has_data()
+
+    def test_memory_nao_grava(self, tmp_path):
+        from src.core.state_backend import MemoryStateBackend
+        from src.agent.session import SessionStore
+        from src.agent.result_store import ResultSpill
+
+        backend = MemoryStateBackend()
+        store = SessionStore(spill=ResultSpill(tmp_path), backend=backend)
+        store.get("ana").ctx.update("pendencia_compras", {}, {"detail_data": _rows(3)}, "q")
+        store.save("ana")
+        assert backend.count(SessionStore.STATE_NS) == 0
+        assert store.get("ana").ctx.has_data()
+
+
+# ============================================================
+# TestLeaderLease
+# ============================================================
+
+class TestLeaderLease:
+    def test_um_lider_e_takeover_apos_expirar(self, tmp_path):
+        import time
+        from src.core.state_backend import SQLiteStateBackend, acquire_lease, release_lease
+
+        path = tmp_path / "state.db"
+        w1, w2 = SQLiteStateBackend(path), SQLiteStateBackend(path)
+        assert acquire_lease(w1, "jobs", "w1", ttl=0.1) is True
+        assert acquire_lease(w2, "jobs", "w2", ttl=0.1) is False
+        assert acquire_lease(w1, "jobs", "w1", ttl=0.1) is True   # renovacao
+        time.sleep(0.15)
+        assert acquire_lease(w2, "jobs", "w2", ttl=60) is True    # w1 parou de renovar
+        assert acquire_lease(w1, "jobs", "w1", ttl=60) is False
+
+        release_lease(w1, "jobs", "w1")                            # nao e dono: nada muda
+        assert acquire_lease(w1, "jobs", "w1", ttl=60) is False
+        release_lease(w2, "jobs", "w2")
+        assert acquire_lease(w1, "jobs", "w1", ttl=60) is True
+
+    def test_run_as_leader_jobs_so_no_lider(self, tmp_path):
+        import asyncio
+        from src.core.state_backend import SQLiteStateBackend, run_as_leader
+
+        path = tmp_path / "state.db"
+        ran = []
+
+        async def job(tag):
+            ran.append(tag)
+            await asyncio.sleep(3600)
+
+        async def run():
+            tasks = [
+                asyncio.create_task(run_as_leader(SQLiteStateBackend(path), "jobs",
+                                                  lambda w=w: [job(f"lider-{w}")],
+                                                  lambda w=w: [job(f"seguidor-{w}")],
+                                                  ttl=0.3, owner=w))
+                for w in ("w1", "w2")
+            ]
+            await asyncio.sleep(0.2)
+            tasks[0].cancel()              # lider cai: solta o lease
+            await asyncio.sleep(0.3)
+            tasks[1].cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run(run())
+        assert ran[:2] == ["lider-w1", "seguidor-w2"]
+        assert ran[2:] == ["lider-w2"]
+
+    def test_run_once_nao_repete_na_troca_de_lider(self, tmp_path):
+        import asyncio
+        from src.core.state_backend import SQLiteStateBackend, run_once
+
+        path = tmp_path / "state.db"
+        w1, w2 = SQLiteStateBackend(path), SQLiteStateBackend(path)
+        ran = []
+
+        async def offline():
+            ran.append("offline")
+            return False
+
+        async def job():
+            ran.append("job")
+
+        assert asyncio.run(run_once(w1, "elastic_startup_sync", offline)) is False
+        assert asyncio.run(run_once(w2, "elastic_startup_sync", job)) is True   # falha nao conta
+        assert asyncio.run(run_once(w1, "elastic_startup_sync", job)) is False  # novo lider pula
+        assert ran == ["offline", "job"]